@@ -0,0 +1,276 @@
+""" # Customer baskets
+-----
+A basket is opened by 'create_order' and identified by 'sBasket_code'. It holds
+the quantity reserved of every item, and lives until it is checked out or its
+time limit runs out. The time limit restarts whenever the customer changes the
+basket.
+
+Money is kept in integer minor units (see 'money'). Each line remembers its
+unit price from the moment the item first went into the basket, and the basket
+keeps a running total per currency. Adding or removing units adjusts the total
+by the line's unit price, so 'list_orders' and 'checkout_order' never walk the
+lines or go back to the catalogue for prices.
+
+Every change to the contents bumps the basket's 'iVersion', and each line
+remembers the version which last changed it (removed lines included). A
+caller who has seen one version can therefore be told what changed since,
+without resending the whole basket (see 'shop.list_orders').
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import expiry
+import tokens
+
+# Seconds a customer has to complete their shopping (a business rule)
+BASKET_LIFETIME = 30 * 60
+
+# Extra seconds given to a basket when checkout fails for technical reasons
+CHECKOUT_GRACE = 5 * 60
+
+# Number of expired basket codes remembered, to answer "basket expired"
+# rather than "invalid basket"
+EXPIRED_MEMORY = 65536
+
+# Number of checked-out baskets whose checkout output is remembered, so that a
+# retried checkout gets the same invoice
+RECEIPT_MEMORY = 65536
+
+#-------------------------------------------------------------------------------
+class Basket:
+    """Items reserved by one customer."""
+
+    __slots__ = ("sBasket_id", "sAuth_token", "sRegion", "fExpiry", "dLines",
+        "dDetails", "dTotals", "iVersion", "dChanged", "bSealed", "oLock")
+
+    def __init__(self, sBasket_id, sAuth_token, sRegion, fExpiry):
+        self.sBasket_id = sBasket_id
+        self.sAuth_token = sAuth_token
+        self.sRegion = sRegion  # customer's region, for the business rules
+        self.fExpiry = fExpiry
+        self.dLines = {}        # sItem_id -> quantity reserved
+        self.dDetails = {}      # sItem_id -> (iUnit_minor, sCurrency, sDesc,
+                                #              sSize, sColour)
+        self.dTotals = {}       # sCurrency -> [total in minor units, lines]
+        self.iVersion = 0       # bumped by every change to the contents
+        self.dChanged = {}      # sItem_id -> version of its last change
+        self.bSealed = False
+        self.oLock = threading.Lock()   # held while the contents change
+
+    def add_line(self, sItem_id, iQty, fnDetails):
+        """Adds units of an item and updates the running total.
+
+        'fnDetails()' is called only for an item not yet in the basket, and
+        returns the line's details as stored in 'dDetails'. The caller holds
+        'oLock'.
+        """
+        tDetails = self.dDetails.get(sItem_id)
+        if tDetails is None:
+            tDetails = self.dDetails[sItem_id] = fnDetails()
+            self.dTotals.setdefault(tDetails[1], [0, 0])[1] += 1
+        self.dLines[sItem_id] = self.dLines.get(sItem_id, 0) + iQty
+        self.dTotals[tDetails[1]][0] += tDetails[0] * iQty
+        self.iVersion += 1
+        self.dChanged[sItem_id] = self.iVersion
+
+    def remove_line(self, sItem_id, iQty):
+        """Takes units of an item out and updates the running total.
+
+        The quantity must not exceed the quantity held. The caller holds
+        'oLock'.
+        """
+        iHeld = self.dLines[sItem_id]
+        iUnit, sCurrency = self.dDetails[sItem_id][:2]
+        aTotal = self.dTotals[sCurrency]
+        aTotal[0] -= iUnit * iQty
+        self.iVersion += 1
+        self.dChanged[sItem_id] = self.iVersion
+        if iQty < iHeld:
+            self.dLines[sItem_id] = iHeld - iQty
+            return
+        del self.dLines[sItem_id]
+        del self.dDetails[sItem_id]
+        aTotal[1] -= 1
+        if not aTotal[1]:
+            del self.dTotals[sCurrency]
+
+    def clear(self):
+        """Empties the basket. The caller holds 'oLock'."""
+        self.iVersion += 1
+        for sItem_id in self.dLines:
+            self.dChanged[sItem_id] = self.iVersion
+        self.dLines.clear()
+        self.dDetails.clear()
+        self.dTotals.clear()
+
+    def changed_since(self, iVersion):
+        """Items whose line changed after version 'iVersion', including lines
+        since removed. The caller holds 'oLock'."""
+        return [sItem_id for sItem_id, iChanged in self.dChanged.items()
+            if iChanged > iVersion]
+
+#-------------------------------------------------------------------------------
+class BasketStore:
+    """Open baskets, addressed by their basket code.
+
+    Deadlines are kept in a timer wheel. A background sweeper (see
+    'start_sweeper') collects the baskets which ran out of time, a batch at a
+    time, without ever scanning the open baskets. 'fnOn_expire' is called with
+    each expired basket, after it has been sealed and dropped from the store,
+    so that its reserved stock can be released.
+
+    A basket which is checked out is closed with the checkout's output (its
+    receipt), which 'receipt' gives back for a while afterwards: checkout is
+    not repeatable, so a retry must get the same invoice, not a new one.
+    """
+
+    __slots__ = ("fLifetime", "fnOn_expire", "_dBaskets", "_dExpired",
+        "_dReceipts", "_oWheel", "_oLock", "_oSweeper", "_oStop")
+
+    def __init__(self, fnOn_expire=None, fLifetime=BASKET_LIFETIME):
+        self.fLifetime = fLifetime
+        self.fnOn_expire = fnOn_expire
+        self._dBaskets = {}
+        self._dExpired = OrderedDict()  # recently expired codes
+        self._dReceipts = OrderedDict() # recently checked-out code -> output
+        self._oWheel = expiry.TimerWheel()
+        self._oLock = threading.Lock()
+        self._oSweeper = None
+        self._oStop = threading.Event()
+
+    def __len__(self):
+        return len(self._dBaskets)
+
+    def open(self, sAuth_token, sRegion=""):
+        """Opens a new, empty basket for an authenticated customer."""
+        with self._oLock:
+            sBasket_id = tokens.new_code(12)
+            while sBasket_id in self._dBaskets:
+                sBasket_id = tokens.new_code(12)
+            oBasket = Basket(sBasket_id, sAuth_token, sRegion,
+                time.time() + self.fLifetime)
+            self._dBaskets[sBasket_id] = oBasket
+            self._oWheel.schedule(sBasket_id, oBasket.fExpiry)
+        return oBasket
+
+    def lookup(self, sBasket_code):
+        """Finds an open basket.
+
+        Returns
+        -------
+            (tuple) (oBasket, sErr_desc). On success the error description is
+            'None'; otherwise the basket is 'None' and the description is
+            "invalid basket" or "basket expired".
+        """
+        oBasket = self._dBaskets.get(sBasket_code) \
+            if isinstance(sBasket_code, str) else None
+        if oBasket is None or oBasket.bSealed:
+            if sBasket_code in self._dExpired:
+                return None, "basket expired"
+            return None, "invalid basket"
+        if oBasket.fExpiry < time.time():
+            self.expire(oBasket)
+            return None, "basket expired"
+        return oBasket, None
+
+    #---------------------------------------------------------------------------
+    def touch(self, oBasket):
+        """Restarts the time limit of a basket the customer is working on."""
+        self._reschedule(oBasket, time.time() + self.fLifetime)
+
+    def extend(self, oBasket, fExtra):
+        """Gives a basket additional time, for example after a technical
+        failure at checkout which wasn't the customer's fault."""
+        self._reschedule(oBasket, max(oBasket.fExpiry, time.time()) + fExtra)
+
+    def _reschedule(self, oBasket, fExpiry):
+        with self._oLock:
+            if oBasket.bSealed or fExpiry <= oBasket.fExpiry:
+                return
+            oBasket.fExpiry = fExpiry
+            self._oWheel.schedule(oBasket.sBasket_id, fExpiry)
+
+    def expire(self, oBasket):
+        """Drops a basket which ran out of time and releases its contents."""
+        with self._oLock:
+            if self._dBaskets.get(oBasket.sBasket_id) is not oBasket:
+                return
+            del self._dBaskets[oBasket.sBasket_id]
+            self._oWheel.cancel(oBasket.sBasket_id)
+            self._remember_expired(oBasket.sBasket_id)
+            oBasket.bSealed = True
+        if self.fnOn_expire is not None:
+            self.fnOn_expire(oBasket)
+
+    def _remember_expired(self, sBasket_id):
+        self._dExpired[sBasket_id] = None
+        if len(self._dExpired) > EXPIRED_MEMORY:
+            self._dExpired.popitem(last=False)
+
+    def close(self, oBasket, dReceipt=None):
+        """Removes a basket which has been checked out, remembering the
+        checkout's output, 'dReceipt', for 'receipt'."""
+        with self._oLock:
+            oBasket.bSealed = True
+            self._dBaskets.pop(oBasket.sBasket_id, None)
+            self._oWheel.cancel(oBasket.sBasket_id)
+            if dReceipt is not None:
+                self._dReceipts[oBasket.sBasket_id] = dReceipt
+                if len(self._dReceipts) > RECEIPT_MEMORY:
+                    self._dReceipts.popitem(last=False)
+
+    def receipt(self, sBasket_code):
+        """The checkout output a recently checked-out basket was closed with,
+        or 'None'."""
+        with self._oLock:
+            return self._dReceipts.get(sBasket_code)
+
+    #---------------------------------------------------------------------------
+    def sweep(self, fNow=None):
+        """Expires every basket whose deadline has passed.
+
+        Returns
+        -------
+            (integer) Number of baskets expired.
+        """
+        if fNow is None:
+            fNow = time.time()
+        aExpired = []
+        with self._oLock:
+            for sBasket_id in self._oWheel.advance(fNow):
+                oBasket = self._dBaskets.pop(sBasket_id, None)
+                if oBasket is not None:
+                    self._remember_expired(sBasket_id)
+                    oBasket.bSealed = True
+                    aExpired.append(oBasket)
+        if self.fnOn_expire is not None:
+            for oBasket in aExpired:
+                self.fnOn_expire(oBasket)
+        return len(aExpired)
+
+    def start_sweeper(self, fInterval=1.0):
+        """Starts the background thread calling 'sweep'. Idempotent."""
+        with self._oLock:
+            if self._oSweeper is not None:
+                return
+            self._oStop.clear()
+            self._oSweeper = threading.Thread(target=self._sweep_loop,
+                args=(fInterval,), name="basket-sweeper", daemon=True)
+            self._oSweeper.start()
+
+    def stop_sweeper(self):
+        """Stops the background sweeper and waits for it to finish."""
+        with self._oLock:
+            oSweeper, self._oSweeper = self._oSweeper, None
+        if oSweeper is not None:
+            self._oStop.set()
+            oSweeper.join()
+
+    def _sweep_loop(self, fInterval):
+        while not self._oStop.wait(fInterval):
+            try:
+                self.sweep()
+            except Exception:
+                pass        # keep sweeping; the next pass retries
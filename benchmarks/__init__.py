@@ -0,0 +1,6 @@
+""" # Benchmarks and stress checks for the shop
+-----
+Each module is a stand-alone script, run from the repository root, e.g.
+
+    python -m benchmarks.stress_reservations
+"""
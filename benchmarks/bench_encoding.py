@@ -0,0 +1,109 @@
+""" # Benchmark: encoding 'list_products' pages, json.dumps vs fragments
+-----
+Loads a synthetic catalogue (see 'catalogue_gen'), runs keyword queries of
+'--page' items each (every other one with facets) and encodes the outputs two
+ways, as the HTTP layer would:
+
+    json.dumps          the whole 'dOutput' through the 'json' module
+    encode_response     'shop.encode_response': products spliced in from
+                        their pre-encoded fragments, for a page encoded for
+                        the first time and for a cached page encoded before
+
+Only the encoding is timed. Each page is also served from a published
+snapshot. Every encoding must decode to the same value as 'json.dumps'; the
+script exits with status 1 if any doesn't.
+
+    python -m benchmarks.bench_encoding [--skus 20000] [--queries 500]
+        [--page 100] [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import encoding
+import shop
+from benchmarks import catalogue_gen
+
+#-------------------------------------------------------------------------------
+def pages(aKeywords, iPage):
+    """A 'list_products' output per keyword; found ones only."""
+    aOutputs = []
+    for iQuery, sKeyword in enumerate(aKeywords):
+        dBriefcase = {"iIdx":0, "iMax_res":iPage, "sItem_filter":sKeyword}
+        if iQuery % 2:
+            dBriefcase["bFacets"] = True
+        dOutput = shop.list_products(dBriefcase)
+        if dOutput["sStatus"] == "OK":
+            aOutputs.append(dOutput)
+    return aOutputs
+
+#-------------------------------------------------------------------------------
+def time_encoder(fnEncode, aOutputs, iRounds, bFresh=False):
+    """Best seconds per page over 'iRounds' passes; with 'bFresh', on copies
+    of the pages which haven't kept an encoding."""
+    fBest = float("inf")
+    for _ in range(iRounds):
+        if bFresh:
+            aOutputs = [encoding.Page(dOutput) for dOutput in aOutputs]
+        fStart = time.perf_counter()
+        for dOutput in aOutputs:
+            fnEncode(dOutput)
+        fBest = min(fBest, time.perf_counter() - fStart)
+    return fBest / len(aOutputs)
+
+#-------------------------------------------------------------------------------
+def mismatches(aOutputs):
+    """Number of outputs whose encoding decodes to something else."""
+    return sum(json.loads(shop.encode_response(dOutput))
+        != json.loads(json.dumps(dOutput)) for dOutput in aOutputs)
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--skus", type=int, default=20000)
+    oParser.add_argument("--vocabulary", type=int, default=2000)
+    oParser.add_argument("--queries", type=int, default=500)
+    oParser.add_argument("--page", type=int, default=100)
+    oParser.add_argument("--rounds", type=int, default=5)
+    oArgs = oParser.parse_args(aArgs)
+
+    aProducts = list(catalogue_gen.make_products(oArgs.skus,
+        oArgs.vocabulary))
+    fStart = time.perf_counter()
+    for dProduct in aProducts:
+        shop.add_product(dProduct)
+    print("loaded %d products in %.2f s" % (len(aProducts),
+        time.perf_counter() - fStart))
+    aKeywords = catalogue_gen.keywords(aProducts, oArgs.queries)
+    aOutputs = pages(aKeywords, oArgs.page)
+    iItems = sum(len(dOutput["aItems"]) for dOutput in aOutputs)
+    print("%d pages, %.1f items per page" % (len(aOutputs),
+        iItems / len(aOutputs)))
+
+    fJson = time_encoder(json.dumps, aOutputs, oArgs.rounds)
+    print("json.dumps               %8.1f us/page" % (fJson * 1e6))
+    for sName, bFresh in (("first", True), ("cached", False)):
+        fEncode = time_encoder(shop.encode_response, aOutputs, oArgs.rounds,
+            bFresh)
+        print("encode_response, %-6s  %8.1f us/page  (%.1fx)" % (sName,
+            fEncode * 1e6, fJson / fEncode))
+
+    iFailures = mismatches(aOutputs)
+    with tempfile.TemporaryDirectory() as sDirectory:
+        sPath = os.path.join(sDirectory, "catalogue.snap")
+        shop.publish_snapshot(sPath)
+        shop.use_snapshot(sPath)
+        iFailures += mismatches(pages(aKeywords, oArgs.page))
+        shop._oSnapshots = None
+    if iFailures:
+        print("FAIL: %d pages encoded differently" % iFailures)
+        return 1
+    print("OK: every page decodes to the same value")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+""" # Micro-benchmark: cost of the API instrumentation
+-----
+Times a trivial function bare and wrapped by 'metrics.Metrics.instrument';
+the difference is what every API call pays for its latency histogram and
+outcome count. Then checks that calls recorded from several threads at once
+are all counted, and that the series of the threads, once they have ended,
+are folded into the retired totals rather than kept; the script exits with
+status 1 if not.
+
+    python -m benchmarks.bench_metrics [--count 500000] [--threads 8]
+"""
+
+import argparse
+import sys
+import threading
+import timeit
+
+import metrics
+
+#-------------------------------------------------------------------------------
+def _answer(iCall):
+    return {"sStatus":"ERROR", "sErr_desc":"item not found"} if iCall % 7 \
+        else {"sStatus":"OK"}
+
+#-------------------------------------------------------------------------------
+def _per_call(fnCall, iCount):
+    """Best of five runs, in nanoseconds per call."""
+    return min(timeit.repeat(lambda: fnCall(1), number=iCount,
+        repeat=5)) / iCount * 1e9
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--count", type=int, default=500000)
+    oParser.add_argument("--threads", type=int, default=8)
+    oArgs = oParser.parse_args(aArgs)
+
+    oMetrics = metrics.Metrics()
+    fnWrapped = oMetrics.instrument(_answer, "answer")
+    fBare = _per_call(_answer, oArgs.count)
+    fWrapped = _per_call(fnWrapped, oArgs.count)
+    print("bare     %8.0f ns/call" % fBare)
+    print("wrapped  %8.0f ns/call  (+%.0f ns)" % (fWrapped, fWrapped - fBare))
+
+    oMetrics.reset()
+    iPer_thread = oArgs.count // oArgs.threads
+    aThreads = [threading.Thread(target=lambda: [fnWrapped(i)
+        for i in range(iPer_thread)]) for _ in range(oArgs.threads)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    dFigures = oMetrics.snapshot()["answer"]
+    iExpected = iPer_thread * oArgs.threads
+    print("recorded %d calls from %d threads: p50 %.0f ns, p99 %.0f ns, "
+        "max %.0f ns" % (dFigures["iCount"], oArgs.threads,
+        dFigures["fP50"] * 1e9, dFigures["fP99"] * 1e9,
+        dFigures["fMax"] * 1e9))
+    if (dFigures["iCount"] != iExpected
+            or sum(dFigures["dOutcomes"].values()) != iExpected):
+        print("FAIL: expected %d calls" % iExpected)
+        return 1
+    if len(oMetrics._dThreads) > 1:     # this thread's own, from the timing
+        print("FAIL: %d threads' series kept" % len(oMetrics._dThreads))
+        return 1
+    print("OK: every call counted; ended threads' series retired")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+""" # Micro-benchmark: business rules, naive vs compiled
+-----
+Checks random (region, item) pairs against a large synthetic rule set:
+
+    naive           every rule evaluated in turn, as a list of dictionaries
+    compiled        'rules.RuleSet.evaluate' (indexed lookups, no memo)
+    memoised        'rules.RulesEngine.check' (compiled, memoised per pair)
+
+All three must agree; the script exits with status 1 if they don't.
+
+    python -m benchmarks.bench_rules [--rules 5000] [--items 20000]
+        [--regions 30] [--count 100000]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import rules
+
+#-------------------------------------------------------------------------------
+def naive_evaluate(aRules, sRegion, dItem):
+    """Reference implementation: one pass over every rule."""
+    sErr_desc, iMax_qty = None, None
+    for dRule in aRules:
+        if any(dItem[sField] != dRule[sField]
+                for sField in rules.MATCH_FIELDS if sField in dRule):
+            continue
+        if "aRegions" in dRule and sRegion not in dRule["aRegions"]:
+            continue
+        if sRegion in dRule.get("aExcept_regions", ()):
+            continue
+        if dRule["sKind"] == "deny":
+            return "not available", None
+        if dRule["sKind"] == "currency":
+            if dItem["sCurrency"] not in dRule["aCurrencies"]:
+                sErr_desc = "invalid currency"
+        elif iMax_qty is None or dRule["iMax_qty"] < iMax_qty:
+            iMax_qty = dRule["iMax_qty"]
+    return sErr_desc, iMax_qty
+
+#-------------------------------------------------------------------------------
+def make_data(iRules, iItems, iRegions, oRandom):
+    """Synthetic regions, items (by 'sItem_id') and rules."""
+    aRegions = ["R%02d" % i for i in range(iRegions)]
+    aCurrencies = ["PLN", "EUR", "USD", "GBP", "CZK"]
+    dItems = {}
+    for i in range(iItems):
+        sItem_id = "I-%06d" % i
+        dItems[sItem_id] = {
+            "sItem_id":sItem_id,
+            "sBrand":"brand-%d" % oRandom.randrange(500),
+            "sCategory":"category-%d" % oRandom.randrange(200),
+            "sCurrency":oRandom.choice(aCurrencies)
+        }
+    aRules = []
+    for sRegion in aRegions:
+        aRules.append({"sKind":"currency", "aRegions":[sRegion],
+            "aCurrencies":oRandom.sample(aCurrencies, 3)})
+    while len(aRules) < iRules:
+        dRule = {"sKind":oRandom.choice(("deny", "max_qty", "max_qty"))}
+        sField = oRandom.choice(("sItem_id", "sCategory", "sBrand"))
+        dRule[sField] = dItems[oRandom.choice(list(dItems))][sField]
+        if oRandom.random() < 0.7:
+            dRule["aRegions"] = oRandom.sample(aRegions, 3)
+        else:
+            dRule["aExcept_regions"] = oRandom.sample(aRegions, 3)
+        if dRule["sKind"] == "max_qty":
+            dRule["iMax_qty"] = oRandom.randrange(1, 20)
+        aRules.append(dRule)
+    return aRegions, dItems, aRules
+
+#-------------------------------------------------------------------------------
+def _rate(fnCall, aQueries):
+    """Calls 'fnCall(sRegion, sItem_id)' per query; returns calls/second."""
+    fStart = time.perf_counter()
+    for sRegion, sItem_id in aQueries:
+        fnCall(sRegion, sItem_id)
+    return len(aQueries) / (time.perf_counter() - fStart)
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--rules", type=int, default=5000)
+    oParser.add_argument("--items", type=int, default=20000)
+    oParser.add_argument("--regions", type=int, default=30)
+    oParser.add_argument("--count", type=int, default=100000)
+    oArgs = oParser.parse_args(aArgs)
+
+    oRandom = random.Random(13)
+    aRegions, dItems, aRules = make_data(oArgs.rules, oArgs.items,
+        oArgs.regions, oRandom)
+    aItem_ids = list(dItems)
+    # Shoppers revisit the same items, so queries repeat.
+    aHot = oRandom.sample(aItem_ids, min(len(aItem_ids), 500))
+    aQueries = [(oRandom.choice(aRegions), oRandom.choice(aHot))
+        for _ in range(oArgs.count)]
+
+    fStart = time.perf_counter()
+    oRules = rules.RuleSet(aRules)
+    fCompile = time.perf_counter() - fStart
+    oEngine = rules.RulesEngine(dItems.__getitem__, oRules)
+
+    iMismatches = 0
+    for sRegion, sItem_id in aQueries[:2000]:
+        tExpected = naive_evaluate(aRules, sRegion, dItems[sItem_id])
+        if (oRules.evaluate(sRegion, dItems[sItem_id]) != tExpected
+                or oEngine.check(sRegion, sItem_id) != tExpected):
+            iMismatches += 1
+    oEngine.install(oRules)
+
+    # The naive pass is slow; time it on a slice of the queries.
+    aNaive = aQueries[:max(1, len(aQueries) // 100)]
+    dRates = {
+        "naive":_rate(lambda sRegion, sItem_id: naive_evaluate(aRules,
+            sRegion, dItems[sItem_id]), aNaive),
+        "compiled":_rate(lambda sRegion, sItem_id: oRules.evaluate(sRegion,
+            dItems[sItem_id]), aQueries),
+        "memoised":_rate(oEngine.check, aQueries)
+    }
+    print("%d rules compiled in %.1f ms" % (len(oRules), fCompile * 1000))
+    for sName, fRate in dRates.items():
+        print("%-10s %12.0f checks/s  (%.2f us/check, %.0fx naive)" % (sName,
+            fRate, 1e6 / fRate, fRate / dRates["naive"]))
+    if iMismatches:
+        print("FAIL: %d outcomes differ from the naive evaluation"
+            % iMismatches)
+        return 1
+    print("OK: compiled outcomes match the naive evaluation")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
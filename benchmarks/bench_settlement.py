@@ -0,0 +1,116 @@
+""" # Benchmark: checkout with background settlement vs charging inline
+-----
+Many shoppers check out at once against a stub payment provider which is
+slow, sometimes fails and sometimes declines. Charging inline is measured
+as the checkout followed by the charge in the shopper's own thread; with
+background settlement, checkout returns a pending invoice and the queue's
+workers charge the provider. Reports checkouts per second and the time
+until every payment is settled.
+
+Every invoice is then checked through 'shop.checkout_status', and the stock
+must add up: what was sold is what was settled, and rejected orders are back
+on sale. The script exits with status 1 if it doesn't.
+
+    python -m benchmarks.bench_settlement [--shoppers 200] [--workers 8]
+        [--latency 0.05] [--reject 0.1] [--failure 0.2]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+import settlement
+import shop
+
+#-------------------------------------------------------------------------------
+def checkout_all(sItem_id, iShoppers, fnAfter=None):
+    """Checks out one unit of an item for each of 'iShoppers' threads.
+    Returns (seconds, list of (sAuth_token, checkout output))."""
+    aResults = []
+    oLock = threading.Lock()
+    oBarrier = threading.Barrier(iShoppers + 1)
+    def shopper(iShopper):
+        sAuth_token = shop.issue_auth_token("%s-%d" % (sItem_id, iShopper))
+        sBasket_code = shop.create_order(sAuth_token)["sBasket_code"]
+        shop.update_order({"sBasket_code":sBasket_code, "sItem_id":sItem_id,
+            "iQty":1})
+        oBarrier.wait()
+        dOutput = shop.checkout_order({"sBasket_code":sBasket_code,
+            "sAuth_token":sAuth_token})
+        if fnAfter is not None:
+            fnAfter(dOutput)
+        with oLock:
+            aResults.append((sAuth_token, dOutput))
+    aThreads = [threading.Thread(target=shopper, args=(i,))
+        for i in range(iShoppers)]
+    for oThread in aThreads:
+        oThread.start()
+    oBarrier.wait()
+    fStart = time.perf_counter()
+    for oThread in aThreads:
+        oThread.join()
+    return time.perf_counter() - fStart, aResults
+
+#-------------------------------------------------------------------------------
+def add_item(sItem_id, iStock):
+    shop.add_product({"sItem_id":sItem_id, "sBrand":"Bench",
+        "sDesc":"Settlement benchmark item", "sSize":"M", "sColour":"Red",
+        "fPrice":9.99, "sCurrency":"PLN", "iStock":iStock, "aPhotos":[]})
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--shoppers", type=int, default=200)
+    oParser.add_argument("--workers", type=int, default=8)
+    oParser.add_argument("--latency", type=float, default=0.05)
+    oParser.add_argument("--reject", type=float, default=0.1)
+    oParser.add_argument("--failure", type=float, default=0.2)
+    oArgs = oParser.parse_args(aArgs)
+    iShoppers = oArgs.shoppers
+
+    oInline = settlement.StubProvider(oArgs.latency, oArgs.reject,
+        oArgs.failure, iSeed=1)
+    def charge(dOutput):
+        for _ in range(settlement.MAX_ATTEMPTS):
+            try:
+                return oInline.charge(dOutput["sInvoice_code"], "", "", 0)
+            except settlement.ProviderError:
+                pass
+    add_item("I-INLINE", iShoppers)
+    fInline, _ = checkout_all("I-INLINE", iShoppers, charge)
+    print("inline      %8.0f checkouts/s" % (iShoppers / fInline))
+
+    oProvider = settlement.StubProvider(oArgs.latency, oArgs.reject,
+        oArgs.failure, iSeed=1)
+    shop.use_settlement(oProvider, oArgs.workers)
+    add_item("I-QUEUED", iShoppers)
+    fStart = time.perf_counter()
+    fQueued, aResults = checkout_all("I-QUEUED", iShoppers)
+    shop._oSettlement.flush()
+    fSettled = time.perf_counter() - fStart
+    print("background  %8.0f checkouts/s  all settled after %.2f s "
+        "(%d workers, %d charges, %d retries, %d escalated)" % (
+        iShoppers / fQueued, fSettled, oArgs.workers, oProvider.iCharges,
+        shop._oSettlement.iRetries, shop._oSettlement.iEscalated))
+
+    dOutcomes = {}
+    for sAuth_token, dOutput in aResults:
+        dStatus = shop.checkout_status({"sAuth_token":sAuth_token,
+            "sInvoice_code":dOutput["sInvoice_code"]})
+        sOutcome = dStatus.get("sPayment", dStatus.get("sErr_desc"))
+        dOutcomes[sOutcome] = dOutcomes.get(sOutcome, 0) + 1
+    iStock = shop._oCatalogue.stock("I-QUEUED")
+    shop.use_settlement(iWorkers=0)
+    print("outcomes %s, stock left %d" % (dict(sorted(dOutcomes.items())),
+        iStock))
+    iSettled = dOutcomes.get("settled", 0)
+    if (iSettled + dOutcomes.get("payment rejected", 0) != iShoppers
+            or iStock != iShoppers - iSettled):
+        print("FAIL: outcomes and stock don't add up")
+        return 1
+    print("OK: every payment settled or rejected; rejected stock returned")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+""" # Benchmark: sharded 'list_products' at 1/2/4/8 processes
+-----
+Builds a synthetic catalogue, then for each shard count publishes it to shard
+snapshots, starts the shard processes and drives them with concurrent client
+threads issuing keyword / faceted queries:
+
+    in-process      the whole catalogue searched by the calling thread
+    N shards        'sharding.ShardedCatalogue' with N shard processes
+
+Every sharded answer (hit count, page, facet counts, deep pages and cursor
+pages) is first compared with the in-process one; the script exits with
+status 1 if any differ. Throughput only scales up to the number of cores.
+
+    python -m benchmarks.bench_sharding [--products 200000] [--queries 2000]
+        [--clients 8] [--shards 1,2,4,8]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import catalogue
+import facets
+import sharding
+
+_WORDS = ("red blue green black white wool cotton silk linen leather "
+    "shirt dress coat jacket scarf hat boots shoes socks gloves belt bag "
+    "summer winter classic slim long short striped plain vintage").split()
+
+#-------------------------------------------------------------------------------
+def make_catalogue(iProducts, oRandom):
+    """Synthetic catalogue of 'iProducts' products."""
+    oCatalogue = catalogue.Catalogue()
+    for i in range(iProducts):
+        oCatalogue.add({
+            "sItem_id":"I-%07d" % oRandom.randrange(10**7),
+            "sBrand":"brand-%d" % oRandom.randrange(200),
+            "sDesc":" ".join(oRandom.sample(_WORDS, 4)),
+            "sSize":oRandom.choice(("S", "M", "L", "XL")),
+            "sColour":oRandom.choice(("Red", "Blue", "Black", "White")),
+            "fPrice":oRandom.randrange(500, 50000) / 100,
+            "sCurrency":"PLN",
+            "iStock":oRandom.randrange(0, 20),
+            "aPhotos":[]
+        })
+    return oCatalogue
+
+#-------------------------------------------------------------------------------
+def make_queries(iCount, oRandom):
+    """(dQuery, iIdx, iMax_res) triples: keyword searches, some with price
+    ranges, price order and facets."""
+    aQueries = []
+    for _ in range(iCount):
+        dBriefcase = {"sItem_filter":" ".join(oRandom.sample(_WORDS,
+            oRandom.choice((1, 1, 2))))}
+        if oRandom.random() < 0.6:
+            dBriefcase["fPrice_max"] = float(oRandom.randrange(50, 500))
+            dBriefcase["sSort"] = oRandom.choice(("fPrice_asc",
+                "fPrice_desc"))
+            dBriefcase["bFacets"] = oRandom.random() < 0.5
+            dBriefcase["bIn_stock"] = oRandom.random() < 0.5
+        aQueries.append((facets.normalise_query(dBriefcase),
+            oRandom.choice((0, 0, 0, 20, 100)), 20))
+    return aQueries
+
+#-------------------------------------------------------------------------------
+def local_query(oCatalogue, dQuery, iIdx, iMax_res, tAfter=None):
+    """The in-process answer, in the shape of 'ShardedCatalogue.query'."""
+    iLimit = (0 if tAfter is not None else iIdx) + iMax_res
+    iSearch_tot, aItems, dFacets = sharding.answer(oCatalogue, dQuery, iLimit,
+        tAfter)
+    if tAfter is None:
+        aItems = aItems[iIdx:]
+    return {"iSearch_tot":iSearch_tot, "aItems":aItems, "dFacets":dFacets}
+
+#-------------------------------------------------------------------------------
+def _same(dExpected, dActual):
+    return (dExpected["iSearch_tot"] == dActual["iSearch_tot"]
+        and dExpected["aItems"] == dActual["aItems"]
+        and dExpected["dFacets"] == dActual["dFacets"])
+
+#-------------------------------------------------------------------------------
+def check(oCatalogue, fnQuery, aQueries):
+    """Number of queries (and follow-up cursor pages) answered differently
+    from the in-process search."""
+    iMismatches = 0
+    for dQuery, iIdx, iMax_res in aQueries:
+        dExpected = local_query(oCatalogue, dQuery, iIdx, iMax_res)
+        dActual = fnQuery(dQuery, iIdx, iMax_res, None)
+        if not _same(dExpected, dActual):
+            iMismatches += 1
+            continue
+        if not dActual["aItems"]:
+            continue
+        dLast = dActual["aItems"][-1]
+        xSort_key = (dLast["sItem_id"] if dQuery["sSort"] == "sItem_id"
+            else dLast["fPrice"])
+        tAfter = (xSort_key, dLast["sItem_id"])
+        if not _same(local_query(oCatalogue, dQuery, 0, iMax_res, tAfter),
+                fnQuery(dQuery, 0, iMax_res, tAfter)):
+            iMismatches += 1
+    return iMismatches
+
+#-------------------------------------------------------------------------------
+def drive(fnQuery, aQueries, iClients):
+    """Runs the queries from 'iClients' threads. Returns (queries/second,
+    median latency, 99th percentile latency) in seconds."""
+    aLatencies = []
+    oLock = threading.Lock()
+    def client(aMine):
+        aOwn = []
+        for dQuery, iIdx, iMax_res in aMine:
+            fStart = time.perf_counter()
+            fnQuery(dQuery, iIdx, iMax_res, None)
+            aOwn.append(time.perf_counter() - fStart)
+        with oLock:
+            aLatencies.extend(aOwn)
+    aThreads = [threading.Thread(target=client, args=(aQueries[i::iClients],))
+        for i in range(iClients)]
+    fStart = time.perf_counter()
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    fElapsed = time.perf_counter() - fStart
+    aLatencies.sort()
+    return (len(aLatencies) / fElapsed, aLatencies[len(aLatencies) // 2],
+        aLatencies[min(len(aLatencies) - 1, len(aLatencies) * 99 // 100)])
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--products", type=int, default=200000)
+    oParser.add_argument("--queries", type=int, default=2000)
+    oParser.add_argument("--clients", type=int, default=8)
+    oParser.add_argument("--shards", default="1,2,4,8")
+    oArgs = oParser.parse_args(aArgs)
+    aShard_counts = [int(s) for s in oArgs.shards.split(",")]
+
+    oRandom = random.Random(18)
+    fStart = time.perf_counter()
+    oCatalogue = make_catalogue(oArgs.products, oRandom)
+    print("%d products built in %.1f s, %d cores" % (oArgs.products,
+        time.perf_counter() - fStart, os.cpu_count() or 1))
+    aQueries = make_queries(oArgs.queries, oRandom)
+
+    fnLocal = lambda dQuery, iIdx, iMax_res, tAfter: local_query(oCatalogue,
+        dQuery, iIdx, iMax_res, tAfter)
+    oLocal_lock = threading.Lock()      # one thread searching, as one process
+    def fnSerial(dQuery, iIdx, iMax_res, tAfter):
+        with oLocal_lock:
+            return fnLocal(dQuery, iIdx, iMax_res, tAfter)
+    fRate, fP50, fP99 = drive(fnSerial, aQueries, oArgs.clients)
+    print("%-12s %9.0f queries/s  p50 %7.2f ms  p99 %7.2f ms" % (
+        "in-process", fRate, fP50 * 1000, fP99 * 1000))
+    fBase = fRate
+
+    iMismatches = 0
+    with tempfile.TemporaryDirectory() as sDirectory:
+        for iShards in aShard_counts:
+            oShards = sharding.ShardedCatalogue(iShards, sDirectory)
+            oShards.publish(oCatalogue)
+            oShards.start()
+            try:
+                iMismatches += check(oCatalogue, oShards.query,
+                    aQueries[:200])
+                fRate, fP50, fP99 = drive(oShards.query, aQueries,
+                    oArgs.clients)
+            finally:
+                oShards.stop()
+            print("%-12s %9.0f queries/s  p50 %7.2f ms  p99 %7.2f ms  "
+                "(%.2fx)" % ("%d shards" % iShards, fRate, fP50 * 1000,
+                fP99 * 1000, fRate / fBase))
+    if iMismatches:
+        print("FAIL: %d sharded answers differ from the in-process search"
+            % iMismatches)
+        return 1
+    print("OK: sharded answers match the in-process search")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+""" # Micro-benchmark: token issue / verify throughput
+-----
+Every basket call verifies a token, so this is a per-request cost. Measures,
+on one core:
+
+    issue           signing a new basket code
+    verify          full verification (base-62 decode + HMAC + expiry check)
+    verify cached   verification through the verified-token cache
+
+    python -m benchmarks.bench_tokens [--count 200000]
+"""
+
+import argparse
+import time
+
+import tokencache
+import tokens
+
+#-------------------------------------------------------------------------------
+def _rate(fnCall, iCount):
+    """Calls 'fnCall(i)' iCount times; returns calls per second."""
+    fStart = time.perf_counter()
+    for i in range(iCount):
+        fnCall(i)
+    return iCount / (time.perf_counter() - fStart)
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--count", type=int, default=200000)
+    oArgs = oParser.parse_args(aArgs)
+    iCount = oArgs.count
+
+    oCodec = tokens.TokenCodec(tokens.load_key())
+    fExpiry = time.time() + tokens.TOKEN_LIFETIME
+    aTokens = [oCodec.issue(tokens.KIND_BASKET, {"sUser_id":"user-%d" % i,
+        "sBasket_id":"%012d" % i}, fExpiry) for i in range(1000)]
+    oCache = tokencache.VerifiedTokenCache(
+        lambda sToken: oCodec.verify(tokens.KIND_BASKET, sToken),
+        "token expired")
+
+    dRates = {
+        "issue":_rate(lambda i: oCodec.issue(tokens.KIND_BASKET,
+            {"sUser_id":"user", "sBasket_id":"000000000001"}, fExpiry), iCount),
+        "verify":_rate(lambda i: oCodec.verify(tokens.KIND_BASKET,
+            aTokens[i % 1000]), iCount),
+        "verify cached":_rate(lambda i: oCache.verify(aTokens[i % 1000]),
+            iCount)
+    }
+    print("token length: %d characters" % len(aTokens[0]))
+    for sName, fRate in dRates.items():
+        print("%-14s %10.0f ops/s per core  (%.2f us/op)" % (sName, fRate,
+            1e6 / fRate))
+    return 0
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+""" # Benchmark: checkout log, group commit vs one fsync per checkout
+-----
+Many threads log invoices at once, through a 'wal.CheckoutLog' with group
+commit and through one syncing every record on its own. Reports checkouts per
+second, syncs and records per sync.
+
+Each log is then reopened with a torn record appended, as a crash mid-write
+would leave it: every acknowledged invoice must be replayed exactly once. The
+script exits with status 1 if any is missing or repeated.
+
+    python -m benchmarks.bench_wal [--threads 64] [--count 100]
+        [--dir /path/on/the/disk/to/test]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import wal
+
+#-------------------------------------------------------------------------------
+def make_invoice(iThread, iCheckout):
+    """An invoice record of typical size."""
+    return {
+        "sInvoice_code":"Z-%03d%05d" % (iThread, iCheckout),
+        "sUser_id":"user-%d" % iThread,
+        "sCurrency":"PLN",
+        "iGoods":12999,
+        "iShip":4000,
+        "fCreated":time.time(),
+        "aLines":[["I-%05d" % i, 1, 4333, "PLN"] for i in range(3)]
+    }
+
+#-------------------------------------------------------------------------------
+def run(sPath, bGroup, iThreads, iCount):
+    """Logs 'iThreads' x 'iCount' invoices. Returns (checkouts/second,
+    syncs, set of invoice codes acknowledged)."""
+    aApplied = []
+    oLog = wal.CheckoutLog(sPath, aApplied.extend, bGroup)
+    setCodes = set()
+    oLock = threading.Lock()
+    oBarrier = threading.Barrier(iThreads + 1)
+    def checkout(iThread):
+        aMine = []
+        oBarrier.wait()
+        for iCheckout in range(iCount):
+            dInvoice = make_invoice(iThread, iCheckout)
+            oLog.append(dInvoice)
+            aMine.append(dInvoice["sInvoice_code"])
+        with oLock:
+            setCodes.update(aMine)
+    aThreads = [threading.Thread(target=checkout, args=(i,))
+        for i in range(iThreads)]
+    for oThread in aThreads:
+        oThread.start()
+    oBarrier.wait()
+    fStart = time.perf_counter()
+    for oThread in aThreads:
+        oThread.join()
+    fElapsed = time.perf_counter() - fStart
+    iSyncs = oLog.iSyncs
+    oLog.close()
+    return iThreads * iCount / fElapsed, iSyncs, setCodes
+
+#-------------------------------------------------------------------------------
+def check_replay(sPath, setCodes):
+    """Reopens a log after a simulated torn write; returns the number of
+    invoices missing or replayed twice."""
+    with open(sPath, "ab") as oFile:
+        oFile.write(wal.encode_record(make_invoice(999, 0))[:-5])
+    aReplayed = []
+    wal.CheckoutLog(sPath, aReplayed.extend).close()
+    aCodes = [dInvoice["sInvoice_code"] for dInvoice in aReplayed]
+    return len(setCodes.symmetric_difference(aCodes)) + len(aCodes) \
+        - len(set(aCodes))
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--threads", type=int, default=64)
+    oParser.add_argument("--count", type=int, default=100)
+    oParser.add_argument("--dir")
+    oArgs = oParser.parse_args(aArgs)
+
+    iFailures = 0
+    with tempfile.TemporaryDirectory(dir=oArgs.dir) as sDirectory:
+        for sName, bGroup in (("per-checkout", False), ("group", True)):
+            sPath = os.path.join(sDirectory, sName + ".log")
+            fRate, iSyncs, setCodes = run(sPath, bGroup, oArgs.threads,
+                oArgs.count)
+            print("%-13s %9.0f checkouts/s  %6d syncs  %6.1f per sync" % (
+                sName, fRate, iSyncs, len(setCodes) / max(iSyncs, 1)))
+            iFailures += check_replay(sPath, setCodes)
+    if iFailures:
+        print("FAIL: %d invoices missing or repeated after replay"
+            % iFailures)
+        return 1
+    print("OK: every acknowledged invoice replayed exactly once")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
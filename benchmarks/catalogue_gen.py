@@ -0,0 +1,123 @@
+""" # Synthetic catalogue generator
+-----
+Products shaped like the 'list_products' examples: each model has a brand, a
+category, a price and a description of words drawn from a vocabulary, and is
+sold in several size / colour variants, each variant a product of its own
+('sItem_id' "I-0000123"). The same seed always gives the same catalogue, so
+runs on different machines (or in different processes) load identical data.
+
+    python -m benchmarks.catalogue_gen --skus 100000 --out feed.jsonl.gz
+        [--vocabulary 2000] [--seed 1]
+
+writes a JSON-lines feed for 'shop.import_products'.
+"""
+
+import argparse
+import gzip
+import json
+import random
+import sys
+
+SIZES = ("XS", "S", "M", "L", "XL", "XXL", "38", "40", "42", "44",
+    "150cm x 100cm", "Medium horse (16hh)")
+COLOURS = ("White", "Black", "Red", "Blue", "Green", "Navy", "Grey", "Beige",
+    "State colours")
+CURRENCIES = ("PLN", "PLN", "PLN", "EUR", "USD")
+
+#-------------------------------------------------------------------------------
+def make_vocabulary(iWords, oRandom):
+    """'iWords' distinct pronounceable words."""
+    setWords = set()
+    while len(setWords) < iWords:
+        setWords.add("".join(oRandom.choice("bcdfghklmnprstvz") +
+            oRandom.choice("aeiou") for _ in range(oRandom.randint(2, 4))))
+    return sorted(setWords)
+
+#-------------------------------------------------------------------------------
+def make_products(iSkus, iVocabulary=2000, iSeed=1):
+    """Yields 'iSkus' products.
+
+    Parameters
+    ----------
+        iSkus (integer)
+            Number of products (variants), in total.
+
+        iVocabulary (integer)
+            Number of distinct words descriptions are made of. Word use
+            follows a Zipf-like law, so a few words match many products.
+
+        iSeed (integer)
+            Seed of the generator.
+    """
+    oRandom = random.Random(iSeed)
+    aWords = make_vocabulary(iVocabulary, oRandom)
+    aWeights = [1.0 / (iRank + 1) for iRank in range(len(aWords))]
+    iSku = 0
+    while iSku < iSkus:
+        sDesc = " ".join(oRandom.choices(aWords, aWeights,
+            k=oRandom.randint(2, 5))).capitalize()
+        sBrand = "Brand %d" % oRandom.randrange(max(1, iSkus // 200))
+        sCategory = "category-%d" % oRandom.randrange(100)
+        sCurrency = oRandom.choice(CURRENCIES)
+        fPrice = round(oRandom.lognormvariate(4, 1), 2) or 0.01
+        aSizes = oRandom.sample(SIZES, oRandom.randint(1, 4))
+        aColours = oRandom.sample(COLOURS, oRandom.randint(1, 3))
+        for sSize in aSizes:
+            for sColour in aColours:
+                if iSku >= iSkus:
+                    return
+                yield {
+                    "sItem_id":"I-%07d" % iSku,
+                    "sBrand":sBrand,
+                    "sDesc":sDesc,
+                    "sSize":sSize,
+                    "sColour":sColour,
+                    "sCategory":sCategory,
+                    "fPrice":fPrice,
+                    "sCurrency":sCurrency,
+                    "iStock":oRandom.randrange(0, 500),
+                    "aPhotos":["https://example.com/photos/%07d-%d.jpg"
+                        % (iSku, i) for i in range(oRandom.randint(0, 3))]
+                }
+                iSku += 1
+
+#-------------------------------------------------------------------------------
+def keywords(aProducts, iCount, iSeed=1):
+    """'iCount' search strings taken from the products' descriptions, with
+    popular words proportionally more likely, as shoppers type them."""
+    oRandom = random.Random(iSeed)
+    aKeywords = []
+    for _ in range(iCount):
+        aWords = oRandom.choice(aProducts)["sDesc"].lower().split()
+        aKeywords.append(" ".join(oRandom.sample(aWords,
+            min(len(aWords), oRandom.choice((1, 1, 1, 2))))))
+    return aKeywords
+
+#-------------------------------------------------------------------------------
+def write_feed(sPath, iterProducts):
+    """Writes products as a JSON-lines feed (gzipped if 'sPath' ends in
+    ".gz"). Returns the number written."""
+    fnOpen = gzip.open if sPath.endswith(".gz") else open
+    iCount = 0
+    with fnOpen(sPath, "wt", encoding="utf-8") as oFile:
+        for dProduct in iterProducts:
+            oFile.write(json.dumps(dProduct, separators=(",", ":")))
+            oFile.write("\n")
+            iCount += 1
+    return iCount
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--skus", type=int, default=100000)
+    oParser.add_argument("--vocabulary", type=int, default=2000)
+    oParser.add_argument("--seed", type=int, default=1)
+    oParser.add_argument("--out", required=True)
+    oArgs = oParser.parse_args(aArgs)
+    iCount = write_feed(oArgs.out, make_products(oArgs.skus, oArgs.vocabulary,
+        oArgs.seed))
+    print("%d products written to %s" % (iCount, oArgs.out))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+""" # Load driver for the shop API
+-----
+Loads a synthetic catalogue (see 'catalogue_gen') and runs scripted shopper
+sessions (see 'sessions') against the shop from many threads, optionally in
+several processes, each process a shop of its own with the same catalogue.
+Latencies and outcomes come from the shop's own instrumentation; the
+processes' histograms are merged, and a machine-readable report is written:
+
+    {
+        "dConfig": the run's options,
+        "dHost": Python version, platform, cores,
+        "fElapsed": seconds measured,
+        "iSessions": sessions completed,
+        "fSessions_per_s": sessions per second,
+        "dSessions": how the sessions ended ("checkout", "browsed", ...),
+        "dEndpoints": per API function, 'metrics.Metrics.snapshot' figures
+            plus "fCalls_per_s"
+    }
+
+With '--baseline', the report is compared with an earlier one: an endpoint
+whose p50 or p99 latency grew, or whose throughput fell, by more than
+'--tolerance' is a regression, and the script exits with status 1.
+
+    python -m benchmarks.load [--skus 50000] [--vocabulary 2000]
+        [--threads 8] [--processes 1] [--duration 10] [--warmup 2]
+        [--seed 1] [--report report.json] [--baseline old.json]
+        [--tolerance 0.25]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import threading
+import time
+
+import metrics
+import shop
+from benchmarks import catalogue_gen, sessions
+
+# Distinct search strings the sessions choose from
+KEYWORDS = 2000
+
+#-------------------------------------------------------------------------------
+def load_catalogue(iSkus, iVocabulary, iSeed):
+    """Adds the synthetic catalogue to the shop. Returns search keywords."""
+    aProducts = []
+    for dProduct in catalogue_gen.make_products(iSkus, iVocabulary, iSeed):
+        shop.add_product(dProduct)
+        aProducts.append(dProduct)
+    return catalogue_gen.keywords(aProducts, KEYWORDS, iSeed)
+
+#-------------------------------------------------------------------------------
+def _shopper(iWorker, aKeywords, oProfile, oMeasure, oStop, dEndings, oLock):
+    """Runs sessions back to back until 'oStop' is set, counting those which
+    end while 'oMeasure' is set."""
+    oRandom = random.Random(iWorker)
+    dMine = {}
+    iSession = 0
+    while not oStop.is_set():
+        sEnding = sessions.run_session(oRandom, oProfile, aKeywords,
+            "load-%d-%d" % (iWorker, iSession))
+        if oMeasure.is_set():
+            dMine[sEnding] = dMine.get(sEnding, 0) + 1
+        iSession += 1
+    with oLock:
+        for sEnding, iCount in dMine.items():
+            dEndings[sEnding] = dEndings.get(sEnding, 0) + iCount
+
+#-------------------------------------------------------------------------------
+def run_process(iProcess, dConfig):
+    """One process's share of the load.
+
+    Returns
+    -------
+        (tuple) (fElapsed, dEndings, dExported): seconds measured, how the
+        sessions ended, and the shop's 'metrics.Metrics.export'.
+    """
+    aKeywords = load_catalogue(dConfig["skus"], dConfig["vocabulary"],
+        dConfig["seed"])
+    oProfile = sessions.Profile()
+    dEndings = {}
+    oLock = threading.Lock()
+    oMeasure = threading.Event()
+    oStop = threading.Event()
+    aThreads = [threading.Thread(target=_shopper, args=(
+        (dConfig["seed"] * 1000 + iProcess) * 1000 + iThread, aKeywords,
+        oProfile, oMeasure, oStop, dEndings, oLock), daemon=True)
+        for iThread in range(dConfig["threads"])]
+    for oThread in aThreads:
+        oThread.start()
+    time.sleep(dConfig["warmup"])
+    shop._oMetrics.reset()
+    oMeasure.set()
+    fStart = time.perf_counter()
+    time.sleep(dConfig["duration"])
+    oStop.set()
+    for oThread in aThreads:
+        oThread.join()
+    fElapsed = time.perf_counter() - fStart
+    return fElapsed, dEndings, shop._oMetrics.export()
+
+#-------------------------------------------------------------------------------
+def run(dConfig):
+    """Runs the load in 'dConfig["processes"]' processes; returns the
+    report."""
+    iProcesses = dConfig["processes"]
+    if iProcesses == 1:
+        aResults = [run_process(0, dConfig)]
+    else:
+        oContext = multiprocessing.get_context("spawn")
+        with oContext.Pool(iProcesses) as oPool:
+            aResults = oPool.starmap(run_process, [(iProcess, dConfig)
+                for iProcess in range(iProcesses)])
+
+    oMetrics = metrics.Metrics()
+    dEndings = {}
+    fElapsed = max(tResult[0] for tResult in aResults)
+    for _, dProcess_endings, dExported in aResults:
+        oMetrics.merge(dExported)
+        for sEnding, iCount in dProcess_endings.items():
+            dEndings[sEnding] = dEndings.get(sEnding, 0) + iCount
+    dEndpoints = oMetrics.snapshot()
+    for dFigures in dEndpoints.values():
+        dFigures["fCalls_per_s"] = dFigures["iCount"] / fElapsed
+    iSessions = sum(dEndings.values())
+    return {
+        "dConfig":dConfig,
+        "dHost":{"sPython":platform.python_version(),
+            "sPlatform":platform.platform(), "iCores":os.cpu_count()},
+        "fElapsed":fElapsed,
+        "iSessions":iSessions,
+        "fSessions_per_s":iSessions / fElapsed,
+        "dSessions":dict(sorted(dEndings.items())),
+        "dEndpoints":dEndpoints
+    }
+
+#-------------------------------------------------------------------------------
+def compare(dBaseline, dReport, fTolerance):
+    """Regressions of a report against a baseline report.
+
+    Returns
+    -------
+        (list of strings) One line per endpoint figure which got worse by
+        more than 'fTolerance' (0.25 = 25%); empty if none did.
+    """
+    aRegressions = []
+    for sName, dOld in dBaseline["dEndpoints"].items():
+        dNew = dReport["dEndpoints"].get(sName)
+        if dNew is None:
+            aRegressions.append("%s: not called" % sName)
+            continue
+        for sKey in ("fP50", "fP99"):
+            if dNew[sKey] > dOld[sKey] * (1 + fTolerance):
+                aRegressions.append("%s: %s %.3f ms -> %.3f ms" % (sName,
+                    sKey, dOld[sKey] * 1000, dNew[sKey] * 1000))
+        if dNew["fCalls_per_s"] < dOld["fCalls_per_s"] * (1 - fTolerance):
+            aRegressions.append("%s: %.0f -> %.0f calls/s" % (sName,
+                dOld["fCalls_per_s"], dNew["fCalls_per_s"]))
+    return aRegressions
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--skus", type=int, default=50000)
+    oParser.add_argument("--vocabulary", type=int, default=2000)
+    oParser.add_argument("--threads", type=int, default=8)
+    oParser.add_argument("--processes", type=int, default=1)
+    oParser.add_argument("--duration", type=float, default=10.0)
+    oParser.add_argument("--warmup", type=float, default=2.0)
+    oParser.add_argument("--seed", type=int, default=1)
+    oParser.add_argument("--report")
+    oParser.add_argument("--baseline")
+    oParser.add_argument("--tolerance", type=float, default=0.25)
+    oArgs = oParser.parse_args(aArgs)
+    dConfig = {sKey:getattr(oArgs, sKey) for sKey in ("skus", "vocabulary",
+        "threads", "processes", "duration", "warmup", "seed")}
+
+    dReport = run(dConfig)
+    print("%d sessions in %.1f s: %.1f sessions/s  %s" % (dReport["iSessions"],
+        dReport["fElapsed"], dReport["fSessions_per_s"],
+        dReport["dSessions"]))
+    print("%-20s %9s %9s %9s %9s %9s" % ("endpoint", "calls/s", "p50 ms",
+        "p95 ms", "p99 ms", "max ms"))
+    for sName, dFigures in dReport["dEndpoints"].items():
+        print("%-20s %9.0f %9.3f %9.3f %9.3f %9.3f" % (sName,
+            dFigures["fCalls_per_s"], dFigures["fP50"] * 1000,
+            dFigures["fP95"] * 1000, dFigures["fP99"] * 1000,
+            dFigures["fMax"] * 1000))
+    if oArgs.report:
+        with open(oArgs.report, "w", encoding="utf-8") as oFile:
+            json.dump(dReport, oFile, indent=2, sort_keys=True)
+    if oArgs.baseline:
+        with open(oArgs.baseline, encoding="utf-8") as oFile:
+            aRegressions = compare(json.load(oFile), dReport, oArgs.tolerance)
+        for sLine in aRegressions:
+            print("REGRESSION " + sLine)
+        if aRegressions:
+            return 1
+        print("OK: no endpoint regressed by more than %.0f%%"
+            % (oArgs.tolerance * 100))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+""" # Scripted shopper sessions
+-----
+A session is one customer's visit, driven through the shop API as a web
+front end would drive it:
+
+    browse      'list_products' for a few keywords, some with filters, facets
+                or a price order, paging on with 'sCursor_n'
+    buy         'create_order', several 'update_order' (some through
+                'update_order_batch'), an occasional 'delete_order', a
+                'list_orders' after each change (passing the basket version
+                last seen, so only the changes come back), then
+                'checkout_order' or leaving the basket to expire
+
+'Profile' holds the proportions. Every call goes through the instrumented API
+functions, so latencies and outcomes end up in 'shop.metrics_snapshot'.
+"""
+
+import shop
+
+#-------------------------------------------------------------------------------
+class Profile:
+    """Shape of a session."""
+
+    __slots__ = ("iSearches", "iPages", "fFilter", "fBuy", "iLines",
+        "fBatch", "fDelete", "fCheckout", "iMax_res")
+
+    def __init__(self, iSearches=3, iPages=2, fFilter=0.3, fBuy=0.5,
+            iLines=4, fBatch=0.2, fDelete=0.2, fCheckout=0.7, iMax_res=20):
+        """Sets the proportions.
+
+        Parameters
+        ----------
+            iSearches (integer)
+                Most keyword searches per session.
+
+            iPages (integer)
+                Most result pages fetched per search.
+
+            fFilter (float)
+                Share of searches with filters, facets or a price order.
+
+            fBuy (float)
+                Share of sessions which open a basket.
+
+            iLines (integer)
+                Most items put in a basket.
+
+            fBatch (float)
+                Share of baskets filled with one 'update_order_batch'.
+
+            fDelete (float)
+                Chance of taking an item back out after adding it.
+
+            fCheckout (float)
+                Share of baskets checked out; the rest are abandoned.
+
+            iMax_res (integer)
+                Page size of the searches.
+        """
+        self.iSearches = iSearches
+        self.iPages = iPages
+        self.fFilter = fFilter
+        self.fBuy = fBuy
+        self.iLines = iLines
+        self.fBatch = fBatch
+        self.fDelete = fDelete
+        self.fCheckout = fCheckout
+        self.iMax_res = iMax_res
+
+#-------------------------------------------------------------------------------
+def browse(oRandom, oProfile, aKeywords):
+    """Searches and pages through results. Returns the items seen."""
+    aSeen = []
+    for _ in range(oRandom.randint(1, oProfile.iSearches)):
+        dBriefcase = {"iIdx":0, "iMax_res":oProfile.iMax_res,
+            "sItem_filter":oRandom.choice(aKeywords)}
+        if oRandom.random() < oProfile.fFilter:
+            dBriefcase["sSort"] = oRandom.choice(("fPrice_asc",
+                "fPrice_desc"))
+            dBriefcase["bFacets"] = True
+            dBriefcase["bIn_stock"] = oRandom.random() < 0.5
+            dBriefcase["fPrice_max"] = float(oRandom.choice((50, 100, 500)))
+        for _ in range(oRandom.randint(1, oProfile.iPages)):
+            dOutput = shop.list_products(dBriefcase)
+            if dOutput["sStatus"] != "OK":
+                break
+            aSeen.extend(dItem["sItem_id"] for dItem in dOutput["aItems"]
+                if dItem["iStock"] > 0)
+            if dOutput["sCursor_n"] is None:
+                break
+            dBriefcase = dict(dBriefcase, sCursor=dOutput["sCursor_n"])
+    return aSeen
+
+#-------------------------------------------------------------------------------
+def buy(oRandom, oProfile, sAuth_token, aCandidates):
+    """Fills a basket from 'aCandidates' and checks it out (or abandons it).
+
+    Returns
+    -------
+        (string) "checkout", "abandoned" or the 'sErr_desc' which ended the
+        session.
+    """
+    dOutput = shop.create_order(sAuth_token)
+    if dOutput["sStatus"] != "OK":
+        return dOutput["sErr_desc"]
+    sBasket_code = dOutput["sBasket_code"]
+    aItems = oRandom.sample(aCandidates, min(len(aCandidates),
+        oRandom.randint(1, oProfile.iLines)))
+
+    iVersion = None
+    if oRandom.random() < oProfile.fBatch:
+        shop.update_order_batch({"sBasket_code":sBasket_code,
+            "aLines":[{"sItem_id":sItem_id, "iQty":oRandom.randint(1, 2)}
+            for sItem_id in aItems]})
+        iVersion = shop.list_orders(sBasket_code).get("iVersion")
+    else:
+        for sItem_id in aItems:
+            dBriefcase = {"sBasket_code":sBasket_code, "sItem_id":sItem_id,
+                "iQty":oRandom.randint(1, 2)}
+            dOutput = shop.update_order(dBriefcase)
+            iVersion = shop.list_orders(sBasket_code, iVersion).get(
+                "iVersion", iVersion)
+            if dOutput["sStatus"] == "OK" \
+                    and oRandom.random() < oProfile.fDelete:
+                shop.delete_order(dict(dBriefcase, iQty=1))
+                iVersion = shop.list_orders(sBasket_code, iVersion).get(
+                    "iVersion", iVersion)
+
+    if oRandom.random() >= oProfile.fCheckout:
+        return "abandoned"
+    dOutput = shop.checkout_order({"sBasket_code":sBasket_code,
+        "sAuth_token":sAuth_token})
+    return "checkout" if dOutput["sStatus"] == "OK" else dOutput["sErr_desc"]
+
+#-------------------------------------------------------------------------------
+def run_session(oRandom, oProfile, aKeywords, sUser_id):
+    """One visit: browsing, then perhaps buying. Returns how it ended:
+    "browsed", "checkout", "abandoned" or an 'sErr_desc'."""
+    aSeen = browse(oRandom, oProfile, aKeywords)
+    if not aSeen or oRandom.random() >= oProfile.fBuy:
+        return "browsed"
+    return buy(oRandom, oProfile, shop.issue_auth_token(sUser_id), aSeen)
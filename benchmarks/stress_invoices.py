@@ -0,0 +1,133 @@
+""" # Stress check: invoice codes stay unique under parallel checkouts
+-----
+Two checks:
+
+    allocator   Several processes share one SQLite database, each with many
+                threads drawing invoice numbers ('invoices.StorageSource').
+                Half of the processes exit without 'close', as after a crash.
+                No number may be handed out twice, a fresh allocator must
+                carry on above every number handed out, and the gaps are
+                reported.
+    checkout    Hundreds of threads check out baskets through
+                'shop.checkout_order' at once; every invoice code must be
+                unique.
+
+The script exits with status 1 if any check fails.
+
+    python -m benchmarks.stress_invoices [--processes 4] [--threads 16]
+        [--count 500] [--shoppers 200]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+import invoices
+import storage
+
+#-------------------------------------------------------------------------------
+def draw(sPath, iThreads, iCount, bClose):
+    """One process: 'iThreads' threads drawing 'iCount' numbers each.
+    Returns every number drawn."""
+    oStorage = storage.SQLiteStorage(sPath)
+    oNumbers = invoices.InvoiceNumbers(invoices.StorageSource(oStorage))
+    aNumbers = []
+    oLock = threading.Lock()
+    def worker():
+        aMine = [oNumbers.next() for _ in range(iCount)]
+        with oLock:
+            aNumbers.extend(aMine)
+    aThreads = [threading.Thread(target=worker) for _ in range(iThreads)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    if bClose:
+        oNumbers.close()
+    oStorage.close()
+    return aNumbers
+
+#-------------------------------------------------------------------------------
+def check_allocator(iProcesses, iThreads, iCount):
+    """Returns the number of failures."""
+    with tempfile.TemporaryDirectory() as sDirectory:
+        sPath = os.path.join(sDirectory, "shop.db")
+        storage.SQLiteStorage(sPath).close()
+        oContext = multiprocessing.get_context("spawn")
+        with oContext.Pool(iProcesses) as oPool:
+            aResults = oPool.starmap(draw, [(sPath, iThreads, iCount,
+                iProcess % 2 == 0) for iProcess in range(iProcesses)])
+        aNumbers = [iNumber for aPart in aResults for iNumber in aPart]
+        oStorage = storage.SQLiteStorage(sPath)
+        iNext = invoices.InvoiceNumbers(
+            invoices.StorageSource(oStorage)).next()
+        oStorage.close()
+
+    iFailures = 0
+    iDuplicates = len(aNumbers) - len(set(aNumbers))
+    iGaps = max(aNumbers) - min(aNumbers) + 1 - len(set(aNumbers))
+    print("allocator: %d numbers from %d processes x %d threads, "
+        "%d duplicates, %d gaps (%.2f%%), next %d after max %d" % (
+        len(aNumbers), iProcesses, iThreads, iDuplicates, iGaps,
+        100.0 * iGaps / len(aNumbers), iNext, max(aNumbers)))
+    if iDuplicates:
+        iFailures += 1
+    if iNext <= max(aNumbers):
+        print("FAIL: a fresh allocator reuses numbers")
+        iFailures += 1
+    return iFailures
+
+#-------------------------------------------------------------------------------
+def check_checkout(iShoppers):
+    """Returns the number of failures."""
+    import shop
+    shop.add_product({"sItem_id":"I-STRESS", "sBrand":"Stress",
+        "sDesc":"Stress test item", "sSize":"M", "sColour":"Red",
+        "fPrice":9.99, "sCurrency":"PLN", "iStock":iShoppers, "aPhotos":[]})
+    aCodes = []
+    oLock = threading.Lock()
+    oBarrier = threading.Barrier(iShoppers)
+    def shopper(iShopper):
+        sAuth_token = shop.issue_auth_token("stress-%d" % iShopper)
+        sBasket_code = shop.create_order(sAuth_token)["sBasket_code"]
+        shop.update_order({"sBasket_code":sBasket_code,
+            "sItem_id":"I-STRESS", "iQty":1})
+        oBarrier.wait()
+        dOutput = shop.checkout_order({"sBasket_code":sBasket_code,
+            "sAuth_token":sAuth_token})
+        with oLock:
+            aCodes.append(dOutput.get("sInvoice_code"))
+    aThreads = [threading.Thread(target=shopper, args=(i,))
+        for i in range(iShoppers)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    iMissing = aCodes.count(None)
+    iDuplicates = len(aCodes) - iMissing - len(set(aCodes) - {None})
+    print("checkout: %d checkouts, %d failed, %d duplicate codes" % (
+        len(aCodes), iMissing, iDuplicates))
+    return int(bool(iMissing or iDuplicates))
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--processes", type=int, default=4)
+    oParser.add_argument("--threads", type=int, default=16)
+    oParser.add_argument("--count", type=int, default=500)
+    oParser.add_argument("--shoppers", type=int, default=200)
+    oArgs = oParser.parse_args(aArgs)
+
+    iFailures = check_allocator(oArgs.processes, oArgs.threads, oArgs.count)
+    iFailures += check_checkout(oArgs.shoppers)
+    if iFailures:
+        print("FAIL")
+        return 1
+    print("OK: invoice codes unique")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+""" # Stress check: no overselling under concurrent reservations
+-----
+Hundreds of threads open baskets and hammer 'update_order' / 'delete_order' on
+a handful of scarce items at the same moment. Afterwards, for every item,
+
+    stock left + units held in baskets == initial stock
+
+must hold, no stock level may be negative, and every basket must hold exactly
+what its thread was told it reserved. The script exits with status 1 if any
+check fails.
+
+    python -m benchmarks.stress_reservations [--threads 300] [--rounds 200]
+"""
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+import shop
+
+#-------------------------------------------------------------------------------
+def _shopper(iSeed, aItems, oBarrier, dResult):
+    """One customer: random reservations and returns on the hot items."""
+    oRandom = random.Random(iSeed)
+    sBasket_code = shop.create_order(
+        shop.issue_auth_token("stress-%d" % iSeed))["sBasket_code"]
+    dHeld = {}
+    dErrors = {}
+    oBarrier.wait()
+    for _ in range(dResult["iRounds"]):
+        sItem_id = oRandom.choice(aItems)
+        iQty = oRandom.randint(1, 3)
+        dBriefcase = {"sBasket_code":sBasket_code, "sItem_id":sItem_id,
+            "iQty":iQty}
+        if dHeld.get(sItem_id) and oRandom.random() < 0.3:
+            dBriefcase["iQty"] = min(iQty, dHeld[sItem_id])
+            dOutput = shop.delete_order(dBriefcase)
+            iSign = -1
+        else:
+            dOutput = shop.update_order(dBriefcase)
+            iSign = 1
+        if dOutput["sStatus"] == "OK":
+            dHeld[sItem_id] = dHeld.get(sItem_id, 0) + iSign * \
+                dBriefcase["iQty"]
+        else:
+            sErr_desc = dOutput["sErr_desc"]
+            dErrors[sErr_desc] = dErrors.get(sErr_desc, 0) + 1
+    dResult["aShoppers"].append((sBasket_code, dHeld, dErrors))
+
+#-------------------------------------------------------------------------------
+def main(aArgs=None):
+    oParser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    oParser.add_argument("--threads", type=int, default=300)
+    oParser.add_argument("--rounds", type=int, default=200)
+    oParser.add_argument("--items", type=int, default=4)
+    oParser.add_argument("--stock", type=int, default=5000)
+    oArgs = oParser.parse_args(aArgs)
+
+    aItems = ["HOT-%03d" % i for i in range(oArgs.items)]
+    for sItem_id in aItems:
+        shop.add_product({"sItem_id":sItem_id, "sBrand":"Stress",
+            "sDesc":"Flash sale item", "sSize":"N/A", "sColour":"Red",
+            "fPrice":9.99, "sCurrency":"PLN", "iStock":oArgs.stock,
+            "aPhotos":[]})
+
+    sys.setswitchinterval(1e-6)     # force frequent thread interleaving
+    oBarrier = threading.Barrier(oArgs.threads)
+    dResult = {"iRounds":oArgs.rounds, "aShoppers":[]}
+    aThreads = [threading.Thread(target=_shopper,
+        args=(iSeed, aItems, oBarrier, dResult))
+        for iSeed in range(oArgs.threads)]
+    fStart = time.perf_counter()
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    fElapsed = time.perf_counter() - fStart
+
+    aFailures = []
+    dErrors = {}
+    dHeld_total = dict.fromkeys(aItems, 0)
+    for sBasket_code, dHeld, dShopper_errors in dResult["aShoppers"]:
+        oBasket, _ = shop._find_basket(sBasket_code)
+        dLines = {sItem_id:iQty for sItem_id, iQty in dHeld.items() if iQty}
+        if oBasket is None or oBasket.dLines != dLines:
+            aFailures.append("basket %s holds %r, expected %r" % (sBasket_code,
+                None if oBasket is None else oBasket.dLines, dLines))
+        for sItem_id, iQty in dLines.items():
+            dHeld_total[sItem_id] += iQty
+        for sErr_desc, iCount in dShopper_errors.items():
+            dErrors[sErr_desc] = dErrors.get(sErr_desc, 0) + iCount
+    for sItem_id in aItems:
+        iStock = shop._oCatalogue.stock(sItem_id)
+        if iStock < 0:
+            aFailures.append("%s: negative stock %d" % (sItem_id, iStock))
+        if iStock + dHeld_total[sItem_id] != oArgs.stock:
+            aFailures.append("%s: %d in stock + %d held != %d" % (sItem_id,
+                iStock, dHeld_total[sItem_id], oArgs.stock))
+
+    iCalls = oArgs.threads * oArgs.rounds
+    print("%d threads, %d calls in %.2f s (%.0f calls/s)" % (oArgs.threads,
+        iCalls, fElapsed, iCalls / fElapsed))
+    print("rejections: %r" % dErrors)
+    for sFailure in aFailures[:20]:
+        print("FAIL", sFailure)
+    print("FAILED" if aFailures else "OK: no overselling")
+    return 1 if aFailures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
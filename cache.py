@@ -0,0 +1,208 @@
+""" # Result cache for 'list_products'
+-----
+Popular listings (the unfiltered first page, common keywords) are requested
+over and over with identical briefcases. The cache keeps the finished
+'dOutput' of such calls, keyed on the normalised briefcase, so a repeat call
+is a dictionary lookup.
+
+    - Size bounded: the least recently used entry is evicted first.
+    - Time bounded: an entry older than its time-to-live is not served.
+    - Targeted invalidation: every entry records which items it lists, and
+      which catalogue fields its membership or order depends on: "bIn_stock"
+      for the in-stock filter, "fPrice" for a price range or sort. When the
+      stock or price of an item changes, only the entries listing that item
+      are dropped, plus the entries depending on the field that changed. A
+      stock change which leaves the item in stock (the common case, as
+      baskets take and return units) drops no entry it isn't listed in.
+    - Any other catalogue change (a product added, removed or replaced)
+      clears the whole cache.
+    - No stale stores: an output is computed outside the cache lock, so a
+      change may land while it is being computed, after the invalidation
+      has run. The caller takes a 'token' before computing and hands it to
+      'put', which drops the output if a change since would have
+      invalidated it.
+
+Hit, miss, eviction and invalidation counters are available from 'stats'.
+Cached outputs are shared between callers and must be treated as read-only.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Number of recent changes remembered for 'put' to check an output against;
+# an output computed across more changes than this is not stored
+RECENT_CHANGES = 1024
+
+#-------------------------------------------------------------------------------
+class ResultCache:
+    """Bounded LRU/TTL cache of 'list_products' outputs."""
+
+    __slots__ = ("iMax_entries", "fTtl", "_dEntries", "_dBy_item",
+        "_dBy_field", "_iChanges", "_aRecent", "_oLock", "_dStats")
+
+    def __init__(self, iMax_entries=4096, fTtl=30.0):
+        """Creates an empty cache.
+
+        Parameters
+        ----------
+            iMax_entries (integer)
+                Number of outputs kept before the least recently used one is
+                evicted.
+
+            fTtl (float)
+                Seconds an output may be served for after it was stored.
+        """
+        self.iMax_entries = iMax_entries
+        self.fTtl = fTtl
+        # key -> (expiry, dOutput, item ids, fields)
+        self._dEntries = OrderedDict()
+        self._dBy_item = {}     # sItem_id -> set of keys listing it
+        self._dBy_field = {}    # sField -> set of keys depending on it
+        self._iChanges = 0      # changes seen, see 'token'
+        # (iChange, sItem_id, sField) of the latest changes
+        self._aRecent = deque(maxlen=RECENT_CHANGES)
+        self._oLock = threading.Lock()
+        self._dStats = {"iHits":0, "iMisses":0, "iEvictions":0,
+            "iInvalidations":0}
+
+    def __len__(self):
+        return len(self._dEntries)
+
+    #---------------------------------------------------------------------------
+    def get(self, tKey):
+        """Returns the cached output for a key, or 'None' on a miss."""
+        with self._oLock:
+            tEntry = self._dEntries.get(tKey)
+            if tEntry is None:
+                self._dStats["iMisses"] += 1
+                return None
+            if tEntry[0] < time.monotonic():
+                self._drop(tKey)
+                self._dStats["iMisses"] += 1
+                return None
+            self._dEntries.move_to_end(tKey)
+            self._dStats["iHits"] += 1
+            return tEntry[1]
+
+    def token(self):
+        """The change counter, to be taken before computing an output which
+        will be handed to 'put'."""
+        return self._iChanges
+
+    def put(self, tKey, dOutput, aItem_ids, aFields=(), iToken=None):
+        """Stores an output, unless a change since 'iToken' made it stale.
+
+        Parameters
+        ----------
+            tKey (tuple)
+                Normalised briefcase.
+
+            dOutput (dictionary)
+                Output to be served for the key.
+
+            aItem_ids (list of strings)
+                Items listed in the output.
+
+            aFields (list of strings)
+                Fields ("bIn_stock", "fPrice") whose change on any item could
+                alter the output, not just a change to the items listed.
+
+            iToken (integer, none)
+                'token' as taken before the output was computed.
+        """
+        aItem_ids = tuple(aItem_ids)
+        aFields = tuple(aFields)
+        with self._oLock:
+            if iToken is not None and self._stale(iToken, aItem_ids,
+                    aFields):
+                self._dStats["iInvalidations"] += 1
+                return
+            if tKey in self._dEntries:
+                self._drop(tKey)
+            self._dEntries[tKey] = (time.monotonic() + self.fTtl, dOutput,
+                aItem_ids, aFields)
+            for sItem_id in aItem_ids:
+                self._dBy_item.setdefault(sItem_id, set()).add(tKey)
+            for sField in aFields:
+                self._dBy_field.setdefault(sField, set()).add(tKey)
+            while len(self._dEntries) > self.iMax_entries:
+                self._drop(next(iter(self._dEntries)))
+                self._dStats["iEvictions"] += 1
+
+    def _stale(self, iToken, aItem_ids, aFields):
+        """Whether a change after 'iToken' invalidates an output listing
+        'aItem_ids' and depending on 'aFields'. The caller holds the lock."""
+        if iToken == self._iChanges:
+            return False
+        if not self._aRecent or self._aRecent[0][0] > iToken + 1:
+            return True
+        setItem_ids = set(aItem_ids)
+        for iChange, sItem_id, sField in reversed(self._aRecent):
+            if iChange <= iToken:
+                return False
+            if (sItem_id is None or sItem_id in setItem_ids
+                    or sField in aFields):
+                return True
+        return False
+
+    def _changed(self, sItem_id, sField):
+        """Counts a change of one item's field, or of everything ('None').
+        The caller holds the lock."""
+        self._iChanges += 1
+        self._aRecent.append((self._iChanges, sItem_id, sField))
+
+    def _drop(self, tKey):
+        _, _, aItem_ids, aFields = self._dEntries.pop(tKey)
+        for dIndex, aValues in ((self._dBy_item, aItem_ids),
+                (self._dBy_field, aFields)):
+            for sValue in aValues:
+                setKeys = dIndex.get(sValue)
+                if setKeys is not None:
+                    setKeys.discard(tKey)
+                    if not setKeys:
+                        del dIndex[sValue]
+
+    #---------------------------------------------------------------------------
+    def on_change(self, sItem_id, sField):
+        """Catalogue listener: drops outputs made stale by a change.
+
+        Parameters
+        ----------
+            sItem_id (string, none)
+                Item that changed; 'None' after a batch of products.
+
+            sField (string, none)
+                "iStock", "bIn_stock" or "fPrice" for a stock or price
+                change, as 'catalogue.Catalogue.add_listener' describes;
+                'None' if the product was added, removed or replaced.
+        """
+        with self._oLock:
+            if sField is None:
+                self._changed(None, None)
+                self._dStats["iInvalidations"] += len(self._dEntries)
+                self._dEntries.clear()
+                self._dBy_item.clear()
+                self._dBy_field.clear()
+                return
+            self._changed(sItem_id, sField)
+            setKeys = (self._dBy_item.get(sItem_id, set())
+                | self._dBy_field.get(sField, set()))
+            for tKey in setKeys:
+                self._drop(tKey)
+            self._dStats["iInvalidations"] += len(setKeys)
+
+    def clear(self):
+        """Drops every cached output."""
+        with self._oLock:
+            self._changed(None, None)
+            self._dEntries.clear()
+            self._dBy_item.clear()
+            self._dBy_field.clear()
+
+    def stats(self):
+        """Snapshot of the counters, with the current number of entries."""
+        with self._oLock:
+            dStats = dict(self._dStats)
+            dStats["iSize"] = len(self._dEntries)
+            return dStats
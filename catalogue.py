@@ -0,0 +1,414 @@
+""" # Columnar product catalogue
+-----
+Products are not stored as one dictionary each. Every field lives in its own
+column and a product is just a row number:
+
+    sItem_id, sDesc       plain lists of strings
+    sBrand, sSize,        'StringColumn': each distinct value is stored once
+    sColour, sCurrency,   (interned) and rows hold a 4-byte code into it
+    sCategory
+    fPrice                array('d') - 8 bytes per product
+    iStock                array('q') - 8 bytes per product
+    aPhotos               list of tuples
+    (live flag)           array('b') - 1 if the row holds a product
+    (JSON fragments)      list of tuples of bytes, see 'encoding'
+
+Measured on the generated catalogue of 'benchmarks', not counting the strings
+themselves (which any layout has to keep), the columns cost about 150 bytes
+per product: 38 for the fixed-width arrays, 32 for the list slots, 40 for the
+photo tuple and 38 for the '_dRows' entry. A list of nine-key dictionaries
+costs about 350. The keyword index adds about 145 bytes per product, and the
+JSON fragments about 320 (a page is then sent without re-encoding its
+products), so a fully loaded catalogue takes about 640 bytes per product;
+'tests/test_catalogue.py' keeps these figures from creeping up. The documented
+output dictionaries are only built ('materialise') for the page of results
+actually being returned.
+
+The keyword index over 'sDesc' is owned by the catalogue, so every add, update
+and removal keeps the two in step. Other components (such as the result cache)
+register a listener to hear about every change. Bulk loads ('batch') announce
+their additions and removals once, rather than product by product.
+
+'sCategory' is an optional product key ("" when absent) used by the business
+rules; it isn't part of the 'list_products' output.
+"""
+
+import contextlib
+import sys
+import threading
+from array import array
+from numbers import Real
+
+import encoding
+import search
+
+#-------------------------------------------------------------------------------
+def validate_product(dProduct):
+    """Checks a product record against the 'data validation' rules.
+
+    Parameters
+    ----------
+        dProduct (dictionary)
+            Product with the keys of 'dOutput["aItems"][n]' in
+            'list_products', and optionally "sCategory".
+
+    Raises
+    ------
+        ValueError: a key is missing or has the wrong type or value. The
+            message names the offending key.
+    """
+    if not isinstance(dProduct, dict):
+        raise ValueError("product must be a dictionary")
+    for sKey in ("sItem_id", "sBrand", "sDesc", "sSize", "sColour"):
+        if not isinstance(dProduct.get(sKey), str):
+            raise ValueError(sKey)
+    if not dProduct["sItem_id"]:
+        raise ValueError("sItem_id")
+    fPrice = dProduct.get("fPrice")
+    if (not isinstance(fPrice, Real) or isinstance(fPrice, bool)
+            or not 0 <= fPrice < float("inf")):
+        raise ValueError("fPrice")
+    sCurrency = dProduct.get("sCurrency")
+    if (not isinstance(sCurrency, str) or len(sCurrency) != 3
+            or not sCurrency.isalpha() or not sCurrency.isupper()):
+        raise ValueError("sCurrency")
+    iStock = dProduct.get("iStock")
+    if not isinstance(iStock, int) or isinstance(iStock, bool) or iStock < 0:
+        raise ValueError("iStock")
+    aPhotos = dProduct.get("aPhotos")
+    if (not isinstance(aPhotos, (list, tuple))
+            or not all(isinstance(sUrl, str) for sUrl in aPhotos)):
+        raise ValueError("aPhotos")
+    if not isinstance(dProduct.get("sCategory", ""), str):
+        raise ValueError("sCategory")
+
+#-------------------------------------------------------------------------------
+def _fragments(dProduct):
+    return encoding.product_fragments(dProduct["sItem_id"], dProduct["sBrand"],
+        dProduct["sDesc"], dProduct["sSize"], dProduct["sColour"],
+        dProduct["sCurrency"], dProduct["aPhotos"])
+
+#-------------------------------------------------------------------------------
+class StringColumn:
+    """Dictionary-encoded column of low-cardinality strings.
+
+    Each distinct value is interned and stored once in 'aValues'; rows hold a
+    4-byte code into that table.
+    """
+
+    __slots__ = ("aCodes", "aValues", "_dCodes")
+
+    def __init__(self):
+        self.aCodes = array("i")
+        self.aValues = []
+        self._dCodes = {}
+
+    def code_of(self, sValue, bCreate=True):
+        """Returns the code for a value; -1 if unknown and not created."""
+        iCode = self._dCodes.get(sValue)
+        if iCode is None:
+            if not bCreate:
+                return -1
+            iCode = len(self.aValues)
+            self.aValues.append(sys.intern(sValue))
+            self._dCodes[self.aValues[iCode]] = iCode
+        return iCode
+
+    def append(self, sValue):
+        self.aCodes.append(self.code_of(sValue))
+
+    def __getitem__(self, iRow):
+        return self.aValues[self.aCodes[iRow]]
+
+    def __setitem__(self, iRow, sValue):
+        self.aCodes[iRow] = self.code_of(sValue)
+
+#-------------------------------------------------------------------------------
+class Catalogue:
+    """Column store of products, addressed by 'sItem_id' or by row number.
+
+    Rows of removed products are recycled by later additions, so the columns
+    only grow with the peak size of the catalogue.
+
+    Products are added and removed one at a time, under a write lock. Reads
+    of a single field take no lock; stock and price are changed in place, one
+    value at a time. Rows are also overwritten in place, when a product is
+    replaced or a row is recycled, so reads of a whole row ('materialise',
+    'product', 'line_details', 'attributes') are optimistic: a write counter
+    is odd while a row is being written, and a read which overlapped a write
+    is done again under the write lock. A product is in the keyword index
+    only while its row is addressable (it is added to '_dRows' first and
+    removed from it last), and readers skip identifiers whose row has gone in
+    the meantime.
+    """
+
+    __slots__ = ("aItem_id", "aDesc", "oBrand", "oSize", "oColour",
+        "oCurrency", "oCategory", "aPrice", "aStock", "aPhotos", "aLive",
+        "aFragments", "oIndex", "_dRows", "_aFree", "_iGeneration", "_iWrites",
+        "_aRanks", "_aListeners", "_oBatch", "_oWrite_lock")
+
+    def __init__(self):
+        self.aItem_id = []
+        self.aDesc = []
+        self.oBrand = StringColumn()
+        self.oSize = StringColumn()
+        self.oColour = StringColumn()
+        self.oCurrency = StringColumn()
+        self.oCategory = StringColumn()
+        self.aPrice = array("d")
+        self.aStock = array("q")
+        self.aPhotos = []
+        self.aLive = array("b")
+        self.aFragments = []
+        self.oIndex = search.KeywordIndex()
+        self._dRows = {}        # sItem_id -> row
+        self._aFree = []        # rows of removed products, for reuse
+        self._iGeneration = 0   # bumped whenever a product is added/removed
+        self._iWrites = 0       # odd while a row is being overwritten
+        self._aRanks = None     # (generation, array of 'sItem_id' ranks)
+        self._aListeners = []
+        self._oBatch = threading.local()    # 'bChanged' inside 'batch'
+        self._oWrite_lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._dRows)
+
+    def __contains__(self, sItem_id):
+        return sItem_id in self._dRows
+
+    def add_listener(self, fnListener):
+        """Registers a callable to be told about every catalogue change.
+
+        The listener is called as 'fnListener(sItem_id, sField)', where
+        'sField' is "iStock" for a stock change which leaves the product in
+        (or out of) stock, "bIn_stock" for one which brings it into or out of
+        stock, "fPrice" for a price change and 'None' when the product was
+        added, removed or replaced. Products added, removed or replaced
+        inside a 'batch' are announced together, as 'fnListener(None, None)'.
+        """
+        self._aListeners.append(fnListener)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Block whose additions, removals and replacements (made by the
+        calling thread) are announced to the listeners once, when it ends,
+        instead of product by product. Until then listeners may serve what
+        they derived from the products as they were. Blocks don't nest."""
+        self._oBatch.bChanged = False
+        try:
+            yield self
+        finally:
+            bChanged = self._oBatch.bChanged
+            del self._oBatch.bChanged
+            if bChanged:
+                self._notify(None, None)
+
+    def _notify(self, sItem_id, sField):
+        if (sField is None
+                and getattr(self._oBatch, "bChanged", None) is not None):
+            self._oBatch.bChanged = True
+            return
+        for fnListener in self._aListeners:
+            fnListener(sItem_id, sField)
+
+    def row_of(self, sItem_id):
+        """Row number of a product; KeyError if it isn't in the catalogue."""
+        return self._dRows[sItem_id]
+
+    def keyword_rows(self, sItem_filter):
+        """Rows matching all keywords, in 'sItem_id' order; 'None' if there
+        are no keywords."""
+        if not search.tokenise(sItem_filter):
+            return None
+        dRows = self._dRows
+        aRows = [dRows.get(sItem_id)
+            for sItem_id in self.oIndex.search(sItem_filter)]
+        if None in aRows:   # removed since the search
+            aRows = [iRow for iRow in aRows if iRow is not None]
+        return aRows
+
+    #---------------------------------------------------------------------------
+    def add(self, dProduct):
+        """Adds a product, or replaces the product with the same 'sItem_id'.
+
+        Raises
+        ------
+            ValueError: the record fails 'validate_product'.
+        """
+        validate_product(dProduct)
+        with self._oWrite_lock:
+            return self._add(dProduct)
+
+    def _add(self, dProduct):
+        sItem_id = dProduct["sItem_id"]
+        iRow = self._dRows.get(sItem_id)
+        if iRow is not None:
+            self._write(iRow, dProduct)
+            self.oIndex.update(sItem_id, dProduct["sDesc"])
+            self._notify(sItem_id, None)
+            return iRow
+        if self._aFree:
+            iRow = self._aFree.pop()
+            self._write(iRow, dProduct)
+        else:
+            iRow = len(self.aItem_id)
+            self.aItem_id.append(sItem_id)
+            self.aDesc.append(dProduct["sDesc"])
+            self.oBrand.append(dProduct["sBrand"])
+            self.oSize.append(dProduct["sSize"])
+            self.oColour.append(dProduct["sColour"])
+            self.oCurrency.append(dProduct["sCurrency"])
+            self.oCategory.append(dProduct.get("sCategory", ""))
+            self.aPrice.append(float(dProduct["fPrice"]))
+            self.aStock.append(dProduct["iStock"])
+            self.aPhotos.append(tuple(dProduct["aPhotos"]))
+            self.aLive.append(1)
+            self.aFragments.append(_fragments(dProduct))
+        self._dRows[sItem_id] = iRow
+        self._iGeneration += 1
+        self.oIndex.add(sItem_id, dProduct["sDesc"])
+        self._notify(sItem_id, None)
+        return iRow
+
+    def _write(self, iRow, dProduct):
+        self._iWrites += 1
+        self.aItem_id[iRow] = dProduct["sItem_id"]
+        self.aDesc[iRow] = dProduct["sDesc"]
+        self.oBrand[iRow] = dProduct["sBrand"]
+        self.oSize[iRow] = dProduct["sSize"]
+        self.oColour[iRow] = dProduct["sColour"]
+        self.oCurrency[iRow] = dProduct["sCurrency"]
+        self.oCategory[iRow] = dProduct.get("sCategory", "")
+        self.aPrice[iRow] = float(dProduct["fPrice"])
+        self.aStock[iRow] = dProduct["iStock"]
+        self.aPhotos[iRow] = tuple(dProduct["aPhotos"])
+        self.aLive[iRow] = 1
+        self.aFragments[iRow] = _fragments(dProduct)
+        self._iWrites += 1
+
+    def remove(self, sItem_id):
+        """Withdraws a product. Unknown identifiers are ignored."""
+        with self._oWrite_lock:
+            self._remove(sItem_id)
+
+    def _remove(self, sItem_id):
+        iRow = self._dRows.get(sItem_id)
+        if iRow is None:
+            return
+        self.oIndex.remove(sItem_id)
+        del self._dRows[sItem_id]
+        self._iWrites += 1
+        self.aItem_id[iRow] = None
+        self.aDesc[iRow] = None
+        self.aPhotos[iRow] = ()
+        self.aFragments[iRow] = None
+        self.aStock[iRow] = 0
+        self.aLive[iRow] = 0
+        self._iWrites += 1
+        self._aFree.append(iRow)
+        self._iGeneration += 1
+        self._notify(sItem_id, None)
+
+    #---------------------------------------------------------------------------
+    def _consistent(self, fnRead, *aArgs):
+        """'fnRead(*aArgs)', read as of one moment: done again under the
+        write lock if a row was overwritten while it ran."""
+        iWrites = self._iWrites
+        oResult = fnRead(*aArgs)
+        if iWrites & 1 or iWrites != self._iWrites:
+            with self._oWrite_lock:
+                oResult = fnRead(*aArgs)
+        return oResult
+
+    def materialise(self, iRow):
+        """Builds the documented output dictionary for one row."""
+        return self._consistent(self._materialise, iRow)
+
+    def _materialise(self, iRow):
+        return {
+            "sItem_id":self.aItem_id[iRow],
+            "sBrand":self.oBrand[iRow],
+            "sDesc":self.aDesc[iRow],
+            "sSize":self.oSize[iRow],
+            "sColour":self.oColour[iRow],
+            "fPrice":self.aPrice[iRow],
+            "sCurrency":self.oCurrency[iRow],
+            "iStock":self.aStock[iRow],
+            "aPhotos":list(self.aPhotos[iRow])
+        }
+
+    def fragments(self, iRow):
+        """Pre-encoded JSON of a row's fixed fields (see 'encoding')."""
+        return self.aFragments[iRow]
+
+    def product(self, iRow):
+        """A row as an 'encoding.Product': its dictionary and fragments."""
+        return self._consistent(self._product, iRow)
+
+    def _product(self, iRow):
+        return encoding.Product(self._materialise(iRow), self.aFragments[iRow])
+
+    def get(self, sItem_id):
+        """Output dictionary for a product; KeyError if it doesn't exist."""
+        return self.materialise(self._dRows[sItem_id])
+
+    def line_details(self, sItem_id):
+        """(fPrice, sCurrency, sDesc, sSize, sColour) of a product, as shown
+        on a basket line; KeyError if it doesn't exist."""
+        return self._consistent(self._line_details, self._dRows[sItem_id])
+
+    def _line_details(self, iRow):
+        return (self.aPrice[iRow], self.oCurrency[iRow], self.aDesc[iRow],
+            self.oSize[iRow], self.oColour[iRow])
+
+    def attributes(self, sItem_id):
+        """Fields the business rules match on; KeyError if the product
+        doesn't exist."""
+        return self._consistent(self._attributes, self._dRows[sItem_id])
+
+    def _attributes(self, iRow):
+        return {
+            "sItem_id":self.aItem_id[iRow],
+            "sBrand":self.oBrand[iRow],
+            "sCategory":self.oCategory[iRow],
+            "sCurrency":self.oCurrency[iRow]
+        }
+
+    def stock(self, sItem_id):
+        """Current stock level of a product."""
+        return self.aStock[self._dRows[sItem_id]]
+
+    def set_stock(self, sItem_id, iStock):
+        """Overwrites the stock level of a product."""
+        iRow = self._dRows[sItem_id]
+        bWas_in_stock = self.aStock[iRow] > 0
+        self.aStock[iRow] = iStock
+        self._notify(sItem_id,
+            "iStock" if (iStock > 0) == bWas_in_stock else "bIn_stock")
+
+    def set_price(self, sItem_id, fPrice):
+        """Overwrites the price of a product."""
+        self.aPrice[self._dRows[sItem_id]] = float(fPrice)
+        self._notify(sItem_id, "fPrice")
+
+    def id_ranks(self):
+        """Position of each row's 'sItem_id' in sorted identifier order.
+
+        Used to sort and page rows by 'sItem_id' without comparing strings.
+        Removed rows get the rank -1. The column is rebuilt, under the write
+        lock, only after products have been added or removed.
+
+        Returns
+        -------
+            (array('q')) One rank per row.
+        """
+        tRanks = self._aRanks
+        if tRanks is None or tRanks[0] != self._iGeneration:
+            with self._oWrite_lock:     # no additions while it is built
+                aRanks = array("q", bytes(8 * len(self.aItem_id)))
+                for iRank, sItem_id in enumerate(self.oIndex.ids()):
+                    aRanks[self._dRows[sItem_id]] = iRank
+                for iRow in self._aFree:
+                    aRanks[iRow] = -1
+                tRanks = self._aRanks = (self._iGeneration, aRanks)
+        return tRanks[1]
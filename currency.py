@@ -0,0 +1,186 @@
+""" # Currency conversion
+-----
+Every product is priced in its own 'sCurrency', but an invoice is written in
+a single currency ('sInv_Currency'). Exchange rates are read from a local
+file and turned into a dense conversion matrix, so converting an amount is
+one multiplication and never a lookup chain through a base currency.
+
+    - Currency codes are interned: each code gets a row/column number once,
+      when the table is built.
+    - The matrix converts minor units to minor units. Entry [i][j] already
+      combines the rate from currency i to currency j with the difference in
+      their minor-unit digits.
+    - A basket is converted in one pass over its per-currency running totals
+      (see 'baskets'), as a dot product with one column of the matrix. Only
+      the final sum is rounded.
+    - Tables are immutable. Loading new rates builds a new table and swaps it
+      in ('RateBook.install'); a checkout which took a snapshot with
+      'RateBook.current' keeps converting with the same rates throughout.
+
+The rate file is JSON: the home currency of the shop, and how many units of
+each currency one unit of the home currency buys:
+
+    {"sBase":"PLN", "dRates":{"PLN":1.0, "EUR":0.232, "USD":0.25}}
+"""
+
+import json
+import math
+import threading
+from array import array
+
+import money
+
+try:
+    import numpy as np
+except ImportError:     # NumPy is optional; plain sums are used without it
+    np = None
+
+#-------------------------------------------------------------------------------
+class RateTable:
+    """Immutable snapshot of exchange rates, as a dense conversion matrix."""
+
+    __slots__ = ("sBase", "iVersion", "aCodes", "_dCodes", "_aFactors",
+        "_oMatrix")
+
+    def __init__(self, sBase, dRates, iVersion=0):
+        """Builds the conversion matrix.
+
+        Parameters
+        ----------
+            sBase (string)
+                ISO-4217 code of the shop's home currency.
+
+            dRates (dictionary)
+                Currency code -> units of that currency per unit of 'sBase'.
+                Must include 'sBase'.
+
+            iVersion (integer)
+                Number identifying this snapshot.
+
+        Raises
+        ------
+            ValueError: a malformed code or rate, or 'sBase' without a rate.
+        """
+        for sCurrency, fRate in dRates.items():
+            if (not isinstance(sCurrency, str) or len(sCurrency) != 3
+                    or not sCurrency.isalpha() or not sCurrency.isupper()):
+                raise ValueError("invalid currency code: %r" % (sCurrency,))
+            if (isinstance(fRate, bool) or not isinstance(fRate, (int, float))
+                    or not math.isfinite(fRate) or fRate <= 0):
+                raise ValueError("invalid rate for %s" % sCurrency)
+        if sBase not in dRates:
+            raise ValueError("no rate for the base currency %r" % (sBase,))
+        self.sBase = sBase
+        self.iVersion = iVersion
+        self.aCodes = tuple(sorted(dRates))
+        self._dCodes = {sCurrency:iCode
+            for iCode, sCurrency in enumerate(self.aCodes)}
+        aScale = [dRates[sCurrency] * 10 ** money.exponent(sCurrency)
+            for sCurrency in self.aCodes]
+        # Row = source currency, column = target currency.
+        self._aFactors = array("d", (fTo / fFrom
+            for fFrom in aScale for fTo in aScale))
+        self._oMatrix = None
+        if np is not None:
+            self._oMatrix = np.frombuffer(self._aFactors, dtype=np.float64) \
+                .reshape(len(self.aCodes), len(self.aCodes))
+
+    def __contains__(self, sCurrency):
+        return sCurrency in self._dCodes
+
+    def __len__(self):
+        return len(self.aCodes)
+
+    def code_of(self, sCurrency):
+        """Row/column number of a currency; KeyError if it has no rate."""
+        return self._dCodes[sCurrency]
+
+    #---------------------------------------------------------------------------
+    def convert(self, iMinor, sFrom, sTo):
+        """Converts an amount in minor units of 'sFrom' to minor units of
+        'sTo'. KeyError for a currency without a rate."""
+        if sFrom == sTo:
+            return iMinor
+        iSize = len(self.aCodes)
+        return money.round_half(iMinor *
+            self._aFactors[self._dCodes[sFrom] * iSize + self._dCodes[sTo]])
+
+    def convert_totals(self, dTotals, sTo):
+        """Converts a basket's per-currency totals into one amount.
+
+        Parameters
+        ----------
+            dTotals (dictionary)
+                Currency code -> amount in minor units. Values may also be
+                lists whose first element is the amount, as kept in
+                'baskets.Basket.dTotals'.
+
+            sTo (string)
+                Target currency.
+
+        Returns
+        -------
+            (integer) Sum in minor units of 'sTo', rounded once.
+
+        Raises
+        ------
+            KeyError: a currency without a rate.
+        """
+        aCodes = [self._dCodes[sCurrency] for sCurrency in dTotals]
+        aAmounts = [xTotal[0] if isinstance(xTotal, list) else xTotal
+            for xTotal in dTotals.values()]
+        iTo = self._dCodes[sTo]
+        if self._oMatrix is not None and len(aCodes) > 8:
+            fSum = float(np.dot(np.asarray(aAmounts, dtype=np.float64),
+                self._oMatrix[aCodes, iTo]))
+        else:
+            iSize = len(self.aCodes)
+            aFactors = self._aFactors
+            fSum = math.fsum(iAmount * aFactors[iCode * iSize + iTo]
+                for iCode, iAmount in zip(aCodes, aAmounts))
+        return money.round_half(fSum)
+
+#-------------------------------------------------------------------------------
+def load_rates(sPath, iVersion=0):
+    """Reads a rate file (see the module description) into a 'RateTable'.
+
+    Raises
+    ------
+        OSError: the file can't be read.
+        ValueError: the file is malformed.
+    """
+    with open(sPath, encoding="utf-8") as oFile:
+        try:
+            dData = json.load(oFile)
+            sBase, dRates = dData["sBase"], dData["dRates"]
+        except (KeyError, TypeError) as e:
+            raise ValueError("malformed rate file: %s" % sPath) from e
+    if not isinstance(dRates, dict):
+        raise ValueError("malformed rate file: %s" % sPath)
+    return RateTable(sBase, dRates, iVersion)
+
+#-------------------------------------------------------------------------------
+class RateBook:
+    """Holds the current 'RateTable' and swaps in new ones."""
+
+    __slots__ = ("_oTable", "_oLock")
+
+    def __init__(self, oTable):
+        self._oTable = oTable
+        self._oLock = threading.Lock()
+
+    def current(self):
+        """The current snapshot. Keep using the same snapshot for the whole
+        of an operation (such as a checkout) to get consistent amounts."""
+        return self._oTable
+
+    def install(self, oTable):
+        """Makes a new table current. Snapshots already taken are unaffected."""
+        with self._oLock:
+            self._oTable = oTable
+
+    def reload(self, sPath):
+        """Loads a rate file and installs it with the next version number."""
+        with self._oLock:
+            self._oTable = load_rates(sPath, self._oTable.iVersion + 1)
+            return self._oTable
@@ -0,0 +1,85 @@
+""" # Continuation cursors for 'list_products'
+-----
+A cursor remembers where the previous page of a search stopped: the sort order
+in use, the sort key and 'sItem_id' of the last item returned, and that item's
+index within the search. The next page starts straight after that item (keyset
+pagination) instead of skipping 'iIdx' results, so deep pages cost no more
+than the first one, and products gaining or losing stock between calls don't
+shift the page boundaries.
+
+To the caller the cursor is an opaque, URL-safe string.
+"""
+
+import base64
+import binascii
+import json
+import math
+
+#-------------------------------------------------------------------------------
+def encode_cursor(sOrder, xSort_key, sItem_id, iIdx):
+    """Packs the position of the last item of a page into a cursor string.
+
+    Parameters
+    ----------
+        sOrder (string)
+            Name of the sort order the page was produced with.
+
+        xSort_key (string, float)
+            Sort key of the last item returned.
+
+        sItem_id (string)
+            Identifier of the last item returned. Breaks ties between items
+            with the same sort key.
+
+        iIdx (integer)
+            Index of the last item within the search ('iIdx_n').
+
+    Returns
+    -------
+        (string) Opaque cursor.
+    """
+    sJson = json.dumps([sOrder, xSort_key, sItem_id, iIdx],
+        separators=(",", ":"))
+    return base64.urlsafe_b64encode(sJson.encode("utf-8")).decode(
+        "ascii").rstrip("=")
+
+#-------------------------------------------------------------------------------
+def decode_cursor(sCursor):
+    """Unpacks a cursor made by 'encode_cursor'.
+
+    The sort key must have the type of the order it was made for: the
+    'sItem_id' string for the "sItem_id" order, a finite price otherwise.
+
+    Returns
+    -------
+        (tuple) (sOrder, xSort_key, sItem_id, iIdx)
+
+    Raises
+    ------
+        ValueError: the string is not a well-formed cursor.
+    """
+    if not isinstance(sCursor, str) or not sCursor:
+        raise ValueError("cursor must be a non-empty string")
+    try:
+        sJson = base64.urlsafe_b64decode(
+            sCursor + "=" * (-len(sCursor) % 4)).decode("utf-8")
+        aParts = json.loads(sJson)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError("malformed cursor") from e
+    if (not isinstance(aParts, list) or len(aParts) != 4
+            or not isinstance(aParts[0], str)
+            or not isinstance(aParts[2], str)
+            or not _is_index(aParts[3])
+            or not _is_sort_key(aParts[0], aParts[1])):
+        raise ValueError("malformed cursor")
+    return tuple(aParts)
+
+#-------------------------------------------------------------------------------
+def _is_index(xValue):
+    return type(xValue) is int and xValue >= 0
+
+#-------------------------------------------------------------------------------
+def _is_sort_key(sOrder, xSort_key):
+    if sOrder == "sItem_id":
+        return isinstance(xSort_key, str)
+    return type(xSort_key) in (int, float) and math.isfinite(xSort_key)
@@ -0,0 +1,118 @@
+""" # Response encoding
+-----
+The HTTP layer sends each 'dOutput' as JSON. Encoding a 'list_products' page
+field by field, for every product on it, on every call, is the largest cost
+of serving it, even when the page comes from the result cache. So a product's
+JSON is mostly encoded once, when it is loaded:
+
+    - 'product_fragments' encodes the fields which only change when the
+      product is replaced, as three byte strings around the two values which
+      change on their own (stock and price):
+
+        {"sItem_id":...,"sColour":...,"fPrice":   <- head
+        ,"sCurrency":"PLN","iStock":              <- middle
+        ,"aPhotos":[...]}                         <- tail
+
+      The catalogue keeps them in a column, next to the product's row (a
+      snapshot encodes them on first use, and keeps a bounded number).
+    - 'list_products' returns its items as 'Product' dictionaries, which
+      carry their row's fragments.
+    - 'encode' writes a 'dOutput' as compact UTF-8 JSON. A 'Product' is
+      spliced in from its fragments, with only its price and stock written
+      out; everything else goes through the 'json' module.
+    - A 'list_products' page is a 'Page' dictionary, which keeps its
+      encoding. Pages in the result cache are never changed (they are
+      dropped instead), so a page served again is not encoded again.
+
+The result decodes to the same value as 'json.dumps(dOutput)'.
+"""
+
+import json
+
+_oEncoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+_fnEncode = _oEncoder.encode
+
+_dMiddles = {}          # sCurrency -> middle fragment, shared by products
+_dKeys = {}             # key -> b'"key":'
+_B_NO_PHOTOS = b',"aPhotos":[]}'   # tail shared by products without photos
+
+#-------------------------------------------------------------------------------
+def product_fragments(sItem_id, sBrand, sDesc, sSize, sColour, sCurrency,
+        aPhotos):
+    """Pre-encodes a product's fixed fields.
+
+    Returns
+    -------
+        (tuple) (bHead, bMiddle, bTail) byte strings, see above.
+    """
+    bHead = ('{"sItem_id":%s,"sBrand":%s,"sDesc":%s,"sSize":%s,"sColour":%s,'
+        '"fPrice":' % (_fnEncode(sItem_id), _fnEncode(sBrand),
+        _fnEncode(sDesc), _fnEncode(sSize), _fnEncode(sColour))
+        ).encode("utf-8")
+    bMiddle = _dMiddles.get(sCurrency)
+    if bMiddle is None:
+        bMiddle = _dMiddles.setdefault(sCurrency, (',"sCurrency":%s,"iStock":'
+            % _fnEncode(sCurrency)).encode("utf-8"))
+    if not aPhotos:
+        return bHead, bMiddle, _B_NO_PHOTOS
+    bTail = (',"aPhotos":%s}' % _fnEncode(list(aPhotos))).encode("utf-8")
+    return bHead, bMiddle, bTail
+
+#-------------------------------------------------------------------------------
+class Product(dict):
+    """A 'list_products' item: the documented dictionary, carrying the
+    fragments of the row it was built from."""
+
+    __slots__ = ("tFragments",)
+
+    def __init__(self, dItem, tFragments):
+        dict.__init__(self, dItem)
+        self.tFragments = tFragments
+
+#-------------------------------------------------------------------------------
+class Page(dict):
+    """A 'list_products' output, keeping its encoding once 'encode' has
+    made it. It must not be changed afterwards."""
+
+    __slots__ = ("bJson",)
+
+    def __init__(self, *aArgs, **dKwargs):
+        dict.__init__(self, *aArgs, **dKwargs)
+        self.bJson = None
+
+#-------------------------------------------------------------------------------
+def encode_item(dItem):
+    """One item as JSON bytes; from its fragments if it is a 'Product'."""
+    tFragments = getattr(dItem, "tFragments", None)
+    if tFragments is None:
+        return _fnEncode(dItem).encode("utf-8")
+    bHead, bMiddle, bTail = tFragments
+    return (bHead + repr(dItem["fPrice"]).encode("ascii") + bMiddle
+        + str(dItem["iStock"]).encode("ascii") + bTail)
+
+#-------------------------------------------------------------------------------
+def encode(dOutput):
+    """A 'dOutput' as compact UTF-8 JSON, with its "aItems" spliced in from
+    fragments where they have them. A 'Page' is encoded once."""
+    bJson = getattr(dOutput, "bJson", None)
+    if bJson is not None:
+        return bJson
+    aItems = dOutput.get("aItems")
+    if not aItems or not isinstance(aItems, list):
+        return _fnEncode(dOutput).encode("utf-8")
+    aParts = []
+    for sKey, xValue in dOutput.items():
+        bKey = _dKeys.get(sKey)
+        if bKey is None:
+            bKey = _dKeys.setdefault(sKey,
+                (_fnEncode(sKey) + ":").encode("utf-8"))
+        if xValue is aItems:
+            bValue = b"[%s]" % b",".join([encode_item(dItem)
+                for dItem in aItems])
+        else:
+            bValue = _fnEncode(xValue).encode("utf-8")
+        aParts.append(bKey + bValue)
+    bJson = b"{%s}" % b",".join(aParts)
+    if type(dOutput) is Page:
+        dOutput.bJson = bJson
+    return bJson
@@ -0,0 +1,147 @@
+""" # Hierarchical timer wheel
+-----
+Every open basket has a deadline, and an expired basket must hand its stock
+back. Scanning all open baskets to find the expired ones costs time in
+proportion to the number of open baskets; the timer wheel only ever touches
+the baskets whose deadline is actually due.
+
+Time is cut into ticks (one second by default). Level 0 of the wheel has one
+slot per tick for the next 64 ticks; level 1 has one slot per 64 ticks for the
+next 64 * 64 ticks, and so on. A deadline is filed in the coarsest slot that
+can hold it. As time moves on, the slots of the higher levels are emptied
+("cascaded") into the finer levels below, so that every deadline reaches
+level 0 just in time to fire. Scheduling, moving and cancelling a deadline are
+O(1).
+
+Moving a deadline later - the common case, as every shopping click extends
+the basket - does not touch the wheel at all. The new deadline is remembered
+and the entry is simply filed again when its old slot comes round.
+"""
+
+import math
+import time
+
+#-------------------------------------------------------------------------------
+class TimerWheel:
+    """Schedules keys to expire at given times.
+
+    The wheel is not thread-safe; its owner serialises access.
+    """
+
+    __slots__ = ("fTick", "fStart", "_iBits", "_iLevels", "_aLevels", "_iNow",
+        "_dState")
+
+    def __init__(self, fTick=1.0, iBits=6, iLevels=4, fStart=None):
+        """Creates an empty wheel.
+
+        Parameters
+        ----------
+            fTick (float)
+                Resolution of the wheel, in seconds.
+
+            iBits (integer)
+                Each level has 2**iBits slots.
+
+            iLevels (integer)
+                Number of levels. Deadlines further away than
+                2**(iBits * iLevels) ticks are parked in the last slot and
+                filed again when it comes round.
+
+            fStart (float, none)
+                Time of tick 0. Defaults to now.
+        """
+        self.fTick = fTick
+        self.fStart = time.time() if fStart is None else fStart
+        self._iBits = iBits
+        self._iLevels = iLevels
+        self._aLevels = [[[] for _ in range(1 << iBits)]
+            for _ in range(iLevels)]
+        self._iNow = 0
+        self._dState = {}   # key -> [tick due, tick of its entry in a slot]
+
+    def __len__(self):
+        return len(self._dState)
+
+    def __contains__(self, xKey):
+        return xKey in self._dState
+
+    def _tick_of(self, fTime):
+        return int((fTime - self.fStart) // self.fTick)
+
+    def _file(self, xKey, iTick, iEarliest=1):
+        """Puts an entry for 'xKey' into the slot for 'iTick'.
+
+        'iEarliest' is the first tick, relative to now, whose level 0 slot
+        hasn't been processed yet. Returns the tick the entry was filed at.
+        """
+        iTick = max(iTick, self._iNow + iEarliest)
+        iBits = self._iBits
+        iDelta = iTick - self._iNow
+        iLevel = 0
+        while (iLevel < self._iLevels - 1
+                and iDelta >= 1 << (iBits * (iLevel + 1))):
+            iLevel += 1
+        iHorizon = 1 << (iBits * (iLevel + 1))
+        if iDelta >= iHorizon:
+            iTick = self._iNow + iHorizon - 1
+        iSlot = (iTick >> (iBits * iLevel)) & ((1 << iBits) - 1)
+        self._aLevels[iLevel][iSlot].append((xKey, iTick))
+        return iTick
+
+    #---------------------------------------------------------------------------
+    def schedule(self, xKey, fDeadline):
+        """Sets (or moves) the deadline of a key.
+
+        Deadlines are rounded up to the next tick, so a key never fires early.
+        """
+        iDue = math.ceil((fDeadline - self.fStart) / self.fTick)
+        aState = self._dState.get(xKey)
+        if aState is None:
+            self._dState[xKey] = [iDue, self._file(xKey, iDue)]
+        elif iDue >= aState[1]:
+            aState[0] = iDue            # later: re-filed when its slot fires
+        else:
+            aState[0] = iDue            # earlier: the old entry goes stale
+            aState[1] = self._file(xKey, iDue)
+
+    def cancel(self, xKey):
+        """Forgets a key. Its entry in the wheel is discarded when reached."""
+        self._dState.pop(xKey, None)
+
+    def advance(self, fNow=None):
+        """Moves the wheel forward to the current time.
+
+        Returns
+        -------
+            (list) Keys whose deadline has passed, in deadline order. They are
+            no longer scheduled.
+        """
+        iTarget = self._tick_of(time.time() if fNow is None else fNow)
+        iBits = self._iBits
+        iMask = (1 << iBits) - 1
+        aExpired = []
+        while self._iNow < iTarget:
+            self._iNow += 1
+            iNow = self._iNow
+            for iLevel in range(self._iLevels - 1, 0, -1):
+                if iNow & ((1 << (iBits * iLevel)) - 1):
+                    continue
+                aSlot = self._aLevels[iLevel]
+                iSlot = (iNow >> (iBits * iLevel)) & iMask
+                aEntries, aSlot[iSlot] = aSlot[iSlot], []
+                for xKey, iTick in aEntries:
+                    aState = self._dState.get(xKey)
+                    if aState is not None and aState[1] == iTick:
+                        aState[1] = self._file(xKey, iTick, 0)
+            aSlot = self._aLevels[0]
+            aEntries, aSlot[iNow & iMask] = aSlot[iNow & iMask], []
+            for xKey, iTick in aEntries:
+                aState = self._dState.get(xKey)
+                if aState is None or aState[1] != iTick:
+                    continue                    # cancelled or moved earlier
+                if aState[0] > iNow:
+                    aState[1] = self._file(xKey, aState[0])
+                else:
+                    del self._dState[xKey]
+                    aExpired.append(xKey)
+        return aExpired
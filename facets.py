@@ -0,0 +1,289 @@
+""" # Faceted filtering and sorting for 'list_products'
+-----
+Besides the keyword in 'sItem_filter', 'list_products' can narrow a listing
+down by brand, colour, size, currency, price range and stock, sort it by price,
+and report how many hits fall under each brand and colour.
+
+The filters are evaluated over whole catalogue columns. With NumPy installed
+each filter is one boolean mask over the column (no Python loop per product),
+the facet counts are a 'bincount' over the brand and colour codes of the hits,
+and the ordering is a single 'lexsort'. The columns are copied for each query
+(a few milliseconds for a million products), as the catalogue may grow while
+the query runs. Without NumPy the same query runs as one pass of plain Python
+over the candidate rows. NumPy is listed in 'requirements-optional.txt'.
+"""
+
+import bisect
+from collections import Counter
+from numbers import Real
+
+try:
+    import numpy as np
+except ImportError:     # NumPy is optional; see '_select_python'
+    np = None
+
+# Sort orders accepted in 'dBriefcase["sSort"]'
+SORT_ORDERS = ("sItem_id", "fPrice_asc", "fPrice_desc")
+
+# Briefcase keys filtering on a string column, and the matching column
+_EQUAL_FILTERS = {
+    "sBrand":"oBrand",
+    "sColour":"oColour",
+    "sSize":"oSize",
+    "sCurrency":"oCurrency"
+}
+
+# Columns for which facet counts are returned
+_FACETS = {"sBrand":"oBrand", "sColour":"oColour"}
+
+#-------------------------------------------------------------------------------
+def normalise_query(dBriefcase):
+    """Extracts the filtering and sorting options from a briefcase.
+
+    Equal briefcases (for example differing only in the order of a list of
+    brands) give equal queries, so the result can also serve as a cache key.
+
+    Parameters
+    ----------
+        dBriefcase (dictionary)
+            The 'list_products' briefcase. All the keys read here are
+            optional.
+
+    Returns
+    -------
+        (dictionary) Query with the keys "sItem_filter", "dEqual" (column ->
+        tuple of accepted values), "fPrice_min", "fPrice_max", "bIn_stock",
+        "sSort" and "bFacets".
+
+    Raises
+    ------
+        ValueError: an option has the wrong type or value.
+    """
+    sItem_filter = dBriefcase.get("sItem_filter")
+    if sItem_filter is not None and not isinstance(sItem_filter, str):
+        raise ValueError("sItem_filter")
+
+    dEqual = {}
+    for sKey in _EQUAL_FILTERS:
+        xValue = dBriefcase.get(sKey)
+        if xValue is None:
+            continue
+        aValues = [xValue] if isinstance(xValue, str) else xValue
+        if (not isinstance(aValues, (list, tuple)) or not aValues
+                or not all(isinstance(sValue, str) for sValue in aValues)):
+            raise ValueError(sKey)
+        dEqual[sKey] = tuple(sorted(set(aValues)))
+
+    aPrice = []
+    for sKey in ("fPrice_min", "fPrice_max"):
+        fValue = dBriefcase.get(sKey)
+        if fValue is not None and (not isinstance(fValue, Real)
+                or isinstance(fValue, bool) or fValue != fValue):
+            raise ValueError(sKey)
+        aPrice.append(None if fValue is None else float(fValue))
+
+    bIn_stock = dBriefcase.get("bIn_stock", False)
+    bFacets = dBriefcase.get("bFacets", False)
+    if not isinstance(bIn_stock, bool):
+        raise ValueError("bIn_stock")
+    if not isinstance(bFacets, bool):
+        raise ValueError("bFacets")
+
+    sSort = dBriefcase.get("sSort")
+    if sSort is None:
+        sSort = "sItem_id"
+    if sSort not in SORT_ORDERS:
+        raise ValueError("sSort")
+
+    return {
+        "sItem_filter":sItem_filter,
+        "dEqual":dEqual,
+        "fPrice_min":aPrice[0],
+        "fPrice_max":aPrice[1],
+        "bIn_stock":bIn_stock,
+        "sSort":sSort,
+        "bFacets":bFacets
+    }
+
+#-------------------------------------------------------------------------------
+def is_plain(dQuery):
+    """True if the query is a keyword search only, in 'sItem_id' order.
+
+    Such a query is answered from the keyword index alone and never needs to
+    look at the catalogue columns.
+    """
+    return (not dQuery["dEqual"] and dQuery["fPrice_min"] is None
+        and dQuery["fPrice_max"] is None and not dQuery["bIn_stock"]
+        and dQuery["sSort"] == "sItem_id" and not dQuery["bFacets"])
+
+#-------------------------------------------------------------------------------
+def sort_key(oCatalogue, sOrder, iRow):
+    """The key a row is sorted on, as recorded in a continuation cursor."""
+    if sOrder == "sItem_id":
+        return oCatalogue.aItem_id[iRow]
+    return oCatalogue.aPrice[iRow]
+
+#-------------------------------------------------------------------------------
+def select(oCatalogue, dQuery, iIdx, iMax_res, tAfter=None):
+    """Runs a faceted query over the catalogue columns.
+
+    Parameters
+    ----------
+        oCatalogue (catalogue.Catalogue)
+            Catalogue to search.
+
+        dQuery (dictionary)
+            Query made by 'normalise_query'.
+
+        iIdx (integer)
+            Number of hits to skip. Ignored if 'tAfter' is given.
+
+        iMax_res (integer)
+            Maximum number of rows to return.
+
+        tAfter (tuple, none)
+            (sort key, sItem_id) of the last item of the previous page. Only
+            hits sorting after it are returned.
+
+    Returns
+    -------
+        (dictionary)
+            "iSearch_tot" (integer): number of hits, ignoring paging.
+            "aRows" (list of integers): catalogue rows of the page, in order.
+            "dFacets" (dictionary, none): for "sBrand" and "sColour", the
+                number of hits per value; 'None' unless requested.
+    """
+    if np is not None:
+        return _select_numpy(oCatalogue, dQuery, iIdx, iMax_res, tAfter)
+    return _select_python(oCatalogue, dQuery, iIdx, iMax_res, tAfter)
+
+#-------------------------------------------------------------------------------
+def _column(aColumn, sType, iRows):
+    """The first 'iRows' values of an 'array' column, as a NumPy copy.
+
+    The catalogue keeps appending to its columns, and an 'array' cannot grow
+    while a NumPy view exports its buffer: the writer would get a BufferError
+    half way through adding a product. 'tobytes' copies the column in one
+    step, without releasing the GIL, so no view of the live column is kept.
+    Every other column is appended to before the live flag, so after 'aLive'
+    each holds at least 'iRows' values.
+    """
+    return np.frombuffer(aColumn.tobytes(), dtype=sType, count=iRows)
+
+#-------------------------------------------------------------------------------
+def _select_numpy(oCatalogue, dQuery, iIdx, iMax_res, tAfter):
+    iRows = len(oCatalogue.aLive)
+    if not iRows:
+        return _select_python(oCatalogue, dQuery, iIdx, iMax_res, tAfter)
+    abMask = _column(oCatalogue.aLive, np.int8, iRows) != 0
+
+    aKeyword = oCatalogue.keyword_rows(dQuery["sItem_filter"])
+    if aKeyword is not None:
+        anKeyword = np.fromiter(aKeyword, dtype=np.intp, count=len(aKeyword))
+        abHits = np.zeros(iRows, dtype=bool)
+        abHits[anKeyword[anKeyword < iRows]] = True     # not rows added since
+        abMask &= abHits
+
+    for sKey, aValues in dQuery["dEqual"].items():
+        oColumn = getattr(oCatalogue, _EQUAL_FILTERS[sKey])
+        aCodes = [oColumn.code_of(sValue, False) for sValue in aValues]
+        anColumn = _column(oColumn.aCodes, np.int32, iRows)
+        abMask &= np.isin(anColumn, [iCode for iCode in aCodes if iCode >= 0])
+
+    afPrice = _column(oCatalogue.aPrice, np.float64, iRows)
+    if dQuery["fPrice_min"] is not None:
+        abMask &= afPrice >= dQuery["fPrice_min"]
+    if dQuery["fPrice_max"] is not None:
+        abMask &= afPrice <= dQuery["fPrice_max"]
+    if dQuery["bIn_stock"]:
+        abMask &= _column(oCatalogue.aStock, np.int64, iRows) > 0
+
+    iSearch_tot = int(np.count_nonzero(abMask))
+    dFacets = None
+    if dQuery["bFacets"]:
+        dFacets = {}
+        for sKey, sColumn in _FACETS.items():
+            oColumn = getattr(oCatalogue, sColumn)
+            anCodes = _column(oColumn.aCodes, np.int32, iRows)[abMask]
+            anCounts = np.bincount(anCodes, minlength=len(oColumn.aValues))
+            dFacets[sKey] = {oColumn.aValues[iCode]:int(anCounts[iCode])
+                for iCode in np.flatnonzero(anCounts)}
+
+    # The ranks array is built whole and never grows, so it can be viewed
+    anRanks = np.frombuffer(oCatalogue.id_ranks(), dtype=np.int64,
+        count=iRows)
+    sSort = dQuery["sSort"]
+    if tAfter is not None:
+        iBoundary = bisect.bisect_right(oCatalogue.oIndex.ids(), tAfter[1])
+        abLater = anRanks >= iBoundary
+        if sSort == "fPrice_asc":
+            abLater = (afPrice > tAfter[0]) | ((afPrice == tAfter[0]) & abLater)
+        elif sSort == "fPrice_desc":
+            abLater = (afPrice < tAfter[0]) | ((afPrice == tAfter[0]) & abLater)
+        abMask &= abLater
+        iIdx = 0
+
+    anRows = np.flatnonzero(abMask)
+    if sSort == "sItem_id":
+        anOrder = np.argsort(anRanks[anRows], kind="stable")
+    elif sSort == "fPrice_asc":
+        anOrder = np.lexsort((anRanks[anRows], afPrice[anRows]))
+    else:
+        anOrder = np.lexsort((anRanks[anRows], -afPrice[anRows]))
+    aRows = anRows[anOrder[iIdx:iIdx + iMax_res]].tolist()
+    return {"iSearch_tot":iSearch_tot, "aRows":aRows, "dFacets":dFacets}
+
+#-------------------------------------------------------------------------------
+def _select_python(oCatalogue, dQuery, iIdx, iMax_res, tAfter):
+    aCandidates = oCatalogue.keyword_rows(dQuery["sItem_filter"])
+    if aCandidates is None:
+        aLive = oCatalogue.aLive
+        aCandidates = [iRow for iRow in range(len(aLive)) if aLive[iRow]]
+
+    aTests = []
+    for sKey, aValues in dQuery["dEqual"].items():
+        oColumn = getattr(oCatalogue, _EQUAL_FILTERS[sKey])
+        setCodes = {oColumn.code_of(sValue, False) for sValue in aValues}
+        aTests.append((oColumn.aCodes, setCodes))
+    aPrice = oCatalogue.aPrice
+    aStock = oCatalogue.aStock
+    fMin = dQuery["fPrice_min"]
+    fMax = dQuery["fPrice_max"]
+    bIn_stock = dQuery["bIn_stock"]
+
+    aRows = [iRow for iRow in aCandidates
+        if (fMin is None or aPrice[iRow] >= fMin)
+        and (fMax is None or aPrice[iRow] <= fMax)
+        and (not bIn_stock or aStock[iRow] > 0)
+        and all(aCodes[iRow] in setCodes for aCodes, setCodes in aTests)]
+
+    iSearch_tot = len(aRows)
+    dFacets = None
+    if dQuery["bFacets"]:
+        dFacets = {}
+        for sKey, sColumn in _FACETS.items():
+            oColumn = getattr(oCatalogue, sColumn)
+            oCounts = Counter(oColumn.aCodes[iRow] for iRow in aRows)
+            dFacets[sKey] = {oColumn.aValues[iCode]:iCount
+                for iCode, iCount in oCounts.items()}
+
+    aItem_id = oCatalogue.aItem_id
+    sSort = dQuery["sSort"]
+    if sSort == "sItem_id":
+        fnKey = lambda iRow: (aItem_id[iRow],)
+    elif sSort == "fPrice_asc":
+        fnKey = lambda iRow: (aPrice[iRow], aItem_id[iRow])
+    else:
+        fnKey = lambda iRow: (-aPrice[iRow], aItem_id[iRow])
+    if tAfter is not None:
+        if sSort == "sItem_id":
+            tLast = (tAfter[1],)
+        elif sSort == "fPrice_asc":
+            tLast = (tAfter[0], tAfter[1])
+        else:
+            tLast = (-tAfter[0], tAfter[1])
+        aRows = [iRow for iRow in aRows if fnKey(iRow) > tLast]
+        iIdx = 0
+    aRows.sort(key=fnKey)
+    return {"iSearch_tot":iSearch_tot, "aRows":aRows[iIdx:iIdx + iMax_res],
+        "dFacets":dFacets}
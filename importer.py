@@ -0,0 +1,199 @@
+""" # Streaming catalogue import
+-----
+Supplier feeds run to several gigabytes, so they are never read whole. The
+import is a pipeline of generators, each holding one record or one batch at a
+time:
+
+    read_records        lines of a CSV or JSON-lines file (optionally gzipped)
+                        -> product records
+    validate_records    drops records failing 'catalogue.validate_product' (the
+                        "data validation" rules), noting why
+    batches             groups the valid records into lists of 'iBatch'
+
+'import_feed' writes each batch to storage in one transaction, then adds it
+to the catalogue, which updates the keyword index product by product and tells
+its listeners (result cache, rules memo) once per batch. Between batches the
+importing thread gives way, so 'list_products' carries on serving during a
+reload. Given the shop's reservation engine, products go in through
+it ('put_product'), so a feed's stock is net of the units held in baskets and
+never races a reservation of the same item.
+
+CSV feeds have a header row naming the columns ('sItem_id', 'sBrand', ...).
+'fPrice' and 'iStock' are converted to numbers, and 'aPhotos' holds the photo
+URLs separated by "|". A JSON-lines feed has one product object per line.
+"""
+
+import csv
+import gzip
+import io
+import json
+import time
+
+import catalogue
+
+# Products written per transaction
+BATCH_SIZE = 1000
+
+# Rejected records listed in the report; the rest are only counted
+MAX_ERRORS = 100
+
+#-------------------------------------------------------------------------------
+def _open_text(sPath):
+    if sPath.endswith(".gz"):
+        return io.TextIOWrapper(gzip.open(sPath, "rb"), encoding="utf-8",
+            newline="")
+    return open(sPath, encoding="utf-8", newline="")
+
+#-------------------------------------------------------------------------------
+def _csv_record(dRow):
+    """Converts the text fields of a CSV row to a product record. Values which
+    don't convert are left as text, for validation to reject."""
+    dProduct = dict(dRow)
+    for sKey, fnConvert in (("fPrice", float), ("iStock", int)):
+        try:
+            dProduct[sKey] = fnConvert(dProduct[sKey])
+        except (KeyError, TypeError, ValueError):
+            pass
+    sPhotos = dProduct.get("aPhotos")
+    if isinstance(sPhotos, str):
+        dProduct["aPhotos"] = [sUrl for sUrl in sPhotos.split("|") if sUrl]
+    if dProduct.get("sCategory") is None:
+        dProduct.pop("sCategory", None)
+    return dProduct
+
+#-------------------------------------------------------------------------------
+def read_records(sPath):
+    """Yields (iLine, xRecord) for every record of a feed.
+
+    The format follows the file name: ".csv" or ".jsonl" / ".ndjson",
+    optionally followed by ".gz". A JSON line which doesn't parse is yielded
+    as 'None'.
+
+    Raises
+    ------
+        ValueError: an unknown file format.
+    """
+    sName = sPath[:-3] if sPath.endswith(".gz") else sPath
+    if sName.endswith(".csv"):
+        with _open_text(sPath) as oFile:
+            oReader = csv.DictReader(oFile)
+            for dRow in oReader:
+                yield oReader.line_num, _csv_record(dRow)
+    elif sName.endswith((".jsonl", ".ndjson")):
+        with _open_text(sPath) as oFile:
+            for iLine, sLine in enumerate(oFile, 1):
+                if not sLine.strip():
+                    continue
+                try:
+                    yield iLine, json.loads(sLine)
+                except ValueError:
+                    yield iLine, None
+    else:
+        raise ValueError("unknown feed format: %s" % sPath)
+
+#-------------------------------------------------------------------------------
+def validate_records(iterRecords, dReport):
+    """Yields the records passing the "data validation" rules.
+
+    Rejections are counted in 'dReport["iRejected"]' and the first
+    'MAX_ERRORS' are listed in 'dReport["aErrors"]' as (iLine, sReason).
+    """
+    for iLine, xRecord in iterRecords:
+        dReport["iRead"] += 1
+        try:
+            catalogue.validate_product(xRecord)
+        except ValueError as e:
+            dReport["iRejected"] += 1
+            if len(dReport["aErrors"]) < MAX_ERRORS:
+                dReport["aErrors"].append((iLine, str(e)))
+            continue
+        yield xRecord
+
+#-------------------------------------------------------------------------------
+def batches(iterRecords, iBatch=BATCH_SIZE):
+    """Groups records into lists of up to 'iBatch'."""
+    aBatch = []
+    for xRecord in iterRecords:
+        aBatch.append(xRecord)
+        if len(aBatch) >= iBatch:
+            yield aBatch
+            aBatch = []
+    if aBatch:
+        yield aBatch
+
+#-------------------------------------------------------------------------------
+def import_feed(sPath, oCatalogue, oStorage=None, bReplace=False,
+        iBatch=BATCH_SIZE, oReservations=None):
+    """Loads a supplier feed into the catalogue (and storage).
+
+    Parameters
+    ----------
+        sPath (string)
+            Feed file; see 'read_records' for the formats.
+
+        oCatalogue (catalogue.Catalogue)
+            Catalogue receiving the products. Existing products with the same
+            'sItem_id' are replaced.
+
+        oStorage (storage.Storage, none)
+            Backend written to, one transaction per batch, before the batch
+            goes into the catalogue.
+
+        bReplace (boolean)
+            If true the feed is the complete catalogue: afterwards, products
+            which weren't in it are removed.
+
+        iBatch (integer)
+            Products per batch.
+
+        oReservations (reservations.ReservationEngine, none)
+            Engine reserving the catalogue's stock, through which products
+            are added and withdrawn.
+
+    Returns
+    -------
+        (dictionary) Report with "iRead", "iImported", "iRejected", "iRemoved"
+        and "aErrors" (see 'validate_records').
+
+    Raises
+    ------
+        OSError: the feed can't be read.
+        ValueError: an unknown feed format.
+        storage.StorageError: a batch couldn't be stored. Earlier batches
+            stay imported.
+    """
+    dReport = {"iRead":0, "iImported":0, "iRejected":0, "iRemoved":0,
+        "aErrors":[]}
+    # Rows written by the feed, one byte each, rather than a set of every
+    # 'sItem_id' in it
+    abSeen = bytearray() if bReplace else None
+    if oReservations is None:
+        fnPut, fnWithdraw = oCatalogue.add, oCatalogue.remove
+    else:
+        fnPut, fnWithdraw = oReservations.put_product, oReservations.withdraw
+    for aBatch in batches(validate_records(read_records(sPath), dReport),
+            iBatch):
+        if oStorage is not None:
+            oStorage.put_products(aBatch)
+        with oCatalogue.batch():
+            for dProduct in aBatch:
+                iRow = fnPut(dProduct)
+                if abSeen is not None:
+                    if iRow >= len(abSeen):
+                        abSeen.extend(bytes(iRow + 1 - len(abSeen)))
+                    abSeen[iRow] = 1
+        dReport["iImported"] += len(aBatch)
+        time.sleep(0)       # let request threads in between batches
+
+    if abSeen is not None:
+        iSeen = len(abSeen)
+        aUnseen = [sItem_id for iRow, sItem_id
+            in enumerate(oCatalogue.aItem_id)
+            if sItem_id is not None and (iRow >= iSeen or not abSeen[iRow])]
+        with oCatalogue.batch():
+            for sItem_id in aUnseen:
+                if oStorage is not None:
+                    oStorage.delete_product(sItem_id)
+                fnWithdraw(sItem_id)
+                dReport["iRemoved"] += 1
+    return dReport
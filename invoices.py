@@ -0,0 +1,150 @@
+""" # Invoice numbers
+-----
+Invoice codes ("Z-000012") come from one sequence. Taking each number from a
+shared counter would make every checkout queue on it, so numbers are handed
+out hi-lo style:
+
+    - A source hands out blocks of consecutive numbers. 'StorageSource'
+      keeps the high-water mark in the storage backend, so blocks are never
+      handed out twice: not after a crash, and not to another process using
+      the same database. 'MemorySource' is for a shop without storage.
+    - Each thread draws numbers from its own block, without locking, and
+      fetches a new block when it runs out.
+
+Gaps are kept small. Blocks are small ('BLOCK_SIZE'), so a crash wastes at
+most one block per thread. On 'close', the unused tails of the topmost blocks
+are handed back to the source, so a clean restart carries on where the codes
+left off.
+"""
+
+import threading
+
+# Numbers per block
+BLOCK_SIZE = 32
+
+#-------------------------------------------------------------------------------
+def code_of(iNumber):
+    """The invoice code of a number."""
+    return "Z-%06d" % iNumber
+
+#-------------------------------------------------------------------------------
+def number_of(sInvoice_code):
+    """The number of an invoice code; ValueError if it isn't one."""
+    if not sInvoice_code.startswith("Z-"):
+        raise ValueError(sInvoice_code)
+    return int(sInvoice_code[2:])
+
+#-------------------------------------------------------------------------------
+class MemorySource:
+    """Blocks from a counter in memory."""
+
+    __slots__ = ("_iNext", "_oLock")
+
+    def __init__(self, iNext=1):
+        self._iNext = iNext
+        self._oLock = threading.Lock()
+
+    def allocate(self, iCount):
+        """First number of a fresh block of 'iCount'."""
+        with self._oLock:
+            iFirst = self._iNext
+            self._iNext += iCount
+            return iFirst
+
+    def release(self, iFrom, iTo):
+        """Takes back the numbers 'iFrom' to 'iTo - 1', if nothing above them
+        has been handed out. Returns true if it did."""
+        with self._oLock:
+            if self._iNext != iTo:
+                return False
+            self._iNext = iFrom
+            return True
+
+#-------------------------------------------------------------------------------
+class StorageSource:
+    """Blocks from a counter kept by a storage backend (see
+    'storage.Storage.allocate_numbers')."""
+
+    __slots__ = ("oStorage", "sName", "iFloor")
+
+    def __init__(self, oStorage, sName="invoice", iFloor=1):
+        """Names the counter and the backend keeping it.
+
+        Parameters
+        ----------
+            oStorage (storage.Storage)
+                Backend keeping the counter.
+
+            sName (string)
+                Name of the counter.
+
+            iFloor (integer)
+                Lowest number to hand out: one past the last stored invoice,
+                for a database which predates the counter.
+        """
+        self.oStorage = oStorage
+        self.sName = sName
+        self.iFloor = iFloor
+
+    def allocate(self, iCount):
+        return self.oStorage.allocate_numbers(self.sName, iCount,
+            self.iFloor)
+
+    def release(self, iFrom, iTo):
+        return self.oStorage.release_numbers(self.sName, iFrom, iTo)
+
+#-------------------------------------------------------------------------------
+class InvoiceNumbers:
+    """Per-thread blocks of invoice numbers."""
+
+    __slots__ = ("oSource", "iBlock", "_oLocal", "_aBlocks", "_oLock")
+
+    def __init__(self, oSource, iBlock=BLOCK_SIZE):
+        """Draws blocks of 'iBlock' numbers from 'oSource' ('MemorySource'
+        or 'StorageSource')."""
+        self.oSource = oSource
+        self.iBlock = iBlock
+        self._oLocal = threading.local()    # .aBlock: [iNext, iEnd]
+        self._aBlocks = []                  # every thread's block
+        self._oLock = threading.Lock()
+
+    def next(self):
+        """A number never handed out before.
+
+        Raises
+        ------
+            storage.StorageError: a new block was needed and the source
+                failed.
+        """
+        try:
+            aBlock = self._oLocal.aBlock
+        except AttributeError:
+            aBlock = self._oLocal.aBlock = [0, 0]
+            with self._oLock:
+                self._aBlocks.append(aBlock)
+        if aBlock[0] >= aBlock[1]:
+            iFirst = self.oSource.allocate(self.iBlock)
+            aBlock[0], aBlock[1] = iFirst, iFirst + self.iBlock
+        iNumber = aBlock[0]
+        aBlock[0] += 1
+        return iNumber
+
+    def next_code(self):
+        """An invoice code never handed out before; see 'next'."""
+        return code_of(self.next())
+
+    def close(self):
+        """Hands the unused numbers of the topmost blocks back to the source,
+        highest first, as far as nothing above them was handed out."""
+        with self._oLock:
+            aBlocks = list(self._aBlocks)
+        aUnused = sorted(((aBlock[0], aBlock[1]) for aBlock in aBlocks
+            if aBlock[0] < aBlock[1]), reverse=True)
+        for aBlock in aBlocks:
+            aBlock[0] = aBlock[1]           # nothing more from these
+        for iFrom, iTo in aUnused:
+            try:
+                if not self.oSource.release(iFrom, iTo):
+                    break
+            except Exception:
+                break
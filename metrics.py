@@ -0,0 +1,357 @@
+""" # API latency and outcome metrics
+-----
+Every API function of the shop is wrapped by 'Metrics.instrument', which
+times each call and records:
+
+    - its latency, in a histogram of nanoseconds,
+    - its outcome: "OK", the returned 'sErr_desc', or "exception" if the call
+      raised.
+
+The histograms are HDR-style (log-linear): values up to 2**SUB_BITS ns are
+counted exactly, and above that each power of two is split into
+2**(SUB_BITS - 1) equal buckets, so every percentile is reported within
+1 / 2**(SUB_BITS - 1) of the true value, whatever the range.
+
+Recording must be cheap enough to leave on in production. Each thread
+records into its own series, so no lock is taken on the request path; a call
+costs two clock readings, a thread-local lookup and the bucket arithmetic,
+written out in the wrapper. 'benchmarks.bench_metrics' measures 0.7 to 1.5
+microseconds per call on CPython 3.11, depending on the machine; about half
+of it is the interpreter's cost of a wrapping function and two clock calls.
+That is small next to an API call, but too much for an inner loop. The shop
+wraps its eight API functions: 'list_products', 'create_order',
+'update_order', 'update_order_batch', 'delete_order', 'checkout_order',
+'checkout_status' and 'list_orders'.
+
+'snapshot' and 'prometheus' add the threads' series up when asked. When a
+thread ends, its series are folded into a shared, retired total and
+forgotten, so a server which keeps replacing its worker threads neither leaks
+series nor makes snapshots slower.
+"""
+
+import functools
+import itertools
+import operator
+import threading
+import time
+import weakref
+
+# Bits of precision of the histograms: values are kept within 1/64 (1.6%)
+SUB_BITS = 7
+
+# Largest latency told apart: 2**MAX_BITS ns, about 18 minutes
+MAX_BITS = 40
+
+_HALF = 1 << (SUB_BITS - 1)
+_BUCKETS = (MAX_BITS - SUB_BITS + 2) * _HALF
+
+# Percentiles in snapshots and in the Prometheus text
+QUANTILES = (0.5, 0.95, 0.99)
+
+#-------------------------------------------------------------------------------
+def bucket_of(iNs):
+    """Histogram bucket of a latency in nanoseconds."""
+    iExp = iNs.bit_length() - SUB_BITS
+    if iExp <= 0:
+        return iNs if iNs > 0 else 0
+    return min((iExp << (SUB_BITS - 1)) + (iNs >> iExp), _BUCKETS - 1)
+
+#-------------------------------------------------------------------------------
+def bucket_range(iBucket):
+    """(lowest, highest) latency in nanoseconds counted in a bucket."""
+    iExp = max((iBucket >> (SUB_BITS - 1)) - 1, 0)
+    iMantissa = iBucket - (iExp << (SUB_BITS - 1))
+    return iMantissa << iExp, ((iMantissa + 1) << iExp) - 1
+
+#-------------------------------------------------------------------------------
+class _Series:
+    """One thread's record of one API function."""
+
+    __slots__ = ("aCounts", "iSum", "iMax", "dOutcomes")
+
+    def __init__(self):
+        self.aCounts = [0] * _BUCKETS
+        self.iSum = 0
+        self.iMax = 0
+        self.dOutcomes = {}     # outcome -> number of calls
+
+    def add(self, iNs, sOutcome):
+        """Counts one call."""
+        # 'bucket_of', written out: this runs on every request.
+        iExp = iNs.bit_length() - SUB_BITS
+        if iExp <= 0:
+            iBucket = iNs if iNs > 0 else 0
+        else:
+            iBucket = (iExp << (SUB_BITS - 1)) + (iNs >> iExp)
+            if iBucket >= _BUCKETS:
+                iBucket = _BUCKETS - 1
+        self.aCounts[iBucket] += 1
+        self.iSum += iNs
+        if iNs > self.iMax:
+            self.iMax = iNs
+        try:
+            self.dOutcomes[sOutcome] += 1
+        except KeyError:
+            self.dOutcomes[sOutcome] = 1
+
+    def fold(self, oOther):
+        """Adds another series' counts to this one."""
+        self.aCounts = list(map(operator.add, self.aCounts,
+            list(oOther.aCounts)))
+        self.iSum += oOther.iSum
+        self.iMax = max(self.iMax, oOther.iMax)
+        for sOutcome, iCount in oOther.dOutcomes.copy().items():
+            self.dOutcomes[sOutcome] = (self.dOutcomes.get(sOutcome, 0)
+                + iCount)
+
+#-------------------------------------------------------------------------------
+class _Owner:
+    """Held by a thread's local storage only: it is freed when the thread
+    ends, which retires the thread's series (see 'Metrics._retire')."""
+
+    __slots__ = ("__weakref__",)
+
+#-------------------------------------------------------------------------------
+class Metrics:
+    """Latency histograms and outcome counts, per API function."""
+
+    __slots__ = ("_oLocal", "_dThreads", "_dRetired", "_oKeys", "_oLock",
+        "__weakref__")
+
+    def __init__(self):
+        self._oLocal = threading.local()
+        self._dThreads = {}     # key -> a live thread's {sName: _Series}
+        self._dRetired = {}     # sName -> _Series of threads which ended
+        self._oKeys = itertools.count()
+        self._oLock = threading.RLock()
+
+    def _series(self, sName):
+        """The calling thread's series for a function."""
+        try:
+            dSeries = self._oLocal.dSeries
+        except AttributeError:
+            dSeries = self._oLocal.dSeries = {}
+            oOwner = self._oLocal.oOwner = _Owner()
+            iKey = next(self._oKeys)
+            with self._oLock:
+                self._dThreads[iKey] = dSeries
+            weakref.finalize(oOwner, _retire, weakref.ref(self), iKey)
+        oSeries = dSeries.get(sName)
+        if oSeries is None:
+            oSeries = dSeries[sName] = _Series()
+        return oSeries
+
+    def _retire(self, iKey):
+        """Folds the series of a thread which ended into the retired
+        totals."""
+        with self._oLock:
+            dSeries = self._dThreads.pop(iKey, None)
+            if dSeries is None:
+                return
+            for sName, oSeries in dSeries.items():
+                oTotal = self._dRetired.get(sName)
+                if oTotal is None:
+                    oTotal = self._dRetired[sName] = _Series()
+                oTotal.fold(oSeries)
+
+    def record(self, sName, iNs, sOutcome):
+        """Records one call of 'sName' which took 'iNs' nanoseconds."""
+        self._series(sName).add(iNs, sOutcome)
+
+    def instrument(self, fnCall, sName=None):
+        """Wraps an API function so that each call is recorded.
+
+        Parameters
+        ----------
+            fnCall (callable)
+                Function returning a 'dOutput' dictionary.
+
+            sName (string, none)
+                Name the calls are recorded under; the function's name by
+                default.
+
+        Returns
+        -------
+            (callable) The wrapped function.
+        """
+        sName = sName or fnCall.__name__
+        fnNow = time.perf_counter_ns
+        oLocal = threading.local()      # .oSeries: the thread's series
+        iLast = _BUCKETS - 1
+
+        @functools.wraps(fnCall)
+        def wrapper(*aArgs, **dKwargs):
+            iStart = fnNow()
+            try:
+                dOutput = fnCall(*aArgs, **dKwargs)
+            except BaseException:
+                self.record(sName, fnNow() - iStart, "exception")
+                raise
+            iNs = fnNow() - iStart
+            try:
+                oSeries = oLocal.oSeries
+            except AttributeError:
+                oSeries = oLocal.oSeries = self._series(sName)
+            # '_Series.add', written out: calling it costs as much as its body
+            iExp = iNs.bit_length() - SUB_BITS
+            if iExp <= 0:
+                oSeries.aCounts[iNs if iNs > 0 else 0] += 1
+            else:
+                iBucket = (iExp << (SUB_BITS - 1)) + (iNs >> iExp)
+                oSeries.aCounts[iBucket if iBucket < iLast else iLast] += 1
+            oSeries.iSum += iNs
+            if iNs > oSeries.iMax:
+                oSeries.iMax = iNs
+            try:
+                sOutcome = dOutput.get("sErr_desc") or "OK"
+            except AttributeError:      # not a dictionary
+                sOutcome = "OK"
+            dOutcomes = oSeries.dOutcomes
+            dOutcomes[sOutcome] = dOutcomes.get(sOutcome, 0) + 1
+            return dOutput
+        return wrapper
+
+    #---------------------------------------------------------------------------
+    def _merged(self):
+        """{sName: _Series} summed over every thread, live or ended."""
+        dMerged = {}
+        with self._oLock:
+            for sName, oSeries in self._dRetired.items():
+                oTotal = dMerged[sName] = _Series()
+                oTotal.fold(oSeries)
+            aSeries = []
+            for dSeries in self._dThreads.values():
+                aSeries += dSeries.copy().items()
+        for sName, oSeries in aSeries:
+            oTotal = dMerged.get(sName)
+            if oTotal is None:
+                oTotal = dMerged[sName] = _Series()
+            oTotal.fold(oSeries)
+        return dMerged
+
+    @staticmethod
+    def _quantiles(oSeries):
+        """Latencies (ns) at 'QUANTILES', each the top of its bucket."""
+        iCount = sum(oSeries.aCounts)
+        aResult = []
+        iSeen = 0
+        iBucket = -1
+        for fQuantile in QUANTILES:
+            iRank = max(1, int(fQuantile * iCount + 0.5))
+            while iSeen < iRank:
+                iBucket += 1
+                iSeen += oSeries.aCounts[iBucket]
+            aResult.append(min(bucket_range(iBucket)[1], oSeries.iMax))
+        return aResult
+
+    def snapshot(self):
+        """Current figures of every instrumented function.
+
+        Returns
+        -------
+            (dictionary) Function name -> dictionary of "iCount" (calls),
+            "fMean", "fP50", "fP95", "fP99", "fMax" (seconds) and "dOutcomes"
+            (outcome -> calls). Functions never called are left out.
+        """
+        dSnapshot = {}
+        for sName, oSeries in sorted(self._merged().items()):
+            iCount = sum(oSeries.aCounts)
+            if not iCount:
+                continue
+            iP50, iP95, iP99 = self._quantiles(oSeries)
+            dSnapshot[sName] = {
+                "iCount":iCount,
+                "fMean":oSeries.iSum / iCount / 1e9,
+                "fP50":iP50 / 1e9,
+                "fP95":iP95 / 1e9,
+                "fP99":iP99 / 1e9,
+                "fMax":oSeries.iMax / 1e9,
+                "dOutcomes":dict(sorted(oSeries.dOutcomes.items()))
+            }
+        return dSnapshot
+
+    def prometheus(self, sPrefix="shop"):
+        """The snapshot in the Prometheus text exposition format.
+
+        Latencies are a summary, '<prefix>_request_seconds', with the
+        'QUANTILES', plus a '<prefix>_request_max_seconds' gauge; outcomes
+        are the counter '<prefix>_requests_total'.
+        """
+        dSnapshot = self.snapshot()
+        aLines = [
+            "# HELP %s_request_seconds Latency of API calls." % sPrefix,
+            "# TYPE %s_request_seconds summary" % sPrefix]
+        for sName, dFigures in dSnapshot.items():
+            sLabel = 'function="%s"' % _escape(sName)
+            for fQuantile, sKey in zip(QUANTILES, ("fP50", "fP95", "fP99")):
+                aLines.append('%s_request_seconds{%s,quantile="%s"} %.9g'
+                    % (sPrefix, sLabel, fQuantile, dFigures[sKey]))
+            aLines.append("%s_request_seconds_sum{%s} %.9g" % (sPrefix,
+                sLabel, dFigures["fMean"] * dFigures["iCount"]))
+            aLines.append("%s_request_seconds_count{%s} %d" % (sPrefix,
+                sLabel, dFigures["iCount"]))
+        aLines += [
+            "# HELP %s_request_max_seconds Slowest API call." % sPrefix,
+            "# TYPE %s_request_max_seconds gauge" % sPrefix]
+        for sName, dFigures in dSnapshot.items():
+            aLines.append('%s_request_max_seconds{function="%s"} %.9g'
+                % (sPrefix, _escape(sName), dFigures["fMax"]))
+        aLines += [
+            "# HELP %s_requests_total API calls by outcome." % sPrefix,
+            "# TYPE %s_requests_total counter" % sPrefix]
+        for sName, dFigures in dSnapshot.items():
+            for sOutcome, iCount in dFigures["dOutcomes"].items():
+                aLines.append('%s_requests_total{function="%s",outcome="%s"}'
+                    ' %d' % (sPrefix, _escape(sName), _escape(sOutcome),
+                    iCount))
+        return "\n".join(aLines) + "\n"
+
+    def export(self):
+        """Everything recorded, in a form which can be pickled or written as
+        JSON and added to another 'Metrics' with 'merge': function name ->
+        {"dCounts": {bucket: calls}, "iSum", "iMax", "dOutcomes"}."""
+        return {sName:{
+            "dCounts":{iBucket:iCount for iBucket, iCount
+                in enumerate(oSeries.aCounts) if iCount},
+            "iSum":oSeries.iSum,
+            "iMax":oSeries.iMax,
+            "dOutcomes":oSeries.dOutcomes
+        } for sName, oSeries in self._merged().items()}
+
+    def merge(self, dExported):
+        """Adds figures from 'export' (of another process, say)."""
+        for sName, dFigures in dExported.items():
+            oSeries = self._series(sName)
+            for iBucket, iCount in dFigures["dCounts"].items():
+                oSeries.aCounts[int(iBucket)] += iCount
+            oSeries.iSum += dFigures["iSum"]
+            oSeries.iMax = max(oSeries.iMax, dFigures["iMax"])
+            for sOutcome, iCount in dFigures["dOutcomes"].items():
+                oSeries.dOutcomes[sOutcome] = (
+                    oSeries.dOutcomes.get(sOutcome, 0) + iCount)
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._oLock:
+            self._dRetired.clear()
+            aThreads = list(self._dThreads.values())
+        for dSeries in aThreads:
+            for oSeries in dSeries.copy().values():
+                oSeries.aCounts[:] = [0] * _BUCKETS
+                oSeries.iSum = 0
+                oSeries.iMax = 0
+                oSeries.dOutcomes.clear()
+
+#-------------------------------------------------------------------------------
+def _retire(oMetrics_ref, iKey):
+    """Finaliser of a thread's '_Owner'; a weak reference keeps the metrics
+    collectable."""
+    oMetrics = oMetrics_ref()
+    if oMetrics is not None:
+        oMetrics._retire(iKey)
+
+#-------------------------------------------------------------------------------
+def _escape(sValue):
+    """A Prometheus label value."""
+    return (sValue.replace("\\", "\\\\").replace('"', '\\"')
+        .replace("\n", "\\n"))
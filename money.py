@@ -0,0 +1,39 @@
+""" # Money amounts in minor units
+-----
+Prices travel through the API as floats ('fPrice', 'fTotal_price', ...), but
+inside the shop every amount is an integer count of the currency's minor unit
+(grosz, cents, satoshi). Sums of integers don't drift the way sums of floats
+do, so a basket total is always exactly the sum of its lines.
+
+The number of minor-unit digits comes from ISO-4217; currencies not listed in
+'EXPONENTS' use 2.
+"""
+
+# ISO-4217 minor-unit digits which differ from the default of 2 ("XBT" is the
+# unofficial bitcoin code, counted in satoshi)
+EXPONENTS = {
+    "BHD":3, "BIF":0, "CLP":0, "DJF":0, "GNF":0, "IQD":3, "ISK":0, "JOD":3,
+    "JPY":0, "KMF":0, "KRW":0, "KWD":3, "LYD":3, "OMR":3, "PYG":0, "RWF":0,
+    "TND":3, "UGX":0, "UYI":0, "VND":0, "VUV":0, "XAF":0, "XBT":8, "XOF":0,
+    "XPF":0
+}
+
+#-------------------------------------------------------------------------------
+def exponent(sCurrency):
+    """Number of minor-unit digits of a currency."""
+    return EXPONENTS.get(sCurrency, 2)
+
+#-------------------------------------------------------------------------------
+def round_half(fValue):
+    """Rounds to a whole number, half away from 0."""
+    return int(fValue + 0.5) if fValue >= 0 else -int(-fValue + 0.5)
+
+#-------------------------------------------------------------------------------
+def to_minor(fAmount, sCurrency):
+    """Converts an amount to whole minor units, rounding half away from 0."""
+    return round_half(fAmount * 10 ** exponent(sCurrency))
+
+#-------------------------------------------------------------------------------
+def to_float(iMinor, sCurrency):
+    """Converts whole minor units back to the API's float amounts."""
+    return round(iMinor / 10 ** exponent(sCurrency), exponent(sCurrency))
@@ -0,0 +1,224 @@
+""" # Stock reservation engine
+-----
+'update_order' moves stock out of 'iStock' into a basket and 'delete_order'
+(or an expired basket) moves it back. During a flash sale many baskets fight
+over the same few items, while the rest of the shop should carry on
+unhindered, so there is no single global lock:
+
+    - Items are spread over a fixed number of lock stripes by the hash of their
+      'sItem_id'. Checking the stock and taking it out of 'iStock' happens
+      under the stripe lock of that item, as one atomic step. Two baskets can
+      therefore never both get the last unit ("item sold out" for the loser),
+      and a request for more than is left reserves nothing ("partial order").
+    - Each basket has its own lock, so the contents of one basket are changed
+      by one request at a time. The basket lock is always taken before any
+      stripe lock, and stripes are always taken in ascending order, which
+      rules out deadlocks.
+    - A line's unit price is captured, in minor units, when the item first
+      goes into the basket; the basket's running totals are updated with each
+      reservation and release.
+    - The engine counts the units of each item held in open baskets. When a
+      product is added or replaced ('put_product', as by a supplier feed), its
+      'iStock' is the feed's stock net of those units, written under the
+      item's stripe lock, so a reload never puts reserved units back on sale.
+      Units of a checked-out basket are sold ('sold') and no longer held.
+"""
+
+import threading
+
+import catalogue
+import money
+
+# Number of lock stripes; a power of two comfortably above the core count
+STRIPES = 64
+
+#-------------------------------------------------------------------------------
+class ReservationEngine:
+    """Atomic check-and-reserve of catalogue stock for baskets."""
+
+    __slots__ = ("oCatalogue", "_aLocks", "_dHeld")
+
+    def __init__(self, oCatalogue, iStripes=STRIPES):
+        """Creates the engine.
+
+        Parameters
+        ----------
+            oCatalogue (catalogue.Catalogue)
+                Catalogue whose 'iStock' column holds the available stock.
+
+            iStripes (integer)
+                Number of item locks.
+        """
+        self.oCatalogue = oCatalogue
+        self._aLocks = [threading.Lock() for _ in range(iStripes)]
+        self._dHeld = {}    # sItem_id -> units in open baskets
+
+    def _stripe(self, sItem_id):
+        return hash(sItem_id) % len(self._aLocks)
+
+    #---------------------------------------------------------------------------
+    def _take(self, oBasket, sItem_id, iQty, iLimit):
+        """Reserves one line. Basket and stripe locks are already held."""
+        if oBasket.bSealed:
+            return "invalid basket"
+        if (iLimit is not None
+                and oBasket.dLines.get(sItem_id, 0) + iQty > iLimit):
+            return "maximum quantity exceeded"
+        if sItem_id not in self.oCatalogue:
+            return "item does not exist"
+        iStock = self.oCatalogue.stock(sItem_id)
+        if iStock == 0:
+            return "item sold out"
+        if iQty > iStock:
+            return "partial order"
+        self.oCatalogue.set_stock(sItem_id, iStock - iQty)
+        self._dHeld[sItem_id] = self._dHeld.get(sItem_id, 0) + iQty
+        oBasket.add_line(sItem_id, iQty, lambda: self._details(sItem_id))
+        return None
+
+    def _details(self, sItem_id):
+        fPrice, sCurrency, sDesc, sSize, sColour = \
+            self.oCatalogue.line_details(sItem_id)
+        return (money.to_minor(fPrice, sCurrency), sCurrency, sDesc, sSize,
+            sColour)
+
+    def reserve(self, oBasket, sItem_id, iQty, iLimit=None):
+        """Moves 'iQty' units of an item from 'iStock' into a basket.
+
+        'iLimit', when given, is the most units of the item the basket may
+        hold afterwards (a business rule).
+
+        Returns
+        -------
+            (string, none) 'None' on success, otherwise the error
+            description: "item does not exist", "item sold out",
+            "partial order", "maximum quantity exceeded" or "invalid basket".
+        """
+        oLock = self._aLocks[self._stripe(sItem_id)]
+        with oBasket.oLock, oLock:
+            return self._take(oBasket, sItem_id, iQty, iLimit)
+
+    def reserve_many(self, oBasket, aLines):
+        """Reserves several lines for one basket in a single locked pass.
+
+        The basket lock and the stripe locks of all items involved are taken
+        once, then every line is reserved. Each line succeeds or fails on its
+        own.
+
+        Parameters
+        ----------
+            oBasket (baskets.Basket)
+                Basket receiving the items.
+
+            aLines (list of tuples)
+                (sItem_id, iQty, iLimit) triples, 'iLimit' as for 'reserve'.
+                The quantities must already be validated.
+
+        Returns
+        -------
+            (list) One error description, or 'None', per line.
+        """
+        aStripes = sorted({self._stripe(tLine[0]) for tLine in aLines})
+        with oBasket.oLock:
+            for iStripe in aStripes:
+                self._aLocks[iStripe].acquire()
+            try:
+                return [self._take(oBasket, sItem_id, iQty, iLimit)
+                    for sItem_id, iQty, iLimit in aLines]
+            finally:
+                for iStripe in reversed(aStripes):
+                    self._aLocks[iStripe].release()
+
+    #---------------------------------------------------------------------------
+    def _unhold(self, sItem_id, iQty):
+        """Counts units as no longer in a basket. The stripe lock is already
+        held."""
+        iHeld = self._dHeld.get(sItem_id, 0) - iQty
+        if iHeld > 0:
+            self._dHeld[sItem_id] = iHeld
+        else:
+            self._dHeld.pop(sItem_id, None)
+
+    def _give_back(self, sItem_id, iQty):
+        """Returns units to 'iStock'. The stripe lock is already held."""
+        if sItem_id in self.oCatalogue:
+            self.oCatalogue.set_stock(sItem_id,
+                self.oCatalogue.stock(sItem_id) + iQty)
+
+    def release(self, oBasket, sItem_id, iQty):
+        """Moves 'iQty' units of an item from a basket back into 'iStock'.
+
+        Returns
+        -------
+            (string, none) 'None' on success, otherwise the 'delete_order'
+            error description: "invalid item code", "quantity too high" or
+            "invalid basket".
+        """
+        oLock = self._aLocks[self._stripe(sItem_id)]
+        with oBasket.oLock, oLock:
+            if oBasket.bSealed:
+                return "invalid basket"
+            iHeld = oBasket.dLines.get(sItem_id)
+            if iHeld is None:
+                return "invalid item code"
+            if iQty > iHeld:
+                return "quantity too high"
+            oBasket.remove_line(sItem_id, iQty)
+            self._unhold(sItem_id, iQty)
+            self._give_back(sItem_id, iQty)
+            return None
+
+    def release_all(self, oBasket):
+        """Returns everything held by a discarded basket to 'iStock'.
+
+        The basket must already be sealed, so nothing new can be added to it.
+        """
+        with oBasket.oLock:
+            for sItem_id, iQty in list(oBasket.dLines.items()):
+                with self._aLocks[self._stripe(sItem_id)]:
+                    self._unhold(sItem_id, iQty)
+                    self._give_back(sItem_id, iQty)
+            oBasket.clear()
+
+    def sold(self, oBasket):
+        """Counts the units of a checked-out basket as sold rather than
+        held. The caller holds the basket lock; the basket is sealed."""
+        for sItem_id, iQty in oBasket.dLines.items():
+            with self._aLocks[self._stripe(sItem_id)]:
+                self._unhold(sItem_id, iQty)
+
+    def restock(self, aLines):
+        """Returns the units of a cancelled order, (sItem_id, iQty, ...)
+        lines of a checked-out basket, to 'iStock'."""
+        for tLine in aLines:
+            with self._aLocks[self._stripe(tLine[0])]:
+                self._give_back(tLine[0], tLine[1])
+
+    #---------------------------------------------------------------------------
+    def held(self, sItem_id):
+        """Units of an item held in open baskets."""
+        return self._dHeld.get(sItem_id, 0)
+
+    def put_product(self, dProduct):
+        """Adds a product to the catalogue, or replaces it, under its stripe
+        lock. Its 'iStock' is taken as the stock on hand, of which the units
+        held in open baskets are not for sale.
+
+        Raises
+        ------
+            ValueError: the record fails 'catalogue.validate_product'.
+        """
+        catalogue.validate_product(dProduct)
+        sItem_id = dProduct["sItem_id"]
+        with self._aLocks[self._stripe(sItem_id)]:
+            iHeld = self._dHeld.get(sItem_id, 0)
+            if iHeld:
+                dProduct = dict(dProduct,
+                    iStock=max(0, dProduct["iStock"] - iHeld))
+            return self.oCatalogue.add(dProduct)
+
+    def withdraw(self, sItem_id):
+        """Removes a product from the catalogue under its stripe lock.
+        Baskets keep the units they hold; released, they go nowhere."""
+        with self._aLocks[self._stripe(sItem_id)]:
+            self.oCatalogue.remove(sItem_id)
@@ -0,0 +1,255 @@
+""" # Business rules for 'update_order'
+-----
+Whether a customer may put an item into their basket depends on "business
+rules": some items can't be sold in some regions ("not available"), a region
+may only accept prices in certain currencies ("invalid currency"), and some
+items are limited per customer ("maximum quantity exceeded").
+
+A rule is a dictionary:
+
+    sKind               "deny", "currency" or "max_qty"
+    sItem_id, sCategory,
+    sBrand, sCurrency   optional; the rule applies to items whose field has
+                        this value (all the given fields must match)
+    aRegions            optional; regions the rule applies in (default: all)
+    aExcept_regions     optional; regions the rule doesn't apply in
+    aCurrencies         "currency" rules: the currencies accepted
+    iMax_qty            "max_qty" rules: units one basket may hold
+
+For example, pellet guns sold only in Poland and Czechia:
+
+    {"sKind":"deny", "sCategory":"air guns", "aExcept_regions":["PL", "CZ"]}
+
+Rules are not evaluated one after another. They are compiled ('RuleSet') into
+an index keyed by the most selective item field each rule names, and within
+that by region, so an item only meets the handful of rules which can apply
+to it. The outcome for a (region, item) pair is then memoised ('RulesEngine')
+until the rules are replaced or the item itself changes.
+"""
+
+import json
+import threading
+
+# Item fields a rule can match on, most selective first. A rule is filed in
+# the index under the first of these it names.
+MATCH_FIELDS = ("sItem_id", "sCategory", "sBrand", "sCurrency")
+
+# Kinds of rules
+KINDS = ("deny", "currency", "max_qty")
+
+# Outcome for an item no rule objects to: (sErr_desc, iMax_qty)
+ALLOWED = (None, None)
+
+#-------------------------------------------------------------------------------
+def _strings(xValue):
+    return (isinstance(xValue, (list, tuple))
+        and all(isinstance(sValue, str) for sValue in xValue))
+
+#-------------------------------------------------------------------------------
+def validate_rule(dRule):
+    """Checks a rule record.
+
+    Raises
+    ------
+        ValueError: a key is missing or has the wrong type or value. The
+            message names the offending key.
+    """
+    if not isinstance(dRule, dict):
+        raise ValueError("rule must be a dictionary")
+    if dRule.get("sKind") not in KINDS:
+        raise ValueError("sKind")
+    for sField in MATCH_FIELDS:
+        if not isinstance(dRule.get(sField, ""), str):
+            raise ValueError(sField)
+    for sKey in ("aRegions", "aExcept_regions"):
+        if sKey in dRule and not _strings(dRule[sKey]):
+            raise ValueError(sKey)
+    if dRule["sKind"] == "currency" and not _strings(dRule.get("aCurrencies")):
+        raise ValueError("aCurrencies")
+    if dRule["sKind"] == "max_qty":
+        iMax_qty = dRule.get("iMax_qty")
+        if (not isinstance(iMax_qty, int) or isinstance(iMax_qty, bool)
+                or iMax_qty < 0):
+            raise ValueError("iMax_qty")
+
+#-------------------------------------------------------------------------------
+class RuleSet:
+    """Rules compiled into indexed lookups. Immutable once built."""
+
+    __slots__ = ("iSize", "_dIndex", "_dAny")
+
+    def __init__(self, aRules):
+        """Compiles a list of rules.
+
+        Raises
+        ------
+            ValueError: a rule fails 'validate_rule'.
+        """
+        self.iSize = 0
+        self._dIndex = {}   # (sField, sValue) -> {sRegion or None: [rules]}
+        self._dAny = {}     # sRegion or None -> [rules matching any item]
+        for dRule in aRules:
+            validate_rule(dRule)
+            tMatch = tuple((sField, dRule[sField]) for sField in MATCH_FIELDS
+                if sField in dRule)
+            # Compiled form: (kind, item matchers after the indexed one,
+            # excluded regions, accepted currencies, quantity limit)
+            tRule = (dRule["sKind"], tMatch[1:],
+                frozenset(dRule.get("aExcept_regions", ())),
+                frozenset(dRule.get("aCurrencies", ())), dRule.get("iMax_qty"))
+            dBy_region = self._dIndex.setdefault(tMatch[0], {}) \
+                if tMatch else self._dAny
+            for sRegion in dRule.get("aRegions", (None,)):
+                dBy_region.setdefault(sRegion, []).append(tRule)
+            self.iSize += 1
+
+    def __len__(self):
+        return self.iSize
+
+    def _candidates(self, sRegion, dItem):
+        aBuckets = [self._dAny]
+        for sField in MATCH_FIELDS:
+            dBy_region = self._dIndex.get((sField, dItem[sField]))
+            if dBy_region is not None:
+                aBuckets.append(dBy_region)
+        for dBy_region in aBuckets:
+            yield from dBy_region.get(None, ())
+            yield from dBy_region.get(sRegion, ())
+
+    def evaluate(self, sRegion, dItem):
+        """Applies the rules to one item for a customer region.
+
+        Parameters
+        ----------
+            sRegion (string)
+                Region of the customer.
+
+            dItem (dictionary)
+                The item's fields named in 'MATCH_FIELDS', as returned by
+                'catalogue.Catalogue.attributes'.
+
+        Returns
+        -------
+            (tuple) (sErr_desc, iMax_qty). The error description is 'None',
+            "not available" or "invalid currency"; the quantity limit is
+            'None' when there is none.
+        """
+        sErr_desc, iMax_qty = None, None
+        for sKind, tMatch, setExcept, setCurrencies, iLimit in \
+                self._candidates(sRegion, dItem):
+            if sRegion in setExcept or any(dItem[sField] != sValue
+                    for sField, sValue in tMatch):
+                continue
+            if sKind == "deny":
+                return "not available", None
+            if sKind == "currency":
+                if dItem["sCurrency"] not in setCurrencies:
+                    sErr_desc = "invalid currency"
+            elif iMax_qty is None or iLimit < iMax_qty:
+                iMax_qty = iLimit
+        return sErr_desc, iMax_qty
+
+#-------------------------------------------------------------------------------
+def load_rules(sPath):
+    """Reads a JSON rule file, '{"aRules":[...]}', into a 'RuleSet'.
+
+    Raises
+    ------
+        OSError: the file can't be read.
+        ValueError: the file or a rule is malformed.
+    """
+    with open(sPath, encoding="utf-8") as oFile:
+        try:
+            aRules = json.load(oFile)["aRules"]
+        except (KeyError, TypeError) as e:
+            raise ValueError("malformed rule file: %s" % sPath) from e
+    if not isinstance(aRules, list):
+        raise ValueError("malformed rule file: %s" % sPath)
+    return RuleSet(aRules)
+
+#-------------------------------------------------------------------------------
+class RulesEngine:
+    """Current rule set plus the memoised outcome per (region, item)."""
+
+    __slots__ = ("fnAttributes", "iMax_entries", "_oRules", "_dMemo",
+        "_iEntries", "_iGeneration", "_oLock")
+
+    def __init__(self, fnAttributes, oRules=None, iMax_entries=1000000):
+        """Creates the engine.
+
+        Parameters
+        ----------
+            fnAttributes (callable)
+                'fnAttributes(sItem_id)' returns the item's fields named in
+                'MATCH_FIELDS', or raises KeyError for an unknown item.
+
+            oRules (RuleSet, none)
+                Initial rules; none by default.
+
+            iMax_entries (integer)
+                Number of memoised outcomes kept. The memo is emptied when it
+                grows beyond this.
+        """
+        self.fnAttributes = fnAttributes
+        self.iMax_entries = iMax_entries
+        self._oRules = RuleSet(()) if oRules is None else oRules
+        self._dMemo = {}        # sItem_id -> {sRegion: (sErr_desc, iMax_qty)}
+        self._iEntries = 0
+        self._iGeneration = 0   # bumped by each change forgetting outcomes
+        self._oLock = threading.Lock()
+
+    def install(self, oRules):
+        """Replaces the rule set and forgets every memoised outcome."""
+        with self._oLock:
+            self._oRules = oRules
+            self._dMemo = {}
+            self._iEntries = 0
+            self._iGeneration += 1
+
+    def check(self, sRegion, sItem_id):
+        """Outcome of the rules for an item and a customer region.
+
+        Returns
+        -------
+            (tuple) (sErr_desc, iMax_qty), as from 'RuleSet.evaluate'. An
+            unknown item is 'ALLOWED'; the reservation reports it.
+        """
+        # Reads are lock-free; a single dictionary lookup is atomic.
+        dRegions = self._dMemo.get(sItem_id)
+        if dRegions is not None:
+            tOutcome = dRegions.get(sRegion)
+            if tOutcome is not None:
+                return tOutcome
+        # The outcome is computed unlocked. It is only memoised if no rule
+        # set or product change, which would have forgotten it, came since.
+        iGeneration = self._iGeneration
+        oRules = self._oRules
+        try:
+            tOutcome = oRules.evaluate(sRegion, self.fnAttributes(sItem_id))
+        except KeyError:
+            return ALLOWED
+        with self._oLock:
+            if iGeneration == self._iGeneration:
+                if self._iEntries >= self.iMax_entries:
+                    self._dMemo = {}
+                    self._iEntries = 0
+                dRegions = self._dMemo.setdefault(sItem_id, {})
+                if sRegion not in dRegions:
+                    self._iEntries += 1
+                dRegions[sRegion] = tOutcome
+        return tOutcome
+
+    def on_change(self, sItem_id, sField):
+        """Catalogue listener: forgets the outcomes of a product which was
+        added, replaced or removed, or of every product after a batch of
+        them ('sItem_id' of 'None'). Stock and price changes don't matter."""
+        if sField is None:
+            with self._oLock:
+                self._iGeneration += 1
+                if sItem_id is None:
+                    self._dMemo = {}
+                    self._iEntries = 0
+                    return
+                dRegions = self._dMemo.pop(sItem_id, None)
+                if dRegions is not None:
+                    self._iEntries -= len(dRegions)
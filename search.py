@@ -0,0 +1,344 @@
+""" # Keyword index behind 'list_products'
+-----
+In-memory inverted index over the 'sDesc' field of the product catalogue.
+
+Every description is broken into case-folded tokens. Each token keeps a
+posting list: the sorted list of 'sItem_id' values whose description contains
+the token. A search for "blue jeans" is then the intersection of the posting
+lists for "blue" and "jeans", walked from the shortest list. The number of
+hits for a single keyword is simply the length of its posting list, so the
+'iSearch_tot' value never requires a scan of the catalogue.
+
+Posting lists are kept sorted, so results always come back in 'sItem_id'
+order and a page can be started from any position with a binary search.
+Inserting into a sorted list one identifier at a time would make loading a
+catalogue quadratic, so added and removed identifiers are collected per token
+and merged into the posting lists, one pass per list, by the next search. A
+bulk load sorts each list once; a few new identifiers are inserted in place,
+and a search walking the list finds its place again by value. A list is never
+shortened in place: removals build a new list. The tokens kept per product are
+interned, so a word costs its string only once.
+"""
+
+import bisect
+import collections
+import re
+import sys
+import threading
+
+_RE_TOKEN = re.compile(r"\w+")
+
+# Multi-term hit counts memoised per index; the oldest are dropped beyond this
+COUNT_MEMORY = 4096
+
+# Identifiers added to (or removed from) a list one by one up to this many;
+# more are merged by sorting (or filtering) the whole list once
+_INSORT_MAX = 32
+
+#-------------------------------------------------------------------------------
+def tokenise(sText):
+    """Splits a description or a search phrase into search tokens.
+
+    Tokens are runs of letters and digits, case-folded so that "Unicorn",
+    "UNICORN" and "unicorn" are the same keyword. Duplicates are removed while
+    the original order is kept.
+
+    Parameters
+    ----------
+        sText (string, none)
+            Text to be tokenised. 'None' or an empty string gives no tokens.
+
+    Returns
+    -------
+        (list of strings) Unique tokens found in the text.
+    """
+    if not sText:
+        return []
+    return list(dict.fromkeys(_RE_TOKEN.findall(sText.casefold())))
+
+#-------------------------------------------------------------------------------
+def _contains(aSorted, sKey):
+    """Binary-search membership test on a sorted posting list."""
+    iPos = bisect.bisect_left(aSorted, sKey)
+    return iPos < len(aSorted) and aSorted[iPos] == sKey
+
+#-------------------------------------------------------------------------------
+class CountMemo:
+    """Memoised hit counts of multi-term queries, at most 'COUNT_MEMORY' of
+    them; the oldest are dropped. Lookups take no lock.
+
+    A count is stored only if the index didn't change while it was computed:
+    take a 'token' first and pass it to 'put'.
+    """
+
+    __slots__ = ("iMax_entries", "_dCounts", "_iGeneration", "_oLock")
+
+    def __init__(self, iMax_entries=COUNT_MEMORY):
+        self.iMax_entries = iMax_entries
+        self._dCounts = collections.OrderedDict()   # sorted tokens -> count
+        self._iGeneration = 0
+        self._oLock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dCounts)
+
+    def get(self, sKey):
+        return self._dCounts.get(sKey)
+
+    def token(self):
+        return self._iGeneration
+
+    def put(self, sKey, iCount, iToken):
+        with self._oLock:
+            if iToken != self._iGeneration:
+                return
+            self._dCounts[sKey] = iCount
+            if len(self._dCounts) > self.iMax_entries:
+                self._dCounts.popitem(last=False)
+
+    def clear(self):
+        """Forgets every count; counts being computed aren't stored."""
+        with self._oLock:
+            self._iGeneration += 1
+            self._dCounts.clear()
+
+#-------------------------------------------------------------------------------
+class KeywordIndex:
+    """Inverted index: token -> sorted posting list of item identifiers.
+
+    The index is maintained incrementally. 'add', 'update' and 'remove' only
+    touch the pending changes of the tokens belonging to that one product.
+    Writers must be serialised by the owner; searches may run alongside.
+    """
+
+    __slots__ = ("_dPostings", "_dPending", "_dGone", "_dTokens", "_aAll",
+        "oCounts", "_oLock")
+
+    def __init__(self):
+        self._dPostings = {}    # token -> sorted list of sItem_id
+        self._dPending = {}     # token (None: all) -> set of new sItem_id
+        self._dGone = {}        # token (None: all) -> set of removed sItem_id
+        self._dTokens = {}      # sItem_id -> tuple of tokens in its 'sDesc'
+        self._aAll = []         # every indexed sItem_id, sorted
+        self.oCounts = CountMemo()
+        self._oLock = threading.Lock()  # changes, and merges by searches
+
+    def __len__(self):
+        return len(self._dTokens)
+
+    def __contains__(self, sItem_id):
+        return sItem_id in self._dTokens
+
+    def ids(self):
+        """Every indexed 'sItem_id', sorted. The list must not be modified."""
+        if self._dPending or self._dGone:
+            self._merge()
+        return self._aAll
+
+    #---------------------------------------------------------------------------
+    def add(self, sItem_id, sDesc):
+        """Indexes a new product. An existing entry is replaced."""
+        if sItem_id in self._dTokens:
+            self.update(sItem_id, sDesc)
+            return
+        aTokens = tuple(map(sys.intern, tokenise(sDesc)))
+        with self._oLock:
+            self._dTokens[sItem_id] = aTokens
+            self._dPending.setdefault(None, set()).add(sItem_id)
+            for sToken in aTokens:
+                self._dPending.setdefault(sToken, set()).add(sItem_id)
+        self.oCounts.clear()
+
+    def update(self, sItem_id, sDesc):
+        """Re-indexes a product whose description has changed.
+
+        Only the tokens which were added to, or dropped from, the description
+        have their posting lists modified.
+        """
+        aOld = self._dTokens.get(sItem_id)
+        if aOld is None:
+            self.add(sItem_id, sDesc)
+            return
+        aNew = tuple(map(sys.intern, tokenise(sDesc)))
+        if aNew == aOld:
+            return
+        with self._oLock:
+            self._dTokens[sItem_id] = aNew
+            setNew = set(aNew)
+            for sToken in aOld:
+                if sToken not in setNew:
+                    self._discard(sToken, sItem_id)
+            setOld = set(aOld)
+            for sToken in aNew:
+                if sToken not in setOld:
+                    self._dPending.setdefault(sToken, set()).add(sItem_id)
+        self.oCounts.clear()
+
+    def remove(self, sItem_id):
+        """Drops a product from the index. Unknown identifiers are ignored."""
+        with self._oLock:
+            aTokens = self._dTokens.pop(sItem_id, None)
+            if aTokens is None:
+                return
+            for sToken in aTokens:
+                self._discard(sToken, sItem_id)
+            self._discard(None, sItem_id)
+        self.oCounts.clear()
+
+    def _discard(self, sToken, sItem_id):
+        """Takes an identifier out of a posting list ('None': the list of
+        all), pending or merged. The lock is held."""
+        setPending = self._dPending.get(sToken)
+        if setPending is not None and sItem_id in setPending:
+            setPending.discard(sItem_id)
+            if not setPending:
+                del self._dPending[sToken]
+            return
+        self._dGone.setdefault(sToken, set()).add(sItem_id)
+
+    def _merge(self):
+        """Merges the pending changes into the posting lists.
+
+        A few additions are inserted in place, which 'search' copes with.
+        Otherwise, and for any removal, the list is built anew and swapped
+        in: a search already walking the old one carries on with it, rather
+        than skipping an entry which moved back under its position.
+        """
+        with self._oLock:
+            for sToken in self._dPending.keys() | self._dGone.keys():
+                aPosting = (self._aAll if sToken is None
+                    else self._dPostings.get(sToken, []))
+                setGone = self._dGone.get(sToken, ())
+                if len(setGone) > _INSORT_MAX:
+                    aPosting = [sItem_id for sItem_id in aPosting
+                        if sItem_id not in setGone]
+                elif setGone:
+                    aPosting = aPosting[:]
+                    for sItem_id in setGone:
+                        del aPosting[bisect.bisect_left(aPosting, sItem_id)]
+                setPending = self._dPending.get(sToken, ())
+                if len(setPending) <= _INSORT_MAX:
+                    for sItem_id in setPending:
+                        bisect.insort(aPosting, sItem_id)
+                else:
+                    aPosting = aPosting + sorted(setPending)
+                    aPosting.sort()     # two sorted runs: a linear merge
+                if sToken is None:
+                    self._aAll = aPosting
+                elif aPosting:
+                    self._dPostings[sToken] = aPosting
+                else:
+                    self._dPostings.pop(sToken, None)
+            self._dPending = {}
+            self._dGone = {}
+
+    #---------------------------------------------------------------------------
+    def _postings(self, sQuery):
+        """Returns the posting lists for a query, shortest first.
+
+        'None' is returned for a query without tokens (show all products). An
+        empty list is returned if any keyword is unknown, as the AND of the
+        keywords can't then match anything.
+        """
+        aTokens = tokenise(sQuery)
+        if not aTokens:
+            return None
+        if self._dPending or self._dGone:
+            self._merge()
+        aLists = []
+        for sToken in aTokens:
+            aPosting = self._dPostings.get(sToken)
+            if aPosting is None:
+                return []
+            aLists.append(aPosting)
+        aLists.sort(key=len)
+        return aLists
+
+    def count(self, sQuery):
+        """Number of products matching all keywords of the query.
+
+        For no keywords, or a single keyword, this is the length of a posting
+        list. Multi-term counts are computed once and memoised (see
+        'CountMemo') until the index next changes.
+        """
+        iToken = self.oCounts.token()
+        aLists = self._postings(sQuery)
+        if aLists is None:
+            return len(self._dTokens)
+        if len(aLists) < 2:
+            return len(aLists[0]) if aLists else 0
+        sKey = " ".join(sorted(tokenise(sQuery)))
+        iCount = self.oCounts.get(sKey)
+        if iCount is None:
+            iCount = sum(1 for _ in self._walk(aLists, 0))
+            self.oCounts.put(sKey, iCount, iToken)
+        return iCount
+
+    def search(self, sQuery, iOffset=0, iLimit=None, sAfter=None):
+        """Returns matching item identifiers in 'sItem_id' order.
+
+        Parameters
+        ----------
+            sQuery (string, none)
+                Keywords, all of which must appear in the description.
+                'None' matches every product.
+
+            iOffset (integer)
+                Number of matches to skip.
+
+            iLimit (integer, none)
+                Maximum number of identifiers to return.
+
+            sAfter (string, none)
+                Only identifiers sorting after this one are considered. This
+                is used for keyset pagination.
+
+        Returns
+        -------
+            (list of strings) Matching 'sItem_id' values.
+        """
+        aLists = self._postings(sQuery)
+        if aLists is None:
+            aLists = [self.ids()]
+        elif not aLists:
+            return []
+        if len(aLists) == 1:
+            while True:
+                iStart = iOffset
+                if sAfter is not None:
+                    iStart += bisect.bisect_right(aLists[0], sAfter)
+                iEnd = None if iLimit is None else iStart + iLimit
+                aOut = aLists[0][iStart:iEnd]
+                # Unless identifiers were inserted between the two steps
+                if sAfter is None or not aOut or aOut[0] > sAfter:
+                    return aOut
+        iStart = 0 if sAfter is None else bisect.bisect_right(aLists[0], sAfter)
+        aOut = []
+        for sItem_id in self._walk(aLists, iStart, sAfter):
+            if iOffset:
+                iOffset -= 1
+                continue
+            if iLimit is not None and len(aOut) >= iLimit:
+                break
+            aOut.append(sItem_id)
+        return aOut
+
+    @staticmethod
+    def _walk(aLists, iStart, sLast=None):
+        """Yields the intersection of sorted posting lists, in order, from
+        position 'iStart' of the first, after 'sLast'.
+
+        Identifiers inserted in front of the position by a merge push back
+        ones already seen: the walk then finds its place again by value.
+        """
+        aFirst, aRest = aLists[0], aLists[1:]
+        iPos = iStart
+        while iPos < len(aFirst):
+            sItem_id = aFirst[iPos]
+            if sLast is not None and sItem_id <= sLast:
+                iPos = bisect.bisect_right(aFirst, sLast)
+                continue
+            sLast = sItem_id
+            iPos += 1
+            if all(_contains(aOther, sItem_id) for aOther in aRest):
+                yield sItem_id
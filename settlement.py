@@ -0,0 +1,539 @@
+""" # Payment settlement queue
+-----
+Charging the customer means waiting on an external payment provider. Doing
+it inside 'checkout_order', with the basket locked, would tie every checkout
+to the provider's latency. Instead, a checkout ends with a pending invoice,
+and the payment is settled in the background:
+
+    - 'SettlementQueue.submit' queues the invoice and returns at once.
+    - A fixed pool of worker threads charges the provider, so no more than
+      'iWorkers' payments are in flight, however busy the shop.
+    - A provider failure (an exception, as opposed to a declined payment) is
+      ambiguous: the charge may or may not have gone through. It is retried
+      with exponential back-off, and the invoice code is the idempotency key
+      which makes the retries one payment. After 'iMax_attempts' charges the
+      payment is escalated ('escalated', 'fnOn_escalate') for someone to
+      look into, and keeps being retried every MAX_DELAY seconds. It stays
+      pending; only the provider's answer settles or rejects it.
+    - The outcome, "settled" or "rejected", is handed to 'fnOn_outcome'
+      (which records it and, for a rejection, returns the stock) before
+      'status' reports it. If 'fnOn_outcome' fails, it is retried without
+      charging the customer again.
+
+Charges carry the invoice code, and providers must treat a repeated charge
+of one invoice as the same payment: after a restart, pending invoices are
+submitted again.
+
+A shop with storage records outcomes there. Without it, 'PaymentRecords'
+remembers the payment state of the invoices issued and, given a journal
+file, logs each change, so that after a restart finished payments are still
+reported and pending ones are submitted again.
+
+A provider's 'charge' may be a coroutine function (see 'AsyncStubProvider'),
+as the clients of most payment APIs are. Its charges then run on an event
+loop of the queue's own; the workers await them there, so the same limit on
+payments in flight applies.
+
+No charge holds a worker for longer than CHARGE_TIMEOUT seconds. A plain
+'charge' is given the timeout ('fTimeout') and must give up by then, as a
+client's socket timeout does; a coroutine is cancelled. Either way, a charge
+which timed out is a provider failure, and retried like any other.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import heapq
+import inspect
+import itertools
+import random
+import threading
+import time
+
+import wal
+
+# Worker threads, which is also the most payments in flight at once
+WORKERS = 8
+
+# Charges attempted before a failing payment is escalated
+MAX_ATTEMPTS = 5
+
+# Seconds before the first retry; each further retry waits twice as long,
+# up to MAX_DELAY
+RETRY_DELAY = 0.5
+MAX_DELAY = 30.0
+
+# Seconds a charge may take before it counts as a provider failure
+CHARGE_TIMEOUT = 10.0
+
+# Number of finished payments whose outcome is remembered (by the queue, and
+# by 'PaymentRecords')
+OUTCOME_MEMORY = 65536
+
+PENDING = "pending"
+SETTLED = "settled"
+REJECTED = "rejected"
+
+#-------------------------------------------------------------------------------
+class ProviderError(Exception):
+    """The payment provider couldn't be reached or failed; worth retrying."""
+
+#-------------------------------------------------------------------------------
+class ChargeTimeout(ProviderError):
+    """A charge took longer than its timeout; retried like any failure."""
+
+#-------------------------------------------------------------------------------
+class StubProvider:
+    """Local stand-in for a payment provider.
+
+    Each charge takes 'fLatency' seconds, or fails after 'fTimeout' if that
+    is shorter. Charges fail ('ProviderError') with probability
+    'fFailure_rate' and are declined with probability 'fReject_rate'. The
+    decision on an invoice, once made, is kept: charging it again gives the
+    same answer.
+    """
+
+    __slots__ = ("fLatency", "fReject_rate", "fFailure_rate", "iCharges",
+        "_oRandom", "_dDecided", "_oLock")
+
+    def __init__(self, fLatency=0.05, fReject_rate=0.0, fFailure_rate=0.0,
+            iSeed=None):
+        self.fLatency = fLatency
+        self.fReject_rate = fReject_rate
+        self.fFailure_rate = fFailure_rate
+        self.iCharges = 0
+        self._oRandom = random.Random(iSeed)
+        self._dDecided = {}
+        self._oLock = threading.Lock()
+
+    def charge(self, sInvoice_code, sUser_id, sCurrency, iAmount,
+            fTimeout=None):
+        """Charges 'iAmount' minor units of 'sCurrency' for an invoice,
+        giving up after 'fTimeout' seconds if it is given.
+
+        Returns
+        -------
+            (boolean) True if the payment went through, false if it was
+            declined.
+
+        Raises
+        ------
+            ProviderError: the charge failed (or, as 'ChargeTimeout', timed
+                out) and may be retried.
+        """
+        if fTimeout is not None and fTimeout < self.fLatency:
+            time.sleep(fTimeout)
+            raise ChargeTimeout("charge timed out")
+        time.sleep(self.fLatency)
+        with self._oLock:
+            self.iCharges += 1
+            bPaid = self._dDecided.get(sInvoice_code)
+            if bPaid is None:
+                if self._oRandom.random() < self.fFailure_rate:
+                    raise ProviderError("provider unavailable")
+                bPaid = self._oRandom.random() >= self.fReject_rate
+                self._dDecided[sInvoice_code] = bPaid
+            return bPaid
+
+#-------------------------------------------------------------------------------
+class AsyncStubProvider(StubProvider):
+    """'StubProvider' whose 'charge' is awaitable, as an asyncio client of a
+    payment provider would be."""
+
+    __slots__ = ()
+
+    async def charge(self, sInvoice_code, sUser_id, sCurrency, iAmount):
+        """Awaitable 'StubProvider.charge'."""
+        await asyncio.sleep(self.fLatency)
+        with self._oLock:
+            self.iCharges += 1
+            bPaid = self._dDecided.get(sInvoice_code)
+            if bPaid is None:
+                if self._oRandom.random() < self.fFailure_rate:
+                    raise ProviderError("provider unavailable")
+                bPaid = self._oRandom.random() >= self.fReject_rate
+                self._dDecided[sInvoice_code] = bPaid
+            return bPaid
+
+#-------------------------------------------------------------------------------
+class Payment:
+    """A payment for one invoice, as handed to 'fnOn_outcome'."""
+
+    __slots__ = ("dInvoice", "sStatus", "sOutcome", "iAttempts",
+        "bEscalated")
+
+    def __init__(self, dInvoice):
+        self.dInvoice = dInvoice    # as stored by 'storage.save_invoice'
+        self.sStatus = PENDING      # as reported by 'status'
+        self.sOutcome = None        # the provider's answer, once known
+        self.iAttempts = 0
+        self.bEscalated = False     # failed 'iMax_attempts' charges
+
+#-------------------------------------------------------------------------------
+class SettlementQueue:
+    """Pending payments, settled by a pool of worker threads."""
+
+    __slots__ = ("oProvider", "fnOn_outcome", "fnOn_escalate",
+        "iMax_attempts", "fRetry_delay", "fCharge_timeout", "iRetries",
+        "iEscalated", "iTimeouts", "_oCondition", "_aDue", "_oSequence",
+        "_dPending", "_dFinished", "_bClosing", "_bStopping", "_aWorkers",
+        "_oLoop")
+
+    def __init__(self, oProvider, fnOn_outcome=None, iWorkers=WORKERS,
+            iMax_attempts=MAX_ATTEMPTS, fRetry_delay=RETRY_DELAY,
+            fnOn_escalate=None, fCharge_timeout=CHARGE_TIMEOUT):
+        """Starts the workers.
+
+        Parameters
+        ----------
+            oProvider (StubProvider, AsyncStubProvider, or alike)
+                Has 'charge(sInvoice_code, sUser_id, sCurrency, iAmount)',
+                a plain or a coroutine function. A plain one is also given
+                'fTimeout', and must raise once that many seconds pass.
+
+            fnOn_outcome (callable, none)
+                Called with the 'Payment' once its outcome ('sOutcome') is
+                known, from a worker thread. If it raises, it is called again
+                later.
+
+            iWorkers (integer)
+                Worker threads; the most charges in flight at once.
+
+            iMax_attempts (integer)
+                Charges attempted before a failing payment is escalated.
+
+            fRetry_delay (float)
+                Seconds before the first retry.
+
+            fnOn_escalate (callable, none)
+                Called with the 'Payment', from a worker thread, when it is
+                escalated. The payment stays pending and is still retried.
+
+            fCharge_timeout (float)
+                Seconds a charge may take before it counts as a provider
+                failure.
+        """
+        self.oProvider = oProvider
+        self.fnOn_outcome = fnOn_outcome
+        self.fnOn_escalate = fnOn_escalate
+        self.iMax_attempts = iMax_attempts
+        self.fRetry_delay = fRetry_delay
+        self.fCharge_timeout = fCharge_timeout
+        self.iRetries = 0
+        self.iEscalated = 0
+        self.iTimeouts = 0
+        self._oCondition = threading.Condition()
+        self._aDue = []                     # heap: (fDue, iSequence, oPayment)
+        self._oSequence = itertools.count()
+        self._dPending = {}
+        self._dFinished = collections.OrderedDict()
+        self._bClosing = False      # no more submissions; workers drain
+        self._bStopping = False     # workers stop, leaving what's left
+        self._oLoop = None
+        if inspect.iscoroutinefunction(oProvider.charge):
+            self._oLoop = asyncio.new_event_loop()
+            threading.Thread(target=self._oLoop.run_forever,
+                name="settlement-loop", daemon=True).start()
+        self._aWorkers = [threading.Thread(target=self._work_loop,
+            name="settlement-%d" % iWorker, daemon=True)
+            for iWorker in range(iWorkers)]
+        for oWorker in self._aWorkers:
+            oWorker.start()
+
+    #---------------------------------------------------------------------------
+    def submit(self, dInvoice):
+        """Queues the payment of an invoice ("sInvoice_code", "sUser_id",
+        "sCurrency", "iGoods" and "iShip", as for 'storage.save_invoice').
+        An invoice already pending is not queued twice.
+
+        Returns
+        -------
+            (boolean) False if the queue is closed; the payment is left
+            pending.
+        """
+        oPayment = Payment(dInvoice)
+        with self._oCondition:
+            if self._bClosing:
+                return False
+            if dInvoice["sInvoice_code"] in self._dPending:
+                return True
+            self._dPending[dInvoice["sInvoice_code"]] = oPayment
+            self._schedule(oPayment, 0.0)
+        return True
+
+    def status(self, sInvoice_code):
+        """(sUser_id, sStatus) of a payment known to the queue, or 'None'.
+        'sStatus' is "pending", "settled" or "rejected"."""
+        with self._oCondition:
+            oPayment = (self._dPending.get(sInvoice_code)
+                or self._dFinished.get(sInvoice_code))
+            if oPayment is None:
+                return None
+            return oPayment.dInvoice["sUser_id"], oPayment.sStatus
+
+    def escalated(self):
+        """Invoice codes of the pending payments which have been escalated:
+        the provider failed 'iMax_attempts' charges of each."""
+        with self._oCondition:
+            return [sInvoice_code for sInvoice_code, oPayment
+                in self._dPending.items() if oPayment.bEscalated]
+
+    def __len__(self):
+        """Number of payments pending."""
+        with self._oCondition:
+            return len(self._dPending)
+
+    def _schedule(self, oPayment, fDelay):
+        """Queues a payment to be worked on in 'fDelay' seconds. The caller
+        holds the condition."""
+        heapq.heappush(self._aDue, (time.monotonic() + fDelay,
+            next(self._oSequence), oPayment))
+        self._oCondition.notify()
+
+    #---------------------------------------------------------------------------
+    def _work_loop(self):
+        while True:
+            with self._oCondition:
+                while True:
+                    if self._bStopping:
+                        return
+                    if self._aDue:
+                        fWait = self._aDue[0][0] - time.monotonic()
+                        if fWait <= 0:
+                            _, _, oPayment = heapq.heappop(self._aDue)
+                            break
+                        self._oCondition.wait(fWait)
+                    else:
+                        self._oCondition.wait()
+            self._settle(oPayment)
+
+    def _settle(self, oPayment):
+        """Charges a payment and hands on its outcome, or schedules a
+        retry."""
+        dInvoice = oPayment.dInvoice
+        if oPayment.sOutcome is None:
+            oPayment.iAttempts += 1
+            try:
+                bPaid = self._charge(dInvoice)
+            except Exception:
+                # Ambiguous: never taken as a decline. Retried with the same
+                # invoice code until the provider answers.
+                if (oPayment.iAttempts >= self.iMax_attempts
+                        and not oPayment.bEscalated):
+                    self._escalate(oPayment)
+                self._retry(oPayment)
+                return
+            oPayment.sOutcome = SETTLED if bPaid else REJECTED
+        if self.fnOn_outcome is not None:
+            try:
+                self.fnOn_outcome(oPayment)
+            except Exception:
+                self._retry(oPayment)
+                return
+        with self._oCondition:
+            oPayment.sStatus = oPayment.sOutcome
+            sInvoice_code = dInvoice["sInvoice_code"]
+            del self._dPending[sInvoice_code]
+            self._dFinished[sInvoice_code] = oPayment
+            if len(self._dFinished) > OUTCOME_MEMORY:
+                self._dFinished.popitem(last=False)
+            self._oCondition.notify_all()
+
+    def _charge(self, dInvoice):
+        """Charges the provider, raising 'ChargeTimeout' if it takes longer
+        than 'fCharge_timeout' seconds."""
+        aArgs = (dInvoice["sInvoice_code"], dInvoice["sUser_id"],
+            dInvoice["sCurrency"], dInvoice["iGoods"] + dInvoice["iShip"])
+        try:
+            if self._oLoop is None:
+                return self.oProvider.charge(*aArgs,
+                    fTimeout=self.fCharge_timeout)
+            oFuture = asyncio.run_coroutine_threadsafe(
+                self.oProvider.charge(*aArgs), self._oLoop)
+            try:
+                return oFuture.result(self.fCharge_timeout)
+            except concurrent.futures.TimeoutError:
+                oFuture.cancel()
+                raise ChargeTimeout("charge timed out") from None
+        except ChargeTimeout:
+            with self._oCondition:
+                self.iTimeouts += 1
+            raise
+
+    def _escalate(self, oPayment):
+        with self._oCondition:
+            oPayment.bEscalated = True
+            self.iEscalated += 1
+        if self.fnOn_escalate is not None:
+            try:
+                self.fnOn_escalate(oPayment)
+            except Exception:
+                pass                # the payment is retried regardless
+
+    def _retry(self, oPayment):
+        with self._oCondition:
+            self.iRetries += 1
+            self._schedule(oPayment, min(MAX_DELAY, self.fRetry_delay
+                * 2 ** max(oPayment.iAttempts - 1, 0)))
+
+    #---------------------------------------------------------------------------
+    def flush(self, fTimeout=None):
+        """Waits until no payment is pending. Returns false if 'fTimeout'
+        seconds passed first."""
+        with self._oCondition:
+            return self._oCondition.wait_for(lambda: not self._dPending,
+                fTimeout)
+
+    def close(self, fTimeout=None):
+        """Stops taking payments, waits up to 'fTimeout' seconds for those
+        pending, and stops the workers. Payments still pending stay so (with
+        storage, they are submitted again after a restart). Idempotent."""
+        with self._oCondition:
+            self._bClosing = True
+            self._oCondition.wait_for(lambda: not self._dPending, fTimeout)
+            self._bStopping = True
+            self._oCondition.notify_all()
+        for oWorker in self._aWorkers:
+            oWorker.join()
+        if self._oLoop is not None:
+            self._oLoop.call_soon_threadsafe(self._oLoop.stop)
+
+#-------------------------------------------------------------------------------
+class PaymentRecords:
+    """Payment state of issued invoices, for a shop without storage.
+
+    The last OUTCOME_MEMORY finished invoices are remembered, and every
+    pending one. With a journal, each change is appended to a write-ahead
+    log ('wal.CheckoutLog') before it counts, and the log is read back on
+    start-up. The journal is compacted to what is remembered when it grows
+    past 'iJournal_bytes'.
+    """
+
+    __slots__ = ("iJournal_bytes", "_dInvoices", "_oJournal", "_oLock")
+
+    def __init__(self, sPath=None, iJournal_bytes=wal.CHECKPOINT_BYTES):
+        """Creates the records, reading the journal if there is one.
+
+        Parameters
+        ----------
+            sPath (string, none)
+                Journal file; created if missing. Without it, nothing
+                outlives the process.
+
+            iJournal_bytes (integer)
+                Journal size beyond which it is compacted.
+
+        Raises
+        ------
+            OSError: the journal can't be opened or compacted.
+        """
+        self.iJournal_bytes = iJournal_bytes
+        self._dInvoices = collections.OrderedDict()  # code -> record
+        self._oLock = threading.Lock()
+        self._oJournal = None
+        if sPath:
+            for dRecord in wal.read_records(sPath)[0]:
+                self._remember(dRecord)
+            self._oJournal = wal.CheckoutLog(sPath)
+            self._oJournal.rewrite(self._records)
+
+    def _remember(self, dRecord):
+        """Keeps a record: "sInvoice_code", "sUser_id", "sStatus", and the
+        invoice, "dInvoice", while it is pending. The caller holds the lock,
+        or is the constructor."""
+        sInvoice_code = dRecord["sInvoice_code"]
+        self._dInvoices.pop(sInvoice_code, None)
+        self._dInvoices[sInvoice_code] = dRecord
+        if len(self._dInvoices) > OUTCOME_MEMORY:
+            for sOldest, dOldest in self._dInvoices.items():
+                if dOldest["sStatus"] != PENDING:
+                    del self._dInvoices[sOldest]
+                    break
+
+    def _records(self):
+        with self._oLock:
+            return list(self._dInvoices.values())
+
+    def _journal(self, dRecord):
+        """Logs a change; compacts the journal if it has grown too large."""
+        if self._oJournal is None:
+            return
+        self._oJournal.append(dRecord)
+        if self._oJournal.size() > self.iJournal_bytes:
+            try:
+                self._oJournal.rewrite(self._records)
+            except OSError:
+                pass                # still whole; compacted next time
+
+    #---------------------------------------------------------------------------
+    def issue(self, dInvoice, sStatus):
+        """Records an invoice handed out by 'checkout_order', its payment
+        "pending" or "settled".
+
+        Raises
+        ------
+            wal.WalError: the journal couldn't be written; nothing is
+                recorded.
+        """
+        dRecord = {"sInvoice_code":dInvoice["sInvoice_code"],
+            "sUser_id":dInvoice["sUser_id"], "sStatus":sStatus}
+        if sStatus == PENDING:
+            dRecord["dInvoice"] = dInvoice
+        with self._oLock:
+            self._remember(dRecord)
+        try:
+            self._journal(dRecord)
+        except wal.WalError:
+            with self._oLock:
+                self._dInvoices.pop(dInvoice["sInvoice_code"], None)
+            raise
+
+    def settle(self, sInvoice_code, sStatus):
+        """Records the outcome, "settled" or "rejected", of a pending
+        payment.
+
+        Returns
+        -------
+            (boolean) True if the payment was pending; false if its outcome
+            was already recorded, or it is unknown.
+
+        Raises
+        ------
+            wal.WalError: the journal couldn't be written; nothing is
+                recorded.
+        """
+        with self._oLock:
+            dPending = self._dInvoices.get(sInvoice_code)
+            if dPending is None or dPending["sStatus"] != PENDING:
+                return False
+            dRecord = {"sInvoice_code":sInvoice_code,
+                "sUser_id":dPending["sUser_id"], "sStatus":sStatus}
+            # Remembered before it is logged, as 'issue' does, so that a
+            # compaction set off by this very change keeps it
+            self._remember(dRecord)
+        try:
+            self._journal(dRecord)
+        except wal.WalError:
+            with self._oLock:
+                self._remember(dPending)    # pending again, to be retried
+            raise
+        return True
+
+    def status(self, sInvoice_code):
+        """(sUser_id, sStatus) of a remembered invoice, or 'None'."""
+        with self._oLock:
+            dRecord = self._dInvoices.get(sInvoice_code)
+        if dRecord is None:
+            return None
+        return dRecord["sUser_id"], dRecord["sStatus"]
+
+    def pending(self):
+        """The invoices whose payment is pending, oldest first."""
+        with self._oLock:
+            return [dRecord["dInvoice"] for dRecord
+                in self._dInvoices.values() if dRecord["sStatus"] == PENDING]
+
+    def close(self):
+        """Closes the journal. Idempotent."""
+        if self._oJournal is not None:
+            self._oJournal.close()
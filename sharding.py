@@ -0,0 +1,354 @@
+""" # Sharded catalogue search
+-----
+A single process answering 'list_products' for a large catalogue is bound by
+one CPU core. In sharded mode the catalogue is split by the hash of
+'sItem_id' into 'iShards' partitions, each served by its own worker process:
+
+    - 'ShardedCatalogue.publish' writes one snapshot file per shard (see
+      'snapshot'); each worker maps its own and picks up new ones.
+    - A query is scattered to every shard at once. A shard filters its own
+      products and answers with its hit count, its facet counts and its first
+      'iIdx + iMax_res' hits in the requested order.
+    - The coordinator gathers the answers, sums the hit and facet counts, and
+      merges the sorted hit lists, keeping hits 'iIdx' to
+      'iIdx + iMax_res - 1'. Paging ('iIdx', 'iIdx_n' and the continuation
+      cursor) therefore behaves exactly as with one catalogue.
+
+Deep pages cost more, as every shard returns all hits up to the end of the
+page; continuation cursors avoid that, since each shard then starts right
+after the cursor.
+
+A shard process which has died is replaced before the next query is
+scattered: a new process is spawned on the same snapshot file, and its
+answers count as a newer generation.
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent import futures
+
+import catalogue
+import facets
+import snapshot
+
+# Seconds the shards, together, may take to answer a query
+TIMEOUT = 10.0
+
+#-------------------------------------------------------------------------------
+def shard_of(sItem_id, iShards):
+    """Shard holding a product. Stable across processes and runs."""
+    return zlib.crc32(sItem_id.encode("utf-8")) % iShards
+
+#-------------------------------------------------------------------------------
+def _order_key(sOrder, dItem):
+    """Merge key of an output item for a sort order."""
+    if sOrder == "sItem_id":
+        return (dItem["sItem_id"],)
+    if sOrder == "fPrice_asc":
+        return (dItem["fPrice"], dItem["sItem_id"])
+    return (-dItem["fPrice"], dItem["sItem_id"])
+
+#-------------------------------------------------------------------------------
+def answer(oListing, dQuery, iLimit, tAfter):
+    """A shard's part of a query.
+
+    Returns
+    -------
+        (tuple) (iSearch_tot, aItems, dFacets): the shard's hit count, its
+        first 'iLimit' hits (after 'tAfter') as output dictionaries in the
+        requested order, and its facet counts (or 'None').
+    """
+    sItem_filter = dQuery["sItem_filter"]
+    dFacets = None
+    if facets.is_plain(dQuery):
+        oIndex = oListing.oIndex
+        iSearch_tot = oIndex.count(sItem_filter)
+        aIds = oIndex.search(sItem_filter, iLimit=iLimit,
+            sAfter=None if tAfter is None else tAfter[1])
+        aRows = [oListing.row_of(sItem_id) for sItem_id in aIds]
+    else:
+        dResult = facets.select(oListing, dQuery, 0, iLimit, tAfter)
+        iSearch_tot = dResult["iSearch_tot"]
+        aRows = dResult["aRows"]
+        dFacets = dResult["dFacets"]
+    return iSearch_tot, [oListing.materialise(iRow) for iRow in aRows], dFacets
+
+#-------------------------------------------------------------------------------
+def _serve(oConnection, sPath, iGeneration=0):
+    """Main loop of a shard process. Each answer carries the number of
+    snapshot swaps the shard has seen, from 'iGeneration' on, its snapshot
+    generation."""
+    aGeneration = [iGeneration]
+    def on_swap(oSnapshot):
+        aGeneration[0] += 1
+    oWatcher = snapshot.SnapshotWatcher(sPath, fnOn_swap=on_swap)
+    while True:
+        try:
+            tRequest = oConnection.recv()
+        except EOFError:
+            return
+        if tRequest is None:
+            return
+        iRequest, dQuery, iLimit, tAfter = tRequest
+        try:
+            oListing = oWatcher.current()
+            xResult = answer(oListing, dQuery, iLimit, tAfter)
+            oConnection.send((iRequest, True, (aGeneration[0], xResult)))
+        except Exception as e:
+            oConnection.send((iRequest, False, repr(e)))
+
+#-------------------------------------------------------------------------------
+class _Shard:
+    """Coordinator's handle on one shard process.
+
+    Requests are sent as they come; a receiver thread hands each answer to
+    the future waiting for it, so several queries can be in flight at once.
+    Once the pipe breaks, every future waiting and every later request fails
+    with ConnectionError.
+    """
+
+    __slots__ = ("oProcess", "_oConnection", "_oSend_lock", "_dPending",
+        "_oPending_lock", "_bBroken", "_oReceiver")
+
+    def __init__(self, oContext, sPath, iGeneration=0):
+        self._oConnection, oChild = oContext.Pipe()
+        self.oProcess = oContext.Process(target=_serve,
+            args=(oChild, sPath, iGeneration), name="shop-shard", daemon=True)
+        self.oProcess.start()
+        oChild.close()
+        self._oSend_lock = threading.Lock()
+        self._dPending = {}     # request number -> Future
+        self._oPending_lock = threading.Lock()
+        self._bBroken = False   # the receiver has stopped
+        self._oReceiver = threading.Thread(target=self._receive,
+            name="shop-shard-receiver", daemon=True)
+        self._oReceiver.start()
+
+    def alive(self):
+        """False once the process has died or its pipe has broken."""
+        return self.oProcess.is_alive() and self._oReceiver.is_alive()
+
+    def submit(self, iRequest, dQuery, iLimit, tAfter):
+        oFuture = futures.Future()
+        with self._oPending_lock:
+            if self._bBroken:
+                oFuture.set_exception(ConnectionError("shard stopped"))
+                return oFuture
+            self._dPending[iRequest] = oFuture
+        try:
+            with self._oSend_lock:
+                self._oConnection.send((iRequest, dQuery, iLimit, tAfter))
+        except (OSError, ValueError) as e:
+            self.forget(iRequest)
+            oFuture.set_exception(ConnectionError("shard unavailable: %s" % e))
+        return oFuture
+
+    def forget(self, iRequest):
+        """Stops waiting for the answer to a request (which timed out)."""
+        with self._oPending_lock:
+            self._dPending.pop(iRequest, None)
+
+    def _receive(self):
+        while True:
+            try:
+                iRequest, bOk, xResult = self._oConnection.recv()
+            except (EOFError, OSError):
+                break
+            with self._oPending_lock:
+                oFuture = self._dPending.pop(iRequest, None)
+            if oFuture is None:
+                continue
+            if bOk:
+                oFuture.set_result(xResult)
+            else:
+                oFuture.set_exception(RuntimeError(xResult))
+        with self._oPending_lock:
+            self._bBroken = True
+            aFutures = list(self._dPending.values())
+            self._dPending.clear()
+        for oFuture in aFutures:
+            oFuture.set_exception(ConnectionError("shard stopped"))
+
+    def stop(self):
+        with self._oSend_lock:
+            try:
+                self._oConnection.send(None)
+            except (OSError, ValueError):
+                pass
+        self.oProcess.join(5)
+        if self.oProcess.is_alive():
+            self.oProcess.terminate()
+        self._oConnection.close()
+
+#-------------------------------------------------------------------------------
+class ShardedCatalogue:
+    """Coordinator of a pool of shard processes.
+
+    'tGeneration' holds the newest snapshot generation of every shard seen in
+    an answer. It changes once shards have switched to newly published
+    snapshots, and 'fnOn_swap' is then called with it.
+    """
+
+    __slots__ = ("iShards", "sDirectory", "fTimeout", "fnOn_swap",
+        "tGeneration", "iRespawns", "_oContext", "_aShards", "_oRequests",
+        "_oLock")
+
+    def __init__(self, iShards, sDirectory, fTimeout=TIMEOUT, fnOn_swap=None):
+        """Sets up the coordinator; 'start' launches the shard processes.
+
+        Parameters
+        ----------
+            iShards (integer)
+                Number of partitions, one process each.
+
+            sDirectory (string)
+                Directory holding the shard snapshot files.
+
+            fTimeout (float)
+                Seconds to wait for all shards to answer.
+
+            fnOn_swap (callable, none)
+                Called with the new 'tGeneration' when it changes.
+        """
+        self.iShards = iShards
+        self.sDirectory = sDirectory
+        self.fTimeout = fTimeout
+        self.fnOn_swap = fnOn_swap
+        self.tGeneration = (0,) * iShards
+        self.iRespawns = 0
+        self._oContext = multiprocessing.get_context("spawn")
+        self._aShards = []
+        self._oRequests = itertools.count()
+        self._oLock = threading.Lock()
+
+    def path_of(self, iShard):
+        """Snapshot file of a shard."""
+        return os.path.join(self.sDirectory,
+            "shard-%d-of-%d.snap" % (iShard, self.iShards))
+
+    def publish(self, oCatalogue):
+        """Splits a catalogue into shards and publishes their snapshots.
+
+        Running shards switch to the new snapshots within a second.
+        """
+        aParts = [catalogue.Catalogue() for _ in range(self.iShards)]
+        for iRow, sItem_id in enumerate(oCatalogue.aItem_id):
+            if sItem_id is None or not oCatalogue.aLive[iRow]:
+                continue
+            dProduct = oCatalogue.materialise(iRow)
+            dProduct["sCategory"] = oCatalogue.oCategory[iRow]
+            aParts[shard_of(sItem_id, self.iShards)].add(dProduct)
+        os.makedirs(self.sDirectory, exist_ok=True)
+        for iShard, oPart in enumerate(aParts):
+            snapshot.write_snapshot(oPart, self.path_of(iShard))
+
+    def start(self):
+        """Launches one process per shard. The snapshots must exist."""
+        self._aShards = [_Shard(self._oContext, self.path_of(iShard))
+            for iShard in range(self.iShards)]
+
+    def stop(self):
+        """Stops the shard processes."""
+        with self._oLock:
+            aShards, self._aShards = self._aShards, []
+        for oShard in aShards:
+            oShard.stop()
+
+    def _respawn(self):
+        """Replaces the shard processes which have died. A new process starts
+        one generation above the last one seen from its shard, so its answers
+        replace whatever was cached from the old one."""
+        with self._oLock:
+            aShards = list(self._aShards)
+            for iShard, oShard in enumerate(aShards):
+                if oShard.alive():
+                    continue
+                oShard.stop()
+                aShards[iShard] = _Shard(self._oContext, self.path_of(iShard),
+                    self.tGeneration[iShard] + 1)
+                self.iRespawns += 1
+            self._aShards = aShards
+            return aShards
+
+    #---------------------------------------------------------------------------
+    def query(self, dQuery, iIdx, iMax_res, tAfter=None):
+        """Runs a 'list_products' query across all shards.
+
+        Parameters
+        ----------
+            dQuery (dictionary)
+                Query made by 'facets.normalise_query'.
+
+            iIdx (integer)
+                Number of hits to skip. Ignored if 'tAfter' is given.
+
+            iMax_res (integer)
+                Maximum number of hits to return.
+
+            tAfter (tuple, none)
+                (sort key, sItem_id) of the last item of the previous page.
+
+        Returns
+        -------
+            (dictionary) "iSearch_tot" (integer), "aItems" (list of output
+            dictionaries, in order), "dFacets" (dictionary, none) and
+            "tGeneration" (tuple): the snapshot generations answered from.
+
+        Raises
+        ------
+            ConnectionError: a shard is unavailable.
+            TimeoutError: a shard didn't answer in time.
+            RuntimeError: a shard failed to answer.
+        """
+        aShards = self._aShards
+        if not all(oShard.alive() for oShard in aShards):
+            aShards = self._respawn()
+        if not aShards:
+            raise ConnectionError("shards not started")
+        if tAfter is not None:
+            iIdx = 0
+        iLimit = iIdx + iMax_res
+        iRequest = next(self._oRequests)
+        aFutures = [oShard.submit(iRequest, dQuery, iLimit, tAfter)
+            for oShard in aShards]
+        # One deadline for all the shards, not 'fTimeout' for each in turn
+        _, setLate = futures.wait(aFutures, self.fTimeout)
+        if setLate:
+            for oShard in aShards:
+                oShard.forget(iRequest)
+            raise TimeoutError("shard timed out")
+        aAnswers = [oFuture.result() for oFuture in aFutures]
+        tGeneration = tuple(iGeneration for iGeneration, _ in aAnswers)
+        aAnswers = [tAnswer for _, tAnswer in aAnswers]
+        self._seen(tGeneration)
+
+        iSearch_tot = sum(tAnswer[0] for tAnswer in aAnswers)
+        sOrder = dQuery["sSort"]
+        aMerged = heapq.merge(*(tAnswer[1] for tAnswer in aAnswers),
+            key=lambda dItem: _order_key(sOrder, dItem))
+        aItems = list(itertools.islice(aMerged, iIdx, iLimit))
+        dFacets = None
+        if dQuery["bFacets"]:
+            dFacets = {}
+            for _, _, dShard_facets in aAnswers:
+                for sKey, dCounts in dShard_facets.items():
+                    dTotal = dFacets.setdefault(sKey, {})
+                    for sValue, iCount in dCounts.items():
+                        dTotal[sValue] = dTotal.get(sValue, 0) + iCount
+        return {"iSearch_tot":iSearch_tot, "aItems":aItems, "dFacets":dFacets,
+            "tGeneration":tGeneration}
+
+    def _seen(self, tGeneration):
+        """Records the generations of an answer, if newer."""
+        with self._oLock:
+            tCurrent = tuple(max(iOld, iNew) for iOld, iNew
+                in zip(self.tGeneration, tGeneration))
+            if tCurrent == self.tGeneration:
+                return
+            self.tGeneration = tCurrent
+        if self.fnOn_swap is not None:
+            self.fnOn_swap(tCurrent)
@@ -3,7 +3,7 @@
 """ # Recruitment task for Ulam Labs (Wrocław, Poland) prepared by Grzegorz Wochlik
     wochlik.gm@gmail.com
 -----
-Dummy program concentrating on design and documentation of the API end points.
+The API end points of an online shop, with their design and documentation.
 
 I ran into some irony. I was trying to get a professional look to the
 documentation, rather than the cut-and-paste text file output. I looked for some
@@ -31,6 +31,409 @@ As you can clearly see, I also have a passion for writing. Well, here I am
 {}* = Idiom in english
 """
 
+import atexit
+import os
+import time
+
+import baskets
+import cache
+import catalogue
+import currency
+import cursor
+import encoding
+import facets
+import importer
+import invoices
+import metrics
+import money
+import reservations
+import rules
+import search
+import settlement
+import sharding
+import snapshot
+import storage
+import tokencache
+import tokens
+import wal
+
+#-------------------------------------------------------------------------------
+# Product catalogue, stored column by column. It owns the keyword index over
+# the 'sDesc' field.
+_oCatalogue = catalogue.Catalogue()
+
+# Finished 'list_products' outputs, dropped as the catalogue changes.
+_oList_cache = cache.ResultCache()
+_oCatalogue.add_listener(_oList_cache.on_change)
+
+# Read-only catalogue snapshot which 'list_products' serves from in worker
+# processes (see 'use_snapshot'); 'None' to serve from '_oCatalogue'.
+_oSnapshots = None
+
+# Latency histograms and outcome counts of the API functions, which are
+# wrapped at the end of this module.
+_oMetrics = metrics.Metrics()
+
+# Pool of shard processes which 'list_products' scatters queries to (see
+# 'use_shards'); 'None' to answer in this process.
+_oShards = None
+
+# Signed authentication tokens and basket codes, verified through caches. The
+# baskets themselves are kept in the basket store. Reserved stock is taken
+# out of 'iStock' while it sits in a basket, and handed back by the basket
+# sweeper when the basket expires.
+_oTokens = tokens.TokenCodec(tokens.load_key())
+_oAuth_cache = tokencache.VerifiedTokenCache(
+    lambda sToken: _oTokens.verify(tokens.KIND_AUTH, sToken), "token expired")
+_oBasket_cache = tokencache.VerifiedTokenCache(
+    lambda sToken: _oTokens.verify(tokens.KIND_BASKET, sToken), "token expired")
+_oReservations = reservations.ReservationEngine(_oCatalogue)
+_oBaskets = baskets.BasketStore(fnOn_expire=_oReservations.release_all)
+
+# Exchange rates for invoicing, from the file named by SHOP_RATES_FILE (by
+# default 'rates.json' next to this module).
+RATES_FILE = os.environ.get("SHOP_RATES_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "rates.json"))
+_oRates = currency.RateBook(currency.load_rates(RATES_FILE))
+
+# Business rules for 'update_order', from the file named by SHOP_RULES_FILE
+# (by default 'rules.json' next to this module). Customers whose
+# authentication doesn't name a region are treated as being in
+# DEFAULT_REGION.
+RULES_FILE = os.environ.get("SHOP_RULES_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json"))
+DEFAULT_REGION = "PL"
+_oRules = rules.RulesEngine(_oCatalogue.attributes,
+    rules.load_rules(RULES_FILE))
+_oCatalogue.add_listener(_oRules.on_change)
+
+# Optional persistent storage: an SQLite database at the path named by
+# SHOP_DB. Without it the shop runs from memory only. Stored products are
+# loaded into the catalogue at start-up.
+STORAGE_PATH = os.environ.get("SHOP_DB")
+_oStorage = storage.SQLiteStorage(STORAGE_PATH) if STORAGE_PATH else None
+
+# Optional checkout log (see 'wal'), with storage only: with SHOP_CHECKOUT_LOG
+# naming a file, an invoice is durable once group-committed to the log, and
+# reaches the storage shortly after, in batches. Invoices logged before a
+# restart are applied first, so the stock loaded below accounts for them. On
+# a clean exit the log is closed once what it holds has been applied.
+CHECKOUT_LOG_PATH = os.environ.get("SHOP_CHECKOUT_LOG")
+_oCheckout_log = None
+if _oStorage is not None and CHECKOUT_LOG_PATH:
+    _oCheckout_log = wal.CheckoutLog(CHECKOUT_LOG_PATH,
+        _oStorage.save_invoices)
+    atexit.register(_oCheckout_log.close)
+
+if _oStorage is not None:
+    for _dProduct in _oStorage.load_products():
+        _oCatalogue.add(_dProduct)
+
+# Invoice numbers, handed to each thread in blocks (see 'invoices'): from a
+# counter kept by the storage, carrying on from the last stored invoice, or
+# from memory. On a clean exit, unused numbers are handed back.
+_sLast_invoice = None if _oStorage is None else _oStorage.last_invoice_code()
+_iFirst_invoice = (1 if _sLast_invoice is None
+    else invoices.number_of(_sLast_invoice) + 1)
+_oInvoice_numbers = invoices.InvoiceNumbers(
+    invoices.MemorySource(_iFirst_invoice) if _oStorage is None
+    else invoices.StorageSource(_oStorage, "invoice", _iFirst_invoice))
+atexit.register(_oInvoice_numbers.close)
+
+# Payments settled in the background (see 'use_settlement'); 'None' to take
+# a checkout as paid. On exit, pending payments get SETTLEMENT_DRAIN seconds
+# to finish.
+_oSettlement = None
+SETTLEMENT_DRAIN = 5.0
+
+# Without storage, the payment state of the invoices handed out is kept by
+# '_oPayments', for 'checkout_status'. With SHOP_SETTLEMENT_LOG naming a file,
+# it is journaled there and outlives a restart: pending payments are then
+# submitted again by 'use_settlement'.
+SETTLEMENT_LOG_PATH = os.environ.get("SHOP_SETTLEMENT_LOG")
+_oPayments = None
+if _oStorage is None:
+    _oPayments = settlement.PaymentRecords(SETTLEMENT_LOG_PATH)
+    atexit.register(_oPayments.close)
+
+# Delivery fee in the home currency of the rate file (a business rule).
+SHIP_COST = 40.00
+
+#-------------------------------------------------------------------------------
+def _error(sErr_desc):
+    """Builds the common error response."""
+    return {"sStatus":"ERROR", "sErr_desc":sErr_desc}
+
+#-------------------------------------------------------------------------------
+def _is_int(xValue, iMin):
+    """True for a genuine integer (not a boolean) of at least 'iMin'."""
+    return (isinstance(xValue, int) and not isinstance(xValue, bool)
+        and xValue >= iMin)
+
+#-------------------------------------------------------------------------------
+def add_product(dProduct):
+    """Adds a product to the catalogue, or replaces the existing entry.
+
+    The keyword index is updated incrementally; only the tokens of this
+    product's description are touched.
+
+    'iStock' is the stock on hand. Units of the product held in open baskets
+    are not for sale, so they are deducted from it.
+
+    Parameters
+    ----------
+        dProduct (dictionary)
+            Product with the same keys as 'dOutput["aItems"][n]' of
+            'list_products'.
+
+    Raises
+    ------
+        ValueError: the product fails the 'data validation' rules.
+        storage.StorageError: the product couldn't be stored.
+    """
+    catalogue.validate_product(dProduct)
+    if _oStorage is not None:
+        _oStorage.put_products([dProduct])
+    _oReservations.put_product(dProduct)
+
+#-------------------------------------------------------------------------------
+def remove_product(sItem_id):
+    """Withdraws a product from the catalogue and the keyword index.
+
+    Raises
+    ------
+        storage.StorageError: the product couldn't be deleted from storage.
+    """
+    if _oStorage is not None:
+        _oStorage.delete_product(sItem_id)
+    _oReservations.withdraw(sItem_id)
+
+#-------------------------------------------------------------------------------
+def import_products(sPath, bReplace=False):
+    """Loads a supplier feed (CSV or JSON lines) into the catalogue.
+
+    The feed is streamed in batches, so memory use doesn't grow with its size
+    and 'list_products' keeps serving during the import. Records failing the
+    'data validation' rules are skipped and reported. See 'importer'.
+
+    Parameters
+    ----------
+        sPath (string)
+            Feed file: ".csv", ".jsonl" or ".ndjson", optionally gzipped
+            (".gz").
+
+        bReplace (boolean)
+            If true the feed is the complete catalogue and products missing
+            from it are withdrawn.
+
+    Returns
+    -------
+        (dictionary) Counts of records read, imported, rejected and removed,
+        and the first rejections with their line numbers.
+    """
+    return importer.import_feed(sPath, _oCatalogue, _oStorage, bReplace,
+        oReservations=_oReservations)
+
+#-------------------------------------------------------------------------------
+def publish_snapshot(sPath):
+    """Writes the catalogue to a snapshot file for 'list_products' workers.
+
+    The file is replaced atomically; workers watching it (see 'use_snapshot')
+    switch to it within their check interval.
+    """
+    snapshot.write_snapshot(_oCatalogue, sPath)
+
+#-------------------------------------------------------------------------------
+def use_snapshot(sPath, fInterval=1.0):
+    """Makes 'list_products' serve from a published snapshot file.
+
+    For worker processes which only list products: the snapshot is mapped
+    read-only, so start-up is immediate and the pages are shared with every
+    other worker. The file is checked for a newer snapshot at most every
+    'fInterval' seconds.
+
+    Raises
+    ------
+        OSError: the file can't be opened.
+        ValueError: the file isn't a catalogue snapshot.
+    """
+    global _oSnapshots
+    _oSnapshots = snapshot.SnapshotWatcher(sPath, fInterval,
+        lambda oSnapshot: _oList_cache.clear())
+    _oList_cache.clear()
+
+#-------------------------------------------------------------------------------
+def use_shards(iShards, sDirectory):
+    """Makes 'list_products' answer through 'iShards' shard processes.
+
+    The catalogue is split by 'sItem_id' hash and published to one snapshot
+    file per shard in 'sDirectory' (see 'sharding'); 'publish_shards' brings
+    the shards up to date afterwards. Called with 'iShards' of 0, stops the
+    shard processes and answers in this process again.
+
+    The shards answer keyword and attribute queries in 'sItem_id' order,
+    with the live stock and price of this process written into their items.
+    Queries filtering on stock or price, or sorting by price, are answered
+    here, as the shards' copies of those columns are only as recent as the
+    last publication. A shard process which dies is respawned, and a query
+    the shards can't answer is answered here.
+
+    Shard processes are spawned afresh and import the main module, so a
+    server script calling this must guard its start-up with
+    'if __name__ == "__main__":'.
+
+    Raises
+    ------
+        OSError: the snapshots can't be written.
+    """
+    global _oShards
+    oShards, _oShards = _oShards, None
+    if oShards is not None:
+        oShards.stop()
+    if iShards > 0:
+        oShards = sharding.ShardedCatalogue(iShards, sDirectory,
+            fnOn_swap=lambda tGeneration: _oList_cache.clear())
+        oShards.publish(_oCatalogue)
+        oShards.start()
+        _oShards = oShards
+    _oList_cache.clear()
+
+#-------------------------------------------------------------------------------
+def publish_shards():
+    """Publishes the catalogue to the shards started by 'use_shards'. They
+    switch to it within a second."""
+    if _oShards is not None:
+        _oShards.publish(_oCatalogue)
+
+#-------------------------------------------------------------------------------
+def use_settlement(oProvider=None, iWorkers=settlement.WORKERS):
+    """Makes 'checkout_order' hand out pending invoices, and settles their
+    payments in the background.
+
+    'iWorkers' threads charge 'oProvider' (by default a local
+    'settlement.StubProvider'), retrying failures; 'checkout_status' gives
+    the outcome. A payment the provider keeps failing is never taken as
+    rejected: it stays pending, is escalated ('_oSettlement.escalated') and
+    retried until the provider answers. Payments left pending by an earlier
+    run are submitted again: from storage, or without it from the journal
+    named by SHOP_SETTLEMENT_LOG. Called with 'iWorkers' of 0, stops
+    settling after waiting for the pending payments (up to SETTLEMENT_DRAIN
+    seconds), and checkouts are taken as paid again.
+
+    Raises
+    ------
+        storage.StorageError: the pending payments couldn't be loaded.
+    """
+    global _oSettlement
+    oSettlement, _oSettlement = _oSettlement, None
+    if oSettlement is not None:
+        oSettlement.close(SETTLEMENT_DRAIN)
+    if iWorkers > 0:
+        aPending = (_oPayments.pending() if _oStorage is None
+            else _oStorage.pending_payments())
+        oSettlement = settlement.SettlementQueue(
+            oProvider or settlement.StubProvider(), _on_payment, iWorkers)
+        atexit.register(oSettlement.close, SETTLEMENT_DRAIN)
+        for dInvoice in aPending:
+            oSettlement.submit(dInvoice)
+        _oSettlement = oSettlement
+
+#-------------------------------------------------------------------------------
+def _on_payment(oPayment):
+    """Records the outcome of a payment; a rejected order's units go back on
+    sale. Called by the settlement workers, which retry it if it raises."""
+    dInvoice = oPayment.dInvoice
+    bPaid = oPayment.sOutcome == settlement.SETTLED
+    if _oStorage is not None:
+        if not _oStorage.settle_payment(dInvoice["sInvoice_code"], bPaid):
+            if _oStorage.payment_status(dInvoice["sInvoice_code"]) is None:
+                # Still in the checkout log, on its way to the storage.
+                raise storage.StorageError("invoice not stored yet")
+            return                          # recorded already
+    elif not _oPayments.settle(dInvoice["sInvoice_code"], oPayment.sOutcome):
+        return                              # recorded already
+    if not bPaid:
+        _oReservations.restock(dInvoice["aLines"])
+
+#-------------------------------------------------------------------------------
+def metrics_snapshot():
+    """Latency percentiles and outcome counts of every API function called so
+    far; see 'metrics.Metrics.snapshot'."""
+    return _oMetrics.snapshot()
+
+#-------------------------------------------------------------------------------
+def metrics_text():
+    """'metrics_snapshot' in the Prometheus text format, for a scrape
+    endpoint."""
+    return _oMetrics.prometheus()
+
+#-------------------------------------------------------------------------------
+def encode_response(dOutput):
+    """The 'dOutput' of any API function as compact UTF-8 JSON, for the HTTP
+    layer. 'list_products' items are spliced in from JSON encoded when the
+    product was loaded, rather than encoded again, and a cached page is
+    encoded only once (see 'encoding')."""
+    return encoding.encode(dOutput)
+
+#-------------------------------------------------------------------------------
+def _listing():
+    """The catalogue 'list_products' reads: the newest snapshot if one is in
+    use, otherwise the live catalogue."""
+    return _oCatalogue if _oSnapshots is None else _oSnapshots.current()
+
+#-------------------------------------------------------------------------------
+def issue_auth_token(sUser_id, sRegion=DEFAULT_REGION):
+    """Issues an 'sAuth_token' to a customer who has just authenticated.
+
+    Called by the authentication service; the token is then passed to
+    'create_order' and 'checkout_order'. It expires after
+    'tokens.TOKEN_LIFETIME' seconds. 'sRegion' (an ISO-3166 country code)
+    selects the business rules which apply to the customer.
+    """
+    return _oTokens.issue(tokens.KIND_AUTH,
+        {"sUser_id":sUser_id, "sRegion":sRegion},
+        time.time() + tokens.TOKEN_LIFETIME)
+
+#-------------------------------------------------------------------------------
+def _find_basket(sBasket_code):
+    """Verifies a basket code and finds its open basket.
+
+    Returns
+    -------
+        (tuple) (oBasket, sErr_desc). On failure the basket is 'None' and the
+        description is "invalid basket" or "basket expired".
+    """
+    sErr_desc, dClaims = _oBasket_cache.verify(sBasket_code)
+    if sErr_desc is not None:
+        return None, ("basket expired" if sErr_desc == "token expired"
+            else "invalid basket")
+    return _oBaskets.lookup(dClaims["sBasket_id"])
+
+#-------------------------------------------------------------------------------
+def _check_line(oBasket, sItem_id, iQty):
+    """Business rules for putting an item into a basket.
+
+    Returns
+    -------
+        (tuple) (sErr_desc, iLimit). The error description is 'None' if the
+        line may be reserved, otherwise an 'update_order' error description.
+        'iLimit' is the most units of the item the basket may hold, or
+        'None'. Unknown items pass, and are then reported as "item does not
+        exist" by the reservation.
+    """
+    sErr_desc, iLimit = _oRules.check(oBasket.sRegion, sItem_id)
+    if sErr_desc is not None:
+        return sErr_desc, None
+    try:
+        sCurrency = _oCatalogue.line_details(sItem_id)[1]
+    except KeyError:
+        return None, None
+    if sCurrency not in _oRates.current():
+        return "invalid currency", None
+    if iLimit is not None and iQty > iLimit:
+        return "maximum quantity exceeded", None
+    return None, iLimit
+
 #-------------------------------------------------------------------------------
 def list_products(dBriefcase):
     """Returns information about items available for purchase in the shop.
@@ -39,6 +442,9 @@ def list_products(dBriefcase):
     parameters provided. A structure is then returned. Note that error handling
     is incoperated into the response.
 
+    Popular searches are answered from a result cache, so the returned
+    dictionary may be shared between callers and must not be modified.
+
     Parameters
     ----------
         dBriefcase (dictionary)
@@ -57,10 +463,44 @@ def list_products(dBriefcase):
 
             dBriefcase["sItem_filter"] (string, none)
                 (string) datatype:
-                    Keyword for searching the 'description' fields of products
+                    Keyword for searching the 'description' fields of products.
+                    Several keywords may be separated by spaces; a product is
+                    listed only if its description contains all of them. The
+                    search is not case sensitive.
                 (none) datatype:
                     Show all products.
 
+            dBriefcase["sCursor"] (string, none) - optional
+                Continuation cursor, as returned in 'dOutput["sCursor_n"]' by
+                the previous call with the same filter. When given, the batch
+                starts straight after the last item of the previous batch and
+                'iIdx' is ignored. Paging with the cursor costs the same for
+                every batch, and isn't thrown off by stock changes between
+                calls. Missing or 'None' means 'use iIdx'.
+
+            dBriefcase["sBrand"], dBriefcase["sColour"], dBriefcase["sSize"],
+            dBriefcase["sCurrency"] (string, list of strings, none) - optional
+                Only list products with this brand / colour / size / currency.
+                A list accepts any of the values given. Missing or 'None'
+                means no restriction.
+
+            dBriefcase["fPrice_min"], dBriefcase["fPrice_max"] (float, none)
+            - optional
+                Inclusive price range, in each product's own 'sCurrency'.
+
+            dBriefcase["bIn_stock"] (boolean) - optional
+                'True' hides products with 'iStock' of 0. Default 'False'.
+
+            dBriefcase["sSort"] (string, none) - optional
+                Order of the results:
+                    "sItem_id" (default): by item identifier
+                    "fPrice_asc": cheapest first
+                    "fPrice_desc": most expensive first
+                Items with the same price are listed by item identifier.
+
+            dBriefcase["bFacets"] (boolean) - optional
+                'True' requests the 'dFacets' counts in the output.
+
     Returns - Valid data
     -------
     A dictionary is returned containing key-value pairs. However, the structure
@@ -82,6 +522,14 @@ def list_products(dBriefcase):
         dOutput["iSearch_tot"] (integer)
             Total number of items in the search
 
+        dOutput["sCursor_n"] (string, none)
+            Opaque cursor to pass as 'dBriefcase["sCursor"]' to fetch the next
+            batch. 'None' when this batch reached the end of the search.
+
+        dOutput["dFacets"] (dictionary) - only if 'dBriefcase["bFacets"]'
+            Number of items in the search per brand and per colour, for
+            example {"sBrand":{"Levi's":12, "Wrangler":3}, "sColour":{...}}.
+
         dOutput["aItems"] (list of dictionaries)
             Information about items requested. Each item in the list has the
             following structure. The 'n' (integer) in the structure indexes the
@@ -219,8 +667,145 @@ def list_products(dBriefcase):
     }
     """
 
-    pass
-    # TODO: Add code here.
+    try:
+        iIdx = dBriefcase["iIdx"]
+        iMax_res = dBriefcase["iMax_res"]
+        sItem_filter = dBriefcase["sItem_filter"]
+        sCursor = dBriefcase.get("sCursor")
+        dQuery = facets.normalise_query(dBriefcase)
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return _error("data validation")
+    if not _is_int(iIdx, 0) or not _is_int(iMax_res, 1):
+        return _error("data validation")
+
+    tAfter = None
+    if sCursor is not None:
+        try:
+            sOrder, xSort_key, sAfter, iLast = cursor.decode_cursor(sCursor)
+        except ValueError:
+            return _error("data validation")
+        if sOrder != dQuery["sSort"]:
+            return _error("data validation")
+        tAfter = (xSort_key, sAfter)
+        iIdx = iLast + 1
+
+    # Stock and prices change between publications of the shard snapshots, so
+    # queries which filter or sort on them are answered here.
+    aFields = []
+    if dQuery["bIn_stock"]:
+        aFields.append("bIn_stock")
+    if (dQuery["sSort"] != "sItem_id" or dQuery["fPrice_min"] is not None
+            or dQuery["fPrice_max"] is not None):
+        aFields.append("fPrice")
+    oShards = None if aFields else _oShards
+    xSource = _listing() if oShards is None else oShards.tGeneration
+    tKey = (
+        xSource,
+        " ".join(sorted(search.tokenise(sItem_filter))),
+        tuple(sorted(dQuery["dEqual"].items())),
+        dQuery["fPrice_min"], dQuery["fPrice_max"], dQuery["bIn_stock"],
+        dQuery["sSort"], dQuery["bFacets"], iIdx, iMax_res, tAfter
+    )
+    dOutput = _oList_cache.get(tKey)
+    if dOutput is None:
+        iToken = _oList_cache.token()
+        if oShards is None:
+            dOutput = _list_products(xSource, dQuery, iIdx, iMax_res, tAfter)
+            bCurrent = True
+        else:
+            dOutput, tGeneration = _list_sharded(oShards, dQuery, iIdx,
+                iMax_res, tAfter)
+            bCurrent = tGeneration == xSource
+        if bCurrent and dOutput.get("sErr_desc") in (None, "item not found"):
+            _oList_cache.put(tKey, dOutput, [dItem["sItem_id"]
+                for dItem in dOutput.get("aItems", ())], aFields, iToken)
+    return dOutput
+
+#-------------------------------------------------------------------------------
+def _list_products(oListing, dQuery, iIdx, iMax_res, tAfter):
+    """Runs a validated 'list_products' query against a catalogue (or a
+    snapshot)."""
+    sItem_filter = dQuery["sItem_filter"]
+    try:
+        dFacets = None
+        if facets.is_plain(dQuery):
+            oIndex = oListing.oIndex
+            iSearch_tot = oIndex.count(sItem_filter)
+            if tAfter is None:
+                aIds = oIndex.search(sItem_filter, iIdx, iMax_res)
+            else:
+                aIds = oIndex.search(sItem_filter, iLimit=iMax_res,
+                    sAfter=tAfter[1])
+            aRows = [oListing.row_of(sItem_id) for sItem_id in aIds]
+        else:
+            dResult = facets.select(oListing, dQuery, iIdx, iMax_res, tAfter)
+            iSearch_tot = dResult["iSearch_tot"]
+            aRows = dResult["aRows"]
+            dFacets = dResult["dFacets"]
+        if not aRows:
+            return _error("item not found")
+        aItems = [oListing.product(iRow) for iRow in aRows]
+    except Exception:
+        return _error("internal error")
+
+    sOrder = dQuery["sSort"]
+    return _page(sOrder, iIdx, iSearch_tot, aItems,
+        facets.sort_key(oListing, sOrder, aRows[-1]), dFacets)
+
+#-------------------------------------------------------------------------------
+def _list_sharded(oShards, dQuery, iIdx, iMax_res, tAfter):
+    """Runs a validated 'list_products' query across the shard processes.
+    Returns the output and the shard snapshot generations it came from.
+
+    The items carry the live stock and price of this process's catalogue.
+    Should a shard be unavailable, the query is answered in this process
+    instead, with no generation (so the output isn't cached).
+    """
+    try:
+        dResult = oShards.query(dQuery, iIdx, iMax_res, tAfter)
+    except (ConnectionError, TimeoutError):
+        return _list_products(_listing(), dQuery, iIdx, iMax_res,
+            tAfter), None
+    except Exception:
+        return _error("internal error"), None
+    aItems = dResult["aItems"]
+    if not aItems:
+        return _error("item not found"), dResult["tGeneration"]
+    oListing = _listing()
+    for dItem in aItems:
+        try:
+            iRow = oListing.row_of(dItem["sItem_id"])
+        except KeyError:
+            dItem["iStock"] = 0         # removed since the shards' snapshot
+            continue
+        dItem["iStock"] = oListing.aStock[iRow]
+        dItem["fPrice"] = oListing.aPrice[iRow]
+    sOrder = dQuery["sSort"]
+    dLast = aItems[-1]
+    xSort_key = dLast["sItem_id"] if sOrder == "sItem_id" else dLast["fPrice"]
+    return (_page(sOrder, iIdx, dResult["iSearch_tot"], aItems, xSort_key,
+        dResult["dFacets"]), dResult["tGeneration"])
+
+#-------------------------------------------------------------------------------
+def _page(sOrder, iIdx, iSearch_tot, aItems, xSort_key, dFacets):
+    """Builds the 'list_products' output for a page of hits starting at
+    'iIdx', with the continuation cursor after its last item."""
+    iIdx_n = iIdx + len(aItems) - 1
+    sCursor_n = None
+    if iIdx_n + 1 < iSearch_tot:
+        sCursor_n = cursor.encode_cursor(sOrder, xSort_key,
+            aItems[-1]["sItem_id"], iIdx_n)
+    dOutput = encoding.Page({
+        "sStatus":"OK",
+        "iIdx_n":iIdx_n,
+        "iSearch_tot":iSearch_tot,
+        "sCursor_n":sCursor_n,
+        "aItems":aItems
+    })
+    if dFacets is not None:
+        dOutput["dFacets"] = dFacets
+    return dOutput
+
 #-------------------------------------------------------------------------------
 def create_order(sAuth_token):
     """Indicates the intention for the customer to make purchaces.
@@ -306,8 +891,19 @@ def create_order(sAuth_token):
     {"sStatus":"Error", "sErr_desc":"invalid token"}
 
     """
-    pass
-    # TODO: Add code here.
+    try:
+        sErr_desc, dClaims = _oAuth_cache.verify(sAuth_token)
+    except Exception:
+        return _error("unable to validate token")
+    if sErr_desc is not None:
+        return _error(sErr_desc)
+    _oBaskets.start_sweeper()
+    oBasket = _oBaskets.open(sAuth_token, dClaims["sRegion"])
+    sBasket_code = _oTokens.issue(tokens.KIND_BASKET, {
+        "sUser_id":dClaims["sUser_id"],
+        "sBasket_id":oBasket.sBasket_id
+    }, dClaims["fExpiry"])
+    return {"sStatus":"OK", "sBasket_code":sBasket_code}
 #-------------------------------------------------------------------------------
 def update_order(dBriefcase):
     """ Requests the selected item to be reserved for purchasing.
@@ -367,6 +963,7 @@ def update_order(dBriefcase):
 
             "invalid currency": Business rules may say that a Polish customer
                 is not allowed to purchase items quoted in, lets say "USD".
+                Also returned for a currency the shop has no exchange rate for.
 
             "maximum quantity exceeded": Some items have limits on how much one
                 customer may purchase. Going over that limit will trigger this
@@ -407,8 +1004,129 @@ def update_order(dBriefcase):
     >>> print(dOutput)
     {"sStatus":"ERROR", "sErr_desc":"invalid currency"}
     """
-    pass
-    # TODO: Add code here.
+    try:
+        sBasket_code = dBriefcase["sBasket_code"]
+        sItem_id = dBriefcase["sItem_id"]
+        iQty = dBriefcase["iQty"]
+    except (KeyError, TypeError):
+        return _error("data validation")
+    if not isinstance(sItem_id, str) or not _is_int(iQty, 1):
+        return _error("data validation")
+
+    oBasket, sErr_desc = _find_basket(sBasket_code)
+    if sErr_desc is None:
+        _oBaskets.touch(oBasket)
+        sErr_desc, iLimit = _check_line(oBasket, sItem_id, iQty)
+    if sErr_desc is None:
+        sErr_desc = _oReservations.reserve(oBasket, sItem_id, iQty, iLimit)
+    if sErr_desc is not None:
+        return _error(sErr_desc)
+    return {"sStatus":"OK"}
+#-------------------------------------------------------------------------------
+def update_order_batch(dBriefcase):
+    """Reserves several items for purchasing in one request.
+
+    Same as calling 'update_order' once per line, but the basket is validated
+    only once and the stock for all lines is reserved in a single locked pass.
+    Useful for restoring a saved basket. Each line succeeds or fails on its
+    own.
+
+    Parameters:
+    ----------
+        dBriefcase (dictionary)
+        This is a container transporting other parameters. It contains the
+        following keys:
+
+            dBriefcase["sBasket_code"] (string)
+                One-time cryptographic token used to identify the correct
+                'basket'.
+
+            dBriefcase["aLines"] (list of dictionaries)
+                Items being purchased. Each line has the keys "sItem_id"
+                (string) and "iQty" (integer), as for 'update_order'.
+
+    Returns - Valid data
+    -------
+    dOutput (dictionary)
+
+        dOutput["sStatus"] = "OK"
+            The basket was found. It doesn't mean every line succeeded.
+
+        dOutput["aLines"] (list of dictionaries)
+            One entry per input line, in the same order:
+
+            dOutput["aLines"][n]["sItem_id"] (string)
+                Item identifier from the input line.
+
+            dOutput["aLines"][n]["sStatus"] (string)
+                "OK" if the stock was reserved, otherwise "ERROR".
+
+            dOutput["aLines"][n]["sErr_desc"] (string) - only for "ERROR"
+                One of the 'update_order' error descriptions, for example
+                "item sold out" or "partial order".
+
+    Returns - Error output:
+    -------
+    dOutput (dictionary)
+
+        dOutput["sStatus"] = "ERROR"
+
+        dOutput["sErr_desc"] (string)
+
+            "data validation": the briefcase or the list of lines is
+                malformed.
+
+            "invalid basket", "basket expired": as for 'update_order'.
+
+    Example of correct use
+    ------
+    >>> dBriefcase = {
+        "sBasket_code": "sA13Qeqx",
+        "aLines": [
+            {"sItem_id": "I-00002", "iQty": 3},     # Flag
+            {"sItem_id": "I-00001", "iQty": 2}      # Unicorn
+        ]
+    }
+    >>> dOutput = update_order_batch(dBriefcase)
+    >>> print(dOutput)
+    {
+        "sStatus":"OK",
+        "aLines":[
+            {"sItem_id":"I-00002", "sStatus":"OK"},
+            {"sItem_id":"I-00001", "sStatus":"ERROR",
+                "sErr_desc":"partial order"}
+        ]
+    }
+    """
+    try:
+        sBasket_code = dBriefcase["sBasket_code"]
+        aLines = [(dLine["sItem_id"], dLine["iQty"])
+            for dLine in dBriefcase["aLines"]]
+    except (KeyError, TypeError):
+        return _error("data validation")
+
+    oBasket, sErr_desc = _find_basket(sBasket_code)
+    if sErr_desc is not None:
+        return _error(sErr_desc)
+    _oBaskets.touch(oBasket)
+
+    aChecks = [_check_line(oBasket, sItem_id, iQty)
+        if isinstance(sItem_id, str) and _is_int(iQty, 1)
+        else ("data validation", None) for sItem_id, iQty in aLines]
+    aValid = [(sItem_id, iQty, iLimit)
+        for (sItem_id, iQty), (sErr_desc, iLimit) in zip(aLines, aChecks)
+        if sErr_desc is None]
+    aReserved = iter(_oReservations.reserve_many(oBasket, aValid))
+    aOut = []
+    for (sItem_id, _), (sErr_desc, _) in zip(aLines, aChecks):
+        if sErr_desc is None:
+            sErr_desc = next(aReserved)
+        if sErr_desc is None:
+            aOut.append({"sItem_id":sItem_id, "sStatus":"OK"})
+        else:
+            aOut.append({"sItem_id":sItem_id, "sStatus":"ERROR",
+                "sErr_desc":sErr_desc})
+    return {"sStatus":"OK", "aLines":aOut}
 #-------------------------------------------------------------------------------
 def delete_order(dBriefcase):
     """Requests a return of item from customer's basket prior to payment.
@@ -473,6 +1191,8 @@ def delete_order(dBriefcase):
             "invalid item code": Trying to return a product which is not in the
                 customer's basket.
 
+            "data validation": Syntax error in the input
+
     Raises (exceptions)
     ------
     To be determined
@@ -505,9 +1225,25 @@ def delete_order(dBriefcase):
     >>> print(dOutput)
     {"sStatus":"ERROR", "sErr_desc":"invalid item code"}
     """
-
-    pass
-    # TODO: Add code here.
+    try:
+        sBasket_code = dBriefcase["sBasket_code"]
+        sItem_id = dBriefcase["sItem_id"]
+        iQty = dBriefcase["iQty"]
+    except (KeyError, TypeError):
+        return _error("data validation")
+    if (not isinstance(sItem_id, str) or not isinstance(iQty, int)
+            or isinstance(iQty, bool)):
+        return _error("data validation")
+    if iQty < 1:
+        return _error("quantity too low")
+
+    oBasket, sErr_desc = _find_basket(sBasket_code)
+    if sErr_desc is None:
+        _oBaskets.touch(oBasket)
+        sErr_desc = _oReservations.release(oBasket, sItem_id, iQty)
+    if sErr_desc is not None:
+        return _error(sErr_desc)
+    return {"sStatus":"OK"}
 
 #-------------------------------------------------------------------------------
 def checkout_order(dBriefcase):
@@ -516,6 +1252,10 @@ def checkout_order(dBriefcase):
     The basket is 'sealed' and no more changes are allowed after this command.
     Destroys the 'sBasket_code', but creates a human-readable invoice code.
 
+    Checking out the same basket again, say because the response was lost,
+    doesn't place a second order: it returns the output of the first
+    checkout, with the same invoice code.
+
     Parameters:
     ----------
         dBriefcase (dictionary)
@@ -546,6 +1286,9 @@ def checkout_order(dBriefcase):
         dOutput["sInv_Currency"] (string)
             ISO-4217 code ("PLN", "USD", "XBT", ect) of the invoice. This is
             the currency of the invoice. All financial amounts use these units.
+            It is the currency of the items when they all share one, and the
+            shop's home currency otherwise. Amounts are converted with one
+            snapshot of the exchange rates.
 
         dOutput["fShip_cost"] (float)
             Amount charged for delivery of goods.
@@ -557,6 +1300,11 @@ def checkout_order(dBriefcase):
             Invoice reference number. This will be needed by the customer to
             validate collection.
 
+        dOutput["sPayment"] = "pending"
+            Only when payments are settled in the background (see
+            'use_settlement'): the payment has not been taken yet.
+            'checkout_status' tells when it has, or that it was rejected.
+
     Returns - Error output:
     -------
     A dictionary is returned, which has one common key with the 'Valid data'
@@ -592,11 +1340,15 @@ def checkout_order(dBriefcase):
             "invalid basket token": token returned does not match internal data.
                 Transaction is completely rejected.
 
+            "empty basket": There is nothing in the basket to check out. The
+                basket stays open; items can still be added to it.
+
             "unable to generate invoice": Technical problems with the financial
                 side of the site. Additional expiry time will be given.
 
             "payment rejected": Customer was unable to settle the invoice. The
-                transaction is completely rejected.
+                transaction is completely rejected. When payments are settled
+                in the background, this comes from 'checkout_status' instead.
 
     Example of correct use
     ------
@@ -631,15 +1383,217 @@ def checkout_order(dBriefcase):
     {"sStatus":"ERROR", "sErr_desc":"invalid basket token"}
 
     """
-    pass
+    try:
+        sBasket_code = dBriefcase["sBasket_code"]
+        sAuth_token = dBriefcase["sAuth_token"]
+    except (KeyError, TypeError):
+        return _error("invalid basket token")
+
+    try:
+        sErr_desc, dAuth = _oAuth_cache.verify(sAuth_token)
+    except Exception:
+        return _error("unable to validate auth token")
+    if sErr_desc is not None:
+        return _error("auth token expired" if sErr_desc == "token expired"
+            else "invalid auth token")
+    try:
+        sErr_desc, dClaims = _oBasket_cache.verify(sBasket_code)
+    except Exception:
+        return _error("unable to validate basket token")
+    if sErr_desc is not None:
+        return _error("basket token expired" if sErr_desc == "token expired"
+            else "invalid basket token")
+    if dClaims["sUser_id"] != dAuth["sUser_id"]:
+        return _error("invalid basket token")
+    dReceipt = _oBaskets.receipt(dClaims["sBasket_id"])
+    if dReceipt is not None:
+        return dict(dReceipt)
+    oBasket, sErr_desc = _oBaskets.lookup(dClaims["sBasket_id"])
+    if sErr_desc is not None:
+        dReceipt = _oBaskets.receipt(dClaims["sBasket_id"])
+        if dReceipt is not None:
+            return dict(dReceipt)
+        return _error("basket token expired" if sErr_desc == "basket expired"
+            else "invalid basket token")
+
+    # One snapshot of the rates for the whole checkout.
+    oRates = _oRates.current()
+    oSettlement = _oSettlement
+    with oBasket.oLock:
+        if oBasket.bSealed:
+            # Checked out by a concurrent call, or expired meanwhile.
+            dReceipt = _oBaskets.receipt(oBasket.sBasket_id)
+            if dReceipt is not None:
+                return dict(dReceipt)
+            return _error("invalid basket token")
+        if not oBasket.dLines:
+            return _error("empty basket")
+        try:
+            if len(oBasket.dTotals) == 1:
+                sCurrency, = oBasket.dTotals
+            else:
+                sCurrency = oRates.sBase
+            iGoods = oRates.convert_totals(oBasket.dTotals, sCurrency)
+            iShip = oRates.convert(money.to_minor(SHIP_COST, oRates.sBase),
+                oRates.sBase, sCurrency)
+        except (KeyError, ValueError):
+            _oBaskets.extend(oBasket, baskets.CHECKOUT_GRACE)
+            return _error("unable to generate invoice")
+        try:
+            sInvoice_code = _oInvoice_numbers.next_code()
+        except storage.StorageError:
+            _oBaskets.extend(oBasket, baskets.CHECKOUT_GRACE)
+            return _error("unable to generate invoice")
+        dInvoice = {
+            "sInvoice_code":sInvoice_code,
+            "sUser_id":dAuth["sUser_id"],
+            "sCurrency":sCurrency,
+            "iGoods":iGoods,
+            "iShip":iShip,
+            "fCreated":time.time(),
+            "aLines":[(sItem_id, iQty) + oBasket.dDetails[sItem_id][:2]
+                for sItem_id, iQty in oBasket.dLines.items()]
+        }
+        if oSettlement is not None:
+            dInvoice["sPayment"] = settlement.PENDING
+        if _oStorage is not None:
+            try:
+                if _oCheckout_log is not None:
+                    _oCheckout_log.append(dInvoice)
+                else:
+                    _oStorage.save_invoice(dInvoice)
+            except (storage.StorageError, wal.WalError):
+                _oBaskets.extend(oBasket, baskets.CHECKOUT_GRACE)
+                return _error("unable to generate invoice")
+        else:
+            try:
+                _oPayments.issue(dInvoice, dInvoice.get("sPayment",
+                    settlement.SETTLED))
+            except wal.WalError:
+                _oBaskets.extend(oBasket, baskets.CHECKOUT_GRACE)
+                return _error("unable to generate invoice")
+        dOutput = {
+            "sStatus":"OK",
+            "sInv_Currency":sCurrency,
+            "fShip_cost":money.to_float(iShip, sCurrency),
+            "fGoods_cost":money.to_float(iGoods, sCurrency),
+            "sInvoice_code":sInvoice_code
+        }
+        if oSettlement is not None:
+            dOutput["sPayment"] = settlement.PENDING
+        _oBaskets.close(oBasket, dOutput)
+        _oReservations.sold(oBasket)
+    _oBasket_cache.forget(sBasket_code)
+    if oSettlement is not None:
+        oSettlement.submit(dInvoice)
+    return dict(dOutput)
 
 #-------------------------------------------------------------------------------
-def list_orders(sBasket_code):
+def checkout_status(dBriefcase):
+    """Tells whether the payment of a checked-out basket went through.
+
+    With background settlement (see 'use_settlement'), 'checkout_order'
+    returns before the customer has been charged; this gives the outcome.
+
+    Parameters:
+    ----------
+        dBriefcase (dictionary)
+        This is a container transporting other parameters. It contains the
+        following keys:
+
+            dBriefcase["sInvoice_code"] (string)
+                Invoice code returned by 'checkout_order'.
+
+            dBriefcase["sAuth_token"] (string)
+                Authentication of the customer who checked out.
+
+    Returns - Valid data:
+    --------
+    dOutput (dictionary)
+
+        dOutput["sStatus"] = "OK"
+            Flag to indicate that the request was successful.
+
+        dOutput["sInvoice_code"] (string)
+            The invoice asked about.
+
+        dOutput["sPayment"] (string)
+            "pending": the payment is still being settled; ask again later.
+            "settled": the customer has paid; the order stands.
+
+    Returns - Error output:
+    -------
+    dOutput (dictionary)
+
+        dOutput["sStatus"] = "ERROR"
+            The string "ERROR" is populated to flag the condition.
+
+        dOutput["sErr_desc"] (string)
+            Brief description of error
+
+            "unable to validate auth token", "auth token expired",
+            "invalid auth token": as for 'checkout_order'.
+
+            "invalid invoice code": no such invoice for this customer. Without
+                storage, only recent invoices are remembered.
+
+            "unable to check payment": technical issue with the storage.
+
+            "payment rejected": Customer was unable to settle the invoice. The
+                transaction is completely rejected and the items are back on
+                sale.
+
+    Example of correct use
+    ------
+    >>> dOutput = checkout_status({"sInvoice_code":"Z-000012",
+        "sAuth_token":"8zQ74sSawCfWza05"})
+    >>> print(dOutput)
+    {"sStatus":"OK", "sInvoice_code":"Z-000012", "sPayment":"settled"}
+
+    """
+    try:
+        sInvoice_code = dBriefcase["sInvoice_code"]
+        sAuth_token = dBriefcase["sAuth_token"]
+    except (KeyError, TypeError):
+        return _error("invalid invoice code")
+    if not isinstance(sInvoice_code, str):
+        return _error("invalid invoice code")
+
+    try:
+        sErr_desc, dAuth = _oAuth_cache.verify(sAuth_token)
+    except Exception:
+        return _error("unable to validate auth token")
+    if sErr_desc is not None:
+        return _error("auth token expired" if sErr_desc == "token expired"
+            else "invalid auth token")
+
+    oSettlement = _oSettlement
+    tStatus = None if oSettlement is None else oSettlement.status(sInvoice_code)
+    if tStatus is None and _oStorage is not None:
+        try:
+            tStatus = _oStorage.payment_status(sInvoice_code)
+        except storage.StorageError:
+            return _error("unable to check payment")
+    if tStatus is None and _oPayments is not None:
+        tStatus = _oPayments.status(sInvoice_code)
+    if tStatus is None or tStatus[0] != dAuth["sUser_id"]:
+        return _error("invalid invoice code")
+    if tStatus[1] == settlement.REJECTED:
+        return _error("payment rejected")
+    return {"sStatus":"OK", "sInvoice_code":sInvoice_code,
+        "sPayment":tStatus[1]}
+
+#-------------------------------------------------------------------------------
+def list_orders(sBasket_code, iVersion=None):
     """Gives customer access to the items in their 'basket'.
 
     Returns a structure which includes all the items which the customer intends
     to purchase. This is the net result of 'update_order' and 'delete_order'
 
+    Every change to the basket gives it a new version number. A frontend
+    which keeps the basket it was last shown can pass that 'iVersion' back,
+    and is sent only what changed since, or nothing at all.
+
     Parameters
     -------
     sBasket_code (string)
@@ -653,6 +1607,12 @@ def list_orders(sBasket_code):
             # English is good. Alternative descriptions will assist in a better
             # understanding of the concept.
 
+    iVersion (integer, optional)
+
+        'dOutput["iVersion"]' of an earlier call for the same basket. Without
+        it (or with a version the basket never had) the whole basket is
+        returned.
+
     Returns - Valid data:
     -------
     A dictionary is returned containing key-value pairs. However, the structure
@@ -669,6 +1629,22 @@ def list_orders(sBasket_code):
             The string "OK" is returned under the "sStatus" key, to indicate
             that non-error data is available.
 
+        dOutput["sStatus"] = "NOT MODIFIED"
+            Only when 'iVersion' was given: the basket is unchanged since that
+            version. No other keys but "iVersion" are returned.
+
+        dOutput["iVersion"] (integer)
+            Version of the basket returned; pass it to the next call.
+
+        dOutput["bDelta"] (boolean)
+            True when 'iVersion' was given and only the lines changed since
+            that version are returned: "aItems" holds the lines added or
+            changed, "aRemoved" the identifiers of the lines removed. False
+            when "aItems" is the whole basket.
+
+        dOutput["aRemoved"] (list of strings) - only if "bDelta" is true
+            Items no longer in the basket.
+
         dOutput["aItems"] (list of dictionaries)
             Lists items reserved for purchace. Each item in the list has the
             following structure. The 'n' (integer) in the structure indexes the
@@ -695,7 +1671,8 @@ def list_orders(sBasket_code):
                 the currency of the customer's region.
 
             dOutput["aItems"][n]["fUnit_price"] (float)
-                Price of the single item in the "sCurrency"
+                Price of the single item in the "sCurrency", as it was when
+                the item first went into the basket.
 
             dOutput["aItems"][n]["fTotal_price"] (float)
                 Price for all the copies of the item.
@@ -732,6 +1709,8 @@ def list_orders(sBasket_code):
     >>> print(dOutput)
     {
         "sStatus":"OK",
+        "iVersion":4,
+        "bDelta":false,
         "aItems":[
             {
                 "sItem_id":"I-00002",
@@ -749,6 +1728,28 @@ def list_orders(sBasket_code):
         ]
     }
 
+    Only what changed, after one more unit of the flag went into the basket:
+
+    >>> dOutput = list_orders("sA13Qeqx", 4)
+    >>> print(dOutput)
+    {
+        "sStatus":"OK",
+        "iVersion":5,
+        "bDelta":true,
+        "aRemoved":[],
+        "aItems":[
+            {
+                "sItem_id":"I-00002",
+                "iQty":4,
+                ...
+                "fTotal_price":"59.96"
+            }
+        ]
+    }
+    >>> dOutput = list_orders("sA13Qeqx", 5)
+    >>> print(dOutput)
+    {"sStatus":"NOT MODIFIED", "iVersion":5}
+
     Example of error response
     -------
     >>> dOutput = list_orders("5A13Qeqx")
@@ -756,8 +1757,60 @@ def list_orders(sBasket_code):
     {"sStatus":"Error", "sErr_desc":"invalid token"}
 
     """
-    pass
-    # TODO: Add code here.
+    try:
+        sErr_desc, dClaims = _oBasket_cache.verify(sBasket_code)
+    except Exception:
+        return _error("unable to validate token")
+    if sErr_desc is not None:
+        return _error(sErr_desc)
+    oBasket, sErr_desc = _oBaskets.lookup(dClaims["sBasket_id"])
+    if sErr_desc is not None:
+        return _error("token expired" if sErr_desc == "basket expired"
+            else "invalid token")
+
+    if not _is_int(iVersion, 0):
+        iVersion = None
+    with oBasket.oLock:
+        iCurrent = oBasket.iVersion
+        if iVersion == iCurrent:
+            return {"sStatus":"NOT MODIFIED", "iVersion":iCurrent}
+        if iVersion is None or iVersion > iCurrent:
+            return {"sStatus":"OK", "iVersion":iCurrent, "bDelta":False,
+                "aItems":[_order_line(oBasket, sItem_id, iQty)
+                for sItem_id, iQty in oBasket.dLines.items()]}
+        aItems = []
+        aRemoved = []
+        for sItem_id in oBasket.changed_since(iVersion):
+            iQty = oBasket.dLines.get(sItem_id)
+            if iQty is None:
+                aRemoved.append(sItem_id)
+            else:
+                aItems.append(_order_line(oBasket, sItem_id, iQty))
+    return {"sStatus":"OK", "iVersion":iCurrent, "bDelta":True,
+        "aRemoved":aRemoved, "aItems":aItems}
+
+#-------------------------------------------------------------------------------
+def _order_line(oBasket, sItem_id, iQty):
+    """One 'list_orders' item. The caller holds the basket lock."""
+    iUnit, sCurrency, sDesc, sSize, sColour = oBasket.dDetails[sItem_id]
+    return {
+        "sItem_id":sItem_id,
+        "iQty":iQty,
+        "sDesc":sDesc,
+        "sSize":sSize,
+        "sColour":sColour,
+        "sItem_currency":sCurrency,
+        "fUnit_price":money.to_float(iUnit, sCurrency),
+        "fTotal_price":money.to_float(iUnit * iQty, sCurrency)
+    }
+
 #-------------------------------------------------------------------------------
-print("This is a dummy program concentrating on the input / output of each " +
-"function.")
+# Every API call is timed and its outcome counted (see 'metrics').
+list_products = _oMetrics.instrument(list_products)
+create_order = _oMetrics.instrument(create_order)
+update_order = _oMetrics.instrument(update_order)
+update_order_batch = _oMetrics.instrument(update_order_batch)
+delete_order = _oMetrics.instrument(delete_order)
+checkout_order = _oMetrics.instrument(checkout_order)
+checkout_status = _oMetrics.instrument(checkout_status)
+list_orders = _oMetrics.instrument(list_orders)
@@ -0,0 +1,220 @@
+""" # Asyncio API of the shop
+-----
+'async def' counterparts of the API functions in 'shop', for event-loop based
+web servers. Each takes the same briefcase (or code) and returns the same
+'dOutput' as its synchronous twin.
+
+The shop's work may block: on locks shared with other requests, on the
+database and on the payment provider. So the event loop never runs it
+directly. Each call is handed to a bounded pool of worker threads
+('run_blocking') and awaited, and the loop keeps serving other shoppers in
+the meantime. The backends have awaitable forms of their own:
+
+    - 'AsyncStorage' wraps a 'storage.Storage'. Its calls run on a pool of
+      their own, as large as the backend's connection pool, so a slow
+      database never holds up the API's workers beyond that.
+    - A payment provider whose 'charge' is a coroutine function (see
+      'settlement.AsyncStubProvider') is awaited on the settlement queue's
+      event loop (see 'shop.use_settlement').
+
+A call which only reads, or whose effect is harmless to repeat, has a time
+limit (the keyword argument 'fTimeout'). If it doesn't finish in time, it is
+answered with the error its synchronous twin uses for technical failures:
+
+    list_products                       "connection error"
+    create_order, list_orders           "unable to validate token"
+    checkout_status                     "unable to check payment"
+
+An abandoned 'create_order' leaves an empty basket behind, which expires.
+
+The calls which change a basket ('update_order', 'update_order_batch',
+'delete_order', 'checkout_order') have no time limit. Abandoned, they would
+still run to completion in their worker thread: the shopper, told the call
+failed, would retry it, and an order line would be reserved twice. So they
+are awaited until they are done, and answered only with the errors their
+synchronous twins document. Should the awaiting task itself be cancelled,
+the call still completes; 'list_orders' shows its outcome, and checking the
+same basket out again returns its invoice.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import shop
+import storage
+
+# Worker threads serving the event loop
+WORKERS = 64
+
+# Seconds a call may take before it is answered with an error
+TIMEOUT = 10.0
+
+_oExecutor = ThreadPoolExecutor(max_workers=WORKERS,
+    thread_name_prefix="shop-async")
+
+_oStorage = None        # 'AsyncStorage' of the shop's backend, once asked for
+
+#-------------------------------------------------------------------------------
+async def run_blocking(fnCall, *aArgs, fTimeout=TIMEOUT,
+        oExecutor=_oExecutor):
+    """Runs a blocking call on a pool of worker threads and awaits its result.
+
+    Parameters
+    ----------
+        fTimeout (float, none)
+            Seconds to wait; 'None' waits until the call is done.
+
+        oExecutor (concurrent.futures.Executor)
+            Pool running the call; the API's own by default.
+
+    Raises
+    ------
+        asyncio.TimeoutError: the call took longer than 'fTimeout' seconds.
+    """
+    oLoop = asyncio.get_running_loop()
+    oFuture = oLoop.run_in_executor(oExecutor,
+        functools.partial(fnCall, *aArgs))
+    if fTimeout is None:
+        return await oFuture
+    return await asyncio.wait_for(oFuture, fTimeout)
+
+#-------------------------------------------------------------------------------
+async def _call(fnCall, aArgs, sTimeout_err, fTimeout):
+    try:
+        return await run_blocking(fnCall, *aArgs, fTimeout=fTimeout)
+    except asyncio.TimeoutError:
+        return shop._error(sTimeout_err)
+
+#-------------------------------------------------------------------------------
+async def _complete(fnCall, aArgs):
+    """Runs a call which changes a basket; never abandoned (see above)."""
+    return await asyncio.shield(run_blocking(fnCall, *aArgs, fTimeout=None))
+
+#-------------------------------------------------------------------------------
+class AsyncStorage:
+    """Awaitable form of a 'storage.Storage': the same methods, as
+    coroutines, raising the same 'storage.StorageError'."""
+
+    __slots__ = ("oStorage", "_oExecutor")
+
+    def __init__(self, oStorage, iWorkers=storage.POOL_SIZE):
+        """Wraps a backend.
+
+        Parameters
+        ----------
+            oStorage (storage.Storage)
+                Backend doing the work.
+
+            iWorkers (integer)
+                Threads running its calls; its connection pool size.
+        """
+        self.oStorage = oStorage
+        self._oExecutor = ThreadPoolExecutor(max_workers=iWorkers,
+            thread_name_prefix="shop-storage")
+
+    async def _run(self, fnCall, *aArgs):
+        return await run_blocking(fnCall, *aArgs, fTimeout=None,
+            oExecutor=self._oExecutor)
+
+    #---------------------------------------------------------------------------
+    async def load_products(self):
+        """List of every stored product, as 'add_product' records."""
+        return await self._run(lambda: list(self.oStorage.load_products()))
+
+    async def put_products(self, aProducts):
+        return await self._run(self.oStorage.put_products, aProducts)
+
+    async def delete_product(self, sItem_id):
+        return await self._run(self.oStorage.delete_product, sItem_id)
+
+    async def save_invoice(self, dInvoice):
+        return await self._run(self.oStorage.save_invoice, dInvoice)
+
+    async def save_invoices(self, aInvoices):
+        return await self._run(self.oStorage.save_invoices, aInvoices)
+
+    async def get_invoice(self, sInvoice_code):
+        return await self._run(self.oStorage.get_invoice, sInvoice_code)
+
+    async def settle_payment(self, sInvoice_code, bPaid):
+        return await self._run(self.oStorage.settle_payment, sInvoice_code,
+            bPaid)
+
+    async def pending_payments(self):
+        return await self._run(self.oStorage.pending_payments)
+
+    async def payment_status(self, sInvoice_code):
+        return await self._run(self.oStorage.payment_status, sInvoice_code)
+
+    async def last_invoice_code(self):
+        return await self._run(self.oStorage.last_invoice_code)
+
+    async def allocate_numbers(self, sName, iCount, iFloor=1):
+        return await self._run(self.oStorage.allocate_numbers, sName, iCount,
+            iFloor)
+
+    async def release_numbers(self, sName, iFrom, iTo):
+        return await self._run(self.oStorage.release_numbers, sName, iFrom,
+            iTo)
+
+    async def close(self):
+        """Closes the backend, then the pool."""
+        await self._run(self.oStorage.close)
+        self._oExecutor.shutdown(wait=False)
+
+#-------------------------------------------------------------------------------
+def shop_storage():
+    """The shop's storage backend (set by SHOP_DB, see 'shop') as an
+    'AsyncStorage', or 'None' when the shop has none."""
+    global _oStorage
+    if shop._oStorage is None:
+        return None
+    if _oStorage is None or _oStorage.oStorage is not shop._oStorage:
+        _oStorage = AsyncStorage(shop._oStorage)
+    return _oStorage
+
+#-------------------------------------------------------------------------------
+async def list_products(dBriefcase, *, fTimeout=TIMEOUT):
+    """Awaitable 'shop.list_products'."""
+    return await _call(shop.list_products, (dBriefcase,), "connection error",
+        fTimeout)
+
+#-------------------------------------------------------------------------------
+async def create_order(sAuth_token, *, fTimeout=TIMEOUT):
+    """Awaitable 'shop.create_order'."""
+    return await _call(shop.create_order, (sAuth_token,),
+        "unable to validate token", fTimeout)
+
+#-------------------------------------------------------------------------------
+async def update_order(dBriefcase):
+    """Awaitable 'shop.update_order'; never abandoned (see above)."""
+    return await _complete(shop.update_order, (dBriefcase,))
+
+#-------------------------------------------------------------------------------
+async def update_order_batch(dBriefcase):
+    """Awaitable 'shop.update_order_batch'; never abandoned (see
+    above)."""
+    return await _complete(shop.update_order_batch, (dBriefcase,))
+
+#-------------------------------------------------------------------------------
+async def delete_order(dBriefcase):
+    """Awaitable 'shop.delete_order'; never abandoned (see above)."""
+    return await _complete(shop.delete_order, (dBriefcase,))
+
+#-------------------------------------------------------------------------------
+async def checkout_order(dBriefcase):
+    """Awaitable 'shop.checkout_order'; never abandoned (see above)."""
+    return await _complete(shop.checkout_order, (dBriefcase,))
+
+#-------------------------------------------------------------------------------
+async def checkout_status(dBriefcase, *, fTimeout=TIMEOUT):
+    """Awaitable 'shop.checkout_status'."""
+    return await _call(shop.checkout_status, (dBriefcase,),
+        "unable to check payment", fTimeout)
+
+#-------------------------------------------------------------------------------
+async def list_orders(sBasket_code, iVersion=None, *, fTimeout=TIMEOUT):
+    """Awaitable 'shop.list_orders'."""
+    return await _call(shop.list_orders, (sBasket_code, iVersion),
+        "unable to validate token", fTimeout)
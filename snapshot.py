@@ -0,0 +1,464 @@
+""" # Read-only catalogue snapshots
+-----
+Worker processes which only answer 'list_products' don't build a catalogue of
+their own. The catalogue is published once as a binary snapshot file, and each
+worker maps it into memory read-only. Opening a snapshot reads nothing but
+the header, so a worker starts at once, and all workers share the same pages
+of the OS page cache instead of holding a copy each.
+
+The file holds, in sections aligned to 8 bytes:
+
+    string table        every distinct string once: UTF-8 bytes plus an
+                        array of offsets
+    product columns     fixed-width arrays, one entry per product, rows in
+                        'sItem_id' order: string numbers for 'sItem_id' and
+                        'sDesc'; dictionary codes for 'sBrand', 'sSize',
+                        'sColour', 'sCurrency' and 'sCategory' (with each
+                        column's value list); 'fPrice' (float64); 'iStock'
+                        (int64); the photo list of each row
+    keyword index       the tokens, sorted, each with a posting list of rows
+
+'Snapshot' offers the read side of 'catalogue.Catalogue' over the mapped
+file: the columns are memoryviews of it (NumPy reads them without copying),
+strings are decoded only when a row is materialised, and 'Snapshot.oIndex'
+searches like 'search.KeywordIndex'. Stock levels are as of publication.
+
+A new snapshot is written to a temporary file and renamed over the old one
+('write_snapshot'), which is atomic. 'SnapshotWatcher' notices the new file
+and swaps it in; requests already running finish on the old mapping.
+"""
+
+import bisect
+import collections
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+import encoding
+import search
+
+_MAGIC = b"SHOPSNAP"
+_VERSION = 1
+
+# Rows whose pre-encoded fragments a snapshot keeps; the oldest are dropped
+FRAGMENT_MEMORY = 65536
+
+# Sections, in file order: name -> array typecode ("B" for raw bytes)
+_SECTIONS = (
+    ("string_offsets", "Q"), ("string_data", "B"),
+    ("item_id", "I"), ("desc", "I"),
+    ("brand", "i"), ("size", "i"), ("colour", "i"), ("currency", "i"),
+    ("category", "i"),
+    ("brand_values", "I"), ("size_values", "I"), ("colour_values", "I"),
+    ("currency_values", "I"), ("category_values", "I"),
+    ("price", "d"), ("stock", "q"), ("ranks", "q"), ("live", "b"),
+    ("photo_offsets", "I"), ("photos", "I"),
+    ("tokens", "I"), ("posting_offsets", "Q"), ("postings", "I")
+)
+# Header: magic, version, products, then (offset, count) per section
+_HEADER = struct.Struct("<8sII" + "QQ" * len(_SECTIONS))
+
+# Dictionary-coded columns: snapshot section -> catalogue attribute
+_CODED = (("brand", "oBrand"), ("size", "oSize"), ("colour", "oColour"),
+    ("currency", "oCurrency"), ("category", "oCategory"))
+
+#-------------------------------------------------------------------------------
+def write_snapshot(oCatalogue, sPath):
+    """Publishes a catalogue as a snapshot file, atomically.
+
+    The snapshot is written next to 'sPath' under a temporary name, flushed
+    to disk, then renamed over 'sPath'. Readers see either the old or the
+    new file, never a partial one.
+    """
+    dStrings = {}
+    aString_offsets = array("Q", [0])
+    oData = bytearray()
+
+    def intern(sValue):
+        iString = dStrings.get(sValue)
+        if iString is None:
+            iString = dStrings[sValue] = len(dStrings)
+            oData.extend(sValue.encode("utf-8"))
+            aString_offsets.append(len(oData))
+        return iString
+
+    aRows = sorted((sItem_id, iRow)
+        for iRow, sItem_id in enumerate(oCatalogue.aItem_id)
+        if sItem_id is not None and oCatalogue.aLive[iRow])
+    dSections = {sName:array(sType) for sName, sType in _SECTIONS}
+    dSections["photo_offsets"].append(0)
+    dCodes = {sSection:{} for sSection, _ in _CODED}
+    for iNew, (sItem_id, iRow) in enumerate(aRows):
+        dSections["item_id"].append(intern(sItem_id))
+        dSections["desc"].append(intern(oCatalogue.aDesc[iRow]))
+        for sSection, sColumn in _CODED:
+            sValue = getattr(oCatalogue, sColumn)[iRow]
+            iCode = dCodes[sSection].get(sValue)
+            if iCode is None:
+                iCode = dCodes[sSection][sValue] = len(dCodes[sSection])
+                dSections[sSection + "_values"].append(intern(sValue))
+            dSections[sSection].append(iCode)
+        dSections["price"].append(oCatalogue.aPrice[iRow])
+        dSections["stock"].append(oCatalogue.aStock[iRow])
+        dSections["ranks"].append(iNew)
+        dSections["live"].append(1)
+        dSections["photos"].extend(intern(sUrl)
+            for sUrl in oCatalogue.aPhotos[iRow])
+        dSections["photo_offsets"].append(len(dSections["photos"]))
+
+    # Keyword index: posting lists of new row numbers, tokens sorted.
+    dPostings = {}
+    for iNew, (_, iRow) in enumerate(aRows):
+        for sToken in search.tokenise(oCatalogue.aDesc[iRow]):
+            dPostings.setdefault(sToken, []).append(iNew)
+    dSections["posting_offsets"].append(0)
+    for sToken in sorted(dPostings):
+        dSections["tokens"].append(intern(sToken))
+        dSections["postings"].extend(dPostings[sToken])
+        dSections["posting_offsets"].append(len(dSections["postings"]))
+    dSections["string_offsets"] = aString_offsets
+    dSections["string_data"] = array("B", oData)
+
+    # Lay out the sections after the header, each 8-byte aligned.
+    aLayout = []
+    iOffset = _HEADER.size
+    for sName, _ in _SECTIONS:
+        iOffset = (iOffset + 7) & ~7
+        aSection = dSections[sName]
+        aLayout.append((iOffset, len(aSection)))
+        iOffset += len(aSection) * aSection.itemsize
+    aHeader = [_MAGIC, _VERSION, len(aRows)]
+    for tPlace in aLayout:
+        aHeader.extend(tPlace)
+
+    sTemp = "%s.%d.tmp" % (sPath, os.getpid())
+    with open(sTemp, "wb") as oFile:
+        oFile.write(_HEADER.pack(*aHeader))
+        for (sName, _), (iOffset, _) in zip(_SECTIONS, aLayout):
+            oFile.write(b"\0" * (iOffset - oFile.tell()))
+            dSections[sName].tofile(oFile)
+        oFile.flush()
+        os.fsync(oFile.fileno())
+    os.replace(sTemp, sPath)
+
+#-------------------------------------------------------------------------------
+class _Strings:
+    """Read-only sequence of strings, decoded from the string table on
+    access."""
+
+    __slots__ = ("_oSnapshot", "_aIndex")
+
+    def __init__(self, oSnapshot, aIndex):
+        self._oSnapshot = oSnapshot
+        self._aIndex = aIndex       # position -> string number
+
+    def __len__(self):
+        return len(self._aIndex)
+
+    def __getitem__(self, iPos):
+        return self._oSnapshot.string(self._aIndex[iPos])
+
+#-------------------------------------------------------------------------------
+class _CodedColumn:
+    """Read side of 'catalogue.StringColumn' over a snapshot."""
+
+    __slots__ = ("aCodes", "aValues", "_dCodes")
+
+    def __init__(self, aCodes, aValues):
+        self.aCodes = aCodes
+        self.aValues = aValues
+        self._dCodes = {sValue:iCode for iCode, sValue in enumerate(aValues)}
+
+    def code_of(self, sValue, bCreate=False):
+        """Returns the code for a value; -1 if unknown."""
+        return self._dCodes.get(sValue, -1)
+
+    def __getitem__(self, iRow):
+        return self.aValues[self.aCodes[iRow]]
+
+#-------------------------------------------------------------------------------
+def _contains(aSorted, iRow):
+    iPos = bisect.bisect_left(aSorted, iRow)
+    return iPos < len(aSorted) and aSorted[iPos] == iRow
+
+#-------------------------------------------------------------------------------
+class _SnapshotIndex:
+    """Read side of 'search.KeywordIndex' over a snapshot's posting lists."""
+
+    __slots__ = ("_oSnapshot", "_aTokens", "_aOffsets", "_aPostings",
+        "oCounts")
+
+    def __init__(self, oSnapshot, aTokens, aOffsets, aPostings):
+        self._oSnapshot = oSnapshot
+        self._aTokens = _Strings(oSnapshot, aTokens)
+        self._aOffsets = aOffsets
+        self._aPostings = aPostings
+        self.oCounts = search.CountMemo()   # bounded; the index never changes
+
+    def __len__(self):
+        return len(self._oSnapshot)
+
+    def ids(self):
+        """Every 'sItem_id', sorted."""
+        return self._oSnapshot.aItem_id
+
+    def _posting(self, sToken):
+        iPos = bisect.bisect_left(self._aTokens, sToken)
+        if iPos == len(self._aTokens) or self._aTokens[iPos] != sToken:
+            return None
+        return self._aPostings[self._aOffsets[iPos]:self._aOffsets[iPos + 1]]
+
+    def _postings(self, sQuery):
+        aTokens = search.tokenise(sQuery)
+        if not aTokens:
+            return None
+        aLists = []
+        for sToken in aTokens:
+            aPosting = self._posting(sToken)
+            if aPosting is None:
+                return []
+            aLists.append(aPosting)
+        aLists.sort(key=len)
+        return aLists
+
+    def count(self, sQuery):
+        """Number of products matching all keywords of the query."""
+        aLists = self._postings(sQuery)
+        if aLists is None:
+            return len(self._oSnapshot)
+        if len(aLists) < 2:
+            return len(aLists[0]) if aLists else 0
+        sKey = " ".join(sorted(search.tokenise(sQuery)))
+        iCount = self.oCounts.get(sKey)
+        if iCount is None:
+            iCount = sum(1 for _ in self._walk(aLists, 0))
+            self.oCounts.put(sKey, iCount, self.oCounts.token())
+        return iCount
+
+    def search(self, sQuery, iOffset=0, iLimit=None, sAfter=None):
+        """Matching identifiers in 'sItem_id' order; as
+        'search.KeywordIndex.search'."""
+        aLists = self._postings(sQuery)
+        if aLists is None:
+            aLists = [range(len(self._oSnapshot))]
+        elif not aLists:
+            return []
+        iStart = 0
+        if sAfter is not None:
+            iRow = bisect.bisect_right(self._oSnapshot.aItem_id, sAfter)
+            iStart = bisect.bisect_left(aLists[0], iRow)
+        if len(aLists) == 1:
+            iStart += iOffset
+            iEnd = None if iLimit is None else iStart + iLimit
+            aRows = aLists[0][iStart:iEnd]
+        else:
+            aRows = []
+            for iRow in self._walk(aLists, iStart):
+                if iOffset:
+                    iOffset -= 1
+                    continue
+                if iLimit is not None and len(aRows) >= iLimit:
+                    break
+                aRows.append(iRow)
+        aItem_id = self._oSnapshot.aItem_id
+        return [aItem_id[iRow] for iRow in aRows]
+
+    def rows(self, sQuery):
+        """Rows matching all keywords, in 'sItem_id' order; 'None' if there
+        are no keywords."""
+        aLists = self._postings(sQuery)
+        if aLists is None or not aLists:
+            return aLists
+        if len(aLists) == 1:
+            return aLists[0].tolist()
+        return list(self._walk(aLists, 0))
+
+    @staticmethod
+    def _walk(aLists, iStart):
+        """Yields the intersection of sorted posting lists of rows."""
+        aFirst, aRest = aLists[0], aLists[1:]
+        for iPos in range(iStart, len(aFirst)):
+            iRow = aFirst[iPos]
+            if all(_contains(aOther, iRow) for aOther in aRest):
+                yield iRow
+
+#-------------------------------------------------------------------------------
+class Snapshot:
+    """A snapshot file mapped read-only, with the read side of
+    'catalogue.Catalogue'."""
+
+    __slots__ = ("sPath", "_oMap", "_aString_offsets", "_oString_data",
+        "aItem_id", "aDesc", "oBrand", "oSize", "oColour", "oCurrency",
+        "oCategory", "aPrice", "aStock", "aLive", "oIndex", "_aRanks",
+        "_aPhoto_offsets", "_aPhotos", "_iProducts", "_dFragments",
+        "_oFragments_lock")
+
+    def __init__(self, sPath):
+        """Maps a snapshot file.
+
+        Raises
+        ------
+            OSError: the file can't be opened.
+            ValueError: the file isn't a snapshot of this version.
+        """
+        self.sPath = sPath
+        with open(sPath, "rb") as oFile:
+            self._oMap = mmap.mmap(oFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._oMap) < _HEADER.size:
+            raise ValueError("not a catalogue snapshot: %s" % sPath)
+        aHeader = _HEADER.unpack_from(self._oMap)
+        if aHeader[0] != _MAGIC or aHeader[1] != _VERSION:
+            raise ValueError("not a catalogue snapshot: %s" % sPath)
+        self._iProducts = aHeader[2]
+        self._dFragments = collections.OrderedDict()   # row -> fragments
+        self._oFragments_lock = threading.Lock()
+        oView = memoryview(self._oMap)
+        dSections = {}
+        for iSection, (sName, sType) in enumerate(_SECTIONS):
+            iOffset, iCount = aHeader[3 + 2 * iSection:5 + 2 * iSection]
+            iEnd = iOffset + iCount * struct.calcsize(sType)
+            if iEnd > len(self._oMap):
+                raise ValueError("truncated catalogue snapshot: %s" % sPath)
+            dSections[sName] = oView[iOffset:iEnd].cast(sType)
+
+        self._aString_offsets = dSections["string_offsets"]
+        self._oString_data = dSections["string_data"]
+        self.aItem_id = _Strings(self, dSections["item_id"])
+        self.aDesc = _Strings(self, dSections["desc"])
+        for sSection, sColumn in _CODED:
+            aValues = [self.string(iString)
+                for iString in dSections[sSection + "_values"]]
+            setattr(self, sColumn, _CodedColumn(dSections[sSection], aValues))
+        self.aPrice = dSections["price"]
+        self.aStock = dSections["stock"]
+        self._aRanks = dSections["ranks"]
+        self.aLive = dSections["live"]
+        self._aPhoto_offsets = dSections["photo_offsets"]
+        self._aPhotos = dSections["photos"]
+        self.oIndex = _SnapshotIndex(self, dSections["tokens"],
+            dSections["posting_offsets"], dSections["postings"])
+
+    def string(self, iString):
+        """Entry of the string table."""
+        return str(self._oString_data[self._aString_offsets[iString]:
+            self._aString_offsets[iString + 1]], "utf-8")
+
+    def __len__(self):
+        return self._iProducts
+
+    def __contains__(self, sItem_id):
+        try:
+            self.row_of(sItem_id)
+        except KeyError:
+            return False
+        return True
+
+    def row_of(self, sItem_id):
+        """Row number of a product; KeyError if it isn't in the snapshot."""
+        iRow = bisect.bisect_left(self.aItem_id, sItem_id)
+        if iRow == self._iProducts or self.aItem_id[iRow] != sItem_id:
+            raise KeyError(sItem_id)
+        return iRow
+
+    def keyword_rows(self, sItem_filter):
+        """Rows matching all keywords, in 'sItem_id' order; 'None' if there
+        are no keywords. Read straight from the posting lists."""
+        return self.oIndex.rows(sItem_filter)
+
+    def id_ranks(self):
+        """Rows are stored in 'sItem_id' order, so a row's rank is itself."""
+        return self._aRanks
+
+    def photos(self, iRow):
+        return tuple(self.string(iString) for iString in
+            self._aPhotos[self._aPhoto_offsets[iRow]:
+                self._aPhoto_offsets[iRow + 1]])
+
+    def materialise(self, iRow):
+        """Builds the documented output dictionary for one row."""
+        return {
+            "sItem_id":self.aItem_id[iRow],
+            "sBrand":self.oBrand[iRow],
+            "sDesc":self.aDesc[iRow],
+            "sSize":self.oSize[iRow],
+            "sColour":self.oColour[iRow],
+            "fPrice":self.aPrice[iRow],
+            "sCurrency":self.oCurrency[iRow],
+            "iStock":self.aStock[iRow],
+            "aPhotos":list(self.photos(iRow))
+        }
+
+    def fragments(self, iRow):
+        """Pre-encoded JSON of a row's fixed fields (see 'encoding'),
+        encoded on first use. The fragments of the 'FRAGMENT_MEMORY' rows
+        encoded last are kept."""
+        tFragments = self._dFragments.get(iRow)
+        if tFragments is None:
+            tFragments = encoding.product_fragments(self.aItem_id[iRow],
+                self.oBrand[iRow], self.aDesc[iRow], self.oSize[iRow],
+                self.oColour[iRow], self.oCurrency[iRow], self.photos(iRow))
+            with self._oFragments_lock:
+                self._dFragments[iRow] = tFragments
+                if len(self._dFragments) > FRAGMENT_MEMORY:
+                    self._dFragments.popitem(last=False)
+        return tFragments
+
+    def product(self, iRow):
+        """A row as an 'encoding.Product': its dictionary and fragments."""
+        return encoding.Product(self.materialise(iRow), self.fragments(iRow))
+
+    def get(self, sItem_id):
+        """Output dictionary for a product; KeyError if it doesn't exist."""
+        return self.materialise(self.row_of(sItem_id))
+
+#-------------------------------------------------------------------------------
+class SnapshotWatcher:
+    """Keeps the newest published snapshot of a path open.
+
+    'current' checks the file at most every 'fInterval' seconds; when it has
+    been replaced, the new snapshot is opened and 'fnOn_swap' is called with
+    it. A snapshot being replaced stays mapped for as long as requests still
+    hold it.
+    """
+
+    __slots__ = ("sPath", "fInterval", "fnOn_swap", "_oSnapshot", "_tStat",
+        "_fChecked", "_oLock")
+
+    def __init__(self, sPath, fInterval=1.0, fnOn_swap=None):
+        self.sPath = sPath
+        self.fInterval = fInterval
+        self.fnOn_swap = fnOn_swap
+        self._tStat = self._stat()
+        self._oSnapshot = Snapshot(sPath)
+        self._fChecked = time.monotonic()
+        self._oLock = threading.Lock()
+
+    def _stat(self):
+        oStat = os.stat(self.sPath)
+        return (oStat.st_ino, oStat.st_mtime_ns, oStat.st_size)
+
+    def current(self):
+        """The newest snapshot."""
+        fNow = time.monotonic()
+        if fNow - self._fChecked >= self.fInterval:
+            with self._oLock:
+                if fNow - self._fChecked >= self.fInterval:
+                    self._fChecked = fNow
+                    self._refresh()
+        return self._oSnapshot
+
+    def _refresh(self):
+        try:
+            tStat = self._stat()
+            if tStat == self._tStat:
+                return
+            oSnapshot = Snapshot(self.sPath)
+        except (OSError, ValueError):
+            return                  # keep serving the snapshot we have
+        self._tStat = tStat
+        self._oSnapshot = oSnapshot
+        if self.fnOn_swap is not None:
+            self.fnOn_swap(oSnapshot)
@@ -0,0 +1,463 @@
+""" # Persistent storage
+-----
+The shop serves from memory (the catalogue, the baskets) and writes through to
+a storage backend for what must survive a restart:
+
+    products    the catalogue, loaded at start-up and updated by
+                'add_product' / 'remove_product'
+    invoices    every checked-out basket, with its lines; the sold units are
+                taken off the stored stock in the same transaction
+    payments    the state of invoices paid for in the background (see
+                'settlement'): pending, settled or rejected; a rejection
+                puts the units back on the stored stock
+
+Open baskets are not stored. They are short-lived reservations; after a
+restart their stock is simply available again.
+
+'Storage' defines the operations. 'SQLiteStorage' is the bundled
+implementation, for running the shop locally or on a single host. Any failure
+to reach or use the backend is raised as 'StorageError'; at checkout it is
+reported as "unable to generate invoice".
+
+Connections are expensive to open, so they are kept in a bounded
+'ConnectionPool' and reused by every call. Each SQL statement is a module
+constant, so a pooled connection prepares it once and then finds it in its
+statement cache.
+"""
+
+import contextlib
+import json
+import queue
+import sqlite3
+import threading
+
+# Connections kept by a pool, and the seconds a caller waits for one
+POOL_SIZE = 8
+POOL_TIMEOUT = 5.0
+
+#-------------------------------------------------------------------------------
+class StorageError(Exception):
+    """The storage backend is unreachable or failed."""
+
+#-------------------------------------------------------------------------------
+class ConnectionPool:
+    """Bounded pool of reusable connections.
+
+    At most 'iSize' connections exist. They are opened on demand and handed
+    back after use; a caller finding them all busy waits up to 'fTimeout'
+    seconds.
+    """
+
+    __slots__ = ("fnConnect", "fTimeout", "_oIdle", "_oSlots", "_aAll",
+        "_oLock")
+
+    def __init__(self, fnConnect, iSize=POOL_SIZE, fTimeout=POOL_TIMEOUT):
+        """Creates an empty pool.
+
+        Parameters
+        ----------
+            fnConnect (callable)
+                Opens a new connection.
+
+            iSize (integer)
+                Most connections open at once.
+
+            fTimeout (float)
+                Seconds to wait for a free connection.
+        """
+        self.fnConnect = fnConnect
+        self.fTimeout = fTimeout
+        self._oIdle = queue.LifoQueue()     # most recently used first
+        self._oSlots = threading.BoundedSemaphore(iSize)
+        self._aAll = []
+        self._oLock = threading.Lock()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrows a connection for the duration of a 'with' block.
+
+        Raises
+        ------
+            StorageError: no connection became free in time, or a new one
+                couldn't be opened.
+        """
+        if not self._oSlots.acquire(timeout=self.fTimeout):
+            raise StorageError("connection pool exhausted")
+        try:
+            try:
+                oConnection = self._oIdle.get_nowait()
+            except queue.Empty:
+                oConnection = self._open()
+            try:
+                yield oConnection
+            except BaseException:
+                self._discard_if_broken(oConnection)
+                raise
+            else:
+                self._oIdle.put(oConnection)
+        finally:
+            self._oSlots.release()
+
+    def _open(self):
+        try:
+            oConnection = self.fnConnect()
+        except Exception as e:
+            raise StorageError("unable to connect: %s" % e) from e
+        with self._oLock:
+            self._aAll.append(oConnection)
+        return oConnection
+
+    def _discard_if_broken(self, oConnection):
+        """Returns a connection to the pool after a failure, unless it can't
+        even roll back."""
+        try:
+            oConnection.rollback()
+        except Exception:
+            with self._oLock:
+                self._aAll.remove(oConnection)
+            with contextlib.suppress(Exception):
+                oConnection.close()
+        else:
+            self._oIdle.put(oConnection)
+
+    def close(self):
+        """Closes every connection. Connections in use are closed too."""
+        with self._oLock:
+            aAll, self._aAll = self._aAll, []
+        for oConnection in aAll:
+            with contextlib.suppress(Exception):
+                oConnection.close()
+        self._oIdle = queue.LifoQueue()
+
+#-------------------------------------------------------------------------------
+class Storage:
+    """Operations every storage backend provides.
+
+    All methods raise 'StorageError' when the backend fails.
+    """
+
+    __slots__ = ()
+
+    def load_products(self):
+        """Iterates over every stored product, as 'add_product' records."""
+        raise NotImplementedError
+
+    def put_products(self, aProducts):
+        """Inserts or replaces products, all in one transaction."""
+        raise NotImplementedError
+
+    def delete_product(self, sItem_id):
+        """Deletes a product. Unknown identifiers are ignored."""
+        raise NotImplementedError
+
+    def save_invoice(self, dInvoice):
+        """Stores a new invoice and takes its units off the stored stock, in
+        one transaction. The invoice is durable before this returns: the
+        checkout is acknowledged on the strength of it.
+
+        Parameters
+        ----------
+            dInvoice (dictionary)
+                "sInvoice_code", "sUser_id", "sCurrency", "iGoods" and "iShip"
+                (minor units), "fCreated" (Unix time), and "aLines": a list
+                of (sItem_id, iQty, iUnit, sCurrency) tuples, 'iUnit' in minor
+                units of the line's currency.
+        """
+        raise NotImplementedError
+
+    def save_invoices(self, aInvoices):
+        """Stores a batch of invoices like 'save_invoice', skipping those
+        already stored, so a batch may safely be saved again (as when the
+        checkout log is replayed). The batch is durable before this returns,
+        as the checkout log is cut back once it is applied."""
+        for dInvoice in aInvoices:
+            if self.get_invoice(dInvoice["sInvoice_code"]) is None:
+                self.save_invoice(dInvoice)
+
+    def get_invoice(self, sInvoice_code):
+        """The invoice as given to 'save_invoice', or 'None'."""
+        raise NotImplementedError
+
+    def settle_payment(self, sInvoice_code, bPaid):
+        """Records the outcome of a pending payment (an invoice saved with
+        "sPayment": "pending"). A rejected payment's units are put back on
+        the stored stock, in the same transaction.
+
+        Returns
+        -------
+            (boolean) True if the payment was pending; false if its outcome
+            was already recorded, or it isn't a pending payment.
+        """
+        raise NotImplementedError
+
+    def pending_payments(self):
+        """Every invoice whose payment is pending, oldest first, as returned
+        by 'get_invoice'."""
+        raise NotImplementedError
+
+    def payment_status(self, sInvoice_code):
+        """(sUser_id, sStatus) of an invoice, or 'None' if there is no such
+        invoice. 'sStatus' is "pending", "settled" or "rejected"; invoices
+        saved without a pending payment are "settled"."""
+        raise NotImplementedError
+
+    def last_invoice_code(self):
+        """The highest invoice code stored (longest, then greatest), or
+        'None'."""
+        raise NotImplementedError
+
+    def allocate_numbers(self, sName, iCount, iFloor=1):
+        """Reserves the next 'iCount' numbers of a persistent counter and
+        returns the first. The reservation is durable before this returns.
+
+        Parameters
+        ----------
+            sName (string)
+                Counter; created at 'iFloor' on first use.
+
+            iCount (integer)
+                Numbers to reserve.
+
+            iFloor (integer)
+                Lowest number to hand out, whatever the counter says.
+        """
+        raise NotImplementedError
+
+    def release_numbers(self, sName, iFrom, iTo):
+        """Gives back the numbers 'iFrom' to 'iTo - 1' of a counter, if they
+        are the last reserved. Returns true if they were."""
+        raise NotImplementedError
+
+    def close(self):
+        """Releases the backend's connections."""
+
+#-------------------------------------------------------------------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    sItem_id TEXT PRIMARY KEY, sBrand TEXT NOT NULL, sDesc TEXT NOT NULL,
+    sSize TEXT NOT NULL, sColour TEXT NOT NULL, sCategory TEXT NOT NULL,
+    fPrice REAL NOT NULL, sCurrency TEXT NOT NULL, iStock INTEGER NOT NULL,
+    sPhotos TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS invoices (
+    sInvoice_code TEXT PRIMARY KEY, sUser_id TEXT NOT NULL,
+    sCurrency TEXT NOT NULL, iGoods INTEGER NOT NULL, iShip INTEGER NOT NULL,
+    fCreated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS invoice_lines (
+    sInvoice_code TEXT NOT NULL, sItem_id TEXT NOT NULL,
+    iQty INTEGER NOT NULL, iUnit INTEGER NOT NULL, sCurrency TEXT NOT NULL,
+    PRIMARY KEY (sInvoice_code, sItem_id));
+CREATE TABLE IF NOT EXISTS counters (
+    sName TEXT PRIMARY KEY, iNext INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS payments (
+    sInvoice_code TEXT PRIMARY KEY, sStatus TEXT NOT NULL);
+"""
+
+_SELECT_PRODUCTS = "SELECT sItem_id, sBrand, sDesc, sSize, sColour, " \
+    "sCategory, fPrice, sCurrency, iStock, sPhotos FROM products"
+_PUT_PRODUCT = "INSERT OR REPLACE INTO products VALUES (?,?,?,?,?,?,?,?,?,?)"
+_DELETE_PRODUCT = "DELETE FROM products WHERE sItem_id = ?"
+_INSERT_INVOICE = "INSERT INTO invoices VALUES (?,?,?,?,?,?)"
+_INSERT_NEW_INVOICE = "INSERT OR IGNORE INTO invoices VALUES (?,?,?,?,?,?)"
+_INSERT_LINE = "INSERT INTO invoice_lines VALUES (?,?,?,?,?)"
+_TAKE_STOCK = "UPDATE products SET iStock = MAX(iStock - ?, 0) " \
+    "WHERE sItem_id = ?"
+_SELECT_INVOICE = "SELECT sUser_id, sCurrency, iGoods, iShip, fCreated " \
+    "FROM invoices WHERE sInvoice_code = ?"
+_SELECT_LINES = "SELECT sItem_id, iQty, iUnit, sCurrency FROM invoice_lines " \
+    "WHERE sInvoice_code = ? ORDER BY rowid"
+_LAST_INVOICE = "SELECT sInvoice_code FROM invoices " \
+    "ORDER BY LENGTH(sInvoice_code) DESC, sInvoice_code DESC LIMIT 1"
+
+_INSERT_PAYMENT = "INSERT INTO payments VALUES (?, 'pending')"
+_SETTLE_PAYMENT = "UPDATE payments SET sStatus = ? " \
+    "WHERE sInvoice_code = ? AND sStatus = 'pending'"
+_RETURN_STOCK = "UPDATE products SET iStock = iStock + ? WHERE sItem_id = ?"
+_PENDING_PAYMENTS = "SELECT payments.sInvoice_code FROM payments " \
+    "JOIN invoices USING (sInvoice_code) " \
+    "WHERE payments.sStatus = 'pending' ORDER BY invoices.fCreated"
+_PAYMENT_STATUS = "SELECT sUser_id, COALESCE(payments.sStatus, 'settled') " \
+    "FROM invoices LEFT JOIN payments USING (sInvoice_code) " \
+    "WHERE invoices.sInvoice_code = ?"
+
+_CREATE_COUNTER = "INSERT OR IGNORE INTO counters VALUES (?, ?)"
+_ADVANCE_COUNTER = "UPDATE counters SET iNext = MAX(iNext, ?) + ? " \
+    "WHERE sName = ?"
+_SELECT_COUNTER = "SELECT iNext FROM counters WHERE sName = ?"
+_RELEASE_NUMBERS = "UPDATE counters SET iNext = ? " \
+    "WHERE sName = ? AND iNext = ?"
+
+_PRODUCT_KEYS = ("sItem_id", "sBrand", "sDesc", "sSize", "sColour",
+    "sCategory", "fPrice", "sCurrency", "iStock")
+
+#-------------------------------------------------------------------------------
+class SQLiteStorage(Storage):
+    """Storage in an SQLite database file, in WAL mode.
+
+    Write-ahead logging lets readers carry on while a transaction commits,
+    and each commit is a sequential append to the log. Commits are synced
+    with synchronous=NORMAL, so the last of them may be lost on power
+    failure, except for invoices and counters, whose transactions are synced
+    in full: a checkout is acknowledged once its invoice is saved, whether
+    or not a checkout log stands in front. (A payment outcome lost this way
+    is pending again after a restart; charged again, it gets the same
+    answer.)
+    """
+
+    __slots__ = ("sPath", "_oPool")
+
+    def __init__(self, sPath, iPool_size=POOL_SIZE):
+        """Opens (and if needed creates) the database.
+
+        Raises
+        ------
+            StorageError: the database can't be opened.
+        """
+        self.sPath = sPath
+        self._oPool = ConnectionPool(self._connect, iPool_size)
+        with self._transaction() as oConnection:
+            oConnection.executescript(_SCHEMA)
+
+    def _connect(self):
+        oConnection = sqlite3.connect(self.sPath, timeout=POOL_TIMEOUT,
+            check_same_thread=False, cached_statements=64)
+        oConnection.execute("PRAGMA journal_mode=WAL")
+        oConnection.execute("PRAGMA synchronous=NORMAL")
+        return oConnection
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """A pooled connection; commits on success, rolls back on failure."""
+        try:
+            with self._oPool.connection() as oConnection:
+                with oConnection:
+                    yield oConnection
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    #---------------------------------------------------------------------------
+    def load_products(self):
+        with self._transaction() as oConnection:
+            aRows = oConnection.execute(_SELECT_PRODUCTS).fetchall()
+        for tRow in aRows:
+            dProduct = dict(zip(_PRODUCT_KEYS, tRow))
+            dProduct["aPhotos"] = json.loads(tRow[-1])
+            yield dProduct
+
+    def put_products(self, aProducts):
+        aRows = [tuple(dProduct.get(sKey, "") for sKey in _PRODUCT_KEYS) +
+            (json.dumps(list(dProduct["aPhotos"])),) for dProduct in aProducts]
+        with self._transaction() as oConnection:
+            oConnection.executemany(_PUT_PRODUCT, aRows)
+
+    def delete_product(self, sItem_id):
+        with self._transaction() as oConnection:
+            oConnection.execute(_DELETE_PRODUCT, (sItem_id,))
+
+    def save_invoice(self, dInvoice):
+        sInvoice_code = dInvoice["sInvoice_code"]
+        with self._durable_transaction() as oConnection:
+            oConnection.execute(_INSERT_INVOICE, (sInvoice_code,
+                dInvoice["sUser_id"], dInvoice["sCurrency"], dInvoice["iGoods"],
+                dInvoice["iShip"], dInvoice["fCreated"]))
+            oConnection.executemany(_INSERT_LINE, [(sInvoice_code,) + tLine
+                for tLine in dInvoice["aLines"]])
+            oConnection.executemany(_TAKE_STOCK, [(iQty, sItem_id)
+                for sItem_id, iQty, _, _ in dInvoice["aLines"]])
+            if dInvoice.get("sPayment") == "pending":
+                oConnection.execute(_INSERT_PAYMENT, (sInvoice_code,))
+
+    def save_invoices(self, aInvoices):
+        with self._durable_transaction() as oConnection:
+            for dInvoice in aInvoices:
+                sInvoice_code = dInvoice["sInvoice_code"]
+                oCursor = oConnection.execute(_INSERT_NEW_INVOICE,
+                    (sInvoice_code, dInvoice["sUser_id"],
+                    dInvoice["sCurrency"], dInvoice["iGoods"],
+                    dInvoice["iShip"], dInvoice["fCreated"]))
+                if oCursor.rowcount != 1:
+                    continue                # stored already
+                oConnection.executemany(_INSERT_LINE, [(sInvoice_code,)
+                    + tuple(tLine) for tLine in dInvoice["aLines"]])
+                oConnection.executemany(_TAKE_STOCK, [(iQty, sItem_id)
+                    for sItem_id, iQty, _, _ in dInvoice["aLines"]])
+                if dInvoice.get("sPayment") == "pending":
+                    oConnection.execute(_INSERT_PAYMENT, (sInvoice_code,))
+
+    def get_invoice(self, sInvoice_code):
+        with self._transaction() as oConnection:
+            tRow = oConnection.execute(_SELECT_INVOICE,
+                (sInvoice_code,)).fetchone()
+            if tRow is None:
+                return None
+            aLines = oConnection.execute(_SELECT_LINES,
+                (sInvoice_code,)).fetchall()
+        dInvoice = dict(zip(("sUser_id", "sCurrency", "iGoods", "iShip",
+            "fCreated"), tRow))
+        dInvoice["sInvoice_code"] = sInvoice_code
+        dInvoice["aLines"] = [tuple(tLine) for tLine in aLines]
+        return dInvoice
+
+    def settle_payment(self, sInvoice_code, bPaid):
+        with self._transaction() as oConnection:
+            if oConnection.execute(_SETTLE_PAYMENT, ("settled" if bPaid
+                    else "rejected", sInvoice_code)).rowcount != 1:
+                return False
+            if not bPaid:
+                oConnection.executemany(_RETURN_STOCK, [(iQty, sItem_id)
+                    for sItem_id, iQty, _, _ in oConnection.execute(
+                    _SELECT_LINES, (sInvoice_code,)).fetchall()])
+        return True
+
+    def pending_payments(self):
+        with self._transaction() as oConnection:
+            aCodes = [tRow[0] for tRow in
+                oConnection.execute(_PENDING_PAYMENTS).fetchall()]
+        aInvoices = []
+        for sInvoice_code in aCodes:
+            dInvoice = self.get_invoice(sInvoice_code)
+            dInvoice["sPayment"] = "pending"
+            aInvoices.append(dInvoice)
+        return aInvoices
+
+    def payment_status(self, sInvoice_code):
+        with self._transaction() as oConnection:
+            tRow = oConnection.execute(_PAYMENT_STATUS,
+                (sInvoice_code,)).fetchone()
+        return None if tRow is None else tuple(tRow)
+
+    def last_invoice_code(self):
+        with self._transaction() as oConnection:
+            tRow = oConnection.execute(_LAST_INVOICE).fetchone()
+        return None if tRow is None else tRow[0]
+
+    def allocate_numbers(self, sName, iCount, iFloor=1):
+        with self._durable_transaction() as oConnection:
+            oConnection.execute(_CREATE_COUNTER, (sName, iFloor))
+            oConnection.execute(_ADVANCE_COUNTER, (iFloor, iCount, sName))
+            iNext, = oConnection.execute(_SELECT_COUNTER,
+                (sName,)).fetchone()
+        return iNext - iCount
+
+    def release_numbers(self, sName, iFrom, iTo):
+        with self._durable_transaction() as oConnection:
+            return oConnection.execute(_RELEASE_NUMBERS,
+                (iFrom, sName, iTo)).rowcount == 1
+
+    @contextlib.contextmanager
+    def _durable_transaction(self):
+        """A transaction synced to disk on commit, unlike the others (in WAL
+        mode with synchronous=NORMAL, the last commits may be lost on power
+        failure). A batch pays for one sync, however many rows it writes."""
+        try:
+            with self._oPool.connection() as oConnection:
+                oConnection.execute("PRAGMA synchronous=FULL")
+                try:
+                    with oConnection:
+                        yield oConnection
+                finally:
+                    oConnection.execute("PRAGMA synchronous=NORMAL")
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def close(self):
+        self._oPool.close()
@@ -0,0 +1,28 @@
+""" # Test configuration
+-----
+The shop's modules sit at the top of the repository; the tests import them
+from there, however pytest is started. Tests which change the shop's global
+state (its catalogue, shards and caches) do so through 'shop_state', which
+puts it back afterwards.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def shop_state():
+    """The 'shop' module. Afterwards, shards are stopped, products added
+    meanwhile are removed and the result cache is emptied."""
+    import shop
+    setBefore = set(shop._oCatalogue._dRows)
+    yield shop
+    shop.use_shards(0, "")
+    for sItem_id in set(shop._oCatalogue._dRows) - setBefore:
+        shop.remove_product(sItem_id)
+    shop._oList_cache.clear()
@@ -0,0 +1,118 @@
+""" # Tests: result cache
+-----
+'cache.ResultCache' drops only the outputs a change can alter: those listing
+the item, and those depending on the field which changed. An output computed
+across a change which would have invalidated it is not stored, and entries
+are evicted least recently used first or once their time-to-live is over.
+"""
+
+import catalogue
+import cache
+
+#-------------------------------------------------------------------------------
+def product(sItem_id, iStock):
+    return {"sItem_id":sItem_id, "sBrand":"Test", "sDesc":"Cache test",
+        "sSize":"M", "sColour":"Red", "fPrice":10.0, "sCurrency":"PLN",
+        "iStock":iStock, "aPhotos":[]}
+
+#-------------------------------------------------------------------------------
+def filled():
+    """Cache holding a plain listing, an in-stock listing and a price sorted
+    listing, each of one item."""
+    oCache = cache.ResultCache()
+    oCache.put("plain", {"sStatus":"OK"}, ["I-1"])
+    oCache.put("in stock", {"sStatus":"OK"}, ["I-2"], ["bIn_stock"])
+    oCache.put("by price", {"sStatus":"OK"}, ["I-3"], ["fPrice"])
+    return oCache
+
+def cached(oCache):
+    return sorted(oCache._dEntries)
+
+#-------------------------------------------------------------------------------
+def test_stock_change_drops_only_the_listings_of_the_item():
+    oCache = filled()
+    oCache.on_change("I-9", "iStock")
+    assert cached(oCache) == ["by price", "in stock", "plain"]
+    oCache.on_change("I-1", "iStock")
+    assert cached(oCache) == ["by price", "in stock"]
+    oCache.on_change("I-9", "bIn_stock")
+    assert cached(oCache) == ["by price"]
+    assert oCache.stats()["iInvalidations"] == 2
+
+#-------------------------------------------------------------------------------
+def test_price_change_drops_the_price_dependent_listings():
+    oCache = filled()
+    oCache.on_change("I-9", "fPrice")
+    assert cached(oCache) == ["in stock", "plain"]
+    oCache.on_change("I-9", None)
+    assert cached(oCache) == []
+    assert oCache._dBy_item == {} and oCache._dBy_field == {}
+
+#-------------------------------------------------------------------------------
+def test_catalogue_reports_products_coming_into_stock():
+    oCatalogue = catalogue.Catalogue()
+    oCatalogue.add(product("I-1", 2))
+    aChanges = []
+    oCatalogue.add_listener(lambda sItem_id, sField: aChanges.append(sField))
+    for iStock in (1, 0, 0, 3, 5):
+        oCatalogue.set_stock("I-1", iStock)
+    oCatalogue.set_price("I-1", 12.5)
+    assert aChanges == ["iStock", "bIn_stock", "iStock", "bIn_stock",
+        "iStock", "fPrice"]
+
+#-------------------------------------------------------------------------------
+def test_outputs_computed_across_a_change_are_not_stored():
+    oCache = cache.ResultCache()
+    iToken = oCache.token()
+    oCache.on_change("I-2", "iStock")
+    oCache.put("other item", {}, ["I-1"], iToken=iToken)
+    oCache.put("same item", {}, ["I-2"], iToken=iToken)
+    oCache.put("in stock", {}, ["I-1"], ["bIn_stock"], iToken=iToken)
+    assert cached(oCache) == ["in stock", "other item"]
+
+    iToken = oCache.token()
+    oCache.on_change("I-2", "bIn_stock")
+    oCache.put("in stock", {}, ["I-1"], ["bIn_stock"], iToken=iToken)
+    assert cached(oCache) == ["other item"]
+
+    iToken = oCache.token()
+    oCache.on_change("I-2", None)
+    oCache.put("other item", {}, ["I-1"], iToken=iToken)
+    assert cached(oCache) == []
+    assert oCache.stats()["iInvalidations"] == 5
+
+#-------------------------------------------------------------------------------
+def test_too_many_changes_make_an_output_stale():
+    oCache = cache.ResultCache()
+    iToken = oCache.token()
+    for iChange in range(cache.RECENT_CHANGES + 1):
+        oCache.on_change("I-%d" % (iChange + 2), "iStock")
+    oCache.put("plain", {}, ["I-1"], iToken=iToken)
+    assert len(oCache) == 0
+
+#-------------------------------------------------------------------------------
+def test_least_recently_used_entry_is_evicted():
+    oCache = cache.ResultCache(iMax_entries=2)
+    oCache.put("a", {"x":1}, ["I-1"])
+    oCache.put("b", {"x":2}, ["I-1"])
+    assert oCache.get("a") == {"x":1}
+    oCache.put("c", {"x":3}, ["I-2"])
+    assert oCache.get("b") is None
+    assert cached(oCache) == ["a", "c"]
+    assert oCache._dBy_item == {"I-1":{"a"}, "I-2":{"c"}}
+    dStats = oCache.stats()
+    assert (dStats["iHits"], dStats["iMisses"], dStats["iEvictions"],
+        dStats["iSize"]) == (1, 1, 1, 2)
+
+#-------------------------------------------------------------------------------
+def test_expired_entry_is_not_served(monkeypatch):
+    fNow = [100.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: fNow[0])
+    oCache = cache.ResultCache(fTtl=30.0)
+    oCache.put("plain", {"x":1}, ["I-1"], ["fPrice"])
+    fNow[0] = 130.0
+    assert oCache.get("plain") == {"x":1}
+    fNow[0] = 130.5
+    assert oCache.get("plain") is None
+    assert len(oCache) == 0
+    assert oCache._dBy_item == {} and oCache._dBy_field == {}
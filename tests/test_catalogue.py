@@ -0,0 +1,128 @@
+""" # Tests: columnar catalogue
+-----
+The memory a product costs in the catalogue's columns, keyword index and JSON
+fragments is kept within the figures given in the 'catalogue' docstring, and
+whole-row reads never see a row half way through being overwritten.
+"""
+
+import gc
+import sys
+import threading
+import tracemalloc
+
+import catalogue
+import encoding
+import search
+from benchmarks import catalogue_gen
+
+_SKUS = 20000
+
+# Bytes per product allocated by each module, a little above the measured
+# figures of the 'catalogue' docstring
+_LIMITS = {"catalogue.py":180, "search.py":170, "encoding.py":350}
+
+#-------------------------------------------------------------------------------
+def product(sItem_id, iVersion):
+    return {
+        "sItem_id":sItem_id,
+        "sBrand":"Brand %d" % iVersion,
+        "sDesc":"Version %d coat" % iVersion,
+        "sSize":("S", "XL")[iVersion],
+        "sColour":("red", "blue")[iVersion],
+        "fPrice":(10.0, 99.5)[iVersion],
+        "sCurrency":("PLN", "EUR")[iVersion],
+        "iStock":(1, 7)[iVersion],
+        "aPhotos":["https://example.com/%s-%d.jpg" % (sItem_id, iVersion)]
+    }
+
+#-------------------------------------------------------------------------------
+def test_memory_per_product():
+    aProducts = list(catalogue_gen.make_products(_SKUS))
+    # Words are interned (and held in 'aWords') before tracing: like the
+    # other strings they aren't counted, and a resize of the interpreter's
+    # table of interned strings, which depends on the modules loaded before,
+    # would be put down to 'search.py'
+    aWords = [sys.intern(sToken) for dProduct in aProducts
+        for sToken in search.tokenise(dProduct["sDesc"])]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        oCatalogue = catalogue.Catalogue()
+        for dProduct in aProducts:
+            oCatalogue.add(dProduct)
+        oCatalogue.oIndex.ids()     # merge the pending postings
+        gc.collect()
+        oSnapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    dBytes = {}
+    for oStat in oSnapshot.statistics("filename"):
+        sFile = oStat.traceback[0].filename.replace("\\", "/").split("/")[-1]
+        dBytes[sFile] = dBytes.get(sFile, 0) + oStat.size
+    assert len(oCatalogue) == _SKUS
+    for sFile, iLimit in _LIMITS.items():
+        assert dBytes.get(sFile, 0) / _SKUS <= iLimit, sFile
+
+#-------------------------------------------------------------------------------
+def test_products_without_photos_share_their_tail():
+    oCatalogue = catalogue.Catalogue()
+    for sItem_id in ("I-1", "I-2"):
+        oCatalogue.add(dict(product(sItem_id, 0), aPhotos=[]))
+    assert oCatalogue.fragments(0)[2] is oCatalogue.fragments(1)[2]
+    oItem = oCatalogue.product(0)
+    assert encoding.encode_item(oItem) \
+        == encoding.encode_item(dict(oItem))
+
+#-------------------------------------------------------------------------------
+def test_recycled_row():
+    oCatalogue = catalogue.Catalogue()
+    oCatalogue.add(product("I-1", 0))
+    oCatalogue.remove("I-1")
+    assert "I-1" not in oCatalogue
+    assert oCatalogue.add(product("I-2", 1)) == 0
+    assert oCatalogue.get("I-2") == product("I-2", 1)
+    assert oCatalogue.attributes("I-2")["sItem_id"] == "I-2"
+
+#-------------------------------------------------------------------------------
+def test_replacement_is_never_read_half_written():
+    oCatalogue = catalogue.Catalogue()
+    oCatalogue.add(product("I-1", 0))
+    aVersions = [product("I-1", iVersion) for iVersion in (0, 1)]
+    aLines = [(dProduct["fPrice"], dProduct["sCurrency"], dProduct["sDesc"],
+        dProduct["sSize"], dProduct["sColour"]) for dProduct in aVersions]
+    aErrors = []
+    oStop = threading.Event()
+
+    def replace():
+        iVersion = 0
+        while not oStop.is_set():
+            iVersion = 1 - iVersion
+            oCatalogue.add(aVersions[iVersion])
+
+    def read():
+        try:
+            check()
+        except Exception as oError:
+            aErrors.append(oError)
+
+    def check():
+        for _ in range(20000):
+            oItem = oCatalogue.product(0)
+            if dict(oItem) not in aVersions:
+                aErrors.append(dict(oItem))
+            elif (encoding.encode_item(oItem)
+                    != encoding.encode_item(dict(oItem))):
+                aErrors.append(oItem.tFragments)
+            if oCatalogue.line_details("I-1") not in aLines:
+                aErrors.append(oCatalogue.line_details("I-1"))
+
+    oWriter = threading.Thread(target=replace)
+    aReaders = [threading.Thread(target=read) for _ in range(3)]
+    oWriter.start()
+    for oReader in aReaders:
+        oReader.start()
+    for oReader in aReaders:
+        oReader.join()
+    oStop.set()
+    oWriter.join()
+    assert aErrors == []
@@ -0,0 +1,118 @@
+""" # Tests: currency rate matrix
+-----
+'currency.RateTable' must convert as the rates say: compared with exact
+rational arithmetic through the base currency, across minor-unit digits,
+for single amounts and for a basket's per-currency totals (on both the
+plain and the NumPy path). Snapshots must be unaffected by new rates.
+"""
+
+import json
+import os
+import random
+from fractions import Fraction
+
+import pytest
+
+import currency
+import money
+
+_RATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), "rates.json")
+
+#-------------------------------------------------------------------------------
+def exact(dRates, iMinor, sFrom, sTo):
+    """'iMinor' of 'sFrom' in minor units of 'sTo', as a fraction."""
+    return (Fraction(iMinor) / 10 ** money.exponent(sFrom)
+        / Fraction(dRates[sFrom]) * Fraction(dRates[sTo])
+        * 10 ** money.exponent(sTo))
+
+#-------------------------------------------------------------------------------
+def close_to(iMinor, fExact):
+    """Whether 'iMinor' is 'fExact' rounded, allowing for float error."""
+    return abs(iMinor - fExact) <= Fraction(1, 2) + abs(fExact) / 10 ** 12
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def rates():
+    with open(_RATES, encoding="utf-8") as oFile:
+        dData = json.load(oFile)
+    return currency.load_rates(_RATES), dData["dRates"]
+
+#-------------------------------------------------------------------------------
+def test_matrix_matches_exact_conversion(rates):
+    oTable, dRates = rates
+    oRandom = random.Random(1)
+    for sFrom in oTable.aCodes:
+        for sTo in oTable.aCodes:
+            for _ in range(50):
+                iMinor = oRandom.randrange(-10 ** 9, 10 ** 9)
+                assert close_to(oTable.convert(iMinor, sFrom, sTo),
+                    exact(dRates, iMinor, sFrom, sTo))
+            assert oTable.convert(12345, sFrom, sFrom) == 12345
+
+#-------------------------------------------------------------------------------
+def test_known_conversions():
+    oTable = currency.RateTable("PLN", {"PLN":1.0, "EUR":0.25, "JPY":40.0,
+        "XBT":0.000004})
+    assert oTable.convert(1000, "PLN", "EUR") == 250
+    assert oTable.convert(250, "EUR", "PLN") == 1000
+    assert oTable.convert(1000, "PLN", "JPY") == 400
+    assert oTable.convert(1000, "PLN", "XBT") == 4000
+    assert oTable.convert(2, "PLN", "EUR") == 1        # 0.5 rounds up
+    assert oTable.convert(-2, "PLN", "EUR") == -1      # and away from 0
+    with pytest.raises(KeyError):
+        oTable.convert(1, "PLN", "USD")
+
+#-------------------------------------------------------------------------------
+def test_totals_round_once(rates):
+    oTable, dRates = rates
+    oRandom = random.Random(2)
+    for sTo in oTable.aCodes:
+        dTotals = {sFrom:[oRandom.randrange(10 ** 7), 0]
+            for sFrom in oTable.aCodes}
+        fExact = sum(exact(dRates, aTotal[0], sFrom, sTo)
+            for sFrom, aTotal in dTotals.items())
+        assert close_to(oTable.convert_totals(dTotals, sTo), fExact)
+        assert oTable.convert_totals({sTo:[123, 0]}, sTo) == 123
+
+#-------------------------------------------------------------------------------
+def test_numpy_totals_match_plain_sums():
+    pytest.importorskip("numpy")
+    dRates = {"PLN":1.0, "CHF":0.2205, "CZK":5.812, "EUR":0.2321,
+        "GBP":0.2018, "JPY":37.41, "SEK":2.694, "USD":0.2507,
+        "XBT":0.0000041, "NOK":2.61}
+    oTable = currency.RateTable("PLN", dRates)
+    oTable_plain = currency.RateTable("PLN", dRates)
+    oTable_plain._oMatrix = None
+    assert oTable._oMatrix is not None
+    oRandom = random.Random(3)
+    for _ in range(100):
+        dTotals = {sCurrency:oRandom.randrange(10 ** 7)
+            for sCurrency in dRates}
+        for sTo in dRates:
+            assert abs(oTable.convert_totals(dTotals, sTo)
+                - oTable_plain.convert_totals(dTotals, sTo)) <= 1
+
+#-------------------------------------------------------------------------------
+def test_snapshots_keep_their_rates(tmp_path):
+    oBook = currency.RateBook(currency.RateTable("PLN", {"PLN":1.0,
+        "EUR":0.25}))
+    oSnapshot = oBook.current()
+    sPath = str(tmp_path / "rates.json")
+    with open(sPath, "w", encoding="utf-8") as oFile:
+        json.dump({"sBase":"PLN", "dRates":{"PLN":1.0, "EUR":0.5}}, oFile)
+    assert oBook.reload(sPath).iVersion == 1
+    assert oSnapshot.convert(1000, "PLN", "EUR") == 250
+    assert oBook.current().convert(1000, "PLN", "EUR") == 500
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("dRates", [
+    {"PLN":1.0, "eur":0.25},
+    {"PLN":1.0, "EUR":0},
+    {"PLN":1.0, "EUR":True},
+    {"PLN":1.0, "EUR":float("nan")},
+    {"EUR":0.25},
+])
+def test_rejects_bad_rates(dRates):
+    with pytest.raises(ValueError):
+        currency.RateTable("PLN", dRates)
@@ -0,0 +1,113 @@
+""" # Tests: response encoding
+-----
+'shop.encode_response' splices pre-encoded product fragments into
+'list_products' pages. The bytes must be exactly those of compact UTF-8
+'json.dumps', for fresh pages, cached pages, pages after stock and price
+changes, and pages served from a snapshot.
+"""
+
+import json
+
+import pytest
+
+import encoding
+import shop
+import snapshot
+
+# Queries covering every sort order, facets and a second page
+_QUERIES = [
+    {"sItem_filter":"encoding"},
+    {"sItem_filter":"encoding", "sSort":"fPrice_asc", "bFacets":True},
+    {"sItem_filter":"encoding", "sSort":"fPrice_desc", "sColour":"Zielony"},
+    {"sItem_filter":"", "iIdx":3, "bIn_stock":True},
+]
+
+#-------------------------------------------------------------------------------
+def expected(dOutput):
+    return json.dumps(dOutput, ensure_ascii=False,
+        separators=(",", ":")).encode("utf-8")
+
+#-------------------------------------------------------------------------------
+def pages():
+    aOutputs = []
+    for dQuery in _QUERIES:
+        dBriefcase = dict({"iIdx":0, "iMax_res":4}, **dQuery)
+        dOutput = shop.list_products(dBriefcase)
+        assert dOutput["sStatus"] == "OK"
+        aOutputs.append(dOutput)
+    return aOutputs
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module", autouse=True)
+def products():
+    aValues = [
+        ("ENC-1", "Żółw", "Encoding kurtka \"puchowa\"", "Zielony", 0.1, 3,
+            ["https://example.com/ż.jpg"]),
+        ("ENC-2", "Café", "Encoding naïve   tab\t", "Zielony", 1e22, 0,
+            []),
+        ("ENC-3", "日本", "Encoding 日本語 </script>", "Blue", 19.99, 7,
+            ["a", "b"]),
+        ("ENC-4", "B", "Encoding emoji \U0001F600 \\", "Red", 5.0, 1, []),
+        ("ENC-5", "B", "Encoding plain", "Red", 123456.789, 2, []),
+    ]
+    for sItem_id, sBrand, sDesc, sColour, fPrice, iStock, aPhotos in aValues:
+        shop.add_product({"sItem_id":sItem_id, "sBrand":sBrand,
+            "sDesc":sDesc, "sSize":"M", "sColour":sColour, "fPrice":fPrice,
+            "sCurrency":"PLN", "iStock":iStock, "aPhotos":aPhotos})
+
+#-------------------------------------------------------------------------------
+def test_pages_encode_byte_identical():
+    for dOutput in pages():
+        assert isinstance(dOutput, encoding.Page)
+        assert shop.encode_response(dOutput) == expected(dOutput)
+
+#-------------------------------------------------------------------------------
+def test_cached_pages_encode_byte_identical():
+    aFirst = [shop.encode_response(dOutput) for dOutput in pages()]
+    aOutputs = pages()
+    for bFirst, dOutput in zip(aFirst, aOutputs):
+        assert shop.encode_response(dOutput) == bFirst == expected(dOutput)
+
+#-------------------------------------------------------------------------------
+def test_stock_and_price_changes_encode_byte_identical():
+    sBasket_code = shop.create_order(
+        shop.issue_auth_token("encoding"))["sBasket_code"]
+    assert shop.update_order({"sBasket_code":sBasket_code,
+        "sItem_id":"ENC-3", "iQty":2})["sStatus"] == "OK"
+    shop._oCatalogue.set_price("ENC-5", 0.3)
+    for dOutput in pages():
+        assert shop.encode_response(dOutput) == expected(dOutput)
+    assert [dItem["iStock"] for dItem in pages()[0]["aItems"]
+        if dItem["sItem_id"] == "ENC-3"] == [5]
+
+#-------------------------------------------------------------------------------
+def test_snapshot_pages_encode_byte_identical(tmp_path):
+    sPath = str(tmp_path / "catalogue.snap")
+    shop.publish_snapshot(sPath)
+    shop.use_snapshot(sPath)
+    try:
+        for dOutput in pages():
+            assert shop.encode_response(dOutput) == expected(dOutput)
+    finally:
+        shop._oSnapshots = None
+
+#-------------------------------------------------------------------------------
+def test_snapshot_keeps_a_bounded_number_of_fragments(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "FRAGMENT_MEMORY", 2)
+    sPath = str(tmp_path / "catalogue.snap")
+    shop.publish_snapshot(sPath)
+    shop.use_snapshot(sPath)
+    try:
+        for _ in range(2):
+            for dOutput in pages():
+                assert shop.encode_response(dOutput) == expected(dOutput)
+        assert len(shop._oSnapshots.current()._dFragments) == 2
+    finally:
+        shop._oSnapshots = None
+
+#-------------------------------------------------------------------------------
+def test_other_outputs_encode_byte_identical():
+    for dOutput in ({"sStatus":"ERROR", "sErr_desc":"data validation"},
+            {"sStatus":"OK", "aItems":[], "iIdx_n":0},
+            {"sStatus":"OK", "aItems":[{"sItem_id":"Ł", "fPrice":1.5}]}):
+        assert encoding.encode(dOutput) == expected(dOutput)
@@ -0,0 +1,67 @@
+""" # Tests: timer wheel
+-----
+Checks 'expiry.TimerWheel' against a plain dictionary of deadlines: every key
+fires in the first 'advance' reaching its deadline (never early, never
+late), in deadline order, across cascades between levels and deadlines
+parked beyond the wheel's horizon.
+"""
+
+import math
+import random
+
+import pytest
+
+import expiry
+
+#-------------------------------------------------------------------------------
+def test_fires_on_time():
+    oWheel = expiry.TimerWheel(fTick=1.0, fStart=0.0)
+    oWheel.schedule("a", 10.0)
+    oWheel.schedule("b", 4.5)
+    assert oWheel.advance(4.0) == []
+    assert oWheel.advance(5.0) == ["b"]
+    assert oWheel.advance(9.99) == []
+    assert oWheel.advance(10.0) == ["a"]
+    assert len(oWheel) == 0
+
+#-------------------------------------------------------------------------------
+def test_moved_and_cancelled_keys():
+    oWheel = expiry.TimerWheel(fTick=1.0, fStart=0.0)
+    for sKey in "abc":
+        oWheel.schedule(sKey, 5.0)
+    oWheel.schedule("a", 100.0)     # later
+    oWheel.schedule("b", 2.0)       # earlier
+    oWheel.cancel("c")
+    assert oWheel.advance(50.0) == ["b"]
+    assert "a" in oWheel and "c" not in oWheel
+    assert oWheel.advance(99.0) == []
+    assert oWheel.advance(100.0) == ["a"]
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("iSeed", range(5))
+def test_matches_reference(iSeed):
+    oRandom = random.Random(iSeed)
+    oWheel = expiry.TimerWheel(fTick=1.0, iBits=2, iLevels=3, fStart=0.0)
+    dDue = {}           # key -> tick it must fire at
+    iNow = 0
+    for _ in range(400):
+        for _ in range(oRandom.randint(0, 6)):
+            xKey = oRandom.randrange(60)
+            if xKey in dDue and oRandom.random() < 0.2:
+                oWheel.cancel(xKey)
+                del dDue[xKey]
+                continue
+            fDeadline = iNow + oRandom.uniform(-3, 300)
+            oWheel.schedule(xKey, fDeadline)
+            dDue[xKey] = max(math.ceil(fDeadline), iNow + 1)
+        iNow += oRandom.choice((0, 1, 1, 2, 5, 17, 70))
+        aExpired = oWheel.advance(float(iNow))
+
+        setExpected = {xKey for xKey, iDue in dDue.items() if iDue <= iNow}
+        assert set(aExpired) == setExpected
+        assert len(aExpired) == len(setExpected)
+        aTicks = [dDue[xKey] for xKey in aExpired]
+        assert aTicks == sorted(aTicks)
+        for xKey in aExpired:
+            del dDue[xKey]
+        assert len(oWheel) == len(dDue)
@@ -0,0 +1,140 @@
+""" # Tests: faceted selection
+-----
+'facets.select' has a NumPy path and a pure-Python fallback. Both must give
+the same hits, page and facet counts for every kind of query, including
+continuation after a cursor position; the comparison is skipped when NumPy
+is missing. Queries on the NumPy path must not get in the way of products
+being added at the same time.
+"""
+
+import itertools
+import random
+import threading
+
+import pytest
+
+import catalogue
+import facets
+
+np = pytest.importorskip("numpy")
+
+_BRANDS = ("Acme", "Borealis", "Żubr", "Zeta")
+_COLOURS = ("Red", "Blue", "Green", "Black")
+_SIZES = ("S", "M", "L")
+_WORDS = ("coat", "jacket", "wool", "linen", "summer", "winter")
+
+# Briefcases run against the catalogue, each with every sort order
+_BRIEFCASES = [
+    {},
+    {"sItem_filter":"coat"},
+    {"sItem_filter":"wool winter"},
+    {"sItem_filter":"nothing"},
+    {"sBrand":"Acme"},
+    {"sBrand":["Żubr", "Zeta", "Unknown"], "sColour":"Red"},
+    {"sSize":"M", "bIn_stock":True},
+    {"fPrice_min":20.0, "fPrice_max":60.0},
+    {"sItem_filter":"jacket", "fPrice_max":35.5, "bIn_stock":True},
+    {"sCurrency":"EUR", "sColour":["Blue", "Black"]},
+]
+_CASES = list(itertools.product(_BRIEFCASES, facets.SORT_ORDERS))
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def shop_catalogue():
+    """A catalogue with repeated prices and rows of removed products."""
+    oRandom = random.Random(4)
+    oCatalogue = catalogue.Catalogue()
+    for iItem in range(600):
+        oCatalogue.add({"sItem_id":"F-%04d" % oRandom.randrange(10000),
+            "sBrand":oRandom.choice(_BRANDS),
+            "sDesc":" ".join(oRandom.sample(_WORDS, 2)),
+            "sSize":oRandom.choice(_SIZES),
+            "sColour":oRandom.choice(_COLOURS),
+            "fPrice":oRandom.choice((9.99, 19.5, 35.5, 60.0, 120.0)),
+            "sCurrency":oRandom.choice(("PLN", "EUR")),
+            "iStock":oRandom.choice((0, 0, 1, 5)), "aPhotos":[]})
+    aItem_id = [sItem_id for sItem_id, bLive in zip(oCatalogue.aItem_id,
+        oCatalogue.aLive) if bLive]
+    for sItem_id in oRandom.sample(aItem_id, 60):
+        oCatalogue.remove(sItem_id)
+    return oCatalogue
+
+#-------------------------------------------------------------------------------
+def both(oCatalogue, dQuery, iIdx, iMax_res, tAfter=None):
+    dNumpy = facets._select_numpy(oCatalogue, dQuery, iIdx, iMax_res, tAfter)
+    dPython = facets._select_python(oCatalogue, dQuery, iIdx, iMax_res,
+        tAfter)
+    assert dNumpy == dPython
+    return dNumpy
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("dBriefcase, sSort", _CASES)
+def test_paths_agree(shop_catalogue, dBriefcase, sSort):
+    dQuery = facets.normalise_query(dict(dBriefcase, sSort=sSort,
+        bFacets=True))
+    dResult = both(shop_catalogue, dQuery, 0, 10 ** 6)
+    for iIdx, iMax_res in ((0, 7), (5, 13), (dResult["iSearch_tot"], 5)):
+        both(shop_catalogue, dQuery, iIdx, iMax_res)
+    dQuery["bFacets"] = False
+    both(shop_catalogue, dQuery, 0, 10)
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("dBriefcase, sSort", _CASES)
+def test_paths_agree_after_a_cursor(shop_catalogue, dBriefcase, sSort):
+    dQuery = facets.normalise_query(dict(dBriefcase, sSort=sSort))
+    aRows = both(shop_catalogue, dQuery, 0, 10 ** 6)["aRows"]
+    aPages = []
+    tAfter = None
+    while True:
+        aPage = both(shop_catalogue, dQuery, 0, 9, tAfter)["aRows"]
+        if not aPage:
+            break
+        aPages += aPage
+        tAfter = (facets.sort_key(shop_catalogue, sSort, aPage[-1]),
+            shop_catalogue.aItem_id[aPage[-1]])
+    assert aPages == aRows
+
+#-------------------------------------------------------------------------------
+def test_queries_while_products_are_added():
+    """The NumPy path keeps no view of a column: a product added while a
+    query runs must neither fail nor leave the columns out of step."""
+    oCatalogue = catalogue.Catalogue()
+    aErrors = []
+    oDone = threading.Event()
+    dQuery = facets.normalise_query({"sItem_filter":"coat", "bFacets":True,
+        "sSort":"fPrice_asc", "bIn_stock":True, "sBrand":"Acme"})
+
+    def add():
+        try:
+            for iItem in range(3000):
+                oCatalogue.add({"sItem_id":"C-%05d" % iItem,
+                    "sBrand":_BRANDS[iItem % len(_BRANDS)],
+                    "sDesc":_WORDS[iItem % len(_WORDS)],
+                    "sSize":_SIZES[iItem % len(_SIZES)],
+                    "sColour":_COLOURS[iItem % len(_COLOURS)],
+                    "fPrice":float(iItem % 50), "sCurrency":"PLN",
+                    "iStock":iItem % 3, "aPhotos":[]})
+        except Exception as oError:
+            aErrors.append(oError)
+        finally:
+            oDone.set()
+
+    def query():
+        try:
+            while not oDone.is_set():
+                facets._select_numpy(oCatalogue, dQuery, 0, 20, None)
+        except Exception as oError:
+            aErrors.append(oError)
+
+    aThreads = [threading.Thread(target=add)] + [threading.Thread(
+        target=query) for _ in range(3)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    assert aErrors == []
+    assert len(oCatalogue) == 3000
+    for aColumn in (oCatalogue.aPrice, oCatalogue.aStock, oCatalogue.aLive,
+            oCatalogue.oBrand.aCodes, oCatalogue.aFragments):
+        assert len(aColumn) == 3000
+    both(oCatalogue, dQuery, 0, 20)
@@ -0,0 +1,101 @@
+""" # Tests: streaming catalogue import
+-----
+'importer.import_feed' loads CSV and JSON-lines feeds batch by batch,
+rejecting records which fail validation; the catalogue's listeners hear of
+each batch once rather than of each product, and a complete feed withdraws
+the products missing from it.
+"""
+
+import gzip
+import json
+import time
+
+import baskets
+import cache
+import catalogue
+import importer
+import reservations
+
+#-------------------------------------------------------------------------------
+def product(sItem_id, iStock=5):
+    return {"sItem_id":sItem_id, "sBrand":"Test", "sDesc":"Imported coat",
+        "sSize":"M", "sColour":"Red", "fPrice":19.5, "sCurrency":"PLN",
+        "iStock":iStock, "aPhotos":["https://example.com/%s.jpg" % sItem_id]}
+
+#-------------------------------------------------------------------------------
+def jsonl_feed(tmp_path, aProducts, sName="feed.jsonl.gz"):
+    sPath = str(tmp_path / sName)
+    with gzip.open(sPath, "wt", encoding="utf-8") as oFile:
+        for dProduct in aProducts:
+            oFile.write(json.dumps(dProduct) + "\n")
+    return sPath
+
+#-------------------------------------------------------------------------------
+def listened(oCatalogue):
+    aChanges = []
+    oCatalogue.add_listener(lambda sItem_id, sField:
+        aChanges.append((sItem_id, sField)))
+    return aChanges
+
+#-------------------------------------------------------------------------------
+def test_csv_feed_is_validated(tmp_path):
+    oPath = tmp_path / "feed.csv"
+    oPath.write_text(
+        "sItem_id,sBrand,sDesc,sSize,sColour,fPrice,sCurrency,iStock,aPhotos\n"
+        "C-1,Test,Imported coat,M,Red,19.5,PLN,5,a.jpg|b.jpg\n"
+        "C-2,Test,Imported coat,M,Red,cheap,PLN,5,\n"
+        "C-3,Test,Imported coat,M,Red,9,PLN,2,\n", encoding="utf-8")
+    oCatalogue = catalogue.Catalogue()
+    dReport = importer.import_feed(str(oPath), oCatalogue)
+    assert (dReport["iRead"], dReport["iImported"], dReport["iRejected"]) \
+        == (3, 2, 1)
+    assert [iLine for iLine, _ in dReport["aErrors"]] == [3]
+    assert oCatalogue.get("C-1")["aPhotos"] == ["a.jpg", "b.jpg"]
+    assert oCatalogue.get("C-3")["fPrice"] == 9.0
+    assert "C-2" not in oCatalogue
+
+#-------------------------------------------------------------------------------
+def test_listeners_hear_once_per_batch(tmp_path):
+    oCatalogue = catalogue.Catalogue()
+    oCache = cache.ResultCache()
+    oCatalogue.add_listener(oCache.on_change)
+    aChanges = listened(oCatalogue)
+    oCache.put("plain", {"sStatus":"OK"}, [])
+    sPath = jsonl_feed(tmp_path, [product("J-%04d" % i) for i in range(25)])
+    dReport = importer.import_feed(sPath, oCatalogue, iBatch=10)
+    assert dReport["iImported"] == 25
+    assert aChanges == [(None, None)] * 3
+    assert len(oCache) == 0
+    assert oCache.stats()["iInvalidations"] == 1
+    # Outside a batch, products are still announced one by one
+    oCatalogue.add(product("J-0000", 7))
+    assert aChanges[-1] == ("J-0000", None)
+
+#-------------------------------------------------------------------------------
+def test_complete_feed_withdraws_missing_products(tmp_path):
+    oCatalogue = catalogue.Catalogue()
+    for sItem_id in ("R-1", "R-2", "R-3", "R-4"):
+        oCatalogue.add(product(sItem_id))
+    oCatalogue.remove("R-1")
+    aChanges = listened(oCatalogue)
+    sPath = jsonl_feed(tmp_path, [product("R-3"), product("R-5"),
+        product("R-6")])
+    dReport = importer.import_feed(sPath, oCatalogue, bReplace=True,
+        iBatch=2)
+    assert (dReport["iImported"], dReport["iRemoved"]) == (3, 2)
+    assert sorted(oCatalogue._dRows) == ["R-3", "R-5", "R-6"]
+    assert aChanges == [(None, None)] * 3
+
+#-------------------------------------------------------------------------------
+def test_feed_stock_is_net_of_held_units(tmp_path):
+    oCatalogue = catalogue.Catalogue()
+    oCatalogue.add(product("H-1", 5))
+    oEngine = reservations.ReservationEngine(oCatalogue)
+    oBasket = baskets.Basket("B-1", "token", "PL", time.time() + 60)
+    assert oEngine.reserve(oBasket, "H-1", 2) is None
+    sPath = jsonl_feed(tmp_path, [product("H-1", 10), product("H-2", 4)])
+    dReport = importer.import_feed(sPath, oCatalogue, bReplace=True,
+        oReservations=oEngine)
+    assert dReport["iRemoved"] == 0
+    assert oCatalogue.stock("H-1") == 8
+    assert oCatalogue.stock("H-2") == 4
@@ -0,0 +1,107 @@
+""" # Tests: invoice codes
+-----
+Invoice codes must never repeat: not between threads drawing them at once,
+and not across restarts of the shop on the same database, whether it closed
+cleanly or crashed.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import invoices
+import storage
+
+# Runs in a fresh interpreter: checks out 'iShoppers' baskets at once on the
+# database of SHOP_DB and prints the invoice codes; exits without the atexit
+# handlers (as a crash would) when 'bCrash'.
+_SHOP_RUN = """
+import json, os, sys, threading
+import shop
+iShoppers, bCrash = int(sys.argv[1]), sys.argv[2] == "crash"
+shop.add_product({"sItem_id":"I-INV", "sBrand":"Test", "sDesc":"Invoice test",
+    "sSize":"M", "sColour":"Red", "fPrice":9.99, "sCurrency":"PLN",
+    "iStock":iShoppers, "aPhotos":[]})
+aCodes = []
+def shopper(iShopper):
+    sAuth_token = shop.issue_auth_token("inv-%d" % iShopper)
+    sBasket_code = shop.create_order(sAuth_token)["sBasket_code"]
+    shop.update_order({"sBasket_code":sBasket_code, "sItem_id":"I-INV",
+        "iQty":1})
+    aCodes.append(shop.checkout_order({"sBasket_code":sBasket_code,
+        "sAuth_token":sAuth_token}).get("sInvoice_code"))
+aThreads = [threading.Thread(target=shopper, args=(i,))
+    for i in range(iShoppers)]
+for oThread in aThreads:
+    oThread.start()
+for oThread in aThreads:
+    oThread.join()
+print(json.dumps(aCodes), flush=True)
+if bCrash:
+    os._exit(0)
+"""
+
+#-------------------------------------------------------------------------------
+def draw(oNumbers, iThreads, iCount):
+    """Every number drawn by 'iThreads' threads taking 'iCount' each."""
+    aNumbers = []
+    oLock = threading.Lock()
+    def worker():
+        aMine = [oNumbers.next() for _ in range(iCount)]
+        with oLock:
+            aNumbers.extend(aMine)
+    aThreads = [threading.Thread(target=worker) for _ in range(iThreads)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    return aNumbers
+
+#-------------------------------------------------------------------------------
+def test_threads_never_share_a_number():
+    oNumbers = invoices.InvoiceNumbers(invoices.MemorySource(), iBlock=8)
+    aNumbers = draw(oNumbers, 16, 500)
+    assert len(aNumbers) == len(set(aNumbers)) == 16 * 500
+
+#-------------------------------------------------------------------------------
+def test_restarts_never_reuse_a_number(tmp_path):
+    sPath = str(tmp_path / "shop.db")
+    aNumbers = []
+    for bClose in (True, False, True, False):
+        oStorage = storage.SQLiteStorage(sPath)
+        oNumbers = invoices.InvoiceNumbers(invoices.StorageSource(oStorage))
+        aNumbers += draw(oNumbers, 8, 100)
+        if bClose:
+            oNumbers.close()
+        oStorage.close()
+    assert len(aNumbers) == len(set(aNumbers))
+
+#-------------------------------------------------------------------------------
+def test_clean_restart_carries_on_where_codes_left_off(tmp_path):
+    sPath = str(tmp_path / "shop.db")
+    oStorage = storage.SQLiteStorage(sPath)
+    oNumbers = invoices.InvoiceNumbers(invoices.StorageSource(oStorage))
+    aNumbers = [oNumbers.next() for _ in range(5)]
+    oNumbers.close()
+    oStorage.close()
+
+    oStorage = storage.SQLiteStorage(sPath)
+    oNumbers = invoices.InvoiceNumbers(invoices.StorageSource(oStorage))
+    assert oNumbers.next() == max(aNumbers) + 1
+    oStorage.close()
+
+#-------------------------------------------------------------------------------
+def test_checkout_codes_unique_across_shop_restarts(tmp_path):
+    dEnv = dict(os.environ, SHOP_DB=str(tmp_path / "shop.db"))
+    dEnv.pop("SHOP_CHECKOUT_LOG", None)
+    sRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    aCodes = []
+    for sEnd in ("exit", "crash", "crash", "exit"):
+        oRun = subprocess.run([sys.executable, "-c", _SHOP_RUN, "40", sEnd],
+            cwd=sRoot, env=dEnv, capture_output=True, text=True, timeout=120,
+            check=True)
+        aCodes += json.loads(oRun.stdout.splitlines()[-1])
+    assert None not in aCodes
+    assert len(aCodes) == len(set(aCodes)) == 4 * 40
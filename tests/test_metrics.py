@@ -0,0 +1,132 @@
+""" # Tests: API metrics
+-----
+The log-linear histogram buckets hold every latency within their precision,
+'Metrics.instrument' counts each call and its outcome from any thread, and
+the Prometheus text carries the documented series, with label values
+escaped.
+"""
+
+import gc
+import random
+import threading
+
+import pytest
+
+import metrics
+
+#-------------------------------------------------------------------------------
+def test_buckets_hold_their_values():
+    oRandom = random.Random(1)
+    aValues = list(range(1 << (metrics.SUB_BITS + 1)))
+    aValues += [oRandom.randrange(1 << iBits)
+        for iBits in range(metrics.SUB_BITS, metrics.MAX_BITS)
+        for _ in range(50)]
+    iPrevious = 0
+    for iNs in sorted(aValues):
+        iBucket = metrics.bucket_of(iNs)
+        assert iBucket >= iPrevious
+        iPrevious = iBucket
+        iLow, iHigh = metrics.bucket_range(iBucket)
+        assert iLow <= iNs <= iHigh
+        if iNs < 1 << metrics.SUB_BITS:
+            assert iLow == iHigh
+        else:
+            assert iHigh - iLow < iLow / (1 << (metrics.SUB_BITS - 1))
+
+#-------------------------------------------------------------------------------
+def test_huge_latencies_share_the_last_bucket():
+    iLast = metrics.bucket_of(1 << 60)
+    assert iLast == metrics._BUCKETS - 1
+    assert metrics.bucket_of(1 << 62) == iLast
+
+#-------------------------------------------------------------------------------
+def test_instrument_counts_outcomes():
+    oMetrics = metrics.Metrics()
+    def answer(xOutput):
+        if xOutput is None:
+            raise KeyError("boom")
+        return xOutput
+    fnWrapped = oMetrics.instrument(answer, "answer")
+    assert fnWrapped.__name__ == "answer"
+    for xOutput in ({"sStatus":"OK"}, {"sStatus":"OK"},
+            {"sStatus":"ERROR", "sErr_desc":"item not found"}, "plain"):
+        assert fnWrapped(xOutput) == xOutput
+    with pytest.raises(KeyError):
+        fnWrapped(None)
+    dFigures = oMetrics.snapshot()["answer"]
+    assert dFigures["iCount"] == 5
+    assert dFigures["dOutcomes"] == {"OK":3, "exception":1,
+        "item not found":1}
+    assert 0 < dFigures["fP50"] <= dFigures["fP99"] <= dFigures["fMax"]
+
+#-------------------------------------------------------------------------------
+def test_quantiles_are_within_precision():
+    oMetrics = metrics.Metrics()
+    for iNs in range(1, 10001):
+        oMetrics.record("f", iNs * 1000, "OK")
+    dFigures = oMetrics.snapshot()["f"]
+    fPrecision = 1.0 / (1 << (metrics.SUB_BITS - 1))
+    for sKey, fExpected in (("fP50", 5e-3), ("fP95", 9.5e-3),
+            ("fP99", 9.9e-3)):
+        assert abs(dFigures[sKey] - fExpected) <= fExpected * fPrecision
+    assert dFigures["fMax"] == 1e-2
+    assert dFigures["fMean"] == pytest.approx(5.0005e-3)
+
+#-------------------------------------------------------------------------------
+def test_threads_are_counted_after_they_end():
+    oMetrics = metrics.Metrics()
+    fnWrapped = oMetrics.instrument(lambda: {"sStatus":"OK"}, "f")
+    aThreads = [threading.Thread(target=lambda: [fnWrapped()
+        for _ in range(1000)]) for _ in range(4)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+    del aThreads
+    gc.collect()
+    assert len(oMetrics._dThreads) == 0
+    assert oMetrics.snapshot()["f"]["iCount"] == 4000
+    oMetrics.reset()
+    assert oMetrics.snapshot() == {}
+
+#-------------------------------------------------------------------------------
+def test_export_and_merge():
+    oSource = metrics.Metrics()
+    for iNs in (500, 70000, 3 * 10 ** 9):
+        oSource.record("f", iNs, "OK")
+    oSource.record("f", 900, "sold out")
+    oTarget = metrics.Metrics()
+    oTarget.record("f", 100, "OK")
+    oTarget.merge(oSource.export())
+    dFigures = oTarget.snapshot()["f"]
+    assert dFigures["iCount"] == 5
+    assert dFigures["dOutcomes"] == {"OK":4, "sold out":1}
+    assert dFigures["fMax"] == 3.0
+
+#-------------------------------------------------------------------------------
+def test_prometheus_text():
+    oMetrics = metrics.Metrics()
+    for iNs in (1000, 2000, 3000):
+        oMetrics.record("list_products", iNs, "OK")
+    oMetrics.record("list_products", 4000, 'bad "quote"\n')
+    aLines = oMetrics.prometheus().splitlines()
+    for sMetric, sType in (("request_seconds", "summary"),
+            ("request_max_seconds", "gauge"), ("requests_total", "counter")):
+        assert "# TYPE shop_%s %s" % (sMetric, sType) in aLines
+        assert any(sLine.startswith("# HELP shop_%s " % sMetric)
+            for sLine in aLines)
+    dValues = {}
+    for sLine in aLines:
+        if not sLine.startswith("#"):
+            sSeries, sValue = sLine.rsplit(" ", 1)
+            dValues[sSeries] = float(sValue)
+    sLabel = 'function="list_products"'
+    assert dValues["shop_request_seconds_count{%s}" % sLabel] == 4
+    assert dValues["shop_request_seconds_sum{%s}" % sLabel] \
+        == pytest.approx(1e-5)
+    assert dValues['shop_request_seconds{%s,quantile="0.5"}' % sLabel] \
+        == pytest.approx(2e-6, rel=0.02)
+    assert dValues["shop_request_max_seconds{%s}" % sLabel] == 4e-6
+    assert dValues['shop_requests_total{%s,outcome="OK"}' % sLabel] == 3
+    assert dValues['shop_requests_total{%s,outcome="bad \\"quote\\"\\n"}'
+        % sLabel] == 1
@@ -0,0 +1,144 @@
+""" # Tests: basket contents
+-----
+'list_orders' returns the whole basket with its version, only the lines
+changed since a version the caller passes back, or "NOT MODIFIED" when there
+are none. 'update_order_batch' reserves each line on its own, with the
+errors 'update_order' would give it.
+"""
+
+import pytest
+
+import rules
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def shop(shop_state):
+    for sItem_id, fPrice, iStock in (("LO-1", 14.99, 20), ("LO-2", 5.0, 10),
+            ("LO-3", 2.5, 2)):
+        shop_state.add_product({"sItem_id":sItem_id, "sBrand":"Test",
+            "sDesc":"Orders test flag", "sSize":"M", "sColour":"Red",
+            "fPrice":fPrice, "sCurrency":"PLN", "iStock":iStock,
+            "aPhotos":[]})
+    return shop_state
+
+#-------------------------------------------------------------------------------
+def basket(shop):
+    return shop.create_order(shop.issue_auth_token("orders"))["sBasket_code"]
+
+def update(shop, sBasket_code, sItem_id, iQty):
+    dOutput = shop.update_order({"sBasket_code":sBasket_code,
+        "sItem_id":sItem_id, "iQty":iQty})
+    assert dOutput["sStatus"] == "OK"
+
+def lines(dOutput):
+    return [(dLine["sItem_id"], dLine["iQty"]) for dLine in dOutput["aItems"]]
+
+#-------------------------------------------------------------------------------
+def test_whole_basket_and_versions(shop):
+    sBasket_code = basket(shop)
+    assert shop.list_orders(sBasket_code) \
+        == {"sStatus":"OK", "iVersion":0, "bDelta":False, "aItems":[]}
+    update(shop, sBasket_code, "LO-1", 3)
+    update(shop, sBasket_code, "LO-2", 1)
+    dOutput = shop.list_orders(sBasket_code)
+    assert (dOutput["iVersion"], dOutput["bDelta"]) == (2, False)
+    assert "aRemoved" not in dOutput
+    assert lines(dOutput) == [("LO-1", 3), ("LO-2", 1)]
+    dLine = dOutput["aItems"][0]
+    assert (dLine["sDesc"], dLine["sItem_currency"], dLine["fUnit_price"],
+        dLine["fTotal_price"]) == ("Orders test flag", "PLN", 14.99, 44.97)
+
+#-------------------------------------------------------------------------------
+def test_not_modified(shop):
+    sBasket_code = basket(shop)
+    assert shop.list_orders(sBasket_code, 0) \
+        == {"sStatus":"NOT MODIFIED", "iVersion":0}
+    update(shop, sBasket_code, "LO-1", 1)
+    assert shop.list_orders(sBasket_code, 1) \
+        == {"sStatus":"NOT MODIFIED", "iVersion":1}
+
+#-------------------------------------------------------------------------------
+def test_deltas(shop):
+    sBasket_code = basket(shop)
+    update(shop, sBasket_code, "LO-1", 2)
+    update(shop, sBasket_code, "LO-2", 1)
+    dOutput = shop.list_orders(sBasket_code, 1)
+    assert (dOutput["iVersion"], dOutput["bDelta"]) == (2, True)
+    assert (lines(dOutput), dOutput["aRemoved"]) == ([("LO-2", 1)], [])
+
+    update(shop, sBasket_code, "LO-1", 1)
+    assert shop.delete_order({"sBasket_code":sBasket_code,
+        "sItem_id":"LO-2", "iQty":1})["sStatus"] == "OK"
+    dOutput = shop.list_orders(sBasket_code, 2)
+    assert dOutput["iVersion"] == 4
+    assert (lines(dOutput), dOutput["aRemoved"]) == ([("LO-1", 3)], ["LO-2"])
+    # From the start: a line added and removed since is reported removed
+    dOutput = shop.list_orders(sBasket_code, 0)
+    assert (lines(dOutput), dOutput["aRemoved"]) == ([("LO-1", 3)], ["LO-2"])
+    assert lines(shop.list_orders(sBasket_code)) == [("LO-1", 3)]
+
+#-------------------------------------------------------------------------------
+def test_unusable_versions_give_the_whole_basket(shop):
+    sBasket_code = basket(shop)
+    update(shop, sBasket_code, "LO-1", 1)
+    for xVersion in (7, -1, "0", True, 0.0):
+        dOutput = shop.list_orders(sBasket_code, xVersion)
+        assert (dOutput["sStatus"], dOutput["bDelta"]) == ("OK", False)
+        assert lines(dOutput) == [("LO-1", 1)]
+
+#-------------------------------------------------------------------------------
+def test_unknown_basket(shop):
+    assert shop.list_orders("not a basket code", 0) \
+        == {"sStatus":"ERROR", "sErr_desc":"invalid token"}
+
+#-------------------------------------------------------------------------------
+def test_batch_lines_succeed_or_fail_on_their_own(shop):
+    sBasket_code = basket(shop)
+    iStock = shop._oCatalogue.stock("LO-1")
+    dOutput = shop.update_order_batch({"sBasket_code":sBasket_code,
+        "aLines":[{"sItem_id":"LO-1", "iQty":2}, {"sItem_id":"LO-9", "iQty":1},
+        {"sItem_id":"LO-3", "iQty":5}, {"sItem_id":"LO-1", "iQty":0},
+        {"sItem_id":7, "iQty":1}, {"sItem_id":"LO-3", "iQty":2},
+        {"sItem_id":"LO-3", "iQty":1}]})
+    assert dOutput == {"sStatus":"OK", "aLines":[
+        {"sItem_id":"LO-1", "sStatus":"OK"},
+        {"sItem_id":"LO-9", "sStatus":"ERROR",
+            "sErr_desc":"item does not exist"},
+        {"sItem_id":"LO-3", "sStatus":"ERROR", "sErr_desc":"partial order"},
+        {"sItem_id":"LO-1", "sStatus":"ERROR",
+            "sErr_desc":"data validation"},
+        {"sItem_id":7, "sStatus":"ERROR", "sErr_desc":"data validation"},
+        {"sItem_id":"LO-3", "sStatus":"OK"},
+        {"sItem_id":"LO-3", "sStatus":"ERROR", "sErr_desc":"item sold out"}]}
+    assert lines(shop.list_orders(sBasket_code)) == [("LO-1", 2), ("LO-3", 2)]
+    assert shop._oCatalogue.stock("LO-1") == iStock - 2
+    assert shop._oCatalogue.stock("LO-3") == 0
+
+#-------------------------------------------------------------------------------
+def test_batch_applies_the_rules(shop):
+    sBasket_code = basket(shop)
+    oRules = shop._oRules._oRules
+    shop._oRules.install(rules.RuleSet([
+        {"sKind":"max_qty", "sItem_id":"LO-2", "iMax_qty":2},
+        {"sKind":"deny", "sItem_id":"LO-1"}]))
+    try:
+        dOutput = shop.update_order_batch({"sBasket_code":sBasket_code,
+            "aLines":[{"sItem_id":"LO-2", "iQty":2},
+            {"sItem_id":"LO-2", "iQty":1}, {"sItem_id":"LO-1", "iQty":1}]})
+    finally:
+        shop._oRules.install(oRules)
+    assert [dLine.get("sErr_desc") for dLine in dOutput["aLines"]] \
+        == [None, "maximum quantity exceeded", "not available"]
+    assert lines(shop.list_orders(sBasket_code)) == [("LO-2", 2)]
+
+#-------------------------------------------------------------------------------
+def test_batch_errors(shop):
+    sBasket_code = basket(shop)
+    for dBriefcase in ({"sBasket_code":sBasket_code},
+            {"sBasket_code":sBasket_code, "aLines":[{"sItem_id":"LO-1"}]},
+            {"sBasket_code":sBasket_code, "aLines":7}, None):
+        assert shop.update_order_batch(dBriefcase) \
+            == {"sStatus":"ERROR", "sErr_desc":"data validation"}
+    assert shop.update_order_batch({"sBasket_code":"not a basket code",
+        "aLines":[]}) == {"sStatus":"ERROR", "sErr_desc":"invalid basket"}
+    assert shop.list_orders(sBasket_code)["iVersion"] == 0
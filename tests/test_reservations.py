@@ -0,0 +1,132 @@
+""" # Tests: stock reservations
+-----
+Concurrent 'update_order' / 'delete_order' calls must never sell more than
+there is: for every item, the stock left plus the units held in baskets is
+the stock it started with, and each basket holds what its caller was told.
+"""
+
+import random
+import sys
+import threading
+
+import pytest
+
+import shop
+
+#-------------------------------------------------------------------------------
+@pytest.fixture
+def fast_switching():
+    """Makes threads interleave as often as possible."""
+    fInterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(fInterval)
+
+#-------------------------------------------------------------------------------
+def add_items(sPrefix, iItems, iStock):
+    aItems = ["%s-%02d" % (sPrefix, i) for i in range(iItems)]
+    for sItem_id in aItems:
+        shop.add_product({"sItem_id":sItem_id, "sBrand":"Test",
+            "sDesc":"Reservation test item", "sSize":"M", "sColour":"Red",
+            "fPrice":9.99, "sCurrency":"PLN", "iStock":iStock, "aPhotos":[]})
+    return aItems
+
+#-------------------------------------------------------------------------------
+def open_basket(sUser_id):
+    return shop.create_order(shop.issue_auth_token(sUser_id))["sBasket_code"]
+
+#-------------------------------------------------------------------------------
+def run_threads(iThreads, fnTarget):
+    oBarrier = threading.Barrier(iThreads)
+    def worker(iThread):
+        oBarrier.wait()
+        fnTarget(iThread)
+    aThreads = [threading.Thread(target=worker, args=(i,))
+        for i in range(iThreads)]
+    for oThread in aThreads:
+        oThread.start()
+    for oThread in aThreads:
+        oThread.join()
+
+#-------------------------------------------------------------------------------
+def test_last_unit_goes_to_one_basket(fast_switching):
+    sItem_id, = add_items("LAST", 1, 1)
+    aBaskets = [open_basket("last-%d" % i) for i in range(50)]
+    aOutputs = [None] * len(aBaskets)
+    def reserve(iThread):
+        aOutputs[iThread] = shop.update_order({
+            "sBasket_code":aBaskets[iThread], "sItem_id":sItem_id, "iQty":1})
+    run_threads(len(aBaskets), reserve)
+
+    aStatus = [dOutput["sStatus"] for dOutput in aOutputs]
+    assert aStatus.count("OK") == 1
+    assert {dOutput["sErr_desc"] for dOutput in aOutputs
+        if dOutput["sStatus"] != "OK"} == {"item sold out"}
+    assert shop._oCatalogue.stock(sItem_id) == 0
+
+#-------------------------------------------------------------------------------
+def test_no_overselling_under_concurrent_changes(fast_switching):
+    iStock = 200
+    aItems = add_items("HOT", 3, iStock)
+    iThreads = 40
+    aBaskets = [open_basket("hot-%d" % i) for i in range(iThreads)]
+    aHeld = [{} for _ in range(iThreads)]
+    def shopper(iThread):
+        oRandom = random.Random(iThread)
+        dHeld = aHeld[iThread]
+        for _ in range(100):
+            sItem_id = oRandom.choice(aItems)
+            iQty = oRandom.randint(1, 4)
+            dBriefcase = {"sBasket_code":aBaskets[iThread],
+                "sItem_id":sItem_id, "iQty":iQty}
+            if dHeld.get(sItem_id) and oRandom.random() < 0.3:
+                dBriefcase["iQty"] = iQty = min(iQty, dHeld[sItem_id])
+                if shop.delete_order(dBriefcase)["sStatus"] == "OK":
+                    dHeld[sItem_id] -= iQty
+            elif shop.update_order(dBriefcase)["sStatus"] == "OK":
+                dHeld[sItem_id] = dHeld.get(sItem_id, 0) + iQty
+    run_threads(iThreads, shopper)
+
+    dHeld_total = dict.fromkeys(aItems, 0)
+    for sBasket_code, dHeld in zip(aBaskets, aHeld):
+        dLines = {sItem_id:iQty for sItem_id, iQty in dHeld.items() if iQty}
+        oBasket, _ = shop._find_basket(sBasket_code)
+        assert oBasket.dLines == dLines
+        for sItem_id, iQty in dLines.items():
+            dHeld_total[sItem_id] += iQty
+    for sItem_id in aItems:
+        assert shop._oCatalogue.stock(sItem_id) >= 0
+        assert shop._oCatalogue.stock(sItem_id) + dHeld_total[sItem_id] \
+            == iStock
+        assert shop._oReservations.held(sItem_id) == dHeld_total[sItem_id]
+
+#-------------------------------------------------------------------------------
+def test_concurrent_checkouts_sell_each_unit_once(fast_switching):
+    sItem_id, = add_items("SOLD", 1, 10)
+    aTokens = [shop.issue_auth_token("sold-%d" % i) for i in range(30)]
+    aBaskets = [shop.create_order(sAuth_token)["sBasket_code"]
+        for sAuth_token in aTokens]
+    aOutputs = [None] * len(aBaskets)
+    def buy(iThread):
+        dBriefcase = {"sBasket_code":aBaskets[iThread], "sItem_id":sItem_id,
+            "iQty":1}
+        if shop.update_order(dBriefcase)["sStatus"] == "OK":
+            aOutputs[iThread] = shop.checkout_order({
+                "sBasket_code":aBaskets[iThread],
+                "sAuth_token":aTokens[iThread]})
+    run_threads(len(aBaskets), buy)
+
+    aSold = [dOutput for dOutput in aOutputs if dOutput is not None]
+    assert len(aSold) == 10
+    assert all(dOutput["sStatus"] == "OK" for dOutput in aSold)
+    assert shop._oCatalogue.stock(sItem_id) == 0
+    assert shop._oReservations.held(sItem_id) == 0
+
+#-------------------------------------------------------------------------------
+def test_reload_keeps_reserved_units_off_sale():
+    sItem_id, = add_items("HELD", 1, 10)
+    sBasket_code = open_basket("held")
+    assert shop.update_order({"sBasket_code":sBasket_code,
+        "sItem_id":sItem_id, "iQty":3})["sStatus"] == "OK"
+    add_items("HELD", 1, 10)
+    assert shop._oCatalogue.stock(sItem_id) == 7
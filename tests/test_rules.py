@@ -0,0 +1,146 @@
+""" # Tests: business rules
+-----
+'rules.RuleSet' gives the outcomes the rule descriptions in 'rules' promise,
+and 'rules.RulesEngine' serves memoised outcomes only while they hold: a new
+rule set, or a change to the product, makes the next check miss the memo.
+"""
+
+import json
+
+import pytest
+
+import catalogue
+import rules
+
+#-------------------------------------------------------------------------------
+def product(sItem_id, sCategory="coats", sCurrency="PLN"):
+    return {"sItem_id":sItem_id, "sBrand":"Test", "sDesc":"Rules test coat",
+        "sSize":"M", "sColour":"Red", "sCategory":sCategory, "fPrice":10.0,
+        "sCurrency":sCurrency, "iStock":5, "aPhotos":[]}
+
+#-------------------------------------------------------------------------------
+class Counted:
+    """Catalogue attributes, counting the lookups (evaluations) made."""
+
+    def __init__(self, oCatalogue):
+        self.oCatalogue = oCatalogue
+        self.iCalls = 0
+
+    def __call__(self, sItem_id):
+        self.iCalls += 1
+        return self.oCatalogue.attributes(sItem_id)
+
+#-------------------------------------------------------------------------------
+@pytest.fixture
+def engine():
+    oCatalogue = catalogue.Catalogue()
+    oCatalogue.add(product("I-1"))
+    oCatalogue.add(product("I-2", "air guns", "EUR"))
+    fnAttributes = Counted(oCatalogue)
+    oEngine = rules.RulesEngine(fnAttributes, rules.RuleSet([
+        {"sKind":"deny", "sCategory":"air guns",
+            "aExcept_regions":["PL", "CZ"]},
+        {"sKind":"max_qty", "sItem_id":"I-1", "iMax_qty":3}]))
+    oCatalogue.add_listener(oEngine.on_change)
+    return oCatalogue, fnAttributes, oEngine
+
+#-------------------------------------------------------------------------------
+def test_rule_outcomes():
+    oRules = rules.RuleSet([
+        {"sKind":"deny", "sCategory":"air guns",
+            "aExcept_regions":["PL", "CZ"]},
+        {"sKind":"currency", "aRegions":["DE"], "aCurrencies":["EUR"]},
+        {"sKind":"max_qty", "sBrand":"Test", "iMax_qty":5},
+        {"sKind":"max_qty", "sBrand":"Test", "sCurrency":"PLN",
+            "iMax_qty":2}])
+    assert len(oRules) == 4
+    dCoat = {"sItem_id":"I-1", "sCategory":"coats", "sBrand":"Test",
+        "sCurrency":"PLN"}
+    dGun = dict(dCoat, sItem_id="I-2", sCategory="air guns",
+        sCurrency="EUR")
+    assert oRules.evaluate("PL", dCoat) == (None, 2)
+    assert oRules.evaluate("DE", dCoat) == ("invalid currency", 2)
+    assert oRules.evaluate("CZ", dGun) == (None, 5)
+    assert oRules.evaluate("DE", dGun) == ("not available", None)
+    assert oRules.evaluate("PL", dict(dCoat, sBrand="Other")) \
+        == rules.ALLOWED
+
+#-------------------------------------------------------------------------------
+def test_invalid_rules_are_rejected(tmp_path):
+    for dRule, sKey in (({"sKind":"ban"}, "sKind"),
+            ({"sKind":"deny", "sBrand":7}, "sBrand"),
+            ({"sKind":"deny", "aRegions":"PL"}, "aRegions"),
+            ({"sKind":"currency"}, "aCurrencies"),
+            ({"sKind":"max_qty", "iMax_qty":-1}, "iMax_qty")):
+        with pytest.raises(ValueError, match=sKey):
+            rules.RuleSet([dRule])
+    oPath = tmp_path / "rules.json"
+    oPath.write_text(json.dumps({"aRules":{}}), encoding="utf-8")
+    with pytest.raises(ValueError):
+        rules.load_rules(str(oPath))
+    oPath.write_text(json.dumps({"aRules":[{"sKind":"deny"}]}),
+        encoding="utf-8")
+    assert len(rules.load_rules(str(oPath))) == 1
+
+#-------------------------------------------------------------------------------
+def test_outcomes_are_memoised(engine):
+    _, fnAttributes, oEngine = engine
+    for _ in range(3):
+        assert oEngine.check("PL", "I-1") == (None, 3)
+        assert oEngine.check("DE", "I-2") == ("not available", None)
+    assert fnAttributes.iCalls == 2
+    assert oEngine.check("XX", "I-9") == rules.ALLOWED
+
+#-------------------------------------------------------------------------------
+def test_new_rules_miss_the_memo(engine):
+    _, fnAttributes, oEngine = engine
+    assert oEngine.check("PL", "I-1") == (None, 3)
+    oEngine.install(rules.RuleSet([
+        {"sKind":"max_qty", "sItem_id":"I-1", "iMax_qty":1}]))
+    assert oEngine.check("PL", "I-1") == (None, 1)
+    assert oEngine.check("DE", "I-2") == rules.ALLOWED
+    assert fnAttributes.iCalls == 3
+
+#-------------------------------------------------------------------------------
+def test_changed_product_misses_the_memo(engine):
+    oCatalogue, fnAttributes, oEngine = engine
+    assert oEngine.check("DE", "I-1") == (None, 3)
+    assert oEngine.check("DE", "I-2") == ("not available", None)
+    # Stock and price don't matter to the rules
+    oCatalogue.set_stock("I-1", 0)
+    oCatalogue.set_price("I-1", 99.0)
+    assert oEngine.check("DE", "I-1") == (None, 3)
+    assert fnAttributes.iCalls == 2
+    oCatalogue.add(product("I-2", "coats"))
+    assert oEngine.check("DE", "I-2") == rules.ALLOWED
+    assert oEngine.check("DE", "I-1") == (None, 3)
+    assert fnAttributes.iCalls == 3
+    oCatalogue.remove("I-2")
+    assert oEngine.check("DE", "I-2") == rules.ALLOWED
+    assert fnAttributes.iCalls == 4
+    with oCatalogue.batch():
+        oCatalogue.add(product("I-3"))
+    assert oEngine.check("DE", "I-1") == (None, 3)
+    assert fnAttributes.iCalls == 5
+
+#-------------------------------------------------------------------------------
+def test_outcome_computed_across_a_change_is_not_memoised(engine):
+    oCatalogue, fnAttributes, oEngine = engine
+    def replaced(sItem_id):
+        dItem = fnAttributes(sItem_id)
+        oCatalogue.add(product("I-1", "air guns"))
+        return dItem
+    oEngine.fnAttributes = replaced
+    assert oEngine.check("DE", "I-1") == (None, 3)
+    oEngine.fnAttributes = fnAttributes
+    assert oEngine.check("DE", "I-1") == ("not available", None)
+    assert fnAttributes.iCalls == 2
+
+#-------------------------------------------------------------------------------
+def test_memo_is_bounded(engine):
+    oCatalogue, fnAttributes, oEngine = engine
+    oEngine.iMax_entries = 4
+    for sRegion in ("PL", "CZ", "DE", "FR", "IT"):
+        oEngine.check(sRegion, "I-1")
+    assert oEngine._iEntries <= 4
+    assert sum(map(len, oEngine._dMemo.values())) == oEngine._iEntries
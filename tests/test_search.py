@@ -0,0 +1,155 @@
+""" # Tests: keyword index
+-----
+'search.KeywordIndex' is checked against a plain dictionary of descriptions:
+adds, updates and removals, in bulk and one at a time, must leave every
+search, page and multi-term AND count as a scan of the descriptions gives,
+without changing a posting list a search may be walking.
+The memo of multi-term counts is bounded, in the index and in a snapshot.
+"""
+
+import random
+import threading
+
+import pytest
+
+import catalogue
+import search
+import snapshot
+
+_WORDS = ("red", "blue", "wool", "coat", "silk", "scarf", "long", "warm")
+
+#-------------------------------------------------------------------------------
+def expected(dDescs, sQuery):
+    setTokens = set(search.tokenise(sQuery))
+    return sorted(sItem_id for sItem_id, sDesc in dDescs.items()
+        if setTokens <= set(search.tokenise(sDesc)))
+
+#-------------------------------------------------------------------------------
+def check(oIndex, dDescs):
+    assert len(oIndex) == len(dDescs)
+    assert oIndex.ids() == sorted(dDescs)
+    for sQuery in ("", "red", "RED coat", "wool coat warm", "silk scarf",
+            "unknown", "red unknown"):
+        aHits = expected(dDescs, sQuery)
+        assert oIndex.search(sQuery) == aHits
+        assert oIndex.count(sQuery) == len(aHits)
+        assert oIndex.search(sQuery, 2, 3) == aHits[2:5]
+        if aHits:
+            assert oIndex.search(sQuery, iLimit=4, sAfter=aHits[0]) \
+                == aHits[1:5]
+
+#-------------------------------------------------------------------------------
+def random_desc(oRandom):
+    return " ".join(oRandom.sample(_WORDS, oRandom.randint(1, 4)))
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("iBatch", [1, 5, 100, 1000])
+def test_matches_reference(iBatch):
+    oRandom = random.Random(iBatch)
+    oIndex = search.KeywordIndex()
+    dDescs = {}
+    for _ in range(min(3000 // iBatch, 150)):
+        for _ in range(iBatch):
+            sItem_id = "I-%04d" % oRandom.randrange(2000)
+            fAction = oRandom.random()
+            if fAction < 0.6:
+                dDescs[sItem_id] = random_desc(oRandom)
+                oIndex.add(sItem_id, dDescs[sItem_id])
+            elif fAction < 0.8:
+                dDescs[sItem_id] = random_desc(oRandom)
+                oIndex.update(sItem_id, dDescs[sItem_id])
+            else:
+                dDescs.pop(sItem_id, None)
+                oIndex.remove(sItem_id)
+        check(oIndex, dDescs)
+
+#-------------------------------------------------------------------------------
+def test_multi_term_counts():
+    oIndex = search.KeywordIndex()
+    for iItem in range(60):
+        oIndex.add("I-%02d" % iItem, " ".join(sWord for iBit, sWord
+            in enumerate(_WORDS[:6]) if iItem >> iBit & 1))
+    assert oIndex.count("red") == 30
+    assert oIndex.count("red blue") == 15
+    assert oIndex.count("blue red") == 15
+    assert oIndex.count("red blue wool coat") == 3
+    oIndex.update("I-03", "wool")         # was red blue
+    assert oIndex.count("red blue") == 14
+    oIndex.remove("I-07")                 # red blue wool
+    assert oIndex.count("red blue") == 13
+    assert oIndex.count("red red blue") == 13
+
+#-------------------------------------------------------------------------------
+def test_count_memo_is_bounded():
+    oIndex = search.KeywordIndex()
+    oIndex.oCounts.iMax_entries = 8
+    for iItem in range(20):
+        oIndex.add("I-%02d" % iItem, "a%d b%d common" % (iItem, iItem % 3))
+    for iItem in range(20):
+        assert oIndex.count("common a%d" % iItem) == 1
+    assert len(oIndex.oCounts) == 8
+    assert oIndex.count("common b1") == 7
+
+#-------------------------------------------------------------------------------
+def test_searches_alongside_a_bulk_load():
+    oIndex = search.KeywordIndex()
+    aErrors = []
+    bDone = threading.Event()
+    def reader():
+        try:
+            while not bDone.is_set():
+                aHits = oIndex.search("red coat")
+                assert aHits == sorted(aHits)
+                oIndex.count("red coat")
+        except Exception as e:
+            aErrors.append(e)
+    aThreads = [threading.Thread(target=reader) for _ in range(2)]
+    for oThread in aThreads:
+        oThread.start()
+    for iItem in range(20000):
+        oIndex.add("I-%05d" % (iItem * 7919 % 20000), "red coat %d" % iItem)
+    bDone.set()
+    for oThread in aThreads:
+        oThread.join()
+    assert not aErrors
+    assert oIndex.count("red coat") == 20000
+
+#-------------------------------------------------------------------------------
+def test_walk_survives_changes_to_its_lists():
+    oIndex = search.KeywordIndex()
+    for iItem in range(0, 100, 2):
+        oIndex.add("I-%03d" % iItem, "red coat")
+    iterHits = oIndex._walk(oIndex._postings("red coat"), 0)
+    aHits = [next(iterHits) for _ in range(10)]
+    # Inserted in place, in front of the walk and ahead of it
+    for iItem in (1, 3, 5, 7, 41):
+        oIndex.add("I-%03d" % iItem, "red coat")
+    assert oIndex.search("red", iLimit=3) == ["I-000", "I-001", "I-002"]
+    aHits += [next(iterHits) for _ in range(10)]
+    # Removed: the walk carries on with the list as it was
+    oIndex.remove("I-060")
+    assert "I-060" not in oIndex.search("red coat")
+    aHits += iterHits
+    assert aHits == sorted(set(aHits))
+    assert {"I-%03d" % iItem for iItem in range(0, 100, 2)} <= set(aHits)
+    assert "I-041" in aHits
+    assert oIndex.search("coat", sAfter="I-057", iLimit=2) \
+        == ["I-058", "I-062"]
+    assert oIndex.count("red coat") == 54
+
+#-------------------------------------------------------------------------------
+def test_snapshot_count_memo_is_bounded(tmp_path):
+    oCatalogue = catalogue.Catalogue()
+    for iItem in range(20):
+        oCatalogue.add({"sItem_id":"I-%02d" % iItem, "sBrand":"B",
+            "sDesc":"a%d b%d common" % (iItem, iItem % 3), "sSize":"M",
+            "sColour":"Red", "fPrice":1.0, "sCurrency":"PLN", "iStock":1,
+            "aPhotos":[]})
+    sPath = str(tmp_path / "catalogue.snap")
+    snapshot.write_snapshot(oCatalogue, sPath)
+    oIndex = snapshot.Snapshot(sPath).oIndex
+    oIndex.oCounts.iMax_entries = 8
+    for iItem in range(20):
+        assert oIndex.count("common a%d" % iItem) == 1
+    assert len(oIndex.oCounts) == 8
+    assert oIndex.count("common b1") == 7
@@ -0,0 +1,218 @@
+""" # Tests: payment settlement
+-----
+'settlement.SettlementQueue' retries provider failures and timeouts with the
+same invoice code, escalates a payment after 'iMax_attempts' failed charges,
+and hands each outcome on exactly once. 'settlement.PaymentRecords' keeps the
+payment state of invoices across restarts through its journal.
+"""
+
+import asyncio
+import threading
+
+import settlement
+import wal
+
+#-------------------------------------------------------------------------------
+def invoice(sInvoice_code):
+    return {"sInvoice_code":sInvoice_code, "sUser_id":"U-1",
+        "sCurrency":"PLN", "iGoods":1000, "iShip":150}
+
+#-------------------------------------------------------------------------------
+class ScriptedProvider:
+    """Answers charges from a script: an exception is raised, anything else
+    returned; the last entry is repeated."""
+
+    def __init__(self, *aScript):
+        self.aScript = list(aScript)
+        self.aCharges = []
+        self.oLock = threading.Lock()
+
+    def answer(self, sInvoice_code, iAmount):
+        with self.oLock:
+            self.aCharges.append((sInvoice_code, iAmount))
+            xAnswer = (self.aScript.pop(0) if len(self.aScript) > 1
+                else self.aScript[0])
+        if isinstance(xAnswer, Exception):
+            raise xAnswer
+        return xAnswer
+
+    def charge(self, sInvoice_code, sUser_id, sCurrency, iAmount,
+            fTimeout=None):
+        return self.answer(sInvoice_code, iAmount)
+
+#-------------------------------------------------------------------------------
+class HangingProvider(ScriptedProvider):
+    """Coroutine provider whose first charge never answers."""
+
+    def __init__(self):
+        ScriptedProvider.__init__(self, True)
+        self.aCancelled = []
+
+    async def charge(self, sInvoice_code, sUser_id, sCurrency, iAmount):
+        bFirst = not self.aCharges
+        bPaid = self.answer(sInvoice_code, iAmount)
+        if bFirst:
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                self.aCancelled.append(sInvoice_code)
+                raise
+        return bPaid
+
+#-------------------------------------------------------------------------------
+def queue(oProvider, **dOptions):
+    aOutcomes = []
+    aEscalated = []
+    oQueue = settlement.SettlementQueue(oProvider, aOutcomes.append,
+        iWorkers=2, fRetry_delay=0.01, fnOn_escalate=aEscalated.append,
+        **dOptions)
+    return oQueue, aOutcomes, aEscalated
+
+#-------------------------------------------------------------------------------
+def test_failures_are_retried_with_the_same_invoice():
+    oProvider = ScriptedProvider(settlement.ProviderError("down"),
+        settlement.ProviderError("down"), True)
+    oQueue, aOutcomes, aEscalated = queue(oProvider)
+    try:
+        assert oQueue.submit(invoice("INV-1"))
+        assert oQueue.flush(5)
+    finally:
+        oQueue.close()
+    assert oProvider.aCharges == [("INV-1", 1150)] * 3
+    assert oQueue.iRetries == 2
+    assert [oPayment.sOutcome for oPayment in aOutcomes] == ["settled"]
+    assert oQueue.status("INV-1") == ("U-1", "settled")
+    assert aEscalated == []
+
+#-------------------------------------------------------------------------------
+def test_decline_is_not_retried():
+    oProvider = ScriptedProvider(False)
+    oQueue, aOutcomes, _ = queue(oProvider)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        oQueue.submit(invoice("INV-1"))     # already pending: one payment
+        assert oQueue.flush(5)
+    finally:
+        oQueue.close()
+    assert len(oProvider.aCharges) == 1
+    assert oQueue.status("INV-1") == ("U-1", "rejected")
+    assert len(aOutcomes) == 1
+
+#-------------------------------------------------------------------------------
+def test_escalation_keeps_the_payment_pending():
+    oError = settlement.ProviderError("down")
+    oProvider = ScriptedProvider(oError, oError, oError, oError, True)
+    oQueue, aOutcomes, aEscalated = queue(oProvider, iMax_attempts=2)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        assert oQueue.flush(5)
+    finally:
+        oQueue.close()
+    assert [oPayment.dInvoice["sInvoice_code"] for oPayment in aEscalated] \
+        == ["INV-1"]
+    assert oQueue.iEscalated == 1
+    assert len(oProvider.aCharges) == 5
+    assert oQueue.status("INV-1") == ("U-1", "settled")
+
+#-------------------------------------------------------------------------------
+def test_escalated_payments_are_listed():
+    oProvider = ScriptedProvider(settlement.ProviderError("down"))
+    oQueue, _, aEscalated = queue(oProvider, iMax_attempts=2)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        assert not oQueue.flush(0.3)
+        assert oQueue.escalated() == ["INV-1"]
+        assert oQueue.status("INV-1") == ("U-1", "pending")
+        assert len(aEscalated) == 1
+    finally:
+        oQueue.close(0)
+
+#-------------------------------------------------------------------------------
+def test_failed_outcome_handler_does_not_charge_again():
+    oProvider = ScriptedProvider(True)
+    aCalls = []
+    def on_outcome(oPayment):
+        aCalls.append(oPayment.sOutcome)
+        if len(aCalls) == 1:
+            raise OSError("disk full")
+    oQueue = settlement.SettlementQueue(oProvider, on_outcome, iWorkers=1,
+        fRetry_delay=0.01)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        assert oQueue.flush(5)
+    finally:
+        oQueue.close()
+    assert aCalls == ["settled", "settled"]
+    assert len(oProvider.aCharges) == 1
+
+#-------------------------------------------------------------------------------
+def test_plain_charge_times_out():
+    oProvider = settlement.StubProvider(fLatency=30.0)
+    oQueue, aOutcomes, aEscalated = queue(oProvider, iMax_attempts=2,
+        fCharge_timeout=0.02)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        assert not oQueue.flush(0.3)
+        assert oQueue.iTimeouts >= 2
+        assert len(aEscalated) == 1
+        assert oQueue.status("INV-1") == ("U-1", "pending")
+    finally:
+        oQueue.close(0)
+    assert aOutcomes == []
+
+#-------------------------------------------------------------------------------
+def test_coroutine_charge_times_out_and_is_cancelled():
+    oProvider = HangingProvider()
+    oQueue, aOutcomes, _ = queue(oProvider, fCharge_timeout=0.05)
+    try:
+        oQueue.submit(invoice("INV-1"))
+        assert oQueue.flush(5)
+    finally:
+        oQueue.close()
+    assert oQueue.iTimeouts == 1
+    assert oProvider.aCancelled == ["INV-1"]
+    assert len(oProvider.aCharges) == 2
+    assert oQueue.status("INV-1") == ("U-1", "settled")
+
+#-------------------------------------------------------------------------------
+def test_payment_records_survive_a_restart(tmp_path):
+    sPath = str(tmp_path / "payments.log")
+    oRecords = settlement.PaymentRecords(sPath)
+    oRecords.issue(invoice("INV-1"), settlement.PENDING)
+    oRecords.issue(invoice("INV-2"), settlement.PENDING)
+    oRecords.issue(invoice("INV-3"), settlement.SETTLED)
+    assert oRecords.settle("INV-1", settlement.REJECTED)
+    assert not oRecords.settle("INV-1", settlement.SETTLED)
+    assert not oRecords.settle("INV-9", settlement.SETTLED)
+    oRecords.close()
+
+    oRecords = settlement.PaymentRecords(sPath)
+    try:
+        assert oRecords.status("INV-1") == ("U-1", "rejected")
+        assert oRecords.status("INV-2") == ("U-1", "pending")
+        assert oRecords.status("INV-3") == ("U-1", "settled")
+        assert oRecords.status("INV-9") is None
+        assert oRecords.pending() == [invoice("INV-2")]
+    finally:
+        oRecords.close()
+
+#-------------------------------------------------------------------------------
+def test_payment_journal_is_compacted(tmp_path):
+    sPath = str(tmp_path / "payments.log")
+    oRecords = settlement.PaymentRecords(sPath, iJournal_bytes=2048)
+    for iInvoice in range(200):
+        sInvoice_code = "INV-%d" % iInvoice
+        oRecords.issue(invoice(sInvoice_code), settlement.PENDING)
+        if iInvoice % 2:
+            oRecords.settle(sInvoice_code, settlement.SETTLED)
+    oRecords.close()
+    # 300 changes were logged; the journal keeps about one per invoice
+    assert len(wal.read_records(sPath)[0]) < 250
+
+    oRecords = settlement.PaymentRecords(sPath)
+    try:
+        assert len(oRecords.pending()) == 100
+        assert oRecords.status("INV-199") == ("U-1", "settled")
+        assert oRecords.status("INV-198") == ("U-1", "pending")
+    finally:
+        oRecords.close()
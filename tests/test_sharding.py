@@ -0,0 +1,102 @@
+""" # Tests: sharded 'list_products'
+-----
+Through 'shop.use_shards': items carry live stock and prices, stock-dependent
+queries see reservations made since the last publication, and a shard
+process which dies is respawned without a failed query. A query waits for
+all the shards against one deadline, and a shard whose pipe has broken
+fails requests at once.
+"""
+
+import time
+from concurrent import futures
+
+import pytest
+
+import sharding
+import shop
+
+_QUERY = {"iIdx":0, "iMax_res":5, "sItem_filter":"sharded"}
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def shards(shop_state, tmp_path_factory):
+    for iItem in range(40):
+        shop.add_product({"sItem_id":"SH-%02d" % iItem, "sBrand":"Test",
+            "sDesc":"Sharded test coat", "sSize":"M", "sColour":"Red",
+            "fPrice":10.0 + iItem, "sCurrency":"PLN", "iStock":2,
+            "aPhotos":[]})
+    shop.use_shards(2, str(tmp_path_factory.mktemp("shards")))
+    return shop._oShards
+
+#-------------------------------------------------------------------------------
+def reserve(sItem_id, iQty):
+    sBasket_code = shop.create_order(
+        shop.issue_auth_token("sharded"))["sBasket_code"]
+    assert shop.update_order({"sBasket_code":sBasket_code,
+        "sItem_id":sItem_id, "iQty":iQty})["sStatus"] == "OK"
+
+#-------------------------------------------------------------------------------
+def test_items_carry_live_stock_and_price(shards):
+    reserve("SH-00", 1)
+    shop._oCatalogue.set_price("SH-00", 12.5)
+    dItem = shop.list_products(_QUERY)["aItems"][0]
+    assert (dItem["sItem_id"], dItem["iStock"], dItem["fPrice"]) \
+        == ("SH-00", 1, 12.5)
+
+#-------------------------------------------------------------------------------
+def test_in_stock_queries_see_reservations(shards):
+    reserve("SH-01", 2)
+    dOutput = shop.list_products(dict(_QUERY, iMax_res=100, bIn_stock=True))
+    assert "SH-01" not in [dItem["sItem_id"] for dItem in dOutput["aItems"]]
+    assert dOutput["iSearch_tot"] == 39
+
+#-------------------------------------------------------------------------------
+def test_dead_shard_is_respawned(shards):
+    aExpected = shop.list_products(dict(_QUERY, iMax_res=40))["aItems"]
+    oProcess = shards._aShards[1].oProcess
+    oProcess.terminate()
+    oProcess.join()
+    iRespawns = shards.iRespawns
+    dOutput = shop.list_products(dict(_QUERY, iMax_res=40, iIdx=0,
+        sColour="Red"))
+    assert dOutput["sStatus"] == "OK"
+    assert dOutput["aItems"] == aExpected
+    assert shards.iRespawns == iRespawns + 1
+    assert all(oShard.alive() for oShard in shards._aShards)
+
+#-------------------------------------------------------------------------------
+def test_broken_shard_fails_requests_at_once(shards):
+    oShard = shards._aShards[0]
+    oShard.oProcess.terminate()
+    oShard.oProcess.join()
+    oShard._oReceiver.join(5)
+    oFuture = oShard.submit(-1, None, 1, None)
+    with pytest.raises(ConnectionError):
+        oFuture.result(0)
+    assert shop.list_products(_QUERY)["sStatus"] == "OK"
+
+#-------------------------------------------------------------------------------
+class SilentShard:
+    """Stands in for a shard which never answers."""
+
+    def __init__(self):
+        self.aForgotten = []
+
+    def alive(self):
+        return True
+
+    def submit(self, iRequest, dQuery, iLimit, tAfter):
+        return futures.Future()
+
+    def forget(self, iRequest):
+        self.aForgotten.append(iRequest)
+
+#-------------------------------------------------------------------------------
+def test_one_deadline_for_all_shards(tmp_path):
+    oShards = sharding.ShardedCatalogue(4, str(tmp_path), fTimeout=0.2)
+    oShards._aShards = [SilentShard() for _ in range(4)]
+    fStart = time.monotonic()
+    with pytest.raises(TimeoutError):
+        oShards.query({"sSort":"sItem_id", "bFacets":False}, 0, 5)
+    assert time.monotonic() - fStart < 0.6
+    assert all(oShard.aForgotten for oShard in oShards._aShards)
@@ -0,0 +1,122 @@
+""" # Tests: asyncio API
+-----
+The 'shop_async' coroutines give the same answers as the shop's functions. A
+read which runs out of time is answered with its documented error, while a
+call changing a basket is never abandoned: cancelling the task awaiting it
+neither stops it nor makes a retry reserve the stock twice.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+import shop_async
+import storage
+
+#-------------------------------------------------------------------------------
+@pytest.fixture(scope="module")
+def shop(shop_state):
+    shop_state.add_product({"sItem_id":"AS-1", "sBrand":"Test",
+        "sDesc":"Async test coat", "sSize":"M", "sColour":"Red",
+        "fPrice":10.0, "sCurrency":"PLN", "iStock":10, "aPhotos":[]})
+    return shop_state
+
+#-------------------------------------------------------------------------------
+def basket(shop):
+    sAuth_token = shop.issue_auth_token("async")
+    dOutput = asyncio.run(shop_async.create_order(sAuth_token))
+    assert dOutput["sStatus"] == "OK"
+    return sAuth_token, dOutput["sBasket_code"]
+
+#-------------------------------------------------------------------------------
+def slowed(fnCall, oRelease):
+    """'fnCall', held up until 'oRelease' is set."""
+    def call(*aArgs):
+        oRelease.wait(5)
+        return fnCall(*aArgs)
+    return call
+
+#-------------------------------------------------------------------------------
+def test_shopping_through_the_loop(shop):
+    sAuth_token, sBasket_code = basket(shop)
+
+    async def shopping():
+        dListing = await shop_async.list_products({"iIdx":0, "iMax_res":5,
+            "sItem_filter":"async test"})
+        assert [dItem["sItem_id"] for dItem in dListing["aItems"]] \
+            == ["AS-1"]
+        dUpdate = await shop_async.update_order({"sBasket_code":sBasket_code,
+            "sItem_id":"AS-1", "iQty":2})
+        assert dUpdate["sStatus"] == "OK"
+        dOrders = await shop_async.list_orders(sBasket_code)
+        assert [dLine["sItem_id"] for dLine in dOrders["aItems"]] == ["AS-1"]
+        dCheckout = await shop_async.checkout_order({
+            "sBasket_code":sBasket_code, "sAuth_token":sAuth_token})
+        assert dCheckout["sStatus"] == "OK"
+        return await shop_async.checkout_status({
+            "sInvoice_code":dCheckout["sInvoice_code"],
+            "sAuth_token":sAuth_token})
+
+    assert asyncio.run(shopping())["sStatus"] == "OK"
+    assert shop._oCatalogue.stock("AS-1") == 8
+
+#-------------------------------------------------------------------------------
+def test_slow_read_is_answered_with_its_error(shop, monkeypatch):
+    oRelease = threading.Event()
+    monkeypatch.setattr(shop, "list_products",
+        slowed(shop.list_products, oRelease))
+    try:
+        dOutput = asyncio.run(shop_async.list_products({"iIdx":0,
+            "iMax_res":5}, fTimeout=0.05))
+    finally:
+        oRelease.set()
+    assert dOutput == {"sStatus":"ERROR", "sErr_desc":"connection error"}
+
+#-------------------------------------------------------------------------------
+def test_cancelled_update_still_completes_once(shop, monkeypatch):
+    _, sBasket_code = basket(shop)
+    iStock = shop._oCatalogue.stock("AS-1")
+    oRelease = threading.Event()
+    monkeypatch.setattr(shop, "update_order",
+        slowed(shop.update_order, oRelease))
+    dBriefcase = {"sBasket_code":sBasket_code, "sItem_id":"AS-1", "iQty":1}
+
+    async def impatient():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(shop_async.update_order(dBriefcase), 0.05)
+        oRelease.set()
+        # The shopper retries with the basket as it now stands
+        while not (await shop_async.list_orders(sBasket_code))["aItems"]:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(impatient())
+    dOrders = shop.list_orders(sBasket_code)
+    assert [(dLine["sItem_id"], dLine["iQty"]) for dLine
+        in dOrders["aItems"]] == [("AS-1", 1)]
+    assert shop._oCatalogue.stock("AS-1") == iStock - 1
+
+#-------------------------------------------------------------------------------
+def test_run_blocking_without_a_limit():
+    async def run():
+        return await shop_async.run_blocking(sum, [1, 2, 3], fTimeout=None)
+    assert asyncio.run(run()) == 6
+
+#-------------------------------------------------------------------------------
+def test_async_storage(tmp_path):
+    oStorage = shop_async.AsyncStorage(storage.SQLiteStorage(
+        str(tmp_path / "shop.db")), iWorkers=2)
+
+    async def use():
+        await oStorage.put_products([{"sItem_id":"AS-9", "sBrand":"Test",
+            "sDesc":"Stored", "sSize":"M", "sColour":"Red", "sCategory":"",
+            "fPrice":1.5, "sCurrency":"PLN", "iStock":3, "aPhotos":["a"]}])
+        aProducts = await oStorage.load_products()
+        assert await oStorage.allocate_numbers("invoice", 2) == 1
+        assert await oStorage.get_invoice("INV-1") is None
+        await oStorage.close()
+        return aProducts
+
+    aProducts = asyncio.run(use())
+    assert [(dProduct["sItem_id"], dProduct["aPhotos"]) for dProduct
+        in aProducts] == [("AS-9", ["a"])]
@@ -0,0 +1,148 @@
+""" # Tests: SQLite storage
+-----
+The connection pool never opens more than its size and reuses what it opened;
+invoices are saved durably and only once, however often a batch is saved
+again; payments and persistent counters behave as 'storage.Storage'
+documents them.
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+
+#-------------------------------------------------------------------------------
+def product(sItem_id, iStock):
+    return {"sItem_id":sItem_id, "sBrand":"Test", "sDesc":"Storage test",
+        "sSize":"M", "sColour":"Red", "sCategory":"", "fPrice":9.99,
+        "sCurrency":"PLN", "iStock":iStock, "aPhotos":[]}
+
+#-------------------------------------------------------------------------------
+def invoice(sInvoice_code, iQty, sPayment=None):
+    dInvoice = {"sInvoice_code":sInvoice_code, "sUser_id":"U-1",
+        "sCurrency":"PLN", "iGoods":999 * iQty, "iShip":0, "fCreated":1.0,
+        "aLines":[("I-1", iQty, 999, "PLN")]}
+    if sPayment is not None:
+        dInvoice["sPayment"] = sPayment
+    return dInvoice
+
+#-------------------------------------------------------------------------------
+class TracedStorage(storage.SQLiteStorage):
+    """Records every statement its connections run."""
+
+    __slots__ = ("aStatements",)
+
+    def __init__(self, sPath):
+        self.aStatements = []
+        storage.SQLiteStorage.__init__(self, sPath)
+
+    def _connect(self):
+        oConnection = storage.SQLiteStorage._connect(self)
+        oConnection.set_trace_callback(self.aStatements.append)
+        return oConnection
+
+#-------------------------------------------------------------------------------
+@pytest.fixture
+def oStorage(tmp_path):
+    oStorage = TracedStorage(str(tmp_path / "shop.db"))
+    oStorage.put_products([product("I-1", 10)])
+    yield oStorage
+    oStorage.close()
+
+#-------------------------------------------------------------------------------
+def stock(oStorage):
+    return {dProduct["sItem_id"]:dProduct["iStock"]
+        for dProduct in oStorage.load_products()}["I-1"]
+
+#-------------------------------------------------------------------------------
+def test_pool_is_bounded_and_reused():
+    aOpened = []
+    def connect():
+        aOpened.append(sqlite3.connect(":memory:", check_same_thread=False))
+        return aOpened[-1]
+    oPool = storage.ConnectionPool(connect, iSize=2, fTimeout=0.05)
+    with oPool.connection() as oFirst:
+        with oPool.connection() as oSecond:
+            assert oFirst is not oSecond
+            with pytest.raises(storage.StorageError):
+                with oPool.connection():
+                    pass
+    for _ in range(5):
+        with oPool.connection() as oConnection:
+            assert oConnection is oFirst or oConnection is oSecond
+    assert len(aOpened) == 2
+    oPool.close()
+
+#-------------------------------------------------------------------------------
+def test_pool_waits_for_a_connection():
+    oPool = storage.ConnectionPool(lambda: sqlite3.connect(":memory:",
+        check_same_thread=False), iSize=1, fTimeout=5.0)
+    oBorrowed = threading.Event()
+    def borrow():
+        with oPool.connection():
+            oBorrowed.set()
+            threading.Event().wait(0.1)
+    oThread = threading.Thread(target=borrow)
+    oThread.start()
+    oBorrowed.wait()
+    with oPool.connection() as oConnection:
+        assert oConnection.execute("SELECT 1").fetchone() == (1,)
+    oThread.join()
+    oPool.close()
+
+#-------------------------------------------------------------------------------
+def test_invoices_are_saved_durably(oStorage):
+    del oStorage.aStatements[:]
+    oStorage.save_invoice(invoice("INV-1", 2))
+    iSync = oStorage.aStatements.index("PRAGMA synchronous=FULL")
+    iInsert = next(iPos for iPos, sStatement
+        in enumerate(oStorage.aStatements) if "INTO invoices" in sStatement)
+    assert iSync < iInsert
+    assert oStorage.aStatements[-1] == "PRAGMA synchronous=NORMAL"
+    assert stock(oStorage) == 8
+    assert oStorage.get_invoice("INV-1") == invoice("INV-1", 2)
+    with pytest.raises(storage.StorageError):
+        oStorage.save_invoice(invoice("INV-1", 2))
+    assert stock(oStorage) == 8
+
+#-------------------------------------------------------------------------------
+def test_saving_a_batch_again_counts_once(oStorage):
+    aBatch = [invoice("INV-1", 1), invoice("INV-2", 2, "pending")]
+    oStorage.save_invoices(aBatch)
+    oStorage.save_invoices(aBatch + [invoice("INV-3", 3)])
+    assert stock(oStorage) == 4
+    assert oStorage.last_invoice_code() == "INV-3"
+    assert oStorage.payment_status("INV-1") == ("U-1", "settled")
+    assert oStorage.payment_status("INV-2") == ("U-1", "pending")
+    assert [dInvoice["sInvoice_code"] for dInvoice
+        in oStorage.pending_payments()] == ["INV-2"]
+
+#-------------------------------------------------------------------------------
+def test_rejected_payment_returns_stock(oStorage):
+    oStorage.save_invoice(invoice("INV-1", 3, "pending"))
+    assert stock(oStorage) == 7
+    assert oStorage.settle_payment("INV-1", False)
+    assert not oStorage.settle_payment("INV-1", True)
+    assert oStorage.payment_status("INV-1") == ("U-1", "rejected")
+    assert oStorage.payment_status("INV-9") is None
+    assert stock(oStorage) == 10
+    assert oStorage.pending_payments() == []
+
+#-------------------------------------------------------------------------------
+def test_counters(oStorage, tmp_path):
+    assert oStorage.allocate_numbers("invoice", 10) == 1
+    assert oStorage.allocate_numbers("invoice", 5) == 11
+    assert oStorage.allocate_numbers("invoice", 5, iFloor=100) == 100
+    assert not oStorage.release_numbers("invoice", 11, 16)
+    assert oStorage.release_numbers("invoice", 100, 105)
+    assert oStorage.allocate_numbers("invoice", 1) == 100
+    assert oStorage.allocate_numbers("other", 3, iFloor=7) == 7
+    oStorage.close()
+
+    oReopened = storage.SQLiteStorage(str(tmp_path / "shop.db"))
+    try:
+        assert oReopened.allocate_numbers("invoice", 1) == 101
+    finally:
+        oReopened.close()
@@ -0,0 +1,92 @@
+""" # Tests: verified token cache
+-----
+'tokencache.VerifiedTokenCache' keeps successful verifications only, under a
+BLAKE2b hash of the token, until the token's own expiry; the least recently
+used token is evicted first, and every outcome is counted in 'stats'.
+"""
+
+import hashlib
+
+import pytest
+
+import tokencache
+
+#-------------------------------------------------------------------------------
+class Verifier:
+    """Accepts tokens starting with "ok", expiring at 'fExpiry'; counts the
+    verifications made."""
+
+    def __init__(self, fExpiry=1000.0):
+        self.fExpiry = fExpiry
+        self.aCalls = []
+
+    def __call__(self, sToken):
+        self.aCalls.append(sToken)
+        if isinstance(sToken, str) and sToken.startswith("ok"):
+            return None, {"sUser_id":sToken, "fExpiry":self.fExpiry}
+        return "invalid token", None
+
+#-------------------------------------------------------------------------------
+@pytest.fixture
+def clock(monkeypatch):
+    aNow = [100.0]
+    monkeypatch.setattr(tokencache.time, "time", lambda: aNow[0])
+    return aNow
+
+def cache(iMax_entries=100):
+    fnVerify = Verifier()
+    return fnVerify, tokencache.VerifiedTokenCache(fnVerify, "token expired",
+        iMax_entries)
+
+#-------------------------------------------------------------------------------
+def test_least_recently_used_token_is_evicted(clock):
+    fnVerify, oCache = cache(iMax_entries=2)
+    for sToken in ("ok-a", "ok-b", "ok-a", "ok-c", "ok-a", "ok-b"):
+        assert oCache.verify(sToken) == (None, {"sUser_id":sToken,
+            "fExpiry":1000.0})
+    # 'ok-a' was used again before 'ok-c' came in, so 'ok-b' went
+    assert fnVerify.aCalls == ["ok-a", "ok-b", "ok-c", "ok-b"]
+    assert len(oCache) == 2
+    assert oCache.stats() == {"iHits":2, "iMisses":4, "iRejected":0,
+        "iExpired":0, "iEvictions":2, "iSize":2}
+
+#-------------------------------------------------------------------------------
+def test_tokens_are_kept_as_blake2b_hashes(clock):
+    _, oCache = cache()
+    oCache.verify("ok-secret")
+    assert list(oCache._dEntries) == [hashlib.blake2b(b"ok-secret",
+        digest_size=16).digest()]
+    oCache.verify("ok-zółw")
+    assert all(isinstance(bKey, bytes) and len(bKey) == 16
+        for bKey in oCache._dEntries)
+    assert oCache._key("ok-zółw") == hashlib.blake2b(
+        "ok-zółw".encode("utf-8"), digest_size=16).digest()
+    oCache.forget("ok-secret")
+    assert oCache._key("ok-secret") not in oCache._dEntries
+    assert len(oCache) == 1
+
+#-------------------------------------------------------------------------------
+def test_rejected_tokens_are_not_cached(clock):
+    fnVerify, oCache = cache(iMax_entries=1)
+    oCache.verify("ok-a")
+    for xToken in ("forged", "forged", None, 42):
+        assert oCache.verify(xToken) == ("invalid token", None)
+    assert oCache.verify("ok-a")[0] is None
+    assert fnVerify.aCalls == ["ok-a", "forged", "forged", None, 42]
+    dStats = oCache.stats()
+    assert (dStats["iHits"], dStats["iRejected"], dStats["iEvictions"],
+        dStats["iSize"]) == (1, 2, 0, 1)
+
+#-------------------------------------------------------------------------------
+def test_token_expires_in_the_cache(clock):
+    fnVerify, oCache = cache()
+    assert oCache.verify("ok-a")[0] is None
+    clock[0] = 1000.0
+    assert oCache.verify("ok-a")[0] is None
+    clock[0] = 1000.5
+    assert oCache.verify("ok-a") == ("token expired", None)
+    assert len(oCache) == 0
+    assert oCache.stats()["iExpired"] == 1
+    # No longer cached: the verifier has the last word
+    oCache.verify("ok-a")
+    assert fnVerify.aCalls == ["ok-a", "ok-a"]
@@ -0,0 +1,91 @@
+""" # Tests: signed tokens
+-----
+Round trips through 'tokens.TokenCodec' and its base-62 encoding, and the
+rejection of tampered, foreign, mistyped and expired tokens, directly and
+through 'tokencache.VerifiedTokenCache'.
+"""
+
+import random
+import time
+
+import pytest
+
+import tokencache
+import tokens
+
+_KEY = bytes(range(32))
+
+#-------------------------------------------------------------------------------
+def test_base62_round_trip():
+    oRandom = random.Random(1)
+    for iSize in range(1, 80):
+        bData = bytes([oRandom.randrange(1, 256)]) + oRandom.randbytes(iSize)
+        sText = tokens.b62encode(bData)
+        assert set(sText) <= set(tokens.ALPHABET)
+        assert tokens.b62decode(sText) == bData
+        assert tokens.b62decode(sText, len(bData)) == bData
+
+#-------------------------------------------------------------------------------
+@pytest.mark.parametrize("bKind, dClaims", [
+    (tokens.KIND_AUTH, {"sUser_id":"u-1", "sRegion":"PL"}),
+    (tokens.KIND_AUTH, {"sUser_id":"Żaneta ☃", "sRegion":""}),
+    (tokens.KIND_BASKET, {"sUser_id":"u-1", "sBasket_id":"x" * 40}),
+])
+def test_issue_verify_round_trip(bKind, dClaims):
+    oCodec = tokens.TokenCodec(_KEY)
+    fExpiry = time.time() + 60
+    sToken = oCodec.issue(bKind, dClaims, fExpiry)
+    assert set(sToken) <= set(tokens.ALPHABET)
+    sErr_desc, dVerified = oCodec.verify(bKind, sToken)
+    assert sErr_desc is None
+    assert dVerified == dict(dClaims, fExpiry=float(int(fExpiry)))
+
+#-------------------------------------------------------------------------------
+def test_rejects_forged_tokens():
+    oCodec = tokens.TokenCodec(_KEY)
+    sToken = oCodec.issue(tokens.KIND_AUTH, {"sUser_id":"u", "sRegion":"PL"},
+        time.time() + 60)
+    for iPos in range(len(sToken)):
+        for sChar in "0Zz":
+            if sToken[iPos] != sChar:
+                sForged = sToken[:iPos] + sChar + sToken[iPos + 1:]
+                assert oCodec.verify(tokens.KIND_AUTH, sForged) \
+                    == ("invalid token", None)
+    assert tokens.TokenCodec(b"other key").verify(tokens.KIND_AUTH,
+        sToken) == ("invalid token", None)
+    assert oCodec.verify(tokens.KIND_BASKET, sToken) \
+        == ("invalid token", None)
+    for xToken in ("", "not-base-62!", "0" * 600, None, 42, sToken[:-4]):
+        assert oCodec.verify(tokens.KIND_AUTH, xToken) \
+            == ("invalid token", None)
+
+#-------------------------------------------------------------------------------
+def test_expired_and_bad_claims():
+    oCodec = tokens.TokenCodec(_KEY)
+    dClaims = {"sUser_id":"u", "sRegion":"PL"}
+    sToken = oCodec.issue(tokens.KIND_AUTH, dClaims, 1000)
+    assert oCodec.verify(tokens.KIND_AUTH, sToken, 999)[0] is None
+    assert oCodec.verify(tokens.KIND_AUTH, sToken, 1001) \
+        == ("token expired", None)
+    with pytest.raises(ValueError):
+        oCodec.issue(tokens.KIND_AUTH, dict(dClaims, sUser_id="a\x1fb"), 1000)
+
+#-------------------------------------------------------------------------------
+def test_cache_matches_codec():
+    oCodec = tokens.TokenCodec(_KEY)
+    oCache = tokencache.VerifiedTokenCache(
+        lambda sToken: oCodec.verify(tokens.KIND_AUTH, sToken),
+        "token expired", iMax_entries=2)
+    aTokens = [oCodec.issue(tokens.KIND_AUTH, {"sUser_id":"u%d" % i,
+        "sRegion":"PL"}, time.time() + 60) for i in range(3)]
+    for _ in range(2):
+        for sToken in aTokens + ["forged"]:
+            assert oCache.verify(sToken) \
+                == oCodec.verify(tokens.KIND_AUTH, sToken)
+    assert len(oCache) == 2
+
+    sShort = oCodec.issue(tokens.KIND_AUTH, {"sUser_id":"s", "sRegion":"PL"},
+        time.time() + 1)
+    assert oCache.verify(sShort)[0] is None
+    time.sleep(2.1)
+    assert oCache.verify(sShort) == ("token expired", None)
@@ -0,0 +1,133 @@
+""" # Tests: checkout write-ahead log
+-----
+Every record 'CheckoutLog.append' acknowledged must be applied: right away,
+or by the replay after a restart, a crash or a failing backend. Torn writes
+at the end of the log are dropped, and checkpoints under load keep the log
+small without losing records.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import wal
+
+# Runs in a fresh interpreter: appends records to the log at argv[1] while
+# the backend fails, then exits without closing it, as a crash would.
+_CRASH_RUN = """
+import os, sys
+import wal
+def fail(aRecords):
+    raise OSError("backend down")
+oLog = wal.CheckoutLog(sys.argv[1], fail)
+for iRecord in range(int(sys.argv[2])):
+    oLog.append({"iRecord":iRecord})
+print("acknowledged", flush=True)
+os._exit(0)
+"""
+
+#-------------------------------------------------------------------------------
+class Backend:
+    """Collects applied records; fails while 'bDown'."""
+
+    def __init__(self):
+        self.aApplied = []
+        self.bDown = False
+        self.oLock = threading.Lock()
+
+    def apply(self, aRecords):
+        if self.bDown:
+            raise OSError("backend down")
+        with self.oLock:
+            self.aApplied.extend(aRecords)
+
+#-------------------------------------------------------------------------------
+def test_replays_records_never_applied(tmp_path):
+    sPath = str(tmp_path / "checkout.log")
+    oLog = wal.CheckoutLog(sPath)
+    for iRecord in range(20):
+        oLog.append({"iRecord":iRecord})
+    oLog.close()
+
+    oBackend = Backend()
+    oLog = wal.CheckoutLog(sPath, oBackend.apply)
+    assert oBackend.aApplied == [{"iRecord":i} for i in range(20)]
+    assert oLog.size() == 0
+    oLog.close()
+
+#-------------------------------------------------------------------------------
+def test_replays_after_a_failing_backend(tmp_path):
+    sPath = str(tmp_path / "checkout.log")
+    oBackend = Backend()
+    oBackend.bDown = True
+    oLog = wal.CheckoutLog(sPath, oBackend.apply)
+    for iRecord in range(10):
+        oLog.append({"iRecord":iRecord})
+    oLog.close()
+    assert oBackend.aApplied == []
+
+    oBackend.bDown = False
+    wal.CheckoutLog(sPath, oBackend.apply).close()
+    assert oBackend.aApplied == [{"iRecord":i} for i in range(10)]
+
+#-------------------------------------------------------------------------------
+def test_replays_after_a_crash(tmp_path):
+    sPath = str(tmp_path / "checkout.log")
+    sRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    oRun = subprocess.run([sys.executable, "-c", _CRASH_RUN, sPath, "50"],
+        cwd=sRoot, capture_output=True, text=True, timeout=120, check=True)
+    assert oRun.stdout.strip() == "acknowledged"
+
+    oBackend = Backend()
+    wal.CheckoutLog(sPath, oBackend.apply).close()
+    assert oBackend.aApplied == [{"iRecord":i} for i in range(50)]
+
+#-------------------------------------------------------------------------------
+def test_drops_a_torn_tail(tmp_path):
+    sPath = str(tmp_path / "checkout.log")
+    oLog = wal.CheckoutLog(sPath, bGroup=False)
+    for iRecord in range(3):
+        oLog.append({"iRecord":iRecord})
+    oLog.close()
+    bTorn = wal.encode_record({"iRecord":3})
+    with open(sPath, "ab") as oFile:
+        oFile.write(bTorn[:len(bTorn) - 2])
+    aRecords, iEnd = wal.read_records(sPath)
+    assert aRecords == [{"iRecord":i} for i in range(3)]
+    assert iEnd == os.path.getsize(sPath) - len(bTorn) + 2
+
+    oLog = wal.CheckoutLog(sPath)
+    oLog.append({"iRecord":4})
+    oLog.close()
+    assert wal.read_records(sPath)[0] \
+        == [{"iRecord":i} for i in (0, 1, 2, 4)]
+
+#-------------------------------------------------------------------------------
+def test_checkpoints_under_load(tmp_path):
+    sPath = str(tmp_path / "checkout.log")
+    oBackend = Backend()
+    oLog = wal.CheckoutLog(sPath, oBackend.apply, iCheckpoint_bytes=2048)
+    iSize_max = 0
+    def writer(iWriter):
+        for iRecord in range(200):
+            oLog.append({"iWriter":iWriter, "iRecord":iRecord,
+                "sPadding":"x" * 40})
+    aThreads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+    for oThread in aThreads:
+        oThread.start()
+    while any(oThread.is_alive() for oThread in aThreads):
+        iSize_max = max(iSize_max, oLog.size())
+        time.sleep(0.001)
+    for oThread in aThreads:
+        oThread.join()
+    assert oLog.flush(30)
+    oLog.close()
+
+    aApplied = [(dRecord["iWriter"], dRecord["iRecord"])
+        for dRecord in oBackend.aApplied]
+    assert sorted(set(aApplied)) == [(iWriter, iRecord)
+        for iWriter in range(8) for iRecord in range(200)]
+    assert iSize_max < 64 * 1024
+    assert os.path.getsize(sPath) < 2048 + 64 * 1024
@@ -0,0 +1,106 @@
+""" # Cache of verified tokens
+-----
+Every basket click presents a token ('sAuth_token' or 'sBasket_code') which has
+to be verified: decoded, its signature checked and its embedded expiry time
+compared with the clock. The outcome can't change until the token's own expiry
+time, so once a token has verified successfully its decoded contents are kept
+here, and later calls with the same token are a dictionary lookup.
+
+    - Keys are a 128-bit BLAKE2b hash of the token, so the cache never holds
+      customer tokens in clear.
+    - Only successful verifications are cached. A bad token is verified (and
+      rejected) every time, so junk can't push good tokens out of the cache.
+    - An entry is served until the expiry time decoded from the token, then
+      dropped and reported as expired.
+    - The cache is bounded; the least recently used entry is evicted first.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+#-------------------------------------------------------------------------------
+class VerifiedTokenCache:
+    """Bounded LRU cache in front of a token verification function."""
+
+    __slots__ = ("fnVerify", "sExpired", "iMax_entries", "_dEntries",
+        "_oLock", "_dStats")
+
+    def __init__(self, fnVerify, sExpired, iMax_entries=100000):
+        """Creates an empty cache.
+
+        Parameters
+        ----------
+            fnVerify (callable)
+                'fnVerify(sToken)' returns (sErr_desc, dClaims). On success
+                'sErr_desc' is 'None' and 'dClaims' holds the decoded token,
+                including its expiry time under "fExpiry".
+
+            sExpired (string)
+                Error description to report for a cached token which has
+                since expired, e.g. "token expired".
+
+            iMax_entries (integer)
+                Number of tokens kept.
+        """
+        self.fnVerify = fnVerify
+        self.sExpired = sExpired
+        self.iMax_entries = iMax_entries
+        self._dEntries = OrderedDict()  # hash of token -> dClaims
+        self._oLock = threading.Lock()
+        self._dStats = {"iHits":0, "iMisses":0, "iRejected":0, "iExpired":0,
+            "iEvictions":0}
+
+    def __len__(self):
+        return len(self._dEntries)
+
+    @staticmethod
+    def _key(sToken):
+        return hashlib.blake2b(sToken.encode("utf-8"), digest_size=16).digest()
+
+    def verify(self, sToken):
+        """Verifies a token, from the cache when possible.
+
+        Returns
+        -------
+            (tuple) (sErr_desc, dClaims), as from 'fnVerify'. The claims must
+            be treated as read-only.
+        """
+        if not isinstance(sToken, str):
+            return self.fnVerify(sToken)
+        bKey = self._key(sToken)
+        with self._oLock:
+            dClaims = self._dEntries.get(bKey)
+            if dClaims is not None:
+                if dClaims["fExpiry"] >= time.time():
+                    self._dEntries.move_to_end(bKey)
+                    self._dStats["iHits"] += 1
+                    return None, dClaims
+                del self._dEntries[bKey]
+                self._dStats["iExpired"] += 1
+                return self.sExpired, None
+            self._dStats["iMisses"] += 1
+
+        sErr_desc, dClaims = self.fnVerify(sToken)
+        with self._oLock:
+            if sErr_desc is not None:
+                self._dStats["iRejected"] += 1
+                return sErr_desc, None
+            self._dEntries[bKey] = dClaims
+            if len(self._dEntries) > self.iMax_entries:
+                self._dEntries.popitem(last=False)
+                self._dStats["iEvictions"] += 1
+        return None, dClaims
+
+    def forget(self, sToken):
+        """Drops a token, e.g. a basket code destroyed at checkout."""
+        with self._oLock:
+            self._dEntries.pop(self._key(sToken), None)
+
+    def stats(self):
+        """Snapshot of the counters, with the current number of entries."""
+        with self._oLock:
+            dStats = dict(self._dStats)
+            dStats["iSize"] = len(self._dEntries)
+            return dStats
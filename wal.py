@@ -0,0 +1,369 @@
+""" # Checkout write-ahead log
+-----
+A checkout is final once its invoice is durable. Forcing each invoice to disk
+on its own caps checkouts at the disk's fsync rate, so invoices go through an
+append-only log with group commit:
+
+    - 'CheckoutLog.append' queues the invoice and waits.
+    - A writer thread takes every invoice queued so far, writes them in one
+      go, syncs the file once, and wakes their callers. While it syncs, the
+      next batch collects, so the busier the shop, the larger the batches.
+    - An applier thread hands the logged invoices, in batches, to the storage
+      backend ('storage.Storage.save_invoices'). A log grown past
+      'CHECKPOINT_BYTES' is checkpointed after a batch is applied: cut back
+      to the records not applied yet, however busy the shop (emptied if
+      there are none, rewritten to a new file and swapped in otherwise).
+
+On start-up the log is replayed: invoices logged but not yet applied when the
+shop stopped are applied before anything else happens. Applying is
+idempotent, so an invoice applied twice counts once.
+
+Each record is its length and CRC-32, then the invoice as JSON. A torn record
+at the end of the file (a crash mid-write, never acknowledged) is dropped on
+replay.
+"""
+
+import collections
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+# Most records written and synced together
+MAX_BATCH = 512
+
+# Log size beyond which it is cut back to the records not yet applied
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+
+# Seconds between attempts to apply records while the backend is failing
+RETRY_DELAY = 1.0
+
+_RECORD = struct.Struct("<II")      # payload length, CRC-32 of the payload
+
+_fnSync = getattr(os, "fdatasync", os.fsync)
+
+#-------------------------------------------------------------------------------
+class WalError(Exception):
+    """The log couldn't be written or synced."""
+
+#-------------------------------------------------------------------------------
+def encode_record(dRecord):
+    """A record as stored in the log."""
+    bPayload = json.dumps(dRecord, separators=(",", ":")).encode("utf-8")
+    return _RECORD.pack(len(bPayload), zlib.crc32(bPayload)) + bPayload
+
+#-------------------------------------------------------------------------------
+def read_records(sPath):
+    """Reads a log.
+
+    Returns
+    -------
+        (tuple) (aRecords, iEnd): the records, and the offset just after the
+        last whole one. Anything after 'iEnd' is a torn write.
+    """
+    try:
+        with open(sPath, "rb") as oFile:
+            bData = oFile.read()
+    except FileNotFoundError:
+        return [], 0
+    aRecords = []
+    iPos = 0
+    while iPos + _RECORD.size <= len(bData):
+        iLength, iCrc = _RECORD.unpack_from(bData, iPos)
+        iStart = iPos + _RECORD.size
+        bPayload = bData[iStart:iStart + iLength]
+        if len(bPayload) < iLength or zlib.crc32(bPayload) != iCrc:
+            break
+        try:
+            aRecords.append(json.loads(bPayload))
+        except ValueError:
+            break
+        iPos = iStart + iLength
+    return aRecords, iPos
+
+#-------------------------------------------------------------------------------
+def _sync_directory(sPath):
+    """Makes a rename in the directory of 'sPath' durable, where the platform
+    allows it."""
+    try:
+        iFd = os.open(os.path.dirname(os.path.abspath(sPath)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(iFd)
+    except OSError:
+        pass
+    finally:
+        os.close(iFd)
+
+#-------------------------------------------------------------------------------
+class _Pending:
+    """A record waiting for its batch to be synced."""
+
+    __slots__ = ("dRecord", "bData", "oDone", "oError")
+
+    def __init__(self, dRecord):
+        self.dRecord = dRecord
+        self.bData = encode_record(dRecord)
+        self.oDone = threading.Event()
+        self.oError = None
+
+#-------------------------------------------------------------------------------
+class CheckoutLog:
+    """Write-ahead log of invoices, with group commit."""
+
+    __slots__ = ("sPath", "fnApply", "bGroup", "iMax_batch",
+        "iCheckpoint_bytes", "iSyncs", "iRecords", "_iFd", "_iSize",
+        "_oFile_lock", "_oCondition", "_aQueue", "_oApply_queue",
+        "_iWritten", "_iApplied", "_bClosing", "_bStopping", "_oWriter",
+        "_oApplier")
+
+    def __init__(self, sPath, fnApply=None, bGroup=True, iMax_batch=MAX_BATCH,
+            iCheckpoint_bytes=CHECKPOINT_BYTES):
+        """Opens a log, replaying what it holds, and starts its threads.
+
+        Parameters
+        ----------
+            sPath (string)
+                Log file; created if missing.
+
+            fnApply (callable, none)
+                Called with a list of logged records to apply them to the
+                backend, idempotently. Without it the log is only ever
+                appended to.
+
+            bGroup (boolean)
+                Group commit. If false, every 'append' writes and syncs on its
+                own (for comparison).
+
+            iMax_batch (integer)
+                Most records per group commit.
+
+            iCheckpoint_bytes (integer)
+                Size beyond which the log is cut back to the records not yet
+                applied.
+
+        Raises
+        ------
+            OSError: the log can't be opened.
+            Exception: whatever 'fnApply' raises while replaying.
+        """
+        self.sPath = sPath
+        self.fnApply = fnApply
+        self.bGroup = bGroup
+        self.iMax_batch = iMax_batch
+        self.iCheckpoint_bytes = iCheckpoint_bytes
+        self.iSyncs = 0
+        self.iRecords = 0
+        self._oFile_lock = threading.Lock()
+        self._oCondition = threading.Condition()
+        self._aQueue = collections.deque()
+        self._oApply_queue = collections.deque()
+        self._iWritten = 0
+        self._iApplied = 0
+        self._bClosing = False      # no more appends; writer drains, stops
+        self._bStopping = False     # writer stopped; applier drains, stops
+
+        aRecords, iEnd = read_records(sPath)
+        self._iFd = os.open(sPath, os.O_RDWR | os.O_CREAT, 0o644)
+        if aRecords and fnApply is not None:
+            fnApply(aRecords)
+            iEnd = 0                        # all applied: start afresh
+        os.ftruncate(self._iFd, iEnd)
+        os.lseek(self._iFd, iEnd, os.SEEK_SET)
+        _fnSync(self._iFd)
+        self._iSize = iEnd
+
+        self._oWriter = self._oApplier = None
+        if bGroup:
+            self._oWriter = threading.Thread(target=self._write_loop,
+                name="checkout-log-writer", daemon=True)
+            self._oWriter.start()
+        if fnApply is not None:
+            self._oApplier = threading.Thread(target=self._apply_loop,
+                name="checkout-log-applier", daemon=True)
+            self._oApplier.start()
+
+    #---------------------------------------------------------------------------
+    def append(self, dRecord):
+        """Logs a record; returns once it is on disk.
+
+        Raises
+        ------
+            WalError: the record couldn't be written or synced, or the log is
+                closed.
+        """
+        oPending = _Pending(dRecord)
+        if not self.bGroup:
+            with self._oFile_lock:
+                self._commit([oPending])
+        else:
+            with self._oCondition:
+                if self._bClosing:
+                    raise WalError("checkout log closed")
+                self._aQueue.append(oPending)
+                self._oCondition.notify_all()
+            oPending.oDone.wait()
+        if oPending.oError is not None:
+            raise WalError(str(oPending.oError)) from oPending.oError
+
+    def _write_loop(self):
+        while True:
+            with self._oCondition:
+                while not self._aQueue and not self._bClosing:
+                    self._oCondition.wait()
+                if not self._aQueue:
+                    return
+                aBatch = [self._aQueue.popleft() for _ in
+                    range(min(len(self._aQueue), self.iMax_batch))]
+            with self._oFile_lock:
+                self._commit(aBatch)
+
+    def _commit(self, aBatch):
+        """Writes and syncs a batch, then wakes its callers. The caller holds
+        the file lock."""
+        bData = b"".join(oPending.bData for oPending in aBatch)
+        try:
+            iDone = 0
+            while iDone < len(bData):
+                iDone += os.write(self._iFd, bData[iDone:])
+            _fnSync(self._iFd)
+        except OSError as e:
+            # Whatever did reach the file would be replayed: cut it off.
+            try:
+                os.ftruncate(self._iFd, self._iSize)
+                os.lseek(self._iFd, self._iSize, os.SEEK_SET)
+            except OSError:
+                pass
+            for oPending in aBatch:
+                oPending.oError = e
+                oPending.oDone.set()
+            return
+        self._iSize += len(bData)
+        self.iSyncs += 1
+        self.iRecords += len(aBatch)
+        if self.fnApply is not None:
+            with self._oCondition:
+                self._iWritten += len(aBatch)
+                self._oApply_queue.extend(oPending.dRecord
+                    for oPending in aBatch)
+                self._oCondition.notify_all()
+        for oPending in aBatch:
+            oPending.oDone.set()
+
+    #---------------------------------------------------------------------------
+    def _apply_loop(self):
+        while True:
+            with self._oCondition:
+                while not self._oApply_queue and not self._bStopping:
+                    self._oCondition.wait()
+                if not self._oApply_queue:
+                    return
+                aRecords = list(self._oApply_queue)
+            try:
+                self.fnApply(aRecords)
+            except Exception:
+                if self._bStopping:
+                    return                  # left for the replay
+                time.sleep(RETRY_DELAY)     # still logged; try again
+                continue
+            with self._oCondition:
+                for _ in aRecords:
+                    self._oApply_queue.popleft()
+                self._iApplied += len(aRecords)
+                self._oCondition.notify_all()
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """Cuts a large log back to the records logged but not yet applied.
+        Called by the applier, so none are applied meanwhile; the file lock
+        keeps the writer out."""
+        if self._iSize < self.iCheckpoint_bytes:
+            return
+        with self._oFile_lock:
+            with self._oCondition:
+                aRecords = list(self._oApply_queue)
+            try:
+                if aRecords:
+                    self._rewrite(aRecords)
+                else:
+                    os.ftruncate(self._iFd, 0)
+                    os.lseek(self._iFd, 0, os.SEEK_SET)
+                    _fnSync(self._iFd)
+                    self._iSize = 0
+            except OSError:
+                return
+
+    def _rewrite(self, aRecords):
+        """Replaces the log by a new file holding 'aRecords' only. The caller
+        holds the file lock.
+
+        The records are written and synced to a temporary file which is then
+        renamed over the log, so a crash leaves either log whole.
+        """
+        bData = b"".join(encode_record(dRecord) for dRecord in aRecords)
+        sTemporary = self.sPath + ".tmp"
+        iFd = os.open(sTemporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o644)
+        try:
+            iDone = 0
+            while iDone < len(bData):
+                iDone += os.write(iFd, bData[iDone:])
+            _fnSync(iFd)
+        finally:
+            os.close(iFd)
+        iFd = os.open(sTemporary, os.O_RDWR)
+        try:
+            os.replace(sTemporary, self.sPath)
+            _sync_directory(self.sPath)
+        except OSError:
+            os.close(iFd)
+            raise
+        os.lseek(iFd, len(bData), os.SEEK_SET)
+        os.close(self._iFd)
+        self._iFd = iFd
+        self._iSize = len(bData)
+
+    def rewrite(self, fnRecords):
+        """Replaces what the log holds, for a log without 'fnApply' which its
+        owner compacts. 'fnRecords()' is called with appends held off and
+        returns the records to keep; appends waiting meanwhile follow them.
+
+        Raises
+        ------
+            OSError: the new log couldn't be written; the old one stands.
+        """
+        with self._oFile_lock:
+            self._rewrite(fnRecords())
+
+    def size(self):
+        """Bytes in the log."""
+        return self._iSize
+
+    def flush(self, fTimeout=None):
+        """Waits until every logged record has been applied. Returns false if
+        'fTimeout' seconds passed first."""
+        with self._oCondition:
+            return self._oCondition.wait_for(
+                lambda: self._iApplied >= self._iWritten, fTimeout)
+
+    def close(self):
+        """Stops the threads once the queued records are written and applied
+        (records which can't be applied are left for the replay), and closes
+        the file. Idempotent."""
+        with self._oCondition:
+            if self._bClosing:
+                return
+            self._bClosing = True
+            self._oCondition.notify_all()
+        if self._oWriter is not None:
+            self._oWriter.join()
+        with self._oCondition:
+            self._bStopping = True
+            self._oCondition.notify_all()
+        if self._oApplier is not None:
+            self._oApplier.join()
+        with self._oFile_lock:
+            os.close(self._iFd)